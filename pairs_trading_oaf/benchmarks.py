@@ -0,0 +1,478 @@
+"""
+Benchmarks of the simulation hot paths.
+
+The benchmarks run on synthetic price data made from seeded random numbers, so the results of
+two runs can be compared. They time:
+- simulate_trading, with the daily loop (trading.py), the vectorized engine (vectorized.py)
+  and the event-driven engine (events.py), as the number of pairs and the number of days
+  grow,
+- calculate_new_position of each strategy as the window size grows,
+- data.read_csv when parsing the CSV file, when loading the binary price store and when
+  reading from the cache,
+- the plotting and CSV exports, and
+- starting a new interpreter and importing the modules needed to run a backtest. Backtests are
+  often run as many short-lived processes, so this is checked against IMPORT_TIME_BUDGET, and
+  the heavy dependencies in DEFERRED_MODULES must not be imported until they are used.
+
+Each benchmark reports the best and median time over a number of repeats, the throughput in
+pair-days per second and the peak memory allocated (measured with tracemalloc in a separate
+run). The results are written to a JSON file, and two result files can be compared to catch
+slowdowns between releases:
+
+    python -m pairs_trading_oaf.benchmarks run --suite quick --output before.json
+    python -m pairs_trading_oaf.benchmarks run --suite quick --output after.json
+    python -m pairs_trading_oaf.benchmarks compare before.json after.json
+"""
+import argparse
+import datetime
+import json
+import os
+import platform
+import shutil
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+import tracemalloc
+import numpy as np
+import pandas as pd
+from pairs_trading_oaf import data, events, portfolio, strategies, trading, vectorized
+
+STRATEGY_CLASSES = [strategies.StrategyA,
+                    strategies.StrategyB,
+                    strategies.StrategyC,
+                    strategies.StrategyD,
+                    strategies.StrategyE]
+
+# The keyword argument of each strategy which sets the size of its longest window
+WINDOW_SIZE_KWARGS = {'StrategyA': 'window_size',
+                      'StrategyB': 'slow_period',
+                      'StrategyC': 'window_size',
+                      'StrategyD': 'wider_window_size',
+                      'StrategyE': 'training_period'}
+
+SUITES = {'quick': {'num_pairs': [4, 16], 'num_days': [250, 1000],
+                    'window_sizes': [20, 120], 'repeat': 3},
+          'full': {'num_pairs': [4, 16, 64], 'num_days': [250, 1000, 4000],
+                   'window_sizes': [20, 60, 250], 'repeat': 5}}
+
+# A benchmark is slower if its best time grew by more than this fraction
+DEFAULT_THRESHOLD = 0.1
+
+# The entry point which runs backtests, which imports every module needed to run them, and
+# the modules which run sweeps and walk-forward backtests
+CORE_MODULES = ['pairs_trading_oaf.main', 'pairs_trading_oaf.sweep',
+                'pairs_trading_oaf.walk_forward']
+# The budget in seconds for starting an interpreter and importing CORE_MODULES
+IMPORT_TIME_BUDGET = 1.0
+# The modules which are only needed to draw figures or start worker processes, and so must
+# not be imported by CORE_MODULES
+DEFERRED_MODULES = ['matplotlib', 'concurrent.futures.process']
+
+# Run in a new interpreter by bench_import_time
+_IMPORT_SCRIPT = """
+import json, sys, tracemalloc
+modules, deferred_modules, trace = json.loads(sys.argv[1])
+if trace:
+    tracemalloc.start()
+for module in modules:
+    __import__(module)
+print(json.dumps({'peak_memory': tracemalloc.get_traced_memory()[1],
+                  'deferred': [module for module in deferred_modules if module in sys.modules]}))
+"""
+
+def run_benchmarks(suite: str = 'quick', seed: int = 0, output: str = None,
+                   include_exports: bool = True):
+    """
+    Run the benchmarks of a suite and return the results.
+
+    Inputs:
+    - suite: the name of a suite in SUITES, which sets the numbers of pairs, numbers of days
+      and window sizes to benchmark and the number of repeats.
+    - seed: the seed of the random numbers used to make the synthetic data.
+    - output: if given, the filename of a JSON file to write the results to.
+    - include_exports: whether to benchmark the plotting and CSV exports, which are the
+      slowest benchmarks.
+
+    Returns:
+    - A dictionary with the metadata of the run under 'metadata' and a list of results
+      under 'results'. Each result has a 'name', the 'params' of the benchmark, the best
+      and median times in 'seconds' and 'median_seconds', 'pair_days_per_second' and
+      'peak_memory_bytes'.
+    """
+    config = SUITES[suite]
+    results = []
+    with tempfile.TemporaryDirectory() as data_dir:
+        max_window_size = max(config['window_sizes'])
+        for num_days in config['num_days']:
+            for num_pairs in config['num_pairs']:
+                training_csv, testing_csv = write_synthetic_data(
+                    data_dir, 2 * num_pairs, 2 * max_window_size, num_days, seed)
+                for engine in [trading, vectorized, events]:
+                    results.append(bench_simulate_trading(engine, training_csv, testing_csv,
+                                                          num_pairs, config['repeat']))
+                results.extend(bench_read_csv(testing_csv, num_pairs, config['repeat']))
+                data.clear_cache()
+
+        num_days = max(config['num_days'])
+        training_csv, testing_csv = write_synthetic_data(data_dir, 2, 2 * max_window_size,
+                                                         num_days, seed)
+        for strategy_class in STRATEGY_CLASSES:
+            for window_size in config['window_sizes']:
+                results.append(bench_calculate_new_position(strategy_class, window_size,
+                                                            training_csv, testing_csv,
+                                                            config['repeat']))
+
+        if include_exports:
+            num_pairs = min(config['num_pairs'])
+            num_days = min(config['num_days'])
+            training_csv, testing_csv = write_synthetic_data(
+                data_dir, 2 * num_pairs, 2 * max_window_size, num_days, seed)
+            results.extend(bench_exports(training_csv, testing_csv, num_pairs,
+                                         os.path.join(data_dir, 'plots')))
+        data.clear_cache()
+    results.append(bench_import_time(config['repeat']))
+
+    benchmark_results = {'metadata': get_metadata(suite, seed), 'results': results}
+    if output is not None:
+        with open(output, 'w', encoding='utf-8') as f:
+            json.dump(benchmark_results, f, indent=2)
+    return benchmark_results
+
+def write_synthetic_data(data_dir: str, num_stocks: int, num_training_days: int,
+                         num_testing_days: int, seed: int):
+    """
+    Write training and testing CSV files of synthetic prices which follow geometric random
+    walks, in the format of the files in the data directory.
+
+    Returns:
+    - The absolute paths of the training and testing files, which can be passed to
+      data.read_csv and portfolio.MasterPortfolio.
+    """
+    rng = np.random.default_rng(seed)
+    num_days = num_training_days + num_testing_days
+    log_returns = rng.normal(0, 0.02, (num_days, num_stocks))
+    prices = 100 * np.exp(np.cumsum(log_returns, axis=0))
+    labels = [f'Stock {i} (SYN:S{i})' for i in range(num_stocks)]
+    dates = pd.bdate_range(start='2000-01-03', periods=num_days, name='Closing Date')
+    df = pd.DataFrame(prices, index=dates, columns=labels)
+    name = f'synthetic_{num_stocks}_{num_training_days}_{num_testing_days}_{seed}'
+    training_csv = os.path.join(os.path.abspath(data_dir), name + '_training.csv')
+    testing_csv = os.path.join(os.path.abspath(data_dir), name + '_testing.csv')
+    df.iloc[:num_training_days].to_csv(training_csv)
+    df.iloc[num_training_days:].to_csv(testing_csv)
+    return training_csv, testing_csv
+
+def make_master_portfolio(training_csv: str, testing_csv: str, num_pairs: int,
+                          name: str = 'Benchmark', every_strategy: bool = False):
+    """
+    Make a master portfolio of num_pairs pair portfolios which trade the synthetic stocks
+    in pairs and cycle through the strategies.
+
+    If every_strategy is True, each pair is instead traded with every strategy, as in
+    main.py, which gives 4 * num_pairs pair portfolios.
+    """
+    master_portfolio = portfolio.MasterPortfolio(1, training_csv, testing_csv, name=name)
+    labels = list(data.read_csv(testing_csv).columns)
+    stock_pair_labels_list = [(labels[2 * i], labels[2 * i + 1]) for i in range(num_pairs)]
+    if every_strategy:
+        pairs_and_strategies = [(stock_pair_labels, strategy_class)
+                                for strategy_class in STRATEGY_CLASSES
+                                for stock_pair_labels in stock_pair_labels_list]
+    else:
+        pairs_and_strategies = [(stock_pair_labels, STRATEGY_CLASSES[i % len(STRATEGY_CLASSES)])
+                                for i, stock_pair_labels in enumerate(stock_pair_labels_list)]
+    for stock_pair_labels, strategy_class in pairs_and_strategies:
+        pair_portfolio = portfolio.PairPortfolio(stock_pair_labels, strategy_class,
+                                                 master_portfolio, cash=10)
+        master_portfolio.add_pair_portfolio(pair_portfolio)
+    return master_portfolio
+
+def measure(function, setup=None, repeat: int = 3):
+    """
+    Time function(setup()) repeat times, then run it once more under tracemalloc.
+    setup is not timed.
+
+    Returns:
+    - The best time, the median time and the peak memory allocated in bytes.
+    """
+    times = []
+    for _ in range(repeat):
+        argument = setup() if setup is not None else None
+        start = time.perf_counter()
+        function(argument)
+        times.append(time.perf_counter() - start)
+
+    argument = setup() if setup is not None else None
+    tracemalloc.start()
+    try:
+        function(argument)
+        _, peak_memory = tracemalloc.get_traced_memory()
+    finally:
+        tracemalloc.stop()
+    return min(times), statistics.median(times), peak_memory
+
+def make_result(name: str, params: dict, timings, pair_days: int):
+    """
+    Make the dictionary recorded for one benchmark.
+    """
+    seconds, median_seconds, peak_memory = timings
+    return {'name': name,
+            'params': params,
+            'seconds': seconds,
+            'median_seconds': median_seconds,
+            'pair_days_per_second': pair_days / seconds if seconds > 0 else None,
+            'peak_memory_bytes': peak_memory}
+
+def bench_simulate_trading(engine, training_csv: str, testing_csv: str, num_pairs: int,
+                           repeat: int):
+    """
+    Benchmark engine.simulate_trading, excluding the construction of the portfolios.
+    """
+    num_days = len(data.read_csv(testing_csv))
+    timings = measure(engine.simulate_trading,
+                      setup=lambda: make_master_portfolio(training_csv, testing_csv, num_pairs),
+                      repeat=repeat)
+    params = {'engine': engine.__name__.rsplit('.', 1)[-1], 'num_pairs': num_pairs,
+              'num_days': num_days}
+    return make_result('simulate_trading', params, timings, num_pairs * num_days)
+
+def bench_calculate_new_position(strategy_class, window_size: int, training_csv: str,
+                                 testing_csv: str, repeat: int):
+    """
+    Benchmark the daily calls to strategy_class.calculate_new_position for one pair.
+    """
+    df_test = data.read_csv(testing_csv)
+    stock_pair_labels = tuple(df_test.columns[:2])
+    stock_pair_prices = list(zip(df_test[stock_pair_labels[0]].tolist(),
+                                 df_test[stock_pair_labels[1]].tolist()))
+    strategy_kwargs = {WINDOW_SIZE_KWARGS[strategy_class.__name__]: window_size}
+    if strategy_class is strategies.StrategyB:
+        strategy_kwargs['training_period'] = 2 * window_size
+
+    def setup():
+        master_portfolio = portfolio.MasterPortfolio(1, training_csv, testing_csv)
+        return portfolio.PairPortfolio(stock_pair_labels, strategy_class, master_portfolio,
+                                       cash=10, strategy_kwargs=strategy_kwargs)
+
+    def run(pair_portfolio):
+        strategy = pair_portfolio.strategy
+        for prices in stock_pair_prices:
+            pair_portfolio.stock_pair_prices = prices
+            strategy.calculate_new_position()
+
+    timings = measure(run, setup=setup, repeat=repeat)
+    params = {'strategy': strategy_class.__name__, 'window_size': window_size,
+              'num_days': len(stock_pair_prices)}
+    return make_result('calculate_new_position', params, timings, len(stock_pair_prices))
+
+def bench_read_csv(filename: str, num_pairs: int, repeat: int):
+    """
+    Benchmark data.read_csv when parsing the CSV file, when loading the binary price store
+    and when the file is already cached.
+    """
+    num_days = len(data.read_csv(filename))
+    store_dir = os.path.join(os.path.dirname(filename), data.PRICE_STORE_DIRNAME)
+
+    def parse(_):
+        data.invalidate(filename)
+        shutil.rmtree(store_dir, ignore_errors=True)
+        data.read_csv(filename)
+
+    def load_store(_):
+        data.invalidate(filename)
+        data.read_csv(filename)
+
+    def read_cached(_):
+        data.read_csv(filename)
+
+    results = []
+    for source, function in [('csv', parse), ('price_store', load_store), ('cache', read_cached)]:
+        timings = measure(function, repeat=repeat)
+        params = {'source': source, 'num_columns': 2 * num_pairs, 'num_days': num_days}
+        results.append(make_result('read_csv', params, timings, num_pairs * num_days))
+    return results
+
+def bench_exports(training_csv: str, testing_csv: str, num_pairs: int, plots_dir: str):
+    """
+    Benchmark the plotting and CSV exports once each, writing the files under plots_dir.
+    The exports expect every pair to be traded with every strategy, so there are
+    4 * num_pairs pair portfolios.
+
+    The exports run in a worker process with the Agg backend (see plotting.init_worker), so
+    that the matplotlib backend of this process is left as it is.
+    """
+    # Imported here, so that the other benchmarks do not need a plotting backend or a pool
+    # pylint: disable-next=import-outside-toplevel
+    from concurrent.futures import ProcessPoolExecutor
+    from pairs_trading_oaf import plotting # pylint: disable=import-outside-toplevel
+    with ProcessPoolExecutor(max_workers=1, initializer=plotting.init_worker) as executor:
+        return executor.submit(_bench_exports, training_csv, testing_csv, num_pairs,
+                               plots_dir).result()
+
+def _bench_exports(training_csv: str, testing_csv: str, num_pairs: int, plots_dir: str):
+    """
+    The benchmarks of bench_exports, run in a worker process.
+    """
+    from pairs_trading_oaf import plotting # pylint: disable=import-outside-toplevel
+
+    # The plotting functions write to plots/<name>, which is plots_dir for an absolute name
+    master_portfolio = make_master_portfolio(training_csv, testing_csv, num_pairs,
+                                             name=os.path.abspath(plots_dir),
+                                             every_strategy=True)
+    vectorized.simulate_trading(master_portfolio)
+    num_pair_portfolios = len(master_portfolio.pair_portfolios)
+    num_days = len(master_portfolio.pair_portfolios[0].dates_over_time)
+    results = []
+    # force=True renders every figure again, rather than skipping the figures whose data has
+    # not changed since the previous call
+    for function, kwargs in [(plotting.plot_position_over_time, {'force': True}),
+                             (plotting.make_csv_strategy_d_and_b, {'force': True}),
+                             (plotting.make_csv_position_strategy_b_d, {})]:
+        timings = measure(lambda _, function=function, kwargs=kwargs:
+                          function(master_portfolio, **kwargs), repeat=1)
+        params = {'function': function.__name__, 'num_pairs': num_pair_portfolios,
+                  'num_days': num_days}
+        results.append(make_result('export', params, timings, num_pair_portfolios * num_days))
+    return results
+
+def bench_import_time(repeat: int, modules=None):
+    """
+    Benchmark starting a new interpreter and importing modules (CORE_MODULES by default).
+
+    Returns:
+    - The result of the benchmark, as made by make_result, which also records the
+      'budget_seconds', whether the best time is 'within_budget' and the
+      'deferred_modules_imported', i.e. the modules in DEFERRED_MODULES which were imported
+      with modules and so slowed down the start of every backtest.
+    """
+    modules = CORE_MODULES if modules is None else modules
+    def run(trace):
+        arguments = json.dumps([modules, DEFERRED_MODULES, trace])
+        completed = subprocess.run([sys.executable, '-c', _IMPORT_SCRIPT, arguments],
+                                   check=True, capture_output=True, text=True)
+        return json.loads(completed.stdout)
+
+    times = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        run(False)
+        times.append(time.perf_counter() - start)
+    traced = run(True)
+    result = make_result('import', {'modules': ','.join(modules)},
+                         (min(times), statistics.median(times), traced['peak_memory']), 0)
+    result['pair_days_per_second'] = None
+    result['budget_seconds'] = IMPORT_TIME_BUDGET
+    result['within_budget'] = result['seconds'] <= IMPORT_TIME_BUDGET
+    result['deferred_modules_imported'] = traced['deferred']
+    return result
+
+def get_metadata(suite: str, seed: int):
+    """
+    Return the metadata recorded with the results of a run.
+    """
+    return {'suite': suite,
+            'seed': seed,
+            'timestamp': datetime.datetime.now(datetime.timezone.utc).isoformat(),
+            'python': platform.python_version(),
+            'numpy': np.__version__,
+            'pandas': pd.__version__,
+            'platform': platform.platform(),
+            'cpu_count': os.cpu_count()}
+
+def load_results(filename: str):
+    """
+    Load the results of a run from a JSON file.
+    """
+    with open(filename, encoding='utf-8') as f:
+        return json.load(f)
+
+def compare_results(old_results, new_results, threshold: float = DEFAULT_THRESHOLD):
+    """
+    Compare the benchmarks which appear in two sets of results.
+
+    Inputs:
+    - old_results, new_results: results from run_benchmarks or load_results.
+    - threshold: a benchmark is marked as slower (or faster) if its best time changed by
+      more than this fraction.
+
+    Returns:
+    - A DataFrame with one row per benchmark in both sets of results, with the columns
+      'name', 'params', 'old_seconds', 'new_seconds', 'ratio' (new / old), 'old_peak_memory_bytes',
+      'new_peak_memory_bytes' and 'status', which is 'slower', 'faster' or 'same'.
+    """
+    def key(result):
+        return result['name'], json.dumps(result['params'], sort_keys=True)
+
+    old_by_key = {key(result): result for result in old_results['results']}
+    rows = []
+    for new_result in new_results['results']:
+        old_result = old_by_key.get(key(new_result))
+        if old_result is None:
+            continue
+        ratio = new_result['seconds'] / old_result['seconds'] \
+            if old_result['seconds'] > 0 else np.inf
+        if ratio > 1 + threshold:
+            status = 'slower'
+        elif ratio < 1 / (1 + threshold):
+            status = 'faster'
+        else:
+            status = 'same'
+        rows.append({'name': new_result['name'],
+                     'params': key(new_result)[1],
+                     'old_seconds': old_result['seconds'],
+                     'new_seconds': new_result['seconds'],
+                     'ratio': ratio,
+                     'old_peak_memory_bytes': old_result['peak_memory_bytes'],
+                     'new_peak_memory_bytes': new_result['peak_memory_bytes'],
+                     'status': status})
+    return pd.DataFrame(rows, columns=['name', 'params', 'old_seconds', 'new_seconds', 'ratio',
+                                       'old_peak_memory_bytes', 'new_peak_memory_bytes',
+                                       'status'])
+
+def main(argv=None):
+    """
+    Command line interface to run the benchmarks and compare result files.
+
+    Returns the exit status: 1 if a comparison found a benchmark which got slower, else 0.
+    """
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    subparsers = parser.add_subparsers(dest='command', required=True)
+    run_parser = subparsers.add_parser('run', help='run the benchmarks')
+    run_parser.add_argument('--suite', choices=sorted(SUITES), default='quick')
+    run_parser.add_argument('--seed', type=int, default=0)
+    run_parser.add_argument('--output', default='benchmark_results.json')
+    run_parser.add_argument('--skip-exports', action='store_true',
+                            help='do not benchmark the plotting and CSV exports')
+    compare_parser = subparsers.add_parser('compare', help='compare two result files')
+    compare_parser.add_argument('old')
+    compare_parser.add_argument('new')
+    compare_parser.add_argument('--threshold', type=float, default=DEFAULT_THRESHOLD)
+    args = parser.parse_args(argv)
+
+    if args.command == 'run':
+        benchmark_results = run_benchmarks(args.suite, args.seed, args.output,
+                                           include_exports=not args.skip_exports)
+        for result in benchmark_results['results']:
+            throughput = result['pair_days_per_second'] or 0
+            print(f"{result['name']:<24} {json.dumps(result['params']):<70} "
+                  f"{result['seconds']:10.4f} s {throughput:14.0f} pair-days/s "
+                  f"{result['peak_memory_bytes'] / 2 ** 20:8.1f} MiB")
+            if result['name'] == 'import' and (not result['within_budget']
+                                               or result['deferred_modules_imported']):
+                print(f"Warning: importing the core modules is over the budget of "
+                      f"{IMPORT_TIME_BUDGET} s or imported "
+                      f"{result['deferred_modules_imported']}")
+        print(f"Results written to {args.output}")
+        return 0
+
+    comparison = compare_results(load_results(args.old), load_results(args.new),
+                                 args.threshold)
+    with pd.option_context('display.max_rows', None, 'display.max_columns', None,
+                           'display.width', 200, 'display.max_colwidth', 80):
+        print(comparison[['name', 'params', 'old_seconds', 'new_seconds', 'ratio', 'status']])
+    return 1 if (comparison['status'] == 'slower').any() else 0
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -1,14 +1,201 @@
 """
 This module contains functions to read data.
+
+Parsed CSV files are kept in a process-wide cache so that the same file is only parsed once,
+however many strategies and pair portfolios read it. The cache is keyed by the path and
+modification time of the file, so a file that changes on disk is parsed again, and the least
+recently used files are evicted once the cache holds more than CACHE_MAX_SIZE files.
+
+Price data (CSV files with a date index and float columns) is also converted once into a
+binary price store in a .price_store directory next to the CSV file. The store holds a
+float64 price matrix, an int64 date index and a JSON file with the column labels, and is
+opened through memory-mapping, so loading it is almost instant and processes reading the
+same dataset share the same physical memory. The CSV file stays the source of truth: the
+store is rebuilt automatically whenever the CSV file changes. Each build writes its arrays
+under new filenames, which the JSON file points to, so a rebuild never replaces a file that
+is still memory-mapped by the cache or by a DataFrame in use (which fails on Windows).
+
+Some stocks are listed after the start of a dataset, e.g. META and GOOGL in the early years of
+the stock datasets, so their early prices are missing (NaN). get_availability returns a mask
+of which prices are present, which is computed once when a dataset is loaded and kept in the
+cache with it. The trading engines use it to skip the days on which a stock of a pair is not
+listed, and the strategies to warm up on the days on which both are.
+
+For backtests which fan out to worker processes, a loaded dataset can be published once into
+shared memory with share_data. This returns a SharedPriceMatrix, which is a data source like
+a filename or a DataFrame (see get_data) but pickles to a handful of bytes: each worker which
+is given one attaches to the shared memory segment and reads the dates and prices through
+zero-copy numpy views, so the workers hold one copy of the prices between them however many
+there are. The process which publishes the dataset owns the segment and unlinks it when the
+SharedPriceMatrix is closed, garbage collected or the process exits. If the process crashes
+instead, the multiprocessing resource tracker unlinks the segment.
 """
+import contextlib
+import glob
+import json
 import os
+import time
+import weakref
+from collections import OrderedDict
+from multiprocessing import shared_memory
+import numpy as np
 import pandas as pd
 
+CACHE_MAX_SIZE = 16
+PRICE_STORE_DIRNAME = '.price_store'
+
+# Maps the path of each cached file to its modification time, the parsed DataFrame and its
+# availability mask
+_cache = OrderedDict()
+# Maps the name of each shared memory segment this process has attached to, to the
+# PriceMatrix of read-only views into it. Like the cache, it holds at most CACHE_MAX_SIZE
+# segments, so a long-lived worker does not keep old segments alive after they are unlinked.
+_shared_attachments = OrderedDict()
+
+class PriceMatrix:
+    """
+    Price data stored as numpy arrays.
+
+    Attributes:
+    - dates: int64 array of the dates as nanoseconds since the epoch.
+    - prices: float64 array of shape (num_days, num_labels) with one column per label.
+    - labels: list of the column labels, e.g. "Chevron Corporation (NYSE:CVX)".
+    - index_name: the name of the date index, e.g. "Closing Date".
+    - available: optional read-only boolean array of the shape of prices, which is True where
+      a price is present (see get_availability).
+    """
+    def __init__(self, dates, prices, labels, index_name=None, available=None):
+        self.dates = dates
+        self.prices = prices
+        self.labels = list(labels)
+        self.index_name = index_name
+        self.available = available
+
+    @classmethod
+    def from_frame(cls, data):
+        """
+        Make a PriceMatrix from a DataFrame with a date index and float columns.
+        """
+        return cls(data.index.asi8, data.to_numpy(dtype=float), data.columns, data.index.name)
+
+    def to_frame(self):
+        """
+        Return the price data as a DataFrame which shares its memory with the prices array.
+        """
+        index = pd.DatetimeIndex(self.dates.view('datetime64[ns]'), name=self.index_name)
+        return pd.DataFrame(self.prices, index=index, columns=self.labels, copy=False)
+
+class SharedPriceMatrix:
+    """
+    Price data published into a multiprocessing.shared_memory segment, see share_data.
+
+    The segment holds the int64 dates followed by the float64 prices in Fortran order, so each
+    column is contiguous. The labels and index name are small, so they are kept in the object
+    itself and pickled with it. Only the object created by share_data owns the segment: copies
+    which are pickled to worker processes attach to it, but never unlink it.
+
+    Attributes:
+    - name: the name of the shared memory segment.
+    - num_days: the number of rows of prices.
+    - labels: list of the column labels.
+    - index_name: the name of the date index.
+    """
+    def __init__(self, price_matrix):
+        self.num_days = len(price_matrix.dates)
+        self.labels = list(price_matrix.labels)
+        self.index_name = price_matrix.index_name
+        # A segment cannot be empty, so allocate at least one byte
+        size = max(8 * self.num_days * (1 + len(self.labels)), 1)
+        self._shared_memory = shared_memory.SharedMemory(create=True, size=size)
+        self.name = self._shared_memory.name
+        self._finalizer = weakref.finalize(self, _unlink_shared_memory, self._shared_memory,
+                                           os.getpid())
+        dates, prices = self._make_views(self._shared_memory.buf)
+        dates[:] = price_matrix.dates
+        prices[:] = price_matrix.prices
+        # Views must not outlive the owner's buffer, or it could not be closed
+        del dates, prices
+
+    def __getstate__(self):
+        return {'name': self.name, 'num_days': self.num_days, 'labels': self.labels,
+                'index_name': self.index_name}
+
+    def __setstate__(self, state):
+        self.__dict__.update(state)
+        self._shared_memory = None
+        self._finalizer = None
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+
+    @property
+    def is_owner(self):
+        """
+        Whether this object owns the segment, i.e. it was created by share_data in this
+        process rather than unpickled.
+        """
+        return self._finalizer is not None
+
+    def to_price_matrix(self):
+        """
+        Return a PriceMatrix of read-only views into the segment, attaching to it the first
+        time it is used in this process.
+
+        Raises a ValueError if the segment has already been unlinked by its owner.
+        """
+        price_matrix = _shared_attachments.get(self.name)
+        if price_matrix is None:
+            try:
+                attached_memory = shared_memory.SharedMemory(name=self.name)
+            except FileNotFoundError as error:
+                raise ValueError(f"shared price matrix {self.name} has been closed") from error
+            dates, prices = (np.asarray(_SharedArray(attached_memory, view))
+                             for view in self._make_views(attached_memory.buf))
+            available = ~np.isnan(prices)
+            available.flags.writeable = False
+            price_matrix = PriceMatrix(dates, prices, self.labels, self.index_name, available)
+            _shared_attachments[self.name] = price_matrix
+            if len(_shared_attachments) > CACHE_MAX_SIZE:
+                _shared_attachments.popitem(last=False)
+        else:
+            _shared_attachments.move_to_end(self.name)
+        return price_matrix
+
+    def to_frame(self):
+        """
+        Return the price data as a read-only DataFrame which shares its memory with the segment.
+        """
+        return self.to_price_matrix().to_frame()
+
+    def close(self):
+        """
+        Detach this process from the segment and, if this object owns it, unlink the segment.
+
+        The memory is freed once every process has detached from the segment. Views of it that
+        are still in use stay valid until they are dropped, as each keeps the segment attached.
+        """
+        _shared_attachments.pop(self.name, None)
+        if self._finalizer is not None:
+            self._finalizer()
+
+    def _make_views(self, buffer):
+        dates = np.ndarray((self.num_days,), dtype=np.int64, buffer=buffer)
+        prices = np.ndarray((self.num_days, len(self.labels)), dtype=np.float64, buffer=buffer,
+                            offset=dates.nbytes, order='F')
+        return dates, prices
+
 def read_csv(filename: str):
     """
     Read a CSV file and return a pandas dataframe object and set the index to be the
     'Closing Date' column.
 
+    The returned DataFrame shares its data with the cache. The data is read-only, so trying
+    to change a value in place raises a ValueError rather than changing what later callers
+    see. Use .copy() to get a DataFrame that can be changed.
+
     Parameters
     ----------
 
@@ -20,14 +207,270 @@ def read_csv(filename: str):
         - "Price Data - CSV - Full Periods.csv"
         - "Price Data - CSV - Trading Period.csv"
     """
+    filepath = _get_filepath(filename)
+    modification_time = os.stat(filepath).st_mtime_ns
+
+    cached = _cache.get(filepath)
+    if cached is None or cached[0] != modification_time:
+        parsed = _parse_csv(filepath)
+        cached = (modification_time, parsed, _make_availability(parsed))
+        _cache[filepath] = cached
+    _cache.move_to_end(filepath)
+    while len(_cache) > CACHE_MAX_SIZE:
+        _cache.popitem(last=False)
+
+    return _read_only_view(cached[1])
+
+def get_data(data_source):
+    """
+    Return the DataFrame of a data source, e.g. the training_data_source or testing_data_source of
+    a portfolio.
+
+    The data source is either the filename of a CSV file, which is read with read_csv, a
+    DataFrame, which is returned as it is, or a SharedPriceMatrix, whose DataFrame is a view
+    into shared memory. Passing DataFrames lets a caller run portfolios on slices of a price
+    matrix it already holds in memory (see walk_forward.py) without writing each slice to a
+    new CSV file.
+    """
+    if isinstance(data_source, pd.DataFrame):
+        return data_source
+    if isinstance(data_source, SharedPriceMatrix):
+        return data_source.to_frame()
+    return read_csv(data_source)
+
+def get_availability(data_source):
+    """
+    Return the availability mask of a data source (see get_data): a read-only boolean
+    DataFrame with the index and columns of its data, which is True where a price is present
+    and False where it is missing, e.g. before a stock was listed.
+
+    The mask of a CSV file or a SharedPriceMatrix is computed once, when the data is loaded,
+    and is shared by every caller. The mask of a DataFrame is computed on each call.
+    """
+    if isinstance(data_source, SharedPriceMatrix):
+        price_matrix = data_source.to_price_matrix()
+        index = pd.DatetimeIndex(price_matrix.dates.view('datetime64[ns]'),
+                                 name=price_matrix.index_name)
+        return pd.DataFrame(price_matrix.available, index=index, columns=price_matrix.labels,
+                            copy=False)
+    df = get_data(data_source)
+    if isinstance(data_source, str):
+        cached = _cache.get(_get_filepath(data_source))
+        # The views returned by read_csv share the index of the cached DataFrame
+        if cached is not None and cached[1].index is df.index:
+            return cached[2]
+    return _make_availability(df)
+
+def share_data(data_source):
+    """
+    Publish the price data of a data source (see get_data) into shared memory and return its
+    SharedPriceMatrix, which owns the segment. Use it as a context manager, or call close, to
+    unlink the segment once the workers are done with it.
+
+    Raises a ValueError if the data source does not contain price data, i.e. a date index and
+    float columns.
+    """
+    df = get_data(data_source)
+    if not _is_price_data(df):
+        raise ValueError("only price data can be shared")
+    return SharedPriceMatrix(PriceMatrix.from_frame(df))
+
+@contextlib.contextmanager
+def shared_data_sources(*data_sources):
+    """
+    Context manager which publishes each data source of price data with share_data for the
+    duration of the block, and yields the list of data sources with those replaced by their
+    SharedPriceMatrix objects. Pass the yielded data sources to worker processes in place of
+    the originals, so that each dataset is loaded once and not pickled or parsed per worker.
+
+    A data source given more than once is shared once, and data sources which are already
+    shared or do not contain price data are yielded as they are.
+    """
+    with contextlib.ExitStack() as stack:
+        shared_sources = []
+        shared_by_id = {}
+        for data_source in data_sources:
+            key = data_source if isinstance(data_source, str) else id(data_source)
+            if key not in shared_by_id:
+                shared_by_id[key] = data_source
+                if not isinstance(data_source, SharedPriceMatrix) \
+                        and _is_price_data(get_data(data_source)):
+                    shared_by_id[key] = stack.enter_context(share_data(data_source))
+            shared_sources.append(shared_by_id[key])
+        yield shared_sources
+
+def invalidate(filename: str):
+    """
+    Remove a file from the cache so that it is parsed again the next time it is read.
+    """
+    _cache.pop(_get_filepath(filename), None)
+
+def clear_cache():
+    """
+    Remove all files from the cache, and detach from the shared memory segments which are no
+    longer in use in this process.
+    """
+    _cache.clear()
+    _shared_attachments.clear()
+
+def build_price_store(filename: str):
+    """
+    Convert a CSV file of price data into a binary price store and return its PriceMatrix.
+
+    Raises a ValueError if the file does not contain price data, i.e. a date index and
+    float columns.
+    """
+    filepath = _get_filepath(filename)
+    data = pd.read_csv(filepath, index_col=0, parse_dates=True)
+    if not _is_price_data(data):
+        raise ValueError(f"{filepath} does not contain price data")
+    _write_price_store(filepath, PriceMatrix.from_frame(data))
+    return _open_price_store(filepath)
+
+def load_price_store(filename: str):
+    """
+    Open the binary price store of a CSV file of price data through memory-mapping,
+    building or rebuilding the store first if it is missing or older than the CSV file.
 
+    Returns a PriceMatrix whose arrays are read-only memory maps.
+    """
+    price_matrix = _open_price_store(_get_filepath(filename))
+    if price_matrix is None:
+        price_matrix = build_price_store(filename)
+    return price_matrix
+
+def build_price_stores(pattern: str = 'Price Data - CSV - *.csv'):
+    """
+    Build the binary price stores of all the CSV files in the data directory which match
+    pattern.
+    """
+    for filepath in sorted(glob.glob(_get_filepath(pattern))):
+        build_price_store(filepath)
+
+def _get_filepath(filename: str):
     current_dir = os.path.dirname(__file__)
     data_dir = os.path.join(current_dir, '..', 'data')
-    filepath = os.path.join(data_dir, filename)
+    return os.path.abspath(os.path.join(data_dir, filename))
 
-    data = pd.read_csv(filepath)
+def _parse_csv(filepath: str):
+    price_matrix = _open_price_store(filepath)
+    if price_matrix is not None:
+        return price_matrix.to_frame()
 
     # Assuming the first column is 'Closing Date'
     data = pd.read_csv(filepath, index_col=0, parse_dates=True)
-
+    if _is_price_data(data):
+        try:
+            _write_price_store(filepath, PriceMatrix.from_frame(data))
+            return _open_price_store(filepath).to_frame()
+        except OSError:
+            # E.g. the data directory is read-only, so carry on without the store
+            pass
+    if len(set(data.dtypes)) == 1:
+        # Store the values as a single read-only array that every caller can share
+        values = data.to_numpy(copy=True)
+        values.flags.writeable = False
+        data = pd.DataFrame(values, index=data.index, columns=data.columns, copy=False)
     return data
+
+class _SharedArray:
+    """
+    Exposes a view of a shared memory segment through the numpy array interface, so that the
+    arrays made from it, and every view of those, keep the segment attached. Closing a
+    SharedMemory does not check for numpy views of its buffer, so it is only closed, by its
+    own __del__, once the last of them has gone.
+    """
+    def __init__(self, attached_memory, view):
+        self.attached_memory = attached_memory
+        self.view = view
+        interface = dict(view.__array_interface__)
+        interface['data'] = (interface['data'][0], True)
+        self.__array_interface__ = interface
+
+def _unlink_shared_memory(owned_memory, owner_pid):
+    owned_memory.close()
+    if os.getpid() != owner_pid:
+        # A forked child which exits normally must not unlink the segment of its parent
+        return
+    try:
+        owned_memory.unlink()
+    except FileNotFoundError:
+        pass
+
+def _read_only_view(data):
+    if len(set(data.dtypes)) == 1:
+        return pd.DataFrame(data.to_numpy(), index=data.index, columns=data.columns, copy=False)
+    # Columns of different types cannot share a single read-only array, so return a copy
+    return data.copy()
+
+def _make_availability(data):
+    available = data.notna().to_numpy()
+    available.flags.writeable = False
+    return pd.DataFrame(available, index=data.index, columns=data.columns, copy=False)
+
+def _is_price_data(data):
+    return isinstance(data.index, pd.DatetimeIndex) and data.index.tz is None \
+        and len(data.columns) > 0 and all(dtype == np.float64 for dtype in data.dtypes)
+
+def _get_price_store_dir(filepath: str):
+    csv_dir, csv_filename = os.path.split(filepath)
+    return os.path.join(csv_dir, PRICE_STORE_DIRNAME, os.path.splitext(csv_filename)[0])
+
+def _get_csv_signature(filepath: str):
+    stat = os.stat(filepath)
+    return {'csv_modification_time': stat.st_mtime_ns, 'csv_size': stat.st_size}
+
+def _write_price_store(filepath: str, price_matrix):
+    store_dir = _get_price_store_dir(filepath)
+    os.makedirs(store_dir, exist_ok=True)
+    metadata = {'labels': price_matrix.labels, 'index_name': price_matrix.index_name}
+    metadata.update(_get_csv_signature(filepath))
+    # Write the arrays of each build under new filenames, and then point the metadata at them,
+    # so other processes never see a partly written file and no file which may still be
+    # memory-mapped is replaced. The metadata is written last because it marks the store as
+    # up to date.
+    version = f"{time.time_ns()}.{os.getpid()}"
+    arrays = {'dates': np.asarray(price_matrix.dates, dtype=np.int64),
+              # Fortran order keeps each column contiguous
+              'prices': np.asfortranarray(price_matrix.prices, dtype=np.float64)}
+    for name, array in arrays.items():
+        array_filename = f'{name}.{version}.npy'
+        temporary_filepath = os.path.join(store_dir, f'{array_filename}.tmp')
+        with open(temporary_filepath, 'wb') as f:
+            np.save(f, array)
+        os.replace(temporary_filepath, os.path.join(store_dir, array_filename))
+        metadata[f'{name}_file'] = array_filename
+    temporary_filepath = os.path.join(store_dir, f'metadata.json.{os.getpid()}.tmp')
+    with open(temporary_filepath, 'w', encoding='utf-8') as f:
+        json.dump(metadata, f)
+    os.replace(temporary_filepath, os.path.join(store_dir, 'metadata.json'))
+
+    # Remove the arrays of earlier builds. Those which are still memory-mapped cannot be
+    # removed on Windows, and are removed by a later build instead.
+    current_filenames = {metadata['dates_file'], metadata['prices_file']}
+    for array_filepath in glob.glob(os.path.join(store_dir, '*.npy')):
+        if os.path.basename(array_filepath) not in current_filenames:
+            try:
+                os.remove(array_filepath)
+            except OSError:
+                pass
+
+def _open_price_store(filepath: str):
+    """
+    Return the memory-mapped PriceMatrix of a CSV file, or None if there is no store
+    or the store is out of date.
+    """
+    store_dir = _get_price_store_dir(filepath)
+    try:
+        with open(os.path.join(store_dir, 'metadata.json'), encoding='utf-8') as f:
+            metadata = json.load(f)
+        csv_signature = _get_csv_signature(filepath)
+        if any(metadata.get(key) != value for key, value in csv_signature.items()):
+            return None
+        dates = np.load(os.path.join(store_dir, metadata['dates_file']), mmap_mode='r')
+        prices = np.load(os.path.join(store_dir, metadata['prices_file']), mmap_mode='r')
+    except (OSError, ValueError, KeyError):
+        return None
+    if prices.shape != (len(dates), len(metadata['labels'])):
+        return None
+    return PriceMatrix(dates, prices, metadata['labels'], metadata['index_name'])
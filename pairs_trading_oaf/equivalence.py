@@ -0,0 +1,349 @@
+"""
+Equivalence harness which checks that a faster engine reproduces the daily loop.
+
+The reference is trading.simulate_trading with the strategies' calculate_new_position. Each
+candidate engine in CANDIDATE_ENGINES, e.g. the vectorized engine in vectorized.py or the
+process pool of trading.simulate_trading_parallel, is run on fresh copies of the same master
+portfolio. Every *_over_time value of every pair and basket portfolio and of its strategy is
+compared day by day with the reference. The harness runs on the bundled datasets in BUNDLED_DATASETS
+and on randomised synthetic datasets with late-listed stocks and missing prices
+(see make_synthetic_dataset):
+
+    python -m pairs_trading_oaf.equivalence --engines vectorized parallel --num-synthetic 10
+
+The dates and positions must match exactly. The other values must match within the relative
+and absolute tolerances rtol and atol, as in numpy.isclose, and NaNs must be NaN in both. For
+each portfolio and value the first divergent day is reported, and the command exits
+with status 1 if any value diverges.
+"""
+import argparse
+import sys
+import numpy as np
+import pandas as pd
+from pairs_trading_oaf import data, events, portfolio, strategies, trading, vectorized
+from pairs_trading_oaf.history import HistoryColumn
+
+# The bundled datasets, as (training data, testing data)
+BUNDLED_DATASETS = {
+    'Crypto': ("Price Data - CSV - Formation Period - Crypto.csv",
+               "Price Data - CSV - Trading Period - Crypto.csv"),
+    'ETFs': ("Price Data - CSV - Formation Period - ETF.csv",
+             "Price Data - CSV - Trading Period - ETF.csv"),
+    'Stocks': ("Price Data - CSV - Formation Period.csv",
+               "Price Data - CSV - Trading Period.csv"),
+    'Covid': ("Price Data - CSV - Formation Period Covid.csv",
+              "Price Data - CSV - Trading Period Covid.csv")}
+STRATEGY_CLASSES = [strategies.StrategyA,
+                    strategies.StrategyB,
+                    strategies.StrategyC,
+                    strategies.StrategyD,
+                    strategies.StrategyE]
+BASKET_STRATEGY_CLASSES = [strategies.StrategyF]
+# The weights of the baskets of default_baskets
+BASKET_WEIGHTS = (0.5, -1.0, 0.5)
+DEFAULT_RTOL = 1e-9
+DEFAULT_ATOL = 1e-9
+# Values which must match exactly rather than within the tolerances
+EXACT_FIELDS = ['dates', 'position']
+DIVERGENCE_COLUMNS = ['engine', 'dataset', 'strategy', 'stocks', 'field', 'day', 'date',
+                      'reference', 'candidate']
+
+def _simulate_trading_parallel(master_portfolio):
+    """
+    Simulate trading with trading.simulate_trading_parallel on two worker processes.
+    """
+    trading.simulate_trading_parallel(master_portfolio, num_workers=2)
+
+def _simulate_trading_events(master_portfolio):
+    """
+    Simulate trading with events.simulate_trading and reconstruct the daily values from the
+    trades.
+    """
+    events.simulate_trading(master_portfolio, reconstruct=True)
+
+CANDIDATE_ENGINES = {'vectorized': vectorized.simulate_trading,
+                     'events': _simulate_trading_events,
+                     'parallel': _simulate_trading_parallel}
+
+def make_synthetic_dataset(seed: int, num_stocks: int = 6, num_formation_days: int = 250,
+                           num_trading_days: int = 250):
+    """
+    Make randomised training and testing data of stocks whose log prices follow correlated
+    random walks.
+
+    The data includes the cases which are easy to get wrong in a faster engine:
+    - a stock which is listed part way through the formation period and one which is listed
+      part way through the trading period, whose earlier prices are NaN, as for META and
+      GOOGL in the bundled stock data,
+    - a few missing prices scattered through the trading period,
+    - volatile prices, so that some pair portfolios lose more than their cash.
+
+    Returns:
+    - df_train, df_test: DataFrames with the stocks 'Stock0', 'Stock1', ... as columns and
+      the dates as the index.
+    """
+    rng = np.random.default_rng(seed)
+    num_days = num_formation_days + num_trading_days
+    common = rng.normal(0, rng.uniform(0.01, 0.03), num_days)
+    log_returns = common[:, None] \
+                + rng.normal(0, rng.uniform(0.005, 0.03), (num_days, num_stocks))
+    prices = 100 * np.exp(np.cumsum(log_returns, axis=0) + rng.normal(0, 0.5, num_stocks))
+    prices[:rng.integers(1, num_formation_days), 0] = np.nan
+    prices[:num_formation_days + rng.integers(1, num_trading_days), 1] = np.nan
+    missing_days = rng.integers(num_formation_days, num_days, 5)
+    prices[missing_days, rng.integers(2, num_stocks, 5)] = np.nan
+    df = pd.DataFrame(prices, columns=[f"Stock{i}" for i in range(num_stocks)],
+                      index=pd.date_range(start='2015-01-01', periods=num_days, freq='D',
+                                          name='Closing Date'))
+    return df.iloc[:num_formation_days], df.iloc[num_formation_days:]
+
+def iter_datasets(dataset_names=None, num_synthetic: int = 5, seed: int = 0):
+    """
+    Yield the (name, training data, testing data) of the bundled datasets in dataset_names
+    (all of them by default) followed by num_synthetic synthetic datasets.
+    """
+    if dataset_names is None:
+        dataset_names = list(BUNDLED_DATASETS)
+    for name in dataset_names:
+        yield (name,) + BUNDLED_DATASETS[name]
+    for i in range(num_synthetic):
+        yield (f"synthetic_{seed + i}",) + make_synthetic_dataset(seed + i)
+
+def default_pairs(df_test):
+    """
+    Pair up neighbouring columns of the testing data, so that every stock is traded once
+    (the last stock of an odd number is paired with the first).
+    """
+    labels = list(df_test.columns)
+    if len(labels) % 2 == 1 and len(labels) > 1:
+        labels.append(labels[0])
+    return [(labels[i], labels[i + 1]) for i in range(0, len(labels) - 1, 2)]
+
+def default_baskets(df_test):
+    """
+    Group neighbouring columns of the testing data into baskets of three stocks with the
+    weights BASKET_WEIGHTS, leaving out the last stocks if there are not three of them.
+
+    Returns a list of (stock labels, weights).
+    """
+    labels = list(df_test.columns)
+    num_legs = len(BASKET_WEIGHTS)
+    return [(tuple(labels[i:i + num_legs]), BASKET_WEIGHTS)
+            for i in range(0, len(labels) - num_legs + 1, num_legs)]
+
+def make_master_portfolio(training_data, testing_data, stock_pair_labels_list,
+                          strategy_classes=None, position_limit: float = 1.0,
+                          cash: float = 10, trading_fee: float = 0.0002, baskets=()):
+    """
+    Make a master portfolio with a pair portfolio for every pair and strategy class, and a
+    basket portfolio for every basket, given as (stock labels, weights), and strategy class
+    in BASKET_STRATEGY_CLASSES.
+    """
+    if strategy_classes is None:
+        strategy_classes = STRATEGY_CLASSES
+    master_portfolio = portfolio.MasterPortfolio(position_limit, training_data, testing_data,
+                                                 trading_fee=trading_fee)
+    for strategy_class in strategy_classes:
+        for stock_pair_labels in stock_pair_labels_list:
+            pair_portfolio = portfolio.PairPortfolio(tuple(stock_pair_labels), strategy_class,
+                                                     master_portfolio, cash=cash)
+            pair_portfolio.trading_fee = trading_fee
+            master_portfolio.add_pair_portfolio(pair_portfolio)
+    for strategy_class in BASKET_STRATEGY_CLASSES:
+        for stock_labels, weights in baskets:
+            basket_portfolio = portfolio.BasketPortfolio(stock_labels, weights, strategy_class,
+                                                         master_portfolio, cash=cash)
+            basket_portfolio.trading_fee = trading_fee
+            master_portfolio.add_basket_portfolio(basket_portfolio)
+    return master_portfolio
+
+def get_over_time_values(pair_portfolio):
+    """
+    Return a dictionary of every *_over_time value of a pair or basket portfolio and of its
+    strategy, e.g. 'cash' and 'strategy.upper_band', as numpy arrays with the days along the
+    first axis. The values of StrategyB's over_time_vals are named e.g. 'strategy.macd'.
+    """
+    over_time_values = {}
+    for key, value in vars(pair_portfolio).items():
+        if key.endswith('_over_time') and isinstance(value, HistoryColumn):
+            over_time_values[key[:-len('_over_time')]] = np.asarray(value.values())
+    strategy = pair_portfolio.strategy
+    for key, value in vars(strategy).items():
+        if key.endswith('_over_time') and isinstance(value, list):
+            over_time_values['strategy.' + key[:-len('_over_time')]] = \
+                np.asarray(value, dtype=float)
+    if hasattr(strategy, 'over_time_vals'):
+        for key, value in vars(strategy.over_time_vals).items():
+            over_time_values['strategy.' + key] = np.asarray(value, dtype=float)
+    return over_time_values
+
+def find_first_divergence(reference, candidate, exact: bool, rtol: float, atol: float):
+    """
+    Return the index of the first day on which two arrays of over time values differ, or
+    None if they are equivalent. A day which is missing from one of them is a divergence.
+    """
+    num_days = min(len(reference), len(candidate))
+    reference_days = reference[:num_days]
+    candidate_days = candidate[:num_days]
+    if exact:
+        different = reference_days != candidate_days
+    else:
+        different = ~np.isclose(candidate_days, reference_days, rtol=rtol, atol=atol,
+                                equal_nan=True)
+    different = different.reshape(num_days, -1).any(axis=1)
+    divergent_days = np.flatnonzero(different)
+    if len(divergent_days) > 0:
+        return int(divergent_days[0])
+    if len(reference) != len(candidate):
+        return num_days
+    return None
+
+def compare_pair_portfolios(reference, candidate, rtol: float = DEFAULT_RTOL,
+                            atol: float = DEFAULT_ATOL):
+    """
+    Compare every over time value of a candidate pair or basket portfolio with the reference.
+
+    Returns a list with a dictionary for each divergent value, giving its 'field', the
+    first divergent 'day' and its 'date', and the 'reference' and 'candidate' values on
+    that day (None if the day is missing).
+    """
+    reference_values = get_over_time_values(reference)
+    candidate_values = get_over_time_values(candidate)
+    reference_dates = reference_values['dates']
+    divergences = []
+    for field in sorted(set(reference_values) | set(candidate_values)):
+        reference_value = reference_values.get(field, np.empty(0))
+        candidate_value = candidate_values.get(field, np.empty(0))
+        day = find_first_divergence(reference_value, candidate_value, field in EXACT_FIELDS,
+                                    rtol, atol)
+        if day is None:
+            continue
+        divergences.append({
+            'field': field,
+            'day': day,
+            'date': pd.Timestamp(reference_dates[day]) if day < len(reference_dates) else None,
+            'reference': reference_value[day].tolist() if day < len(reference_value) else None,
+            'candidate': candidate_value[day].tolist() if day < len(candidate_value) else None})
+    return divergences
+
+def check_engine(candidate_engine, training_data, testing_data, stock_pair_labels_list=None,
+                 strategy_classes=None, rtol: float = DEFAULT_RTOL, atol: float = DEFAULT_ATOL,
+                 reference_portfolio=None, baskets=None, **portfolio_kwargs):
+    """
+    Run the reference daily loop and a candidate engine on the same dataset and compare them.
+
+    Inputs:
+    - candidate_engine: a function which simulates trading for a master portfolio, e.g.
+      vectorized.simulate_trading.
+    - training_data, testing_data: the data sources of the master portfolio, filenames or
+      DataFrames (see data.get_data).
+    - stock_pair_labels_list: the pairs to trade. Defaults to default_pairs.
+    - strategy_classes: the strategies to trade each pair with. Defaults to STRATEGY_CLASSES.
+    - baskets: the (stock labels, weights) of the baskets to trade with
+      BASKET_STRATEGY_CLASSES. Defaults to default_baskets.
+    - rtol, atol: the tolerances of the values other than EXACT_FIELDS.
+    - reference_portfolio: an already simulated reference master portfolio of the same pairs,
+      baskets and strategies, so that it can be shared between candidate engines.
+    - portfolio_kwargs: passed to make_master_portfolio, e.g. position_limit.
+
+    Returns:
+    - A DataFrame with the columns DIVERGENCE_COLUMNS other than 'engine' and 'dataset',
+      with one row per divergent portfolio and value, sorted by the first divergent day. The
+      'stocks' column holds the stock labels of the portfolio joined by ' / '.
+    """
+    if stock_pair_labels_list is None:
+        stock_pair_labels_list = default_pairs(data.get_data(testing_data))
+    if baskets is None:
+        baskets = default_baskets(data.get_data(testing_data))
+    if reference_portfolio is None:
+        reference_portfolio = make_master_portfolio(training_data, testing_data,
+                                                    stock_pair_labels_list, strategy_classes,
+                                                    baskets=baskets, **portfolio_kwargs)
+        trading.simulate_trading(reference_portfolio)
+    candidate_portfolio = make_master_portfolio(training_data, testing_data,
+                                                stock_pair_labels_list, strategy_classes,
+                                                baskets=baskets, **portfolio_kwargs)
+    candidate_engine(candidate_portfolio)
+
+    rows = []
+    for reference, candidate in zip(reference_portfolio.traded_portfolios,
+                                    candidate_portfolio.traded_portfolios):
+        for divergence in compare_pair_portfolios(reference, candidate, rtol, atol):
+            rows.append({'strategy': reference.strategy.__class__.__name__,
+                         'stocks': ' / '.join(reference.stock_labels),
+                         **divergence})
+    divergences = pd.DataFrame(rows, columns=DIVERGENCE_COLUMNS[2:])
+    return divergences.sort_values('day', kind='stable', ignore_index=True)
+
+def run_equivalence(engine_names=None, dataset_names=None, num_synthetic: int = 5,
+                    seed: int = 0, rtol: float = DEFAULT_RTOL, atol: float = DEFAULT_ATOL):
+    """
+    Check every candidate engine in engine_names (all of CANDIDATE_ENGINES by default) on the
+    datasets of iter_datasets.
+
+    Returns a DataFrame with the columns DIVERGENCE_COLUMNS and one row per divergent
+    engine, dataset, portfolio and value, which is empty if every engine is equivalent
+    to the reference.
+    """
+    if engine_names is None:
+        engine_names = list(CANDIDATE_ENGINES)
+    results = []
+    for dataset_name, training_data, testing_data in iter_datasets(dataset_names,
+                                                                   num_synthetic, seed):
+        stock_pair_labels_list = default_pairs(data.get_data(testing_data))
+        baskets = default_baskets(data.get_data(testing_data))
+        portfolio_kwargs = {}
+        if dataset_name.startswith('synthetic_'):
+            # Large positions in the synthetic data make some pair portfolios lose more than
+            # their cash, which the engines must handle in the same way
+            portfolio_kwargs['position_limit'] = 20.0
+        reference_portfolio = make_master_portfolio(training_data, testing_data,
+                                                    stock_pair_labels_list, baskets=baskets,
+                                                    **portfolio_kwargs)
+        trading.simulate_trading(reference_portfolio)
+        for engine_name in engine_names:
+            divergences = check_engine(CANDIDATE_ENGINES[engine_name], training_data,
+                                       testing_data, stock_pair_labels_list, rtol=rtol,
+                                       atol=atol, reference_portfolio=reference_portfolio,
+                                       baskets=baskets, **portfolio_kwargs)
+            divergences.insert(0, 'dataset', dataset_name)
+            divergences.insert(0, 'engine', engine_name)
+            results.append(divergences)
+    return pd.concat(results, ignore_index=True) if results \
+        else pd.DataFrame(columns=DIVERGENCE_COLUMNS)
+
+def main(argv=None):
+    """
+    Command line interface to check the candidate engines against the reference.
+
+    Returns the exit status, 1 if any engine diverges from the reference.
+    """
+    parser = argparse.ArgumentParser(
+        description="Check that faster engines reproduce trading.simulate_trading.")
+    parser.add_argument('--engines', nargs='+', choices=list(CANDIDATE_ENGINES),
+                        help='the candidate engines to check (default: all)')
+    parser.add_argument('--datasets', nargs='*', choices=list(BUNDLED_DATASETS),
+                        help='the bundled datasets to check (default: all)')
+    parser.add_argument('--num-synthetic', type=int, default=5,
+                        help='the number of synthetic datasets to check')
+    parser.add_argument('--seed', type=int, default=0,
+                        help='the seed of the first synthetic dataset')
+    parser.add_argument('--rtol', type=float, default=DEFAULT_RTOL)
+    parser.add_argument('--atol', type=float, default=DEFAULT_ATOL)
+    args = parser.parse_args(argv)
+
+    divergences = run_equivalence(args.engines, args.datasets, args.num_synthetic,
+                                  args.seed, args.rtol, args.atol)
+    if len(divergences) == 0:
+        print("All engines reproduce the reference.")
+        return 0
+    for (engine, dataset), group in divergences.groupby(['engine', 'dataset'], sort=False):
+        first = group.iloc[0]
+        print(f"{engine} diverges from the reference on {dataset} in {len(group)} values. "
+              f"First on day {first['day']} ({first['date']}): {first['strategy']} "
+              f"{first['stocks']} {first['field']} "
+              f"{first['candidate']} instead of {first['reference']}")
+    return 1
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,232 @@
+"""
+An event-driven alternative to trading.simulate_trading.
+
+The strategies are still asked for their position every day, as in the daily loop, as they
+update their rolling windows and indicators with the prices of every day. But on most days
+the position does not change and there is nothing to execute. Rather than recording a
+snapshot of every pair portfolio every day, this engine only records the trades, as events in
+a TradeLog: the day, the old and new positions, the shares, the fee and the cash after the
+trade. The portfolio value is only recalculated on the days on which a position is held, as
+it is only needed for the check that forces the position to "no position" when the value goes
+negative.
+
+The trade logs, in the trade_logs of each portfolio, are the output of this engine, so the
+memory and the time spent recording the results grow with the number of trades rather than
+the number of days, which suits long backtests which rarely trade. The daily positions,
+shares, cash, prices and portfolio values are reconstructed on demand from the events and the
+prices of the testing data, by carrying the state after each trade forward with numpy array
+operations (see TradeLog.daily_values). reconstruct_over_time_values, or simulate_trading with
+reconstruct=True, reconstructs them into the same *_over_time values as
+trading.simulate_trading, e.g. for the plotting routines and metrics.calc_metrics.
+"""
+import numpy as np
+import pandas as pd
+from pairs_trading_oaf import data, trading
+from pairs_trading_oaf.history import HistoryColumn
+from pairs_trading_oaf.positions import Position, to_position
+
+class TradeLog:
+    """
+    The trades of a pair or basket portfolio over one trading period.
+
+    Inputs:
+    - pair_portfolio: the pair or basket portfolio, in its state at the start of the period.
+    - data_source: the testing data of the period (see data.get_data), which the daily
+      values are reconstructed from.
+
+    Each trade is recorded with the index of its day in the trading period and its date, the
+    positions before and after the trade, the shares of each stock and the cash after the
+    trade, and the transaction fee paid for closing the old position and opening the new one.
+    """
+    def __init__(self, pair_portfolio, data_source):
+        self.data_source = data_source
+        self.stock_labels = tuple(pair_portfolio.stock_labels)
+        self.initial_position = to_position(pair_portfolio.position)
+        self.initial_shares = np.array(pair_portfolio.shares, dtype=float)
+        self.initial_cash = pair_portfolio.cash
+        self.initial_prices = np.array(pair_portfolio.prices, dtype=float)
+        num_legs = len(self.stock_labels)
+        self.days = HistoryColumn(np.int64)
+        self.dates = HistoryColumn()
+        self.old_positions = HistoryColumn(np.int8, item_type=Position)
+        self.new_positions = HistoryColumn(np.int8, item_type=Position)
+        self.shares = HistoryColumn(float, width=num_legs)
+        self.fees = HistoryColumn(float)
+        self.cash = HistoryColumn(float)
+
+    def __len__(self):
+        return len(self.days)
+
+    def execute_trade(self, pair_portfolio, day: int, new_position):
+        """
+        Execute the trades of pair_portfolio into new_position on day day of the trading
+        period (see trading.execute_trades) and record them.
+        """
+        old_position = pair_portfolio.position
+        old_shares = np.abs(pair_portfolio.shares)
+        trading.execute_trades(pair_portfolio, new_position)
+        prices = np.asarray(pair_portfolio.prices, dtype=float)
+        trade_amount = old_shares @ prices + np.abs(pair_portfolio.shares) @ prices
+        self.days.append(day)
+        self.dates.append(pair_portfolio.date)
+        self.old_positions.append(old_position)
+        self.new_positions.append(pair_portfolio.position)
+        self.shares.append(pair_portfolio.shares)
+        self.fees.append(trade_amount * pair_portfolio.trading_fee)
+        self.cash.append(pair_portfolio.cash)
+
+    def to_frame(self):
+        """
+        Return the trades as a DataFrame with a row for each trade and the columns day, date,
+        old_position, new_position, fee and cash, followed by the shares of each stock after
+        the trade in a column named after the stock.
+        """
+        df = pd.DataFrame({'day': self.days.values(),
+                           'date': pd.DatetimeIndex(self.dates.tolist()),
+                           'old_position': self.old_positions.values(),
+                           'new_position': self.new_positions.values(),
+                           'fee': self.fees.values(),
+                           'cash': self.cash.values()})
+        for i, stock_label in enumerate(self.stock_labels):
+            df[stock_label] = self.shares.values()[:, i]
+        return df
+
+    def daily_values(self, prices=None, listed=None):
+        """
+        Reconstruct the daily values of the trading period from the trades.
+
+        prices, the prices of the stocks on each day of shape (num_days, num_stocks), and
+        listed, which is True on the days on which every stock is listed, are looked up in the
+        testing data if they are None.
+
+        Returns a dictionary of numpy arrays with a value for each day of the period:
+        - 'dates': the dates.
+        - 'position': the position codes held at the end of each day.
+        - 'shares': the shares of each stock, of shape (num_days, num_stocks).
+        - 'cash': the cash.
+        - 'prices': the prices the portfolio is valued at, of shape (num_days, num_stocks).
+          As in trading.simulate_trading, the days on which a stock is not listed keep the
+          prices of the last day on which every stock was listed.
+        - 'portfolio_value': the value of the cash and shares, where missing prices add
+          nothing to the value.
+        """
+        df = data.get_data(self.data_source)
+        stock_labels = list(self.stock_labels)
+        if prices is None:
+            prices = df[stock_labels].to_numpy(dtype=float)
+        if listed is None:
+            available = data.get_availability(self.data_source)
+            listed = available[stock_labels].to_numpy().all(axis=1)
+        # Index -1 picks out the state at the start of the period, appended after the values
+        # of the listed days or trades
+        listed_days = np.flatnonzero(listed)
+        last_listed = get_last_indices(listed_days, len(df))
+        marked_prices = np.concatenate([prices[listed_days], [self.initial_prices]])[last_listed]
+        last_trade = get_last_indices(self.days.values(), len(df))
+        positions = np.append(self.new_positions.values(),
+                              np.int8(self.initial_position))[last_trade]
+        shares = np.concatenate([self.shares.values(), [self.initial_shares]])[last_trade]
+        cash = np.append(self.cash.values(), self.initial_cash)[last_trade]
+
+        # Add the value of each stock in turn, in the order of the daily loop
+        portfolio_values = cash.copy()
+        for i in range(len(stock_labels)):
+            missing = np.isnan(marked_prices[:, i])
+            portfolio_values += np.where(missing, 0.0, shares[:, i] * marked_prices[:, i])
+        return {'dates': df.index, 'position': positions, 'shares': shares, 'cash': cash,
+                'prices': marked_prices, 'portfolio_value': portfolio_values}
+
+def get_last_indices(days, num_days: int):
+    """
+    Return, for each of num_days days, the index into the sorted array days of the latest
+    day on or before it, or -1 for the days before the first of them.
+    """
+    last_indices = np.full(num_days, -1)
+    last_indices[days] = np.arange(len(days))
+    np.maximum.accumulate(last_indices, out=last_indices)
+    return last_indices
+
+def simulate_trading(master_portfolio, reconstruct: bool = False):
+    """
+    Simulate trading for the master portfolio, both its pair portfolios and its basket
+    portfolios, by iterating through the testing data and only recording the trades.
+
+    The trades of each portfolio are appended to its trade_logs as one TradeLog for the
+    period (see simulate_pair_portfolios). If reconstruct is True the daily values are also
+    reconstructed into its *_over_time values (see reconstruct_over_time_values).
+    """
+    df_test = data.get_data(master_portfolio.testing_data_source)
+    simulate_pair_portfolios(df_test, master_portfolio.traded_portfolios,
+                             data.get_availability(master_portfolio.testing_data_source),
+                             reconstruct)
+
+def simulate_pair_portfolios(df_test, pair_portfolios, available=None,
+                             reconstruct: bool = False):
+    """
+    Simulate trading for a list of pair and basket portfolios by iterating through the rows
+    of df_test, with the same days, warm-up and forced closes as
+    trading.simulate_pair_portfolios, but only recording the trades.
+
+    available is the availability mask of df_test (see data.get_availability), which is
+    calculated from df_test if it is None.
+
+    Each portfolio gets a TradeLog of its trades over df_test, which is appended to its
+    trade_logs. Simulating several trading periods one after another, e.g. in a walk-forward
+    test, leaves one TradeLog for each period in trade_logs, in order, each numbering its
+    days from the start of its own period.
+    """
+    price_rows, column_indices = trading.get_price_rows(df_test, pair_portfolios)
+    if available is None:
+        available = data.get_availability(df_test)
+    pair_available = trading.get_pair_availability(available, pair_portfolios)
+    day_states = trading.get_day_states(available, pair_portfolios)
+    trade_logs = [TradeLog(pair_portfolio, df_test) for pair_portfolio in pair_portfolios]
+    for day, (date, row, row_states) in enumerate(zip(df_test.index, price_rows, day_states)):
+        for pair_portfolio, indices, state, trade_log in zip(pair_portfolios, column_indices,
+                                                             row_states, trade_logs):
+            if state == trading.NOT_LISTED:
+                continue
+            pair_portfolio.update_prices_from_row(date, row, indices)
+            new_position = pair_portfolio.strategy.calculate_new_position()
+            if state == trading.WARMING_UP:
+                # The strategy has used up one of its warm-up days
+                pair_portfolio.strategy.warm_up_days -= 1
+                new_position = pair_portfolio.position
+            if pair_portfolio.portfolio_value < 0:
+                new_position = Position.NO_POSITION
+            elif not isinstance(new_position, Position):
+                # Strategies may still return the position as a string
+                new_position = to_position(new_position)
+            if new_position != pair_portfolio.position:
+                trade_log.execute_trade(pair_portfolio, day, new_position)
+            elif pair_portfolio.position == Position.NO_POSITION:
+                # Without shares the value is the cash, which only changes with a trade
+                continue
+            pair_portfolio.portfolio_value = pair_portfolio.calculate_portfolio_value()
+
+    prices = np.array(price_rows).reshape(len(df_test), -1) if reconstruct else None
+    for i, (pair_portfolio, trade_log) in enumerate(zip(pair_portfolios, trade_logs)):
+        if len(df_test) > 0:
+            pair_portfolio.date = df_test.index[-1]
+        pair_portfolio.trade_logs.append(trade_log)
+        if reconstruct:
+            reconstruct_over_time_values(pair_portfolio, prices[:, list(column_indices[i])],
+                                         pair_available[:, i])
+
+def reconstruct_over_time_values(pair_portfolio, prices=None, listed=None, trade_log=None):
+    """
+    Append the daily values reconstructed from a trade log of a pair or basket portfolio (see
+    TradeLog.daily_values, which is given prices and listed) to its *_over_time values, as
+    trading.simulate_trading would have recorded them. trade_log defaults to the log of the
+    latest trading period, the last of its trade_logs. To reconstruct several periods, call
+    it for each of the trade_logs in order.
+    """
+    if trade_log is None:
+        trade_log = pair_portfolio.trade_logs[-1]
+    daily_values = trade_log.daily_values(prices, listed)
+    pair_portfolio.cash_over_time.extend(daily_values['cash'])
+    pair_portfolio.dates_over_time.extend(daily_values['dates'])
+    pair_portfolio.position_over_time.extend(daily_values['position'])
+    pair_portfolio.shares_over_time.extend(daily_values['shares'])
+    pair_portfolio.portfolio_value_over_time.extend(daily_values['portfolio_value'])
+    pair_portfolio.extend_prices_over_time(daily_values['prices'])
@@ -0,0 +1,161 @@
+"""
+Array-backed storage for the *_over_time values of the pair portfolios.
+
+Each *_over_time value is a HistoryColumn: a typed numpy array which is preallocated for the
+trading period and filled in by index, rather than a Python list of floats and tuples. The
+columns behave like read-only lists for existing callers (len, indexing, slicing, iteration
+and == against lists), and values() returns the filled part of the array as a read-only view,
+so callers which want a numpy array do not need to convert a list.
+"""
+import numpy as np
+import pandas as pd
+
+class HistoryColumn:
+    """
+    A column of values recorded once per day.
+
+    Inputs:
+    - dtype: the numpy dtype of the values, e.g. float. If None the dtype is chosen from the
+      first value recorded: datetime64[ns] for timezone-naive timestamps, otherwise object.
+    - width: None for a column of scalars, or the length of the tuples stored on each day,
+      e.g. 2 for the stock A and stock B prices. Reading a day of a column with a width
+      gives a tuple.
+    - capacity: the number of days to preallocate.
+    - item_type: optional type, e.g. positions.Position, which the values are converted to
+      when they are read back one at a time or as a list.
+
+    Appending beyond the capacity grows the array geometrically, so appends stay cheap on
+    average even without a call to reserve().
+    """
+    def __init__(self, dtype=None, width=None, capacity=0, item_type=None):
+        self.width = width
+        self.item_type = item_type
+        self._dtype = None if dtype is None else np.dtype(dtype)
+        self._size = 0
+        self._data = None
+        if self._dtype is not None:
+            self._data = np.empty(self._shape(capacity), dtype=self._dtype)
+        self._capacity = capacity
+
+    def reserve(self, capacity):
+        """
+        Make sure the column has space for at least capacity days without reallocating.
+        """
+        if capacity > self._capacity:
+            self._capacity = capacity
+            if self._data is not None:
+                data = np.empty(self._shape(capacity), dtype=self._dtype)
+                data[:self._size] = self._data[:self._size]
+                self._data = data
+
+    def append(self, value):
+        """
+        Record the value of the next day.
+        """
+        if self._data is None:
+            self._set_dtype(value)
+        if self._size == self._capacity:
+            self.reserve(max(2 * self._capacity, 16))
+        self._data[self._size] = value
+        self._size += 1
+
+    def extend(self, values):
+        """
+        Record the values of the next len(values) days. values can be a list or an array.
+        """
+        if not isinstance(values, (np.ndarray, pd.Index)):
+            values = list(values)
+        if len(values) == 0:
+            return
+        if self._data is None:
+            self._set_dtype(values[0])
+        if self._dtype.kind == 'M' and isinstance(values, pd.Index):
+            values = values.to_numpy(dtype=self._dtype)
+        elif self._dtype.kind == 'O' and self.width is None:
+            # Stop numpy from treating tuples in an object column as rows
+            object_values = np.empty(len(values), dtype=object)
+            object_values[:] = list(values)
+            values = object_values
+        size = self._size + len(values)
+        if size > self._capacity:
+            self.reserve(max(size, 2 * self._capacity))
+        self._data[self._size:size] = values
+        self._size = size
+
+    def values(self):
+        """
+        Return a read-only view of the recorded values, of shape (num_days,) or
+        (num_days, width).
+        """
+        if self._data is None:
+            return np.empty(self._shape(0))
+        view = self._data[:self._size]
+        view.flags.writeable = False
+        return view
+
+    def tolist(self):
+        """
+        Return the recorded values as a list, with the same types as a list of the values
+        recorded by the daily loop: floats, tuples of floats, pandas Timestamps or item_type.
+        """
+        values = self.values()
+        if values.dtype.kind == 'M':
+            return list(pd.DatetimeIndex(values))
+        if self.width is not None:
+            return [tuple(row) for row in values.tolist()]
+        if self.item_type is not None:
+            return [self.item_type(value) for value in values.tolist()]
+        return values.tolist()
+
+    def __len__(self):
+        return self._size
+
+    def __getitem__(self, index):
+        if isinstance(index, slice):
+            return self.tolist()[index]
+        values = self.values()
+        value = values[index]
+        if self.width is not None:
+            return tuple(value.tolist())
+        if values.dtype.kind == 'M':
+            return pd.Timestamp(value)
+        if self.item_type is not None:
+            return self.item_type(value)
+        return value.item() if isinstance(value, np.generic) else value
+
+    def __iter__(self):
+        return iter(self.tolist())
+
+    def __eq__(self, other):
+        if isinstance(other, HistoryColumn):
+            other = other.tolist()
+        if isinstance(other, (list, tuple)):
+            return self.tolist() == list(other)
+        return NotImplemented
+
+    __hash__ = None
+
+    def __array__(self, dtype=None):
+        values = self.values()
+        return values if dtype is None else values.astype(dtype)
+
+    def __repr__(self):
+        return f"HistoryColumn({self.tolist()!r})"
+
+    def __getstate__(self):
+        # Only pickle the recorded values, not the unused capacity
+        state = self.__dict__.copy()
+        if self._data is not None:
+            state['_data'] = self._data[:self._size].copy()
+            state['_capacity'] = self._size
+        return state
+
+    def _shape(self, capacity):
+        return (capacity,) if self.width is None else (capacity, self.width)
+
+    def _set_dtype(self, value):
+        if isinstance(value, (pd.Timestamp, np.datetime64)) and getattr(value, 'tz', None) is None:
+            self._dtype = np.dtype('datetime64[ns]')
+        else:
+            self._dtype = np.dtype(object)
+        self._data = np.empty(self._shape(self._capacity), dtype=self._dtype)
@@ -0,0 +1,122 @@
+"""
+Opt-in instrumentation of the daily trading loop in trading.py.
+
+Pass a list of collectors to trading.simulate_trading (or trading.simulate_pair_portfolios)
+and the loop times each phase of each day for each pair portfolio:
+- update_prices_and_date: handing the prices of the pair from the row of testing data to the
+  pair portfolio,
+- calculate_new_position: the strategy,
+- execute_trades: closing and opening positions,
+- update_over_time_values: recording the over time values.
+and reports the timings and every change of position to the collectors. Without collectors
+the loop is not instrumented and runs at full speed.
+
+A collector is any object with the methods of Collector, so custom collectors can subclass
+Collector and override the hooks they need. ProfileCollector is the built-in collector, which
+adds up the time spent in each phase and counts the trades and position flips for each pair
+portfolio, and reports them as DataFrames:
+
+    profile = instrumentation.ProfileCollector()
+    trading.simulate_trading(master_portfolio, collectors=[profile])
+    print(profile.summary())
+"""
+import numpy as np
+import pandas as pd
+from pairs_trading_oaf.positions import Position
+
+PHASES = ('update_prices_and_date',
+          'calculate_new_position',
+          'execute_trades',
+          'update_over_time_values')
+
+class Collector:
+    """
+    Base class of the collectors. Each hook does nothing by default.
+    """
+    def on_start(self, pair_portfolios):
+        """
+        Called before the first day with the list of pair portfolios to simulate.
+        """
+
+    def on_day(self, pair_portfolio, date, phase_seconds):
+        """
+        Called at the end of each day for each pair portfolio, where phase_seconds is a tuple
+        of the seconds spent in each phase, in the order of PHASES.
+        """
+
+    def on_trade(self, pair_portfolio, date, old_position, new_position):
+        """
+        Called whenever the position of a pair portfolio changes.
+        """
+
+    def on_finish(self):
+        """
+        Called after the last day.
+        """
+
+class ProfileCollector(Collector):
+    """
+    Collector which adds up the time spent in each phase and counts the trades (changes of
+    position) and flips (changes straight from one long/short position to the opposite one)
+    for each pair portfolio.
+    """
+    def __init__(self):
+        self.pair_portfolios = []
+        self.phase_seconds = np.zeros((0, len(PHASES)))
+        self.num_days = np.zeros(0, dtype=np.int64)
+        self.num_trades = np.zeros(0, dtype=np.int64)
+        self.num_flips = np.zeros(0, dtype=np.int64)
+        self._indices = {}
+
+    def on_start(self, pair_portfolios):
+        for pair_portfolio in pair_portfolios:
+            if id(pair_portfolio) not in self._indices:
+                self._indices[id(pair_portfolio)] = len(self.pair_portfolios)
+                self.pair_portfolios.append(pair_portfolio)
+        num_pair_portfolios = len(self.pair_portfolios)
+        num_new = num_pair_portfolios - len(self.num_days)
+        self.phase_seconds = np.vstack([self.phase_seconds, np.zeros((num_new, len(PHASES)))])
+        self.num_days = np.append(self.num_days, np.zeros(num_new, dtype=np.int64))
+        self.num_trades = np.append(self.num_trades, np.zeros(num_new, dtype=np.int64))
+        self.num_flips = np.append(self.num_flips, np.zeros(num_new, dtype=np.int64))
+
+    def on_day(self, pair_portfolio, date, phase_seconds):
+        index = self._indices[id(pair_portfolio)]
+        self.phase_seconds[index] += phase_seconds
+        self.num_days[index] += 1
+
+    def on_trade(self, pair_portfolio, date, old_position, new_position):
+        index = self._indices[id(pair_portfolio)]
+        self.num_trades[index] += 1
+        if old_position != Position.NO_POSITION and new_position != Position.NO_POSITION:
+            self.num_flips[index] += 1
+
+    def report(self):
+        """
+        Return a DataFrame with one row per pair or basket portfolio and the columns
+        'strategy', 'stocks' (the full stock labels joined with underscores, e.g.
+        "Walmart Inc. (NYSE:WMT)_Target Corporation (NYSE:TGT)"), 'num_days', the seconds spent
+        in each phase, 'total_seconds', 'num_trades' and 'num_flips'.
+        """
+        report = pd.DataFrame({
+            'strategy': [pair_portfolio.strategy.__class__.__name__
+                         for pair_portfolio in self.pair_portfolios],
+            'stocks': ['_'.join(pair_portfolio.stock_labels)
+                       for pair_portfolio in self.pair_portfolios],
+            'num_days': self.num_days})
+        for i, phase in enumerate(PHASES):
+            report[phase + '_seconds'] = self.phase_seconds[:, i]
+        report['total_seconds'] = self.phase_seconds.sum(axis=1)
+        report['num_trades'] = self.num_trades
+        report['num_flips'] = self.num_flips
+        return report
+
+    def summary(self):
+        """
+        Return the report added up over the pair and basket portfolios of each strategy class,
+        with their number in 'num_pair_portfolios'.
+        """
+        report = self.report().drop(columns=['stocks'])
+        summary = report.groupby('strategy', sort=False).sum()
+        summary.insert(0, 'num_pair_portfolios', report.groupby('strategy', sort=False).size())
+        return summary
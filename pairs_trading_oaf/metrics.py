@@ -0,0 +1,298 @@
+"""
+Performance metrics of the pair portfolios, calculated from their over time values.
+
+Every function works on whole arrays with time along the last axis, so the metrics of all the
+pair portfolios of a master portfolio are calculated at once from arrays of shape
+(num_pair_portfolios, num_days), without looping over the days or the pair portfolios in
+Python. stack_over_time_values makes these arrays from a list of pair portfolios, and
+calc_metrics puts every metric into one DataFrame:
+
+    metrics_df = metrics.calc_metrics(master_portfolio.traded_portfolios)
+    print(metrics.summarise_by_strategy(metrics_df))
+
+Holding periods and trades are found by run-length encoding the positions: each run of days
+with the same position is one holding period, and each run with a position other than
+Position.NO_POSITION is one trade. As positions are opened without any cash changing hands
+(see trading.open_position), the profit or loss of a trade is the change in cash on the day it
+is closed, or the value of its shares if it is still open on the last day.
+"""
+import numpy as np
+import pandas as pd
+from pairs_trading_oaf.positions import Position, POSITION_STRINGS, to_codes
+
+# The number of trading days in a year, used to annualise the metrics
+PERIODS_PER_YEAR = 252
+
+def stack_over_time_values(pair_portfolios, value_string: str):
+    """
+    Stack one of the over time values of a list of pair portfolios, e.g. "portfolio_value",
+    into an array of shape (num_pair_portfolios, num_days). The positions are returned as int8
+    position codes.
+
+    Raises a ValueError if the pair portfolios have different numbers of days.
+    """
+    over_time_values = [getattr(pair_portfolio, value_string + "_over_time")
+                        for pair_portfolio in pair_portfolios]
+    if value_string == "position":
+        return np.stack([to_codes(values) for values in over_time_values])
+    return np.stack([np.asarray(values, dtype=float) for values in over_time_values])
+
+def calc_returns(portfolio_values):
+    """
+    Calculate the daily returns of the portfolio values along the last axis.
+    """
+    portfolio_values = np.asarray(portfolio_values, dtype=float)
+    with np.errstate(divide='ignore', invalid='ignore'):
+        return portfolio_values[..., 1:] / portfolio_values[..., :-1] - 1
+
+def calc_sharpe_ratio(portfolio_values, periods_per_year=PERIODS_PER_YEAR):
+    """
+    Calculate the annualised Sharpe ratio of the daily returns, taking the risk-free rate to
+    be zero. The ratio is NaN if the returns do not vary.
+    """
+    returns = calc_returns(portfolio_values)
+    with np.errstate(divide='ignore', invalid='ignore'):
+        std = returns.std(axis=-1, ddof=1) if returns.shape[-1] > 1 \
+            else np.full(returns.shape[:-1], np.nan)
+        std = np.where(std > 0, std, np.nan)
+        return returns.mean(axis=-1) / std * np.sqrt(periods_per_year)
+
+def calc_sortino_ratio(portfolio_values, periods_per_year=PERIODS_PER_YEAR):
+    """
+    Calculate the annualised Sortino ratio of the daily returns, i.e. the mean return over the
+    downside deviation (the root mean square of the negative returns), taking the target return
+    to be zero. The ratio is NaN if no return is negative.
+    """
+    returns = calc_returns(portfolio_values)
+    with np.errstate(divide='ignore', invalid='ignore'):
+        downside_deviation = np.sqrt(np.mean(np.minimum(returns, 0) ** 2, axis=-1))
+        downside_deviation = np.where(downside_deviation > 0, downside_deviation, np.nan)
+        return returns.mean(axis=-1) / downside_deviation * np.sqrt(periods_per_year)
+
+def calc_max_drawdown(portfolio_values):
+    """
+    Calculate the maximum drawdown along the last axis, i.e. the largest fall from a running
+    peak as a fraction of that peak. The drawdown is 0 if the value never falls.
+    """
+    portfolio_values = np.asarray(portfolio_values, dtype=float)
+    if portfolio_values.shape[-1] == 0:
+        return np.zeros(portfolio_values.shape[:-1])
+    peaks = np.fmax.accumulate(portfolio_values, axis=-1)
+    with np.errstate(divide='ignore', invalid='ignore'):
+        drawdowns = (peaks - portfolio_values) / np.abs(peaks)
+    drawdowns[~np.isfinite(drawdowns)] = 0.0
+    return np.maximum(drawdowns.max(axis=-1), 0.0)
+
+def calc_max_drawdown_duration(portfolio_values):
+    """
+    Calculate the longest number of consecutive days on which the portfolio value was below its
+    running peak, along the last axis.
+    """
+    portfolio_values = np.asarray(portfolio_values, dtype=float)
+    if portfolio_values.shape[-1] == 0:
+        return np.zeros(portfolio_values.shape[:-1], dtype=np.int64)
+    is_below_peak = portfolio_values < np.fmax.accumulate(portfolio_values, axis=-1)
+    rows, _, lengths, run_values = run_length_encode(is_below_peak)
+    durations = np.zeros(int(np.prod(portfolio_values.shape[:-1])), dtype=np.int64)
+    np.maximum.at(durations, rows[run_values], lengths[run_values])
+    return durations.reshape(portfolio_values.shape[:-1])
+
+def calc_num_position_changes(positions, initial_position=Position.NO_POSITION):
+    """
+    Calculate the number of times the position changed along the last axis, starting from
+    initial_position.
+    """
+    codes = to_codes(positions)
+    previous_codes = np.concatenate([np.full(codes.shape[:-1] + (1,), int(initial_position),
+                                             dtype=np.int8), codes], axis=-1)[..., :-1]
+    return np.count_nonzero(codes != previous_codes, axis=-1)
+
+def calc_turnover(positions, portfolio_values, position_limit,
+                  periods_per_year=PERIODS_PER_YEAR, initial_position=Position.NO_POSITION):
+    """
+    Calculate the annualised turnover, i.e. the notional traded per year as a fraction of the
+    mean portfolio value.
+
+    Each leg of a trade is counted at the position limit, so opening or closing a position
+    trades 2 * position_limit and going straight from one position to the opposite one trades
+    4 * position_limit. position_limit can be an array with one limit per pair portfolio.
+    """
+    codes = to_codes(positions).astype(np.int64)
+    previous_codes = np.concatenate([np.full(codes.shape[:-1] + (1,), int(initial_position)),
+                                     codes], axis=-1)[..., :-1]
+    traded_notional = 2 * np.asarray(position_limit, dtype=float) \
+                    * np.abs(codes - previous_codes).sum(axis=-1)
+    portfolio_values = np.asarray(portfolio_values, dtype=float)
+    with np.errstate(divide='ignore', invalid='ignore'):
+        return traded_notional / portfolio_values.mean(axis=-1) \
+             * periods_per_year / portfolio_values.shape[-1]
+
+def run_length_encode(values):
+    """
+    Run-length encode an array along its last axis.
+
+    Inputs:
+    - values: array of shape (num_days,) or (num_rows, num_days).
+
+    Returns:
+    - rows: the row of each run (all 0 for a one-dimensional array).
+    - starts: the day on which each run starts.
+    - lengths: the number of days in each run.
+    - run_values: the value of each run.
+    The runs are ordered by row and then by start.
+    """
+    values = np.asarray(values)
+    values_2d = values.reshape(-1, values.shape[-1])
+    num_rows, num_days = values_2d.shape
+    is_start = np.ones(values_2d.shape, dtype=bool)
+    is_start[:, 1:] = values_2d[:, 1:] != values_2d[:, :-1]
+    rows, starts = np.nonzero(is_start)
+    # Each row starts with a run, so the run after the last run of a row starts the next row
+    flat_starts = rows * num_days + starts
+    lengths = np.diff(np.append(flat_starts, num_rows * num_days))
+    return rows, starts, lengths, values_2d[rows, starts]
+
+def calc_trades(positions, cash, portfolio_values):
+    """
+    Find every trade, i.e. every run of days with a position other than no position.
+
+    Inputs:
+    - positions, cash, portfolio_values: arrays of shape (num_pair_portfolios, num_days) of the
+      over time values (see stack_over_time_values).
+
+    Returns:
+    - A DataFrame with one row per trade and the columns 'pair_portfolio' (the row of the
+      pair portfolio), 'position', 'start' (the day the position was opened),
+      'holding_period' (the number of days it was held), 'pnl' (the profit or loss, net of the
+      trading fees paid on the day it was closed) and 'is_open' (whether it is still open on
+      the last day).
+    """
+    codes = np.atleast_2d(to_codes(positions))
+    cash = np.atleast_2d(np.asarray(cash, dtype=float))
+    portfolio_values = np.atleast_2d(np.asarray(portfolio_values, dtype=float))
+    num_days = codes.shape[-1]
+    rows, starts, lengths, run_codes = run_length_encode(codes)
+    is_trade = run_codes != Position.NO_POSITION
+    rows, starts, lengths, run_codes = \
+        rows[is_trade], starts[is_trade], lengths[is_trade], run_codes[is_trade]
+
+    ends = starts + lengths
+    is_open = ends == num_days
+    closes = np.minimum(ends, num_days - 1)
+    realised_pnl = cash[rows, closes] - cash[rows, closes - 1]
+    unrealised_pnl = portfolio_values[rows, -1] - cash[rows, -1]
+    return pd.DataFrame({'pair_portfolio': rows,
+                         'position': run_codes,
+                         'start': starts,
+                         'holding_period': lengths,
+                         'pnl': np.where(is_open, unrealised_pnl, realised_pnl),
+                         'is_open': is_open})
+
+def calc_position_days(positions):
+    """
+    Calculate the number of days spent in each position and the mean holding period of each
+    position, i.e. the mean length of the runs of consecutive days in that position.
+
+    Inputs:
+    - positions: array of shape (num_pair_portfolios, num_days) of position codes.
+
+    Returns:
+    - A DataFrame with one row per pair portfolio and, for each position, the columns
+      'num_days_<position>' and 'mean_holding_period_<position>', e.g.
+      'num_days_long_A_short_B'. The mean holding period is 0 for a position which is never
+      held.
+    """
+    codes = np.atleast_2d(to_codes(positions))
+    num_rows = codes.shape[0]
+    rows, _, lengths, run_codes = run_length_encode(codes)
+    position_days = {}
+    for position, position_string in POSITION_STRINGS.items():
+        is_position = run_codes == position
+        num_days = np.bincount(rows[is_position], weights=lengths[is_position],
+                               minlength=num_rows).astype(np.int64)
+        num_runs = np.bincount(rows[is_position], minlength=num_rows)
+        column_suffix = position_string.replace(' ', '_')
+        position_days['num_days_' + column_suffix] = num_days
+        position_days['mean_holding_period_' + column_suffix] = \
+            np.divide(num_days, num_runs, out=np.zeros(num_rows), where=num_runs > 0)
+    return pd.DataFrame(position_days)
+
+def get_stock_columns(pair_portfolios):
+    """
+    Return the stock labels of a list of pair and basket portfolios as a dictionary of
+    columns 'stock_a', 'stock_b', 'stock_c' and so on, with a column for each leg of the
+    portfolio with the most legs. A portfolio with fewer legs has None in the other columns.
+    """
+    num_legs = max((len(pair_portfolio.stock_labels) for pair_portfolio in pair_portfolios),
+                   default=2)
+    return {'stock_' + chr(ord('a') + i): [pair_portfolio.stock_labels[i]
+                                           if i < len(pair_portfolio.stock_labels) else None
+                                           for pair_portfolio in pair_portfolios]
+            for i in range(num_legs)}
+
+def calc_metrics(pair_portfolios, periods_per_year=PERIODS_PER_YEAR):
+    """
+    Calculate the performance metrics of a list of pair and basket portfolios with the same
+    number of days, e.g. master_portfolio.traded_portfolios after simulating trading.
+
+    Returns:
+    - A DataFrame with one row per portfolio and the columns 'strategy', 'stock_a',
+      'stock_b' (and 'stock_c' and so on for baskets, see get_stock_columns), 'final_value', 'total_return', 'sharpe_ratio', 'sortino_ratio',
+      'max_drawdown', 'max_drawdown_duration', 'turnover', 'num_trades', 'hit_rate' (the
+      fraction of trades with a positive profit), 'mean_trade_pnl', 'total_trade_pnl',
+      'mean_holding_period' and 'max_holding_period' (of the trades, in days), and the
+      columns of calc_position_days.
+    """
+    portfolio_values = stack_over_time_values(pair_portfolios, "portfolio_value")
+    positions = stack_over_time_values(pair_portfolios, "position")
+    cash = stack_over_time_values(pair_portfolios, "cash")
+    # A basket trades abs(weights[i]) * position_limit of each leg i, which is the notional of
+    # a pair with the position limit below, as a pair trades position_limit of each of its legs
+    position_limits = np.array([pair_portfolio.position_limit
+                                * np.abs(pair_portfolio.weights).sum() / 2
+                                for pair_portfolio in pair_portfolios], dtype=float)
+    num_pair_portfolios = len(pair_portfolios)
+
+    trades = calc_trades(positions, cash, portfolio_values)
+    trade_rows = trades['pair_portfolio'].to_numpy()
+    num_trades = np.bincount(trade_rows, minlength=num_pair_portfolios)
+    num_profitable_trades = np.bincount(trade_rows, weights=trades['pnl'].to_numpy() > 0,
+                                        minlength=num_pair_portfolios)
+    total_trade_pnl = np.bincount(trade_rows, weights=trades['pnl'].to_numpy(),
+                                  minlength=num_pair_portfolios)
+    total_holding_period = np.bincount(trade_rows, weights=trades['holding_period'].to_numpy(),
+                                       minlength=num_pair_portfolios)
+    max_holding_period = np.zeros(num_pair_portfolios, dtype=np.int64)
+    np.maximum.at(max_holding_period, trade_rows, trades['holding_period'].to_numpy())
+    with np.errstate(divide='ignore', invalid='ignore'):
+        hit_rate = num_profitable_trades / num_trades
+        mean_trade_pnl = total_trade_pnl / num_trades
+        mean_holding_period = total_holding_period / num_trades
+
+    metrics_df = pd.DataFrame({
+        'strategy': [pair_portfolio.strategy.__class__.__name__
+                     for pair_portfolio in pair_portfolios],
+        **get_stock_columns(pair_portfolios),
+        'final_value': portfolio_values[:, -1],
+        'total_return': portfolio_values[:, -1] / portfolio_values[:, 0] - 1,
+        'sharpe_ratio': calc_sharpe_ratio(portfolio_values, periods_per_year),
+        'sortino_ratio': calc_sortino_ratio(portfolio_values, periods_per_year),
+        'max_drawdown': calc_max_drawdown(portfolio_values),
+        'max_drawdown_duration': calc_max_drawdown_duration(portfolio_values),
+        'turnover': calc_turnover(positions, portfolio_values, position_limits,
+                                  periods_per_year),
+        'num_trades': num_trades,
+        'hit_rate': hit_rate,
+        'mean_trade_pnl': mean_trade_pnl,
+        'total_trade_pnl': total_trade_pnl,
+        'mean_holding_period': mean_holding_period,
+        'max_holding_period': max_holding_period})
+    return pd.concat([metrics_df, calc_position_days(positions)], axis=1)
+
+def summarise_by_strategy(metrics_df):
+    """
+    Average the metrics of calc_metrics over the pair portfolios of each strategy.
+    """
+    stock_columns = [column for column in metrics_df.columns if column.startswith('stock_')]
+    return metrics_df.drop(columns=stock_columns) \
+        .groupby('strategy', sort=False).mean()
@@ -0,0 +1,219 @@
+"""
+Monte Carlo robustness tests of the strategies on resampled price paths.
+
+Rather than trading each pair once over the historical trading period, this module trades it
+over thousands of synthetic trading periods. Each synthetic price path is made by a block
+bootstrap of the daily log returns of the pair in the training (formation) data: blocks of
+block_size consecutive days are drawn at random, with the returns of stock A and stock B on the
+same days kept together so that their correlation is preserved, and joined until the path is
+num_days long. Every path starts from the last prices of the training data, so the strategies
+warm up from the training data exactly as in trading.simulate_trading.
+
+The paths are generated in chunks of chunk_size paths as an array of shape
+(chunk_size, num_days, 2). Each strategy calculates its positions on the whole chunk at once with
+calculate_new_positions (see strategies.py), and the trades, cash and portfolio values are then
+calculated for the whole chunk as array operations. Only the final portfolio value and maximum
+drawdown of each path are kept, so the memory used is bounded by the size of a chunk however
+many paths are run. Every strategy trades the same paths, and the paths are drawn from random
+number generators seeded from seed, so the same seed and chunk_size give the same results.
+
+    results = montecarlo.run_monte_carlo([strategies.StrategyA, strategies.StrategyD],
+                                         stock_pair_labels_list, training_data_source,
+                                         position_limit=1, num_paths=5000)
+    print(montecarlo.summarise(results))
+"""
+import copy
+import numpy as np
+import pandas as pd
+from pairs_trading_oaf import data, metrics, portfolio, vectorized
+from pairs_trading_oaf.strategies import NO_POSITION
+
+def calc_log_returns(df_train, stock_pair_labels):
+    """
+    Calculate the daily log returns of a stock pair from the training data.
+
+    Returns:
+    - log_returns: array of shape (num_returns, 2) with the stock A and stock B log returns on
+      the days where both stocks have a price on that day and the day before.
+    - initial_prices: array of the last stock A and stock B prices where both have a price.
+    """
+    prices = df_train[list(stock_pair_labels)].to_numpy(dtype=float)
+    prices = prices[~np.isnan(prices).any(axis=1)]
+    if len(prices) < 2:
+        raise ValueError(f"Not enough training data to resample {stock_pair_labels}")
+    return np.diff(np.log(prices), axis=0), prices[-1]
+
+def block_bootstrap_paths(log_returns, initial_prices, num_paths: int, num_days: int,
+                          block_size: int, rng):
+    """
+    Make price paths by a block bootstrap of log returns.
+
+    Inputs:
+    - log_returns: array of shape (num_returns, 2) of the log returns to resample.
+    - initial_prices: the stock A and stock B prices on the day before each path starts.
+    - num_paths, num_days: the number of paths and the number of days in each path.
+    - block_size: the number of consecutive days in each block. A block size of 1 gives the
+      ordinary (independent) bootstrap.
+    - rng: the numpy random Generator to draw the blocks with.
+
+    Returns:
+    - An array of shape (num_paths, num_days, 2) with the stock A and stock B prices.
+    """
+    block_size = min(block_size, len(log_returns))
+    num_blocks = -(-num_days // block_size)
+    block_starts = rng.integers(0, len(log_returns) - block_size + 1,
+                                size=(num_paths, num_blocks))
+    day_indices = (block_starts[:, :, np.newaxis] + np.arange(block_size)).reshape(num_paths, -1)
+    path_returns = log_returns[day_indices[:, :num_days]]
+    return np.asarray(initial_prices, dtype=float) * np.exp(np.cumsum(path_returns, axis=1))
+
+def execute_trades(new_positions, stock_pair_prices, position_limit, cash, trading_fee=0.0):
+    """
+    Calculate the portfolio values of a batch of paths traded from no position.
+
+    This is the batched form of vectorized.execute_trades, with the same shares and cash
+    calculations (see vectorized.calc_target_shares and vectorized.calc_cash_changes), but
+    without the forced close when the portfolio value goes negative. Paths whose value goes
+    negative must be simulated with vectorized.execute_trades instead.
+
+    Inputs:
+    - new_positions: int8 array of shape (num_paths, num_days) returned by
+      calculate_new_positions for the batch.
+    - stock_pair_prices: array of shape (num_paths, num_days, 2) of the prices.
+    - position_limit, cash, trading_fee: as in portfolio.PairPortfolio.
+
+    Returns:
+    - An array of shape (num_paths, num_days) of the portfolio values.
+    """
+    num_paths, num_days = new_positions.shape
+    positions = vectorized.resolve_positions(new_positions, NO_POSITION)
+    previous_positions = np.concatenate([np.full((num_paths, 1), NO_POSITION, dtype=np.int8),
+                                         positions[:, :-1]], axis=1)
+    is_trade = positions != previous_positions
+
+    target_shares = vectorized.calc_target_shares(positions, stock_pair_prices, position_limit)
+    # Carry the shares bought on the latest trade forward to each day
+    last_trade = np.where(is_trade, np.arange(num_days), -1)
+    np.maximum.accumulate(last_trade, axis=1, out=last_trade)
+    shares = np.take_along_axis(target_shares, np.maximum(last_trade, 0)[..., np.newaxis],
+                                axis=1)
+    shares[last_trade < 0] = 0.0
+    previous_shares = np.concatenate([np.zeros((num_paths, 1, 2)), shares[:, :-1]], axis=1)
+
+    # Adding the changes of every day in order, with no change on the days without a trade,
+    # gives the same cash as vectorized.execute_trades
+    cash_changes = vectorized.calc_cash_changes(previous_shares, target_shares,
+                                                stock_pair_prices, trading_fee)
+    cash_changes[~is_trade] = 0.0
+    cash_over_time = np.cumsum(np.concatenate([np.full((num_paths, 1), float(cash)),
+                                               cash_changes.reshape(num_paths, -1)], axis=1),
+                               axis=1)[:, 3::3]
+    return vectorized.calc_portfolio_values(cash_over_time, shares, stock_pair_prices)
+
+def iter_monte_carlo(strategy_classes, stock_pair_labels_list, training_data_source,
+                     position_limit, num_paths=1000, num_days=252, block_size=20,
+                     chunk_size=250, cash=10, seed=0):
+    """
+    Trade every strategy on every pair over resampled price paths, one chunk at a time.
+
+    Inputs:
+    - strategy_classes: list of the strategy classes to trade. Each must implement
+      calculate_new_positions.
+    - stock_pair_labels_list: list of the (stock A label, stock B label) pairs to trade.
+    - training_data_source: the training data, as in portfolio.MasterPortfolio, which the
+      strategies warm up on and the returns are resampled from.
+    - position_limit, cash: as in portfolio.PairPortfolio.
+    - num_paths, num_days: the number of paths and the (positive) number of days in each
+      path.
+    - block_size: the number of consecutive days in each resampled block.
+    - chunk_size: the number of paths generated and traded at once.
+    - seed: the seed of the random number generators.
+
+    Yields:
+    - A DataFrame for each chunk with one row per path, strategy and pair, and the columns
+      'path', 'strategy', 'stock_a', 'stock_b', 'final_value' and 'max_drawdown'.
+    """
+    df_train = data.get_data(training_data_source)
+    master_portfolio = portfolio.MasterPortfolio(position_limit, df_train, None)
+    pair_portfolios = []
+    for strategy_class in strategy_classes:
+        if not hasattr(strategy_class, 'calculate_new_positions'):
+            raise TypeError(f"{strategy_class.__name__} does not implement "
+                            "calculate_new_positions")
+        for stock_pair_labels in stock_pair_labels_list:
+            pair_portfolios.append(portfolio.PairPortfolio(tuple(stock_pair_labels),
+                                                           strategy_class, master_portfolio,
+                                                           cash=cash))
+    log_returns = {}
+    for stock_pair_labels in stock_pair_labels_list:
+        log_returns[tuple(stock_pair_labels)] = calc_log_returns(df_train, stock_pair_labels)
+    dates = pd.bdate_range(df_train.index[-1] + pd.offsets.BDay(), periods=num_days)
+
+    num_chunks = -(-num_paths // chunk_size)
+    seed_sequences = np.random.SeedSequence(seed).spawn(num_chunks)
+    for chunk, seed_sequence in enumerate(seed_sequences):
+        rng = np.random.default_rng(seed_sequence)
+        first_path = chunk * chunk_size
+        num_chunk_paths = min(chunk_size, num_paths - first_path)
+        paths = {}
+        for stock_pair_labels, (pair_log_returns, initial_prices) in log_returns.items():
+            paths[stock_pair_labels] = block_bootstrap_paths(
+                pair_log_returns, initial_prices, num_chunk_paths, num_days, block_size, rng)
+
+        chunk_results = []
+        for pair_portfolio in pair_portfolios:
+            stock_pair_prices = paths[pair_portfolio.stock_pair_labels]
+            new_positions = pair_portfolio.strategy.calculate_new_positions(stock_pair_prices)
+            portfolio_values = execute_trades(new_positions, stock_pair_prices, position_limit,
+                                              cash, pair_portfolio.trading_fee)
+            for path in np.flatnonzero((portfolio_values < 0).any(axis=1)):
+                portfolio_values[path] = _simulate_path(pair_portfolio, dates,
+                                                        stock_pair_prices[path],
+                                                        new_positions[path])
+            chunk_results.append(pd.DataFrame({
+                'path': np.arange(first_path, first_path + num_chunk_paths),
+                'strategy': pair_portfolio.strategy.__class__.__name__,
+                'stock_a': pair_portfolio.stock_pair_labels[0],
+                'stock_b': pair_portfolio.stock_pair_labels[1],
+                'final_value': portfolio_values[:, -1],
+                'max_drawdown': metrics.calc_max_drawdown(portfolio_values)}))
+        yield pd.concat(chunk_results, ignore_index=True)
+
+def run_monte_carlo(strategy_classes, stock_pair_labels_list, training_data_source,
+                    position_limit, **kwargs):
+    """
+    Trade every strategy on every pair over resampled price paths and return the results of
+    every path as one DataFrame. Takes the same arguments as iter_monte_carlo.
+    """
+    return pd.concat(iter_monte_carlo(strategy_classes, stock_pair_labels_list,
+                                      training_data_source, position_limit, **kwargs),
+                     ignore_index=True)
+
+def summarise(results, quantiles=(0.05, 0.5, 0.95)):
+    """
+    Summarise the distributions of the final portfolio values and maximum drawdowns in the
+    results of run_monte_carlo, with one row per strategy and pair.
+    """
+    grouped = results.groupby(['strategy', 'stock_a', 'stock_b'], sort=False)
+    summary = grouped[['final_value', 'max_drawdown']].agg(['mean', 'std'])
+    summary.columns = [f'{value}_{statistic}' for value, statistic in summary.columns]
+    for quantile in quantiles:
+        quantile_values = grouped[['final_value', 'max_drawdown']].quantile(quantile)
+        for value in ['final_value', 'max_drawdown']:
+            summary[f'{value}_q{quantile:g}'] = quantile_values[value]
+    summary.insert(0, 'num_paths', grouped.size())
+    return summary
+
+def _simulate_path(pair_portfolio, dates, stock_pair_prices, new_positions):
+    """
+    Simulate one path on a copy of the untraded pair portfolio with vectorized.execute_trades,
+    which closes the position when the portfolio value goes negative, and return its
+    portfolio values.
+    """
+    path_portfolio = copy.copy(pair_portfolio)
+    for value_string in ["cash", "dates", "position", "shares", "stock_pair_prices",
+                         "portfolio_value", "ratio"]:
+        setattr(path_portfolio, value_string + "_over_time",
+                copy.deepcopy(getattr(pair_portfolio, value_string + "_over_time")))
+    vectorized.execute_trades(path_portfolio, dates, stock_pair_prices, new_positions)
+    return np.asarray(path_portfolio.portfolio_value_over_time)
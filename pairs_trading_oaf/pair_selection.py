@@ -0,0 +1,212 @@
+"""
+Screening of every candidate pair in a universe of stocks.
+
+Rather than hand-picking the pairs to trade, score_pairs scores all N * (N - 1) / 2 pairs of
+the columns of a formation dataset at once:
+- the correlation of the daily log returns,
+- the sum of squared differences (SSD) between the normalised prices, i.e. the prices divided
+  by their first valid price, as in the distance method of Gatev et al., and
+- an Engle-Granger cointegration test: regress the log price of stock A on the log price of
+  stock B, then run a Dickey-Fuller test (no constant, no lags) on the residuals.
+
+Every statistic is calculated from N x N matrices of cross moments, e.g. the sum over days of
+x_i * y_j for every pair of columns i and j, which are matrix products of the T x N price
+matrices. The products run in the multithreaded BLAS library used by numpy, so the scoring
+uses every core and stays fast for several hundred stocks (tens of thousands of pairs).
+
+Missing prices are handled pairwise: each pair only uses the days on which both prices are
+available, which is done by zeroing missing values and multiplying by the availability masks.
+
+select_pairs returns the best k pairs as (stock A label, stock B label) tuples which can be
+passed straight to portfolio.PairPortfolio.
+"""
+import numpy as np
+import pandas as pd
+from pairs_trading_oaf import data
+
+# MacKinnon (2010) response surface coefficients for the critical values of the
+# Engle-Granger test with two variables and a constant: tau = b0 + b1 / T + b2 / T ** 2
+ENGLE_GRANGER_COEFFICIENTS = {0.01: (-3.89644, -10.9519, -22.527),
+                              0.05: (-3.33613, -6.1101, -6.823),
+                              0.10: (-3.04445, -4.2412, -2.720)}
+
+def engle_granger_critical_value(num_obs, significance: float = 0.05):
+    """
+    Return the critical value of the Engle-Granger test statistic for num_obs observations
+    (a scalar or an array) at a significance level of 0.01, 0.05 or 0.10.
+    """
+    if significance not in ENGLE_GRANGER_COEFFICIENTS:
+        raise ValueError(f"significance must be one of {sorted(ENGLE_GRANGER_COEFFICIENTS)}")
+    b0, b1, b2 = ENGLE_GRANGER_COEFFICIENTS[significance]
+    num_obs = np.asarray(num_obs, dtype=float)
+    return b0 + b1 / num_obs + b2 / num_obs ** 2
+
+def score_pairs(prices, min_periods: int = 60):
+    """
+    Score every pair of columns of prices.
+
+    Inputs:
+    - prices: DataFrame of prices with one column per stock, e.g. from data.read_csv, or the
+      filename of such a dataset. Missing or non-positive prices are ignored.
+    - min_periods: pairs with fewer days on which both prices are available are left out.
+
+    Returns:
+    - A DataFrame with one row per pair and the columns:
+      - stock_a, stock_b: the labels of the pair, ordered so that regressing stock A on
+        stock B gives the more significant cointegration test.
+      - num_obs: the number of days on which both prices are available.
+      - correlation: the correlation of the daily log returns.
+      - ssd: the sum of squared differences between the normalised prices.
+      - hedge_ratio: the slope of the regression of log(stock A) on log(stock B).
+      - eg_tstat: the Engle-Granger test statistic, more negative is more significant.
+      - eg_critical_value: the 5% critical value of the test for num_obs observations.
+    """
+    if isinstance(prices, str):
+        prices = data.read_csv(prices)
+    labels = list(prices.columns)
+    values = prices.to_numpy(dtype=float)
+    with np.errstate(divide='ignore', invalid='ignore'):
+        log_prices = np.log(values)
+    is_valid = np.isfinite(log_prices)
+
+    num_obs, ssd = _calc_ssd(values, is_valid)
+    correlation = _calc_return_correlation(log_prices, is_valid)
+    hedge_ratio, eg_tstat = _calc_engle_granger(log_prices, is_valid)
+
+    # Keep each pair once, in the direction with the more negative test statistic
+    rows, cols = np.triu_indices(len(labels), k=1)
+    swap = eg_tstat[cols, rows] < eg_tstat[rows, cols]
+    stock_a = np.where(swap, cols, rows)
+    stock_b = np.where(swap, rows, cols)
+    keep = num_obs[stock_a, stock_b] >= max(min_periods, 3)
+    stock_a, stock_b = stock_a[keep], stock_b[keep]
+
+    labels = np.array(labels, dtype=object)
+    pair_num_obs = num_obs[stock_a, stock_b]
+    return pd.DataFrame({'stock_a': labels[stock_a],
+                         'stock_b': labels[stock_b],
+                         'num_obs': pair_num_obs,
+                         'correlation': correlation[stock_a, stock_b],
+                         'ssd': ssd[stock_a, stock_b],
+                         'hedge_ratio': hedge_ratio[stock_a, stock_b],
+                         'eg_tstat': eg_tstat[stock_a, stock_b],
+                         'eg_critical_value': engle_granger_critical_value(pair_num_obs)})
+
+def select_pairs(prices, k: int = 10, method: str = 'cointegration',
+                 significance: float = 0.05, min_periods: int = 60):
+    """
+    Select the best k pairs of a universe of stocks.
+
+    Inputs:
+    - prices, min_periods: as in score_pairs.
+    - k: the number of pairs to return. Fewer pairs are returned if fewer qualify.
+    - method: how to rank the pairs:
+      - 'cointegration': the most negative Engle-Granger test statistic, keeping only the
+        pairs which are cointegrated at the given significance level.
+      - 'ssd': the smallest sum of squared differences between the normalised prices.
+      - 'correlation': the highest correlation of the daily log returns.
+    - significance: 0.01, 0.05 or 0.10, only used by the 'cointegration' method.
+
+    Returns:
+    - A list of (stock A label, stock B label) tuples, best pair first.
+    """
+    scores = score_pairs(prices, min_periods=min_periods)
+    if method == 'cointegration':
+        critical_values = engle_granger_critical_value(scores['num_obs'], significance)
+        scores = scores[scores['eg_tstat'] < critical_values]
+        scores = scores.sort_values('eg_tstat', kind='stable')
+    elif method == 'ssd':
+        scores = scores.sort_values('ssd', kind='stable')
+    elif method == 'correlation':
+        scores = scores.sort_values('correlation', ascending=False, kind='stable')
+    else:
+        raise ValueError(f"Unknown method {method!r}, "
+                         "use 'cointegration', 'ssd' or 'correlation'")
+    scores = scores.dropna(subset=['eg_tstat' if method == 'cointegration' else method])
+    return list(zip(scores['stock_a'].head(k), scores['stock_b'].head(k)))
+
+def _masked(values, is_valid):
+    """
+    Return a copy of values with the invalid values replaced by zero.
+    """
+    return np.where(is_valid, values, 0.0)
+
+def _calc_ssd(values, is_valid):
+    """
+    Return the number of common days and the SSD of the normalised prices of each pair.
+    """
+    first_valid = np.argmax(is_valid, axis=0)
+    first_prices = values[first_valid, np.arange(values.shape[1])]
+    normalised = _masked(values / first_prices, is_valid)
+    mask = is_valid.astype(float)
+    num_obs = mask.T @ mask
+    squares = (normalised ** 2).T @ mask
+    ssd = squares + squares.T - 2 * (normalised.T @ normalised)
+    return num_obs.round().astype(np.int64), np.maximum(ssd, 0.0)
+
+def _calc_return_correlation(log_prices, is_valid):
+    """
+    Return the correlation of the daily log returns of each pair over the days on which
+    both returns are available.
+    """
+    is_valid = is_valid[1:] & is_valid[:-1]
+    returns = _masked(np.diff(log_prices, axis=0), is_valid)
+    mask = is_valid.astype(float)
+    count = mask.T @ mask
+    sums = returns.T @ mask # sums[i, j] is the sum of returns of i on the days common with j
+    squares = (returns ** 2).T @ mask
+    products = returns.T @ returns
+    with np.errstate(divide='ignore', invalid='ignore'):
+        covariance = products - sums * sums.T / count
+        variance = squares - sums ** 2 / count
+        correlation = covariance / np.sqrt(variance * variance.T)
+    return np.clip(correlation, -1.0, 1.0)
+
+def _calc_engle_granger(log_prices, is_valid):
+    """
+    Return the hedge ratios and Engle-Granger test statistics of regressing each column i
+    (y) on each column j (x), as N x N matrices indexed [i, j].
+    """
+    # Subtracting the column means does not change the results, but reduces rounding errors
+    column_means = np.nanmean(np.where(is_valid, log_prices, np.nan), axis=0)
+    levels = _masked(log_prices - column_means, is_valid)
+    mask = is_valid.astype(float)
+
+    # Step 1: y = a + b * x over the days on which both prices are available
+    count = mask.T @ mask
+    sums = levels.T @ mask # sums[i, j] is the sum of i over the days common with j
+    squares = (levels ** 2).T @ mask
+    products = levels.T @ levels
+    with np.errstate(divide='ignore', invalid='ignore'):
+        mean_y = sums / count
+        mean_x = sums.T / count
+        b = (products - count * mean_y * mean_x) / (squares.T - count * mean_x ** 2)
+    a = mean_y - b * mean_x
+
+    # Step 2: diff(e)[t] = gamma * e[t - 1] + u[t], where e = y - a - b * x, over the days
+    # on which both prices are available on that day and the day before
+    is_valid_diff = is_valid[1:] & is_valid[:-1]
+    lagged = _masked(levels[:-1], is_valid_diff)
+    diffs = _masked(np.diff(levels, axis=0), is_valid_diff)
+    mask = is_valid_diff.astype(float)
+    n = mask.T @ mask
+    sum_z = lagged.T @ mask # sum_z[i, j] is the sum of lagged i over the days common with j
+    sum_d = diffs.T @ mask
+    zz = lagged.T @ lagged
+    dd = diffs.T @ diffs
+    zd = lagged.T @ diffs # zd[i, j] is the sum of lagged i times diff j
+    zd_own = (lagged * diffs).T @ mask # zd_own[i, j] is the sum of lagged i times diff i
+    sum_zy2 = (lagged ** 2).T @ mask
+    sum_dy2 = (diffs ** 2).T @ mask
+
+    # Sums of e[t - 1] ** 2, e[t - 1] * diff(e)[t] and diff(e)[t] ** 2 for each pair
+    s_ee = sum_zy2 + n * a ** 2 + b ** 2 * sum_zy2.T - 2 * a * sum_z \
+         - 2 * b * zz + 2 * a * b * sum_z.T
+    s_ed = zd_own - b * zd - a * sum_d + a * b * sum_d.T - b * zd.T + b ** 2 * zd_own.T
+    s_dd = sum_dy2 - 2 * b * dd + b ** 2 * sum_dy2.T
+    with np.errstate(divide='ignore', invalid='ignore'):
+        gamma = s_ed / s_ee
+        residual_variance = (s_dd - gamma * s_ed) / (n - 1)
+        eg_tstat = gamma / np.sqrt(residual_variance / s_ee)
+    np.fill_diagonal(eg_tstat, np.nan)
+    return b, eg_tstat
@@ -1,283 +1,485 @@
 """
 Functions to plot trading data.
+
+Each plot function collects the data of its figures from the master portfolio into FigureJob
+objects and passes them to render_figures, which draws and saves them. Rendering is what takes
+the time, so render_figures:
+- renders the figures in a pool of worker processes, which use the non-interactive Agg
+  backend, when num_workers is more than one,
+- renders at DRAFT_DPI when quality is "draft", and at the resolution of each figure (up to
+  1000 dpi) when quality is "final",
+- skips a figure if its image file already exists and was rendered from the same data at the
+  same resolution. A content hash of the data of each figure is stored in a .plot_hashes.json
+  file next to the images. Pass force=True to render every figure again.
+
+plot_all renders the figures of several plot functions in one pool, e.g.
+
+    plotting.plot_all(master_portfolio, quality='draft', num_workers=4)
 """
 
+import functools
+import hashlib
+import importlib.metadata
+import inspect
+import json
 import os
-import matplotlib.pyplot as plt
-import matplotlib.dates as mdates
+import pickle
 import numpy as np
 import pandas as pd
+from pairs_trading_oaf.metrics import calc_position_days
+from pairs_trading_oaf.positions import to_codes, to_strings
 
-def plot_average_values_over_time(master_portfolio):
+DRAFT_DPI = 100
+QUALITIES = ('draft', 'final')
+HASHES_FILENAME = '.plot_hashes.json'
+
+class FigureJob:
     """
-    Plots the average value of the portfolio over time for each pair
-    in the master portfolio over the entire trading period.
+    Everything needed to render one figure, which can be sent to a worker process.
+
+    Attributes:
+    - fname: the path of the image file.
+    - render: the module-level function which draws the figure. It is called as
+      render(**data) and returns the matplotlib figure.
+    - data: dictionary of the arguments of render, e.g. the dates and values to plot.
+    - dpi: the resolution of the figure when rendered at final quality.
+    """
+    def __init__(self, fname, render, data, dpi=300):
+        self.fname = fname
+        self.render = render
+        self.data = data
+        self.dpi = dpi
+
+    def content_hash(self, dpi):
+        """
+        Return a hash of the data, the code of the render function and the resolution, which
+        changes whenever the rendered image would change.
+        """
+        content = hashlib.sha256()
+        content.update(inspect.getsource(self.render).encode('utf-8'))
+        content.update(_get_matplotlib_version().encode('utf-8'))
+        content.update(pickle.dumps((self.data, dpi), protocol=4))
+        return content.hexdigest()
+
+def render_figures(jobs, quality='final', num_workers=1, force=False, executor=None):
+    """
+    Render a list of FigureJob objects and save the images.
+
+    Inputs:
+    - jobs: the figures to render.
+    - quality: "draft" to render at DRAFT_DPI (or lower if the figure's own resolution is
+      lower), or "final" to render at the resolution of each figure.
+    - num_workers: the number of worker processes. With one worker and no executor the
+      figures are rendered in this process.
+    - force: whether to render figures whose data has not changed.
+    - executor: an existing concurrent.futures executor to render the figures on. Worker
+      processes should be set up with init_worker.
+
+    Returns:
+    - The list of the image files which were rendered, i.e. not skipped.
+    """
+    if quality not in QUALITIES:
+        raise ValueError(f"quality must be one of {QUALITIES}, not {quality!r}")
+    hashes = {}
+    pending_jobs, dpis, content_hashes = [], [], []
+    for job in jobs:
+        dpi = job.dpi if quality == 'final' else min(job.dpi, DRAFT_DPI)
+        content_hash = job.content_hash(dpi)
+        plots_dir, fname = os.path.split(os.path.abspath(job.fname))
+        if plots_dir not in hashes:
+            hashes[plots_dir] = _load_hashes(plots_dir)
+        if not force and hashes[plots_dir].get(fname) == content_hash \
+                and os.path.exists(job.fname):
+            continue
+        pending_jobs.append(job)
+        dpis.append(dpi)
+        content_hashes.append(content_hash)
+
+    if executor is not None:
+        list(executor.map(_render_job, pending_jobs, dpis))
+    elif num_workers > 1 and len(pending_jobs) > 1:
+        from concurrent.futures import ProcessPoolExecutor # pylint: disable=import-outside-toplevel
+        with ProcessPoolExecutor(max_workers=min(num_workers, len(pending_jobs)),
+                                 initializer=init_worker) as new_executor:
+            list(new_executor.map(_render_job, pending_jobs, dpis))
+    else:
+        for job, dpi in zip(pending_jobs, dpis):
+            _render_job(job, dpi)
+
+    changed_dirs = set()
+    for job, content_hash in zip(pending_jobs, content_hashes):
+        plots_dir, fname = os.path.split(os.path.abspath(job.fname))
+        hashes[plots_dir][fname] = content_hash
+        changed_dirs.add(plots_dir)
+    for plots_dir in changed_dirs:
+        _save_hashes(plots_dir, hashes[plots_dir])
+    return [job.fname for job in pending_jobs]
+
+def plot_all(master_portfolio, plot_functions=None, quality='draft', num_workers=None,
+             force=False, executor=None):
+    """
+    Render the figures of several plot functions in one pool of worker processes.
+
+    Inputs:
+    - master_portfolio: the simulated master portfolio.
+    - plot_functions: the plot functions, e.g. [plotting.plot_values_over_time]. Defaults to
+      every function in FIGURE_BUILDERS.
+    - quality, force, executor: as in render_figures.
+    - num_workers: the number of worker processes. Defaults to the number of CPUs.
+
+    Returns:
+    - The list of the image files which were rendered.
+    """
+    if plot_functions is None:
+        plot_functions = list(FIGURE_BUILDERS)
+    if num_workers is None:
+        num_workers = os.cpu_count() or 1
+    jobs = []
+    for plot_function in plot_functions:
+        jobs.extend(FIGURE_BUILDERS[plot_function](master_portfolio))
+    return render_figures(jobs, quality=quality, num_workers=num_workers, force=force,
+                          executor=executor)
+
+def get_plots_dir(master_portfolio):
+    """
+    Return the directory the plots of a master portfolio are saved in, creating it if needed.
     """
     current_dir = os.path.dirname(__file__)
     plots_dir = os.path.join(current_dir, '..', 'plots', master_portfolio.name)
     os.makedirs(plots_dir, exist_ok=True)
+    return plots_dir
+
+def plot_average_values_over_time(master_portfolio, quality='final', num_workers=1,
+                                  force=False):
+    """
+    Plots the average value of the portfolio over time for each pair
+    in the master portfolio over the entire trading period.
+    """
+    return render_figures(_average_values_over_time_figures(master_portfolio),
+                          quality, num_workers, force)
+
+def _average_values_over_time_figures(master_portfolio):
+    plots_dir = get_plots_dir(master_portfolio)
     master_portfolio.calc_strategy_strings()
     master_portfolio.calc_average_values_over_time_by_strategy()
+    jobs = []
     for value_string in master_portfolio.average_values_over_time.keys():
-        fig, ax = plt.subplots()
-        for strategy_string in master_portfolio.average_values_over_time[value_string].keys():
-            ax.plot(master_portfolio.pair_portfolios[0].dates_over_time,
-                    master_portfolio.average_values_over_time[value_string][strategy_string],
-                    label=strategy_string)
-        ax.set_ylabel(value_string + ' [USD] (Position limit = $' +
-                f'{master_portfolio.position_limit:.2f})')
-        plt.xticks(rotation=45)
-        ax.set_title(f'{master_portfolio.name} Average {value_string} over time')
-        ax.legend()
         fname = os.path.join(plots_dir, 'average_' + value_string + '_over_time.png')
-        fig.savefig(fname, dpi=300, bbox_inches='tight')
-        plt.close()
+        jobs.append(FigureJob(fname, _draw_average_values_over_time, {
+            'dates': master_portfolio.pair_portfolios[0].dates_over_time.values(),
+            'average_values': master_portfolio.average_values_over_time[value_string],
+            'value_string': value_string,
+            'position_limit': master_portfolio.position_limit,
+            'name': master_portfolio.name}))
+    return jobs
 
-def plot_values_over_time(master_portfolio):
+def _draw_average_values_over_time(dates, average_values, value_string, position_limit, name):
+    import matplotlib.pyplot as plt # pylint: disable=import-outside-toplevel
+    fig, ax = plt.subplots()
+    for strategy_string, values in average_values.items():
+        ax.plot(dates, values, label=strategy_string)
+    ax.set_ylabel(value_string + ' [USD] (Position limit = $' +
+            f'{position_limit:.2f})')
+    plt.xticks(rotation=45)
+    ax.set_title(f'{name} Average {value_string} over time')
+    ax.legend()
+    return fig
+
+def plot_values_over_time(master_portfolio, quality='final', num_workers=1, force=False):
     """
     Plots the values of the portfolio over time for each pair.
     """
-    current_dir = os.path.dirname(__file__)
-    plots_dir = os.path.join(current_dir, '..', 'plots', master_portfolio.name)
+    return render_figures(_values_over_time_figures(master_portfolio),
+                          quality, num_workers, force)
+
+def _values_over_time_figures(master_portfolio):
+    plots_dir = get_plots_dir(master_portfolio)
     master_portfolio.calc_strategy_strings()
     pairs_portfolio_index_dict = master_portfolio.calc_pairs_portfolio_index_dict()
     value_strings = ["portfolio_value", "cash", "ratio"]
     stock_pair_labels = pairs_portfolio_index_dict[master_portfolio.strategy_strings[0]].keys()
+    jobs = []
     for value_string in value_strings:
+        plots_subdir = os.path.join(plots_dir, value_string + '_over_time')
+        os.makedirs(plots_subdir, exist_ok=True)
         for stock_pair_label in stock_pair_labels:
-            fig, ax = plt.subplots()
+            lines = []
             for strategy_string in master_portfolio.strategy_strings:
                 pairs_portfolio_index = \
                     pairs_portfolio_index_dict[strategy_string][stock_pair_label]
                 pair_portfolio = master_portfolio.pair_portfolios[pairs_portfolio_index]
-                ax.plot(pair_portfolio.dates_over_time,
-                        pair_portfolio.__dict__[value_string + "_over_time"],
-                        label=strategy_string)
-                plt.grid(True)
-            ax.set_ylabel(value_string + ' [USD] (Position limit = $' +
-                          f'{master_portfolio.position_limit:.2f})')
-            plt.xticks(rotation=45)
-            ax.set_title(f'{value_string} over time for stock pair {stock_pair_label}')
-            ax.legend()
-            plots_subdir = os.path.join(plots_dir, value_string + '_over_time')
-            os.makedirs(plots_subdir, exist_ok=True)
+                lines.append((strategy_string, pair_portfolio.dates_over_time.values(),
+                              getattr(pair_portfolio, value_string + "_over_time").values()))
             fname = os.path.join(plots_subdir, value_string + '_over_time_' +
                                  stock_pair_label + '.png')
-            fig.savefig(fname, dpi=300, bbox_inches='tight')
-            plt.close()
+            jobs.append(FigureJob(fname, _draw_values_over_time, {
+                'lines': lines,
+                'value_string': value_string,
+                'stock_pair_label': stock_pair_label,
+                'position_limit': master_portfolio.position_limit}))
+    return jobs
+
+def _draw_values_over_time(lines, value_string, stock_pair_label, position_limit):
+    import matplotlib.pyplot as plt # pylint: disable=import-outside-toplevel
+    fig, ax = plt.subplots()
+    for strategy_string, dates, values in lines:
+        ax.plot(dates, values, label=strategy_string)
+        plt.grid(True)
+    ax.set_ylabel(value_string + ' [USD] (Position limit = $' +
+                  f'{position_limit:.2f})')
+    plt.xticks(rotation=45)
+    ax.set_title(f'{value_string} over time for stock pair {stock_pair_label}')
+    ax.legend()
+    return fig
 
-def plot_position_over_time(master_portfolio):
+def plot_position_over_time(master_portfolio, quality='final', num_workers=1, force=False):
     """
     The position can be one of the following values:
     - "no position"
     - "long A short B"
     - "long B short A"
     """
-    current_dir = os.path.dirname(__file__)
-    plots_dir = os.path.join(current_dir, '..', 'plots', master_portfolio.name)
-    os.makedirs(plots_dir, exist_ok=True)
+    return render_figures(_position_over_time_figures(master_portfolio),
+                          quality, num_workers, force)
+
+def _position_over_time_figures(master_portfolio):
+    plots_dir = get_plots_dir(master_portfolio)
     master_portfolio.calc_strategy_strings()
     pairs_portfolio_index_dict = master_portfolio.calc_pairs_portfolio_index_dict()
     stock_pair_labels = pairs_portfolio_index_dict[master_portfolio.strategy_strings[0]].keys()
+    plot_subdir = os.path.join(plots_dir, 'position_over_time')
+    os.makedirs(plot_subdir, exist_ok=True)
+    jobs = []
     for stock_pair_label in stock_pair_labels:
-        fig, ax = plt.subplots()
+        lines = []
         for strategy_string in master_portfolio.strategy_strings:
             pairs_portfolio_index = \
                 pairs_portfolio_index_dict[strategy_string][stock_pair_label]
             pair_portfolio = master_portfolio.pair_portfolios[pairs_portfolio_index]
-            postion_over_time_int = \
-                (1 * (np.array(pair_portfolio.position_over_time) == "long A short B")) -\
-                (1 * (np.array(pair_portfolio.position_over_time) == "long B short A"))
-            ax.scatter(pair_portfolio.dates_over_time,
-                       postion_over_time_int,
-                       s = 0.1,
-                       label=strategy_string)
-        ax.set_ylabel('Position (Position limit = $' +
-                      f'{master_portfolio.position_limit:.2f})')
-        ax.set_yticks([-1, 0, 1])
-        ax.set_yticklabels(["long B short A", "no position", "long A short B"])
-        plt.xticks(rotation=45)
-        ax.set_title(f'Position over time for stock pair {stock_pair_label}')
-        ax.legend()
-        plot_subdir = os.path.join(plots_dir, 'position_over_time')
-        os.makedirs(plot_subdir, exist_ok=True)
+            # The position codes are 1 for long A short B and -1 for long B short A
+            lines.append((strategy_string, pair_portfolio.dates_over_time.values(),
+                          pair_portfolio.position_over_time.values()))
         fname = os.path.join(plot_subdir, 'position_over_time_' +
                              stock_pair_label + '.png')
-        fig.savefig(fname, dpi=300, bbox_inches='tight')
-        plt.close()
+        jobs.append(FigureJob(fname, _draw_position_over_time, {
+            'lines': lines,
+            'stock_pair_label': stock_pair_label,
+            'position_limit': master_portfolio.position_limit}))
+    return jobs
+
+def _draw_position_over_time(lines, stock_pair_label, position_limit):
+    import matplotlib.pyplot as plt # pylint: disable=import-outside-toplevel
+    fig, ax = plt.subplots()
+    for strategy_string, dates, positions in lines:
+        ax.scatter(dates,
+                   positions,
+                   s = 0.1,
+                   label=strategy_string)
+    ax.set_ylabel('Position (Position limit = $' +
+                  f'{position_limit:.2f})')
+    ax.set_yticks([-1, 0, 1])
+    ax.set_yticklabels(["long B short A", "no position", "long A short B"])
+    plt.xticks(rotation=45)
+    ax.set_title(f'Position over time for stock pair {stock_pair_label}')
+    ax.legend()
+    return fig
 
-def plot_strategy_c_bollinger_bands_and_trades(master_portfolio):
+def plot_strategy_c_bollinger_bands_and_trades(master_portfolio, quality='final',
+                                               num_workers=1, force=False):
     """
     Plots the Bollinger bands and annotates the trades for Strategy C
     """
+    return render_figures(_strategy_c_bollinger_bands_and_trades_figures(master_portfolio),
+                          quality, num_workers, force)
 
-    current_dir = os.path.dirname(__file__)
-    plots_dir = os.path.join(current_dir, '..', 'plots', master_portfolio.name)
-    os.makedirs(plots_dir, exist_ok=True)
+def _strategy_c_bollinger_bands_and_trades_figures(master_portfolio):
+    plots_dir = get_plots_dir(master_portfolio)
     master_portfolio.calc_strategy_strings()
     pairs_portfolio_index_dict = master_portfolio.calc_pairs_portfolio_index_dict()
     stock_pair_labels = pairs_portfolio_index_dict[master_portfolio.strategy_strings[0]].keys()
     num_bins = 100
-
+    plot_subdir = os.path.join(plots_dir, 'strategy_c_bollinger_bands_and_trades')
+    os.makedirs(plot_subdir, exist_ok=True)
+    jobs = []
     for stock_pair_label in stock_pair_labels:
         pairs_portfolio_index = pairs_portfolio_index_dict["StrategyC"][stock_pair_label]
         pair_portfolio = master_portfolio.pair_portfolios[pairs_portfolio_index]
-
-        fig, ax = plt.subplots(figsize=(8, 8))
-        ax.plot(pair_portfolio.dates_over_time[-num_bins:],
-                pair_portfolio.ratio_over_time[-num_bins:],
-                label="Ratio over time")
-
-        band_color = 'skyblue'
-        ax.plot(pair_portfolio.dates_over_time[-num_bins:],
-                pair_portfolio.strategy.upper_band_over_time[-num_bins:],
-                label="Bollinger Band", color=band_color)
-        ax.legend()
-        ax.plot(pair_portfolio.dates_over_time[-num_bins:],
-                pair_portfolio.strategy.lower_band_over_time[-num_bins:],
-                label="Lower Bollinger Band", color=band_color)
-
         cash_delta = np.diff(pair_portfolio.cash_over_time,
                              prepend=pair_portfolio.cash_over_time[0])
+        fname = os.path.join(plot_subdir,
+                             f'strategy_c_bollinger_bands_and_trades_{stock_pair_label}.png')
+        jobs.append(FigureJob(fname, _draw_strategy_c_bollinger_bands_and_trades, {
+            'dates': pair_portfolio.dates_over_time[-num_bins:],
+            'ratios': pair_portfolio.ratio_over_time[-num_bins:],
+            'upper_band': pair_portfolio.strategy.upper_band_over_time[-num_bins:],
+            'lower_band': pair_portfolio.strategy.lower_band_over_time[-num_bins:],
+            'cash_delta': cash_delta[-num_bins:],
+            'positions': to_strings(pair_portfolio.position_over_time[-num_bins:]).tolist(),
+            'stock_pair_label': stock_pair_label}, dpi=1000))
+    return jobs
+
+def _draw_strategy_c_bollinger_bands_and_trades(dates, ratios, upper_band, lower_band,
+                                                cash_delta, positions, stock_pair_label):
+    import matplotlib.pyplot as plt # pylint: disable=import-outside-toplevel
+    import matplotlib.dates as mdates # pylint: disable=import-outside-toplevel
+    fig, ax = plt.subplots(figsize=(8, 8))
+    ax.plot(dates,
+            ratios,
+            label="Ratio over time")
 
-        for i, delta in enumerate(cash_delta[-num_bins:]):
-            if delta != 0:
-                color = 'green' if delta > 0 else 'red'
+    band_color = 'skyblue'
+    ax.plot(dates,
+            upper_band,
+            label="Bollinger Band", color=band_color)
+    ax.legend()
+    ax.plot(dates,
+            lower_band,
+            label="Lower Bollinger Band", color=band_color)
 
-                position = pair_portfolio.position_over_time[-num_bins:][i]
-                # delta_text = f'{position}\nΔ${delta:.2f}'
-                delta_text = f'{position}'
+    for i, delta in enumerate(cash_delta):
+        if delta != 0:
+            color = 'green' if delta > 0 else 'red'
 
-                ax.annotate(delta_text,
-                            xy=(pair_portfolio.dates_over_time[-num_bins:][i],
-                                pair_portfolio.ratio_over_time[-num_bins:][i]),
-                            xytext=(0, 90), textcoords='offset points',
-                            arrowprops=dict(arrowstyle="->", color=color),
-                            ha='center', va='bottom', color=color)
+            position = positions[i]
+            # delta_text = f'{position}\nΔ${delta:.2f}'
+            delta_text = f'{position}'
 
-        # ax.set_ylabel(f'Ratio of the {stock_pair_label} prices')
-        # Replace _ with / in stock pair label
-        ax.set_ylabel(f'Pair price ratio ({stock_pair_label.replace("_", "/")})')
-        # plt.xticks(rotation=45)
-        ax.grid(True)
-        ax.xaxis.set_major_locator(mdates.MonthLocator(bymonth=[4, 5, 6, 7]))
-        # ax.xaxis.set_major_locator(plt.MultipleLocator(5))
-        # ax.set_title(f'StrategyC Bollinger Bands and Trades for Stock Pair {stock_pair_label}')
+            ax.annotate(delta_text,
+                        xy=(dates[i], ratios[i]),
+                        xytext=(0, 90), textcoords='offset points',
+                        arrowprops=dict(arrowstyle="->", color=color),
+                        ha='center', va='bottom', color=color)
 
-        plot_subdir = os.path.join(plots_dir, 'strategy_c_bollinger_bands_and_trades')
-        os.makedirs(plot_subdir, exist_ok=True)
-        fname = os.path.join(plot_subdir,
-                             f'strategy_c_bollinger_bands_and_trades_{stock_pair_label}.png')
-        fig.savefig(fname, dpi=1000, bbox_inches='tight')
-        plt.close()
+    # ax.set_ylabel(f'Ratio of the {stock_pair_label} prices')
+    # Replace _ with / in stock pair label
+    ax.set_ylabel(f'Pair price ratio ({stock_pair_label.replace("_", "/")})')
+    # plt.xticks(rotation=45)
+    ax.grid(True)
+    ax.xaxis.set_major_locator(mdates.MonthLocator(bymonth=[4, 5, 6, 7]))
+    # ax.xaxis.set_major_locator(plt.MultipleLocator(5))
+    # ax.set_title(f'StrategyC Bollinger Bands and Trades for Stock Pair {stock_pair_label}')
+    return fig
 
-def plot_strategy_b_macd_histogram_and_trades(master_portfolio):
+def plot_strategy_b_macd_histogram_and_trades(master_portfolio, quality='final',
+                                              num_workers=1, force=False):
     """
     Plots the MACD histogram and annotates the trades for Strategy B
     """
+    return render_figures(_strategy_b_macd_histogram_and_trades_figures(master_portfolio),
+                          quality, num_workers, force)
 
-    current_dir = os.path.dirname(__file__)
-    plots_dir = os.path.join(current_dir, '..', 'plots', master_portfolio.name)
-    os.makedirs(plots_dir, exist_ok=True)
+def _strategy_b_macd_histogram_and_trades_figures(master_portfolio):
+    plots_dir = get_plots_dir(master_portfolio)
     master_portfolio.calc_strategy_strings()
     pairs_portfolio_index_dict = master_portfolio.calc_pairs_portfolio_index_dict()
     stock_pair_labels = pairs_portfolio_index_dict[master_portfolio.strategy_strings[0]].keys()
     num_bins = 50
-
+    plot_subdir = os.path.join(plots_dir, 'strategy_b_macd_histogram_and_trades')
+    os.makedirs(plot_subdir, exist_ok=True)
+    jobs = []
     for stock_pair_label in stock_pair_labels:
         pairs_portfolio_index = pairs_portfolio_index_dict["StrategyB"][stock_pair_label]
         pair_portfolio = master_portfolio.pair_portfolios[pairs_portfolio_index]
-
-        # Figure needs to go in a powerpoint presentation on the right half of a 16:9 slide,
-        # therefore the figsize is set to (5, 4)
-        # The figure has two subplots, the top one shows the ratio over time
-        # as well as the fast and slow ewma over time.
-        # The bottom figure shows the MACD and the signal line over time.
-        fig, axs = plt.subplots(2, 1, figsize=(8, 8), sharex=False)
-        axs[0].plot(pair_portfolio.dates_over_time[-num_bins:],
-                    pair_portfolio.ratio_over_time[-num_bins:],
-                    label="Ratio over time")
-        axs[0].plot(pair_portfolio.dates_over_time[-num_bins:],
-                    pair_portfolio.strategy.over_time_vals.fast_ewma[-num_bins:],
-                    label="Fast EWMA")
-        axs[0].plot(pair_portfolio.dates_over_time[-num_bins:],
-                    pair_portfolio.strategy.over_time_vals.slow_ewma[-num_bins:],
-                    label="Slow EWMA")
-        axs[0].set_ylabel(f'Ratio of {stock_pair_label} prices')
+        over_time_vals = pair_portfolio.strategy.over_time_vals
         cash_delta = np.diff(pair_portfolio.cash_over_time,
                              prepend=pair_portfolio.cash_over_time[0])
-        for i, delta in enumerate(cash_delta[-num_bins:]):
-            if delta != 0:
-                color = 'green' if delta > 0 else 'red'
-                position = pair_portfolio.position_over_time[-num_bins:][i]
-                delta_text = f'{position}'
-                axs[0].annotate(delta_text,
-                                xy=(pair_portfolio.dates_over_time[-num_bins:][i],
-                                    pair_portfolio.ratio_over_time[-num_bins:][i]),
-                                xytext=(0, 60), textcoords='offset points',
-                                arrowprops=dict(arrowstyle="->", color=color),
-                                ha='center', va='bottom', color=color)
-        axs[0].legend()
-
-        axs[1].plot(pair_portfolio.dates_over_time[-num_bins:],
-                    pair_portfolio.strategy.over_time_vals.macd[-num_bins:],
-                    label="MACD")
-        axs[1].plot(pair_portfolio.dates_over_time[-num_bins:],
-                    pair_portfolio.strategy.over_time_vals.signal[-num_bins:],
-                    label="Signal Line")
-        # Add annotations for the trades
-        cash_delta = np.diff(pair_portfolio.cash_over_time,
-                             prepend=pair_portfolio.cash_over_time[0])
-        for i, delta in enumerate(cash_delta[-num_bins:]):
-            if delta != 0:
-                color = 'green' if delta > 0 else 'red'
-                position = pair_portfolio.position_over_time[-num_bins:][i]
-                delta_text = f'{position}'
-                axs[1].annotate(delta_text,
-                                xy=(pair_portfolio.dates_over_time[-num_bins:][i],
-                                    pair_portfolio.strategy.over_time_vals.macd[-num_bins:][i]),
-                                xytext=(0, 60),
-                                textcoords='offset points',
-                                arrowprops=dict(arrowstyle="->", color=color),
-                                ha='center', va='bottom', color=color)
-        axs[1].set_ylabel('MACD & Signal')
-        axs[1].legend()
-        # Make x-axis labels more sparse
-        # axs[0].xaxis.set_major_locator(plt.MaxNLocator(5))
-        # axs[1].xaxis.set_major_locator(plt.MaxNLocator(5))
-        # Change x-axis labels to just show year and month and at 1st of May, June
-        # and July
-        axs[0].xaxis.set_major_locator(mdates.MonthLocator(bymonth=[5, 6, 7]))
-        axs[1].xaxis.set_major_locator(mdates.MonthLocator(bymonth=[5, 6, 7]))
-        # axs[0].xaxis.set_major_formatter(mdates.DateFormatter('%Y-%m'))
-        # axs[1].xaxis.set_major_formatter(mdates.DateFormatter('%Y-%m'))
-        # axs[0].xaxis.set_major_formatter(mdates.DateFormatter('%Y-%m-%d'))
-
-        # plt.xticks(rotation=45)
-        # Add grid to both axes
-        for ax in axs:
-            ax.grid(True)
-        # Add more vertical grid lines
-        for ax in axs:
-            ax.grid(which='minor', axis='x', linestyle='-')
-            ax.grid(which='major', axis='x', linestyle='-')
-            ax.grid(which='minor', axis='y', linestyle='-')
-            ax.grid(which='major', axis='y', linestyle='-')
-            # Add more grid lines or xticks if needs be
-            # Add more grid lines or xticks if needs be
-        # Add more major grid lines to x-axis
-        # Add more major grid lines to x-axis
-        axs[0].xaxis.set_major_locator(plt.MultipleLocator(10))
-        axs[1].xaxis.set_major_locator(plt.MultipleLocator(10))
-
-        plot_subdir = os.path.join(plots_dir, 'strategy_b_macd_histogram_and_trades')
-        os.makedirs(plot_subdir, exist_ok=True)
         fname = os.path.join(plot_subdir,
                              f'strategy_b_macd_histogram_and_trades_{stock_pair_label}.png')
-        fig.savefig(fname, dpi=1000, bbox_inches='tight')
-        plt.close()
+        jobs.append(FigureJob(fname, _draw_strategy_b_macd_histogram_and_trades, {
+            'dates': pair_portfolio.dates_over_time[-num_bins:],
+            'ratios': pair_portfolio.ratio_over_time[-num_bins:],
+            'fast_ewma': over_time_vals.fast_ewma[-num_bins:],
+            'slow_ewma': over_time_vals.slow_ewma[-num_bins:],
+            'macd': over_time_vals.macd[-num_bins:],
+            'signal': over_time_vals.signal[-num_bins:],
+            'cash_delta': cash_delta[-num_bins:],
+            'positions': to_strings(pair_portfolio.position_over_time[-num_bins:]).tolist(),
+            'stock_pair_label': stock_pair_label}, dpi=1000))
+    return jobs
+
+def _draw_strategy_b_macd_histogram_and_trades(dates, ratios, fast_ewma, slow_ewma, macd,
+                                               signal, cash_delta, positions,
+                                               stock_pair_label):
+    import matplotlib.pyplot as plt # pylint: disable=import-outside-toplevel
+    import matplotlib.dates as mdates # pylint: disable=import-outside-toplevel
+    # Figure needs to go in a powerpoint presentation on the right half of a 16:9 slide,
+    # therefore the figsize is set to (5, 4)
+    # The figure has two subplots, the top one shows the ratio over time
+    # as well as the fast and slow ewma over time.
+    # The bottom figure shows the MACD and the signal line over time.
+    fig, axs = plt.subplots(2, 1, figsize=(8, 8), sharex=False)
+    axs[0].plot(dates,
+                ratios,
+                label="Ratio over time")
+    axs[0].plot(dates,
+                fast_ewma,
+                label="Fast EWMA")
+    axs[0].plot(dates,
+                slow_ewma,
+                label="Slow EWMA")
+    axs[0].set_ylabel(f'Ratio of {stock_pair_label} prices')
+    for i, delta in enumerate(cash_delta):
+        if delta != 0:
+            color = 'green' if delta > 0 else 'red'
+            position = positions[i]
+            delta_text = f'{position}'
+            axs[0].annotate(delta_text,
+                            xy=(dates[i], ratios[i]),
+                            xytext=(0, 60), textcoords='offset points',
+                            arrowprops=dict(arrowstyle="->", color=color),
+                            ha='center', va='bottom', color=color)
+    axs[0].legend()
+
+    axs[1].plot(dates,
+                macd,
+                label="MACD")
+    axs[1].plot(dates,
+                signal,
+                label="Signal Line")
+    # Add annotations for the trades
+    for i, delta in enumerate(cash_delta):
+        if delta != 0:
+            color = 'green' if delta > 0 else 'red'
+            position = positions[i]
+            delta_text = f'{position}'
+            axs[1].annotate(delta_text,
+                            xy=(dates[i], macd[i]),
+                            xytext=(0, 60),
+                            textcoords='offset points',
+                            arrowprops=dict(arrowstyle="->", color=color),
+                            ha='center', va='bottom', color=color)
+    axs[1].set_ylabel('MACD & Signal')
+    axs[1].legend()
+    # Make x-axis labels more sparse
+    # axs[0].xaxis.set_major_locator(plt.MaxNLocator(5))
+    # axs[1].xaxis.set_major_locator(plt.MaxNLocator(5))
+    # Change x-axis labels to just show year and month and at 1st of May, June
+    # and July
+    axs[0].xaxis.set_major_locator(mdates.MonthLocator(bymonth=[5, 6, 7]))
+    axs[1].xaxis.set_major_locator(mdates.MonthLocator(bymonth=[5, 6, 7]))
+    # axs[0].xaxis.set_major_formatter(mdates.DateFormatter('%Y-%m'))
+    # axs[1].xaxis.set_major_formatter(mdates.DateFormatter('%Y-%m'))
+    # axs[0].xaxis.set_major_formatter(mdates.DateFormatter('%Y-%m-%d'))
+
+    # plt.xticks(rotation=45)
+    # Add grid to both axes
+    for ax in axs:
+        ax.grid(True)
+    # Add more vertical grid lines
+    for ax in axs:
+        ax.grid(which='minor', axis='x', linestyle='-')
+        ax.grid(which='major', axis='x', linestyle='-')
+        ax.grid(which='minor', axis='y', linestyle='-')
+        ax.grid(which='major', axis='y', linestyle='-')
+        # Add more grid lines or xticks if needs be
+        # Add more grid lines or xticks if needs be
+    # Add more major grid lines to x-axis
+    # Add more major grid lines to x-axis
+    axs[0].xaxis.set_major_locator(plt.MultipleLocator(10))
+    axs[1].xaxis.set_major_locator(plt.MultipleLocator(10))
+    return fig
 
-def plot_strategy_b_against_d(master_portfolio):
+def plot_strategy_b_against_d(master_portfolio, quality='final', num_workers=1, force=False):
     """
     Plot the MACD strategy (Strategy B) against Golden's cointigration strategy (Strategy D).
     For the following stock pairs:
@@ -286,24 +488,41 @@ def plot_strategy_b_against_d(master_portfolio):
     - CAT_DE
     - CVX_XOM
     """
+    return render_figures(_strategy_b_against_d_figures(master_portfolio),
+                          quality, num_workers, force)
+
+def _strategy_b_against_d_figures(master_portfolio):
     # stock_pair_labels = ["JPM_BAC", "WMT_TGT", "CAT_DE", "CVX_XOM"]
     stock_pair_labels = ["WMT_TGT", "CVX_XOM", "CAT_DE", "JPM_BAC"]
-    clrs = ['tab:blue', 'tab:orange', 'tab:green', 'tab:red']
     master_portfolio.calc_strategy_strings()
     pairs_portfolio_index_dict = master_portfolio.calc_pairs_portfolio_index_dict()
-    fig, ax = plt.subplots()
-    for i, stock_pair_label in enumerate(stock_pair_labels):
+    lines = []
+    for stock_pair_label in stock_pair_labels:
         pairs_portfolio_index_b = pairs_portfolio_index_dict["StrategyB"][stock_pair_label]
         pairs_portfolio_index_d = pairs_portfolio_index_dict["StrategyD"][stock_pair_label]
         pair_portfolio_b = master_portfolio.pair_portfolios[pairs_portfolio_index_b]
         pair_portfolio_d = master_portfolio.pair_portfolios[pairs_portfolio_index_d]
+        lines.append((
+            pair_portfolio_b.dates_over_time.values(),
+            np.array(pair_portfolio_b.cash_over_time) - pair_portfolio_b.cash_over_time[0],
+            pair_portfolio_d.dates_over_time.values(),
+            np.array(pair_portfolio_d.cash_over_time) - pair_portfolio_d.cash_over_time[0]))
+    fname = os.path.join(get_plots_dir(master_portfolio),
+                         'strategy_b_against_d.png')
+    return [FigureJob(fname, _draw_strategy_b_against_d,
+                      {'stock_pair_labels': stock_pair_labels, 'lines': lines})]
 
-        ax.plot(pair_portfolio_b.dates_over_time,
-                np.array(pair_portfolio_b.cash_over_time) - pair_portfolio_b.cash_over_time[0],
+def _draw_strategy_b_against_d(stock_pair_labels, lines):
+    import matplotlib.pyplot as plt # pylint: disable=import-outside-toplevel
+    clrs = ['tab:blue', 'tab:orange', 'tab:green', 'tab:red']
+    fig, ax = plt.subplots()
+    for i, (dates_b, cash_b, dates_d, cash_d) in enumerate(lines):
+        ax.plot(dates_b,
+                cash_b,
                 color = clrs[i],
                 linestyle = '--')
-        ax.plot(pair_portfolio_d.dates_over_time,
-                np.array(pair_portfolio_d.cash_over_time) - pair_portfolio_d.cash_over_time[0],
+        ax.plot(dates_d,
+                cash_d,
                 color = clrs[i],
                 linestyle = '-')
     plt.grid(True)
@@ -318,22 +537,41 @@ def plot_strategy_b_against_d(master_portfolio):
         linestyle = linestyles[i]
         ax.plot([], [], color='k', linestyle=linestyle, label=strategy)
     ax.legend()
-    current_dir = os.path.dirname(__file__)
-    plots_dir = os.path.join(current_dir, '..', 'plots', master_portfolio.name)
-    os.makedirs(plots_dir, exist_ok=True)
-    fname = os.path.join(plots_dir,
-                         'strategy_b_against_d.png')
-    fig.savefig(fname,
-                dpi=300, bbox_inches='tight')
+    return fig
 
-def make_csv_strategy_d_and_b(master_portfolio):
+def make_csv_strategy_d_and_b(master_portfolio, quality='final', num_workers=1, force=False,
+                              executor=None):
     """
     Make a CSV of cash everytime Strategy D or Strategy B closes a position with date as a column.
     Use Pandas dataframe to do this.
+
+    The CSV files are always written. The plots of the cash over time are rendered with
+    render_figures (see plot_cash_over_time).
+    """
+    plots_dir = get_plots_dir(master_portfolio)
+    for strategy_string, stock_pair_label, df, filtered_df in _cash_frames(master_portfolio):
+        plot_subdir = os.path.join(plots_dir, strategy_string)
+        os.makedirs(plot_subdir, exist_ok=True)
+        fname = os.path.join(plot_subdir,
+                             f'{strategy_string}_{stock_pair_label}.csv')
+        df.to_csv(fname)
+        fname = os.path.join(plot_subdir,
+                             f'{strategy_string}_{stock_pair_label}_filtered.csv')
+        if strategy_string == "StrategyB":
+            fname = os.path.join(plot_subdir,
+                                 f'MACD_strategy_{stock_pair_label}_filtered.csv')
+        elif strategy_string == "StrategyD":
+            fname = os.path.join(plot_subdir,
+                                 f'Mean-reversion_strategy_{stock_pair_label}_filtered.csv')
+        filtered_df.to_csv(fname)
+    return render_figures(_cash_over_time_figures(master_portfolio), quality, num_workers, force,
+                          executor)
+
+def _cash_frames(master_portfolio):
+    """
+    Yield the strategy string, the stock pair label and the DataFrames of the cash of each pair
+    portfolio, over every day and filtered to the days on which the position changes.
     """
-    current_dir = os.path.dirname(__file__)
-    plots_dir = os.path.join(current_dir, '..', 'plots', master_portfolio.name)
-    os.makedirs(plots_dir, exist_ok=True)
     master_portfolio.calc_strategy_strings()
     pairs_portfolio_index_dict = master_portfolio.calc_pairs_portfolio_index_dict()
     for strategy_string in pairs_portfolio_index_dict.keys():
@@ -343,88 +581,118 @@ def make_csv_strategy_d_and_b(master_portfolio):
             df = pd.DataFrame()
             df['date'] = pair_portfolio.dates_over_time
             df['cash'] = np.array(pair_portfolio.cash_over_time) - pair_portfolio.cash_over_time[0]
-            df['position'] = pair_portfolio.position_over_time
-            plot_subdir = os.path.join(plots_dir, strategy_string)
-            os.makedirs(plot_subdir, exist_ok=True)
-            fname = os.path.join(plot_subdir,
-                                 f'{strategy_string}_{stock_pair_label}.csv')
-            df.to_csv(fname)
+            df['position'] = to_strings(pair_portfolio.position_over_time)
             # Filter csv to only show the cash when the position changes because this is the
             # only time when the cash changes
-            df = df[df['position'] != df['position'].shift(1)]
-            fname = os.path.join(plot_subdir,
-                                 f'{strategy_string}_{stock_pair_label}_filtered.csv')
-            if strategy_string == "StrategyB":
-                fname = os.path.join(plot_subdir,
-                                     f'MACD_strategy_{stock_pair_label}_filtered.csv')
-            elif strategy_string == "StrategyD":
-                fname = os.path.join(plot_subdir,
-                                     f'Mean-reversion_strategy_{stock_pair_label}_filtered.csv')
-            df.to_csv(fname)
-            # Plot the cash over time from filtered and non-filtered
-            fig, ax = plt.subplots()
-            ax.plot(pair_portfolio.dates_over_time,
-                    np.array(pair_portfolio.cash_over_time) - pair_portfolio.cash_over_time[0],
-                    label='All trades')
-            ax.plot(df['date'], df['cash'], label='Filtered trades')
-            ax.set_ylabel('Cash [USD]')
-            plt.xticks(rotation=45)
-            ax.set_title(f'Cash over time for {strategy_string} {stock_pair_label}')
-            ax.legend()
-            plot_subdir = os.path.join(plots_dir, 'cash_over_time')
-            os.makedirs(plot_subdir, exist_ok=True)
-            fname = os.path.join(plot_subdir,
-                                 f'{strategy_string}_{stock_pair_label}_cash_over_time.png')
-            fig.savefig(fname, dpi=300, bbox_inches='tight')
-            plt.close()
+            filtered_df = df[df['position'] != df['position'].shift(1)]
+            yield strategy_string, stock_pair_label, df, filtered_df
+
+def plot_cash_over_time(master_portfolio, quality='final', num_workers=1, force=False):
+    """
+    Plots the cash of each pair portfolio over time, on every day and only on the days on
+    which the position changes, as in the CSVs of make_csv_strategy_d_and_b.
+    """
+    return render_figures(_cash_over_time_figures(master_portfolio),
+                          quality, num_workers, force)
+
+def _cash_over_time_figures(master_portfolio):
+    plot_subdir = os.path.join(get_plots_dir(master_portfolio), 'cash_over_time')
+    os.makedirs(plot_subdir, exist_ok=True)
+    jobs = []
+    for strategy_string, stock_pair_label, df, filtered_df in _cash_frames(master_portfolio):
+        fname = os.path.join(plot_subdir,
+                             f'{strategy_string}_{stock_pair_label}_cash_over_time.png')
+        jobs.append(FigureJob(fname, _draw_cash_over_time, {
+            'dates': df['date'].to_numpy(),
+            'cash': df['cash'].to_numpy(),
+            'filtered_dates': filtered_df['date'].to_numpy(),
+            'filtered_cash': filtered_df['cash'].to_numpy(),
+            'strategy_string': strategy_string,
+            'stock_pair_label': stock_pair_label}))
+    return jobs
+
+def _draw_cash_over_time(dates, cash, filtered_dates, filtered_cash, strategy_string,
+                         stock_pair_label):
+    import matplotlib.pyplot as plt # pylint: disable=import-outside-toplevel
+    fig, ax = plt.subplots()
+    ax.plot(dates,
+            cash,
+            label='All trades')
+    ax.plot(filtered_dates, filtered_cash, label='Filtered trades')
+    ax.set_ylabel('Cash [USD]')
+    plt.xticks(rotation=45)
+    ax.set_title(f'Cash over time for {strategy_string} {stock_pair_label}')
+    ax.legend()
+    return fig
+
+# Maps each plot function to the function which collects the FigureJob objects of its figures
+FIGURE_BUILDERS = {
+    plot_average_values_over_time: _average_values_over_time_figures,
+    plot_values_over_time: _values_over_time_figures,
+    plot_position_over_time: _position_over_time_figures,
+    plot_strategy_c_bollinger_bands_and_trades: _strategy_c_bollinger_bands_and_trades_figures,
+    plot_strategy_b_macd_histogram_and_trades: _strategy_b_macd_histogram_and_trades_figures,
+    plot_strategy_b_against_d: _strategy_b_against_d_figures,
+    plot_cash_over_time: _cash_over_time_figures,
+}
+
+def init_worker():
+    """
+    Set up a worker process to render figures, e.g. as the initializer of a process pool which
+    is passed to render_figures as its executor. Worker processes only save figures to files,
+    so they never need an interactive backend.
+    """
+    import matplotlib # pylint: disable=import-outside-toplevel
+    matplotlib.use('Agg')
+
+@functools.lru_cache(maxsize=None)
+def _get_matplotlib_version():
+    # Read from the package metadata, so that checking the hashes of figures which do not need
+    # rendering again does not import matplotlib
+    return importlib.metadata.version('matplotlib')
+
+def _render_job(job, dpi):
+    import matplotlib.pyplot as plt # pylint: disable=import-outside-toplevel
+    fig = job.render(**job.data)
+    fig.savefig(job.fname, dpi=dpi, bbox_inches='tight')
+    plt.close(fig)
+
+def _load_hashes(plots_dir):
+    try:
+        with open(os.path.join(plots_dir, HASHES_FILENAME), encoding='utf-8') as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return {}
+
+def _save_hashes(plots_dir, hashes):
+    with open(os.path.join(plots_dir, HASHES_FILENAME), 'w', encoding='utf-8') as f:
+        json.dump(hashes, f, indent=1, sort_keys=True)
 
 def make_csv_position_strategy_b_d(master_portfolio):
     """
     Make a CSV of the total time a position is open, as well as the average time a position is held for. We need four numbers for each stock pair.
     """
-    current_dir = os.path.dirname(__file__)
-    plots_dir = os.path.join(current_dir, '..', 'plots', master_portfolio.name)
-    os.makedirs(plots_dir, exist_ok=True)
+    plots_dir = get_plots_dir(master_portfolio)
     master_portfolio.calc_strategy_strings()
     pairs_portfolio_index_dict = master_portfolio.calc_pairs_portfolio_index_dict()
-    with open(os.path.join(plots_dir, 'position_stats_no_covid_macd_mean_reversion.csv'), 'w', encoding='utf-8') as f:
-        # write header
-        f.write('stock_pair_label,strategy_string,num_days_long_A_short_B,num_days_long_B_short_A,num_days_no_position,'
-                'average_holding_period\n')
-        for strategy_string in ["StrategyB", "StrategyD"]:
-            for stock_pair_label in pairs_portfolio_index_dict[strategy_string].keys():
-                pairs_portfolio_index = pairs_portfolio_index_dict[strategy_string][stock_pair_label]
-                pair_portfolio = master_portfolio.pair_portfolios[pairs_portfolio_index]
-                position_over_time = np.array(pair_portfolio.position_over_time)
-                num_days_in_position = {}
-                num_days_in_position['long A short B'] = np.sum(position_over_time == 'long A short B')
-                num_days_in_position['long B short A'] = np.sum(position_over_time == 'long B short A')
-                num_days_in_position['no position'] = np.sum(position_over_time == 'no position')
-                if strategy_string == "StrategyB":
-                    output_strategy = "MACD"
-                elif strategy_string == "StrategyD":
-                    output_strategy = "Mean-reversion"
-                # Calculate average length of time a position is held consecutively
-                consecutive_days_in_position = {}
-                consecutive_days_in_position['long A short B'] = []
-                consecutive_days_in_position['long B short A'] = []
-                consecutive_days_in_position['no position'] = []
-                last_position = ''
-                for next_position in position_over_time:
-                    if next_position != last_position:
-                        consecutive_days_in_position[next_position].append(1)
-                    elif next_position == last_position:
-                        consecutive_days_in_position[next_position][-1] += 1
-                    last_position = next_position
-                for position in ['long A short B', 'long B short A', 'no position']:
-                    consecutive_days_in_position[position] = np.array(consecutive_days_in_position[position])
-                average_holding_period = {}
-                for position in ['long A short B', 'long B short A', 'no position']:
-                    if len(consecutive_days_in_position[position]) == 0:
-                        average_holding_period[position] = 0
-                    else:
-                        average_holding_period[position] = np.sum(consecutive_days_in_position[position]) / len(consecutive_days_in_position[position])
-                average_holding_period_total = (average_holding_period['long A short B'] + average_holding_period['long B short A']) / 2
-                # Write to CSV
-                f.write(f'{stock_pair_label},{output_strategy},{num_days_in_position["long A short B"]},{num_days_in_position["long B short A"]},'
-                        f'{num_days_in_position["no position"]},{average_holding_period_total}\n')
+    stock_pair_labels, output_strategies, positions = [], [], []
+    for strategy_string, output_strategy in [("StrategyB", "MACD"),
+                                             ("StrategyD", "Mean-reversion")]:
+        for stock_pair_label, pairs_portfolio_index in \
+                pairs_portfolio_index_dict[strategy_string].items():
+            pair_portfolio = master_portfolio.pair_portfolios[pairs_portfolio_index]
+            stock_pair_labels.append(stock_pair_label)
+            output_strategies.append(output_strategy)
+            positions.append(to_codes(pair_portfolio.position_over_time))
+    # The position statistics of every pair portfolio at once, from run-length encoding
+    position_days = calc_position_days(np.stack(positions))
+    df = pd.DataFrame({
+        'stock_pair_label': stock_pair_labels,
+        'strategy_string': output_strategies,
+        'num_days_long_A_short_B': position_days['num_days_long_A_short_B'],
+        'num_days_long_B_short_A': position_days['num_days_long_B_short_A'],
+        'num_days_no_position': position_days['num_days_no_position'],
+        'average_holding_period': (position_days['mean_holding_period_long_A_short_B']
+                                   + position_days['mean_holding_period_long_B_short_A']) / 2})
+    df.to_csv(os.path.join(plots_dir, 'position_stats_no_covid_macd_mean_reversion.csv'),
+              index=False)
@@ -4,31 +4,62 @@ This module contains the portfolio classes.
 from typing import Tuple, Type
 import numpy as np
 from pairs_trading_oaf import strategies
+from pairs_trading_oaf.history import HistoryColumn
+from pairs_trading_oaf.positions import Position
 
 class MasterPortfolio:
     """
     Class to represent the master portfolio. This is the top-level portfolio and contains
     all the pair portfolios which in turn contain the individual stock portfolios.
-    Different pair portfolios can have different strategies.
+    Different pair portfolios can have different strategies. It can also contain basket
+    portfolios, which trade more than two stocks (see BasketPortfolio).
 
     Note that the training data is used by some training strategies to calculate the
     trading thresholds. For example, the training data is used for a moving average
     strategy to calculate the moving average until the time of the lower bound of the
     window is greater than the trading start date. The testing data is used to execute
     trades.
+
+    The training and testing data sources are usually the filenames of CSV files in the data
+    directory, but can also be DataFrames (see data.get_data), e.g. the formation and trading
+    windows of walk_forward.py. training_data_str and testing_data_str are the old names of
+    training_data_source and testing_data_source, which are kept as aliases.
     """
-    def __init__(self, position_limit: int, training_data_str: str, testing_data_str: str,
+    def __init__(self, position_limit: int, training_data_source, testing_data_source,
                  trading_fee: float = 0.0, name: str = "Master Portfolio"):
         self.position_limit = position_limit
-        self.training_data_str = training_data_str
-        self.testing_data_str = testing_data_str
+        self.training_data_source = training_data_source
+        self.testing_data_source = testing_data_source
         self.trading_fee = trading_fee
         self.pair_portfolios = []
+        self.basket_portfolios = []
         self.average_pertofolio_value_over_time = None
         self.strategy_strings = None
         self.average_values_over_time = None
         self.name = name
 
+    @property
+    def training_data_str(self):
+        """
+        The old name of training_data_source.
+        """
+        return self.training_data_source
+
+    @training_data_str.setter
+    def training_data_str(self, training_data_source):
+        self.training_data_source = training_data_source
+
+    @property
+    def testing_data_str(self):
+        """
+        The old name of testing_data_source.
+        """
+        return self.testing_data_source
+
+    @testing_data_str.setter
+    def testing_data_str(self, testing_data_source):
+        self.testing_data_source = testing_data_source
+
     def add_pair_portfolio(self, pair_portfolio):
         """
         Add a pair portfolio to the master portfolio.
@@ -37,6 +68,22 @@ class MasterPortfolio:
             raise TypeError("pair_portfolio must be an instance of PairPortfolio")
         self.pair_portfolios.append(pair_portfolio)
 
+    def add_basket_portfolio(self, basket_portfolio):
+        """
+        Add a basket portfolio to the master portfolio.
+        """
+        if not isinstance(basket_portfolio, BasketPortfolio):
+            raise TypeError("basket_portfolio must be an instance of BasketPortfolio")
+        self.basket_portfolios.append(basket_portfolio)
+
+    @property
+    def traded_portfolios(self):
+        """
+        The pair portfolios followed by the basket portfolios, i.e. every portfolio which the
+        trading engines simulate.
+        """
+        return self.pair_portfolios + self.basket_portfolios
+
     def calc_strategy_strings(self):
         """
         Calculate a list of unique strategies used by the pair portfolios.
@@ -87,13 +134,13 @@ class MasterPortfolio:
             self.average_values_over_time[value_string] = {}
             for strategy_string in self.strategy_strings:
                 self.average_values_over_time[value_string][strategy_string] = \
-                    np.zeros(len(self.pair_portfolios[0].__dict__[value_string + "_over_time"]))
+                    np.zeros(len(getattr(self.pair_portfolios[0], value_string + "_over_time")))
         for pair_portfolio in self.pair_portfolios:
             strategy_string = pair_portfolio.strategy.__class__.__name__
             num_pairs_portfolio_counter[strategy_string] += 1
             for value_string in value_strings:
                 self.average_values_over_time[value_string][strategy_string] += \
-                    np.array(pair_portfolio.__dict__[value_string + "_over_time"])
+                    np.asarray(getattr(pair_portfolio, value_string + "_over_time"))
         for value_string in value_strings:
             for strategy_string in self.strategy_strings:
                 self.average_values_over_time[value_string][strategy_string] /= \
@@ -137,34 +184,53 @@ class PairPortfolio(MasterPortfolio):
     Note that we will refer to stock_pair_labels[0] as stock A and stock_pair_labels[1] as
     stock B.
 
-    The possible values of self.position are:
-    - "no position"
-    - "long A short B"
-    - "long B short A"
+    The possible values of self.position are the members of positions.Position:
+    - Position.NO_POSITION
+    - Position.LONG_A_SHORT_B
+    - Position.LONG_B_SHORT_A
+
+    A pair portfolio is traded like a basket portfolio with the weights (1, -1), through the
+    same prices, shares and weights (see trading.execute_trades).
     """
+    weights = (1.0, -1.0)
+
     def __init__(self,
                  stock_pair_labels: Tuple[str, str],
                  strategy_class: Type[strategies.BaseStrategy],
                  master_portfolio: MasterPortfolio,
-                 cash: float = 1e6):
+                 cash: float = 1e6,
+                 strategy_kwargs: dict = None,
+                 strategy: strategies.BaseStrategy = None):
         super().__init__(master_portfolio.position_limit,
-                         master_portfolio.training_data_str,
-                         master_portfolio.testing_data_str)
+                         master_portfolio.training_data_source,
+                         master_portfolio.testing_data_source)
         self.stock_pair_labels = stock_pair_labels
-        self.strategy = strategy_class(self)
+        # Keyword arguments passed to the strategy, e.g. {'window_size': 30}
+        self.strategy_kwargs = dict(strategy_kwargs or {})
+        if strategy is None:
+            self.strategy = strategy_class(self, **self.strategy_kwargs)
+        else:
+            # An already initialised strategy, e.g. a copy of a strategy warmed up on the same
+            # training data (see runner.py), which is linked to this pair portfolio instead
+            self.strategy = strategy
+            self.strategy.pair_portfolio = self
         self.cash = cash
         self.stock_pair_prices = (None, None) # Stores the latest prices of the stock pair
         self.portfolio_value = self.cash
         self.date = None # Stores the latest date
-        self.position = "no position"
+        self.position = Position.NO_POSITION
         self.shares = (0, 0) # Stores the number of shares of stock A and stock B
-        self.cash_over_time = []
-        self.dates_over_time = []
-        self.position_over_time = []
-        self.shares_over_time = []
-        self.stock_pair_prices_over_time = []
-        self.portfolio_value_over_time = []
-        self.ratio_over_time = []
+        # The over time values are stored in HistoryColumn arrays, which can be read like lists
+        self.cash_over_time = HistoryColumn(float)
+        self.dates_over_time = HistoryColumn()
+        self.position_over_time = HistoryColumn(np.int8, item_type=Position)
+        self.shares_over_time = HistoryColumn(float, width=2)
+        self.stock_pair_prices_over_time = HistoryColumn(float, width=2)
+        self.portfolio_value_over_time = HistoryColumn(float)
+        self.ratio_over_time = HistoryColumn(float)
+        # The trade events recorded by events.simulate_trading, with one events.TradeLog for
+        # each trading period it was called for, in order
+        self.trade_logs = []
 
     def update_prices_and_date(self, date, row):
         """
@@ -175,6 +241,62 @@ class PairPortfolio(MasterPortfolio):
                                   row[self.stock_pair_labels[1]])
         self.date = date
 
+    @property
+    def stock_labels(self):
+        """
+        The labels of the stocks traded by the portfolio, the same as stock_pair_labels.
+        """
+        return self.stock_pair_labels
+
+    @property
+    def prices(self):
+        """
+        The latest prices of the stocks, the same as stock_pair_prices.
+        """
+        return self.stock_pair_prices
+
+    def update_prices_from_row(self, date, row, column_indices):
+        """
+        Update the pair portfolio with the latest prices of stock A and stock B and the date,
+        from a row of prices whose columns were looked up once before the trading loop (see
+        trading.get_price_rows).
+        """
+        self.stock_pair_prices = (row[column_indices[0]], row[column_indices[1]])
+        self.date = date
+
+    def reserve_over_time_values(self, num_days: int):
+        """
+        Preallocate space in the over time values for num_days more days, e.g. the length of
+        the trading period.
+        """
+        for value_string in ["cash", "dates", "position", "shares", "stock_pair_prices",
+                             "portfolio_value", "ratio"]:
+            over_time_values = getattr(self, value_string + "_over_time")
+            over_time_values.reserve(len(over_time_values) + num_days)
+
+    def calculate_portfolio_value(self):
+        """
+        Calculate the value of the cash and shares at the latest prices.
+        """
+        price_a, price_b = self.stock_pair_prices
+        # The prices are None before the first day on which both stocks are listed, and
+        # missing (None or NaN) prices add nothing to the value
+        portfolio_value = self.cash
+        if price_a is not None and price_a == price_a:
+            portfolio_value += self.shares[0] * price_a
+        if price_b is not None and price_b == price_b:
+            portfolio_value += self.shares[1] * price_b
+        return portfolio_value
+
+    def extend_prices_over_time(self, prices):
+        """
+        Append the prices of several days, of shape (num_days, 2), to the over time values of
+        the prices and the price ratio, e.g. when reconstructing them (see events.py).
+        """
+        self.stock_pair_prices_over_time.extend(prices)
+        with np.errstate(divide='ignore', invalid='ignore'):
+            self.ratio_over_time.extend(prices[:, 0] / prices[:, 1])
+
     def update_over_time_values(self):
         """
         Update the portfolio over time.
@@ -184,11 +306,120 @@ class PairPortfolio(MasterPortfolio):
         self.position_over_time.append(self.position)
         self.shares_over_time.append(self.shares)
         self.stock_pair_prices_over_time.append(self.stock_pair_prices)
+        self.portfolio_value = self.calculate_portfolio_value()
+        self.portfolio_value_over_time.append(self.portfolio_value)
+        price_a, price_b = self.stock_pair_prices
+        if price_a is None or price_b is None:
+            self.ratio_over_time.append(np.nan)
+        else:
+            self.ratio_over_time.append(price_a / price_b)
+
+class BasketPortfolio(MasterPortfolio):
+    """
+    Class to represent a portfolio which trades a weighted basket of any number of stocks,
+    e.g. a sector basket of ETFs.
+
+    The basket holds weights[i] * position_limit dollars of stock i when the position is
+    Position.LONG_A_SHORT_B ("long the basket"), and the opposite amounts when the position is
+    Position.LONG_B_SHORT_A ("short the basket"), where a negative weight is a short leg. A
+    pair portfolio is the basket with the weights (1, -1), and both are traded by
+    trading.close_position and trading.open_position. The shares are a tuple with a value for
+    each leg, as for a pair portfolio, and the prices are a numpy array.
+
+    Strategies for baskets read the latest prices from stock_prices rather than
+    stock_pair_prices, e.g. strategies.StrategyF.
+    """
+    def __init__(self,
+                 stock_labels: Tuple[str, ...],
+                 weights,
+                 strategy_class: Type[strategies.BaseStrategy],
+                 master_portfolio: MasterPortfolio,
+                 cash: float = 1e6,
+                 strategy_kwargs: dict = None,
+                 strategy: strategies.BaseStrategy = None):
+        super().__init__(master_portfolio.position_limit,
+                         master_portfolio.training_data_source,
+                         master_portfolio.testing_data_source)
+        self.stock_labels = tuple(stock_labels)
+        self.weights = np.asarray(weights, dtype=float)
+        if self.weights.shape != (len(self.stock_labels),):
+            raise ValueError("weights must have one value for each of the stock labels")
+        self.strategy_kwargs = dict(strategy_kwargs or {})
+        if strategy is None:
+            self.strategy = strategy_class(self, **self.strategy_kwargs)
+        else:
+            self.strategy = strategy
+            self.strategy.pair_portfolio = self
+        num_legs = len(self.stock_labels)
+        self.cash = cash
+        self.stock_prices = np.full(num_legs, np.nan) # Stores the latest prices of the stocks
         self.portfolio_value = self.cash
-        if self.stock_pair_prices[0] is not None:
-            self.portfolio_value += self.shares[0] * self.stock_pair_prices[0]
-        if self.stock_pair_prices[1] is not None:
-            self.portfolio_value += self.shares[1] * self.stock_pair_prices[1]
+        self.date = None # Stores the latest date
+        self.position = Position.NO_POSITION
+        self.shares = (0.0,) * num_legs # Stores the number of shares of each stock
+        self.cash_over_time = HistoryColumn(float)
+        self.dates_over_time = HistoryColumn()
+        self.position_over_time = HistoryColumn(np.int8, item_type=Position)
+        self.shares_over_time = HistoryColumn(float, width=num_legs)
+        self.stock_prices_over_time = HistoryColumn(float, width=num_legs)
+        self.portfolio_value_over_time = HistoryColumn(float)
+        # The dollar value of the basket with the weights as its numbers of shares
+        self.basket_value_over_time = HistoryColumn(float)
+        self.trade_logs = [] # See PairPortfolio.trade_logs
+
+    def update_prices_from_row(self, date, row, column_indices):
+        """
+        Update the basket portfolio with the latest prices of its stocks and the date, from a
+        row of prices whose columns were looked up once before the trading loop (see
+        trading.get_price_rows).
+        """
+        self.stock_prices = np.array([row[index] for index in column_indices])
+        self.date = date
+
+    @property
+    def prices(self):
+        """
+        The latest prices of the stocks, the same as stock_prices.
+        """
+        return self.stock_prices
+
+    def reserve_over_time_values(self, num_days: int):
+        """
+        Preallocate space in the over time values for num_days more days, e.g. the length of
+        the trading period.
+        """
+        for value_string in ["cash", "dates", "position", "shares", "stock_prices",
+                             "portfolio_value", "basket_value"]:
+            over_time_values = getattr(self, value_string + "_over_time")
+            over_time_values.reserve(len(over_time_values) + num_days)
+
+    def calculate_portfolio_value(self):
+        """
+        Calculate the value of the cash and shares at the latest prices.
+        """
+        # Missing (NaN) prices, e.g. before the first day on which every stock is listed,
+        # add nothing to the value
+        valid_prices = np.where(np.isnan(self.stock_prices), 0.0, self.stock_prices)
+        return self.cash + float(self.shares @ valid_prices)
+
+    def extend_prices_over_time(self, prices):
+        """
+        Append the prices of several days, of shape (num_days, num_stocks), to the over time
+        values of the prices and the basket value, e.g. when reconstructing them (see
+        events.py).
+        """
+        self.stock_prices_over_time.extend(prices)
+        self.basket_value_over_time.extend(prices @ self.weights)
+
+    def update_over_time_values(self):
+        """
+        Update the portfolio over time.
+        """
+        self.cash_over_time.append(self.cash)
+        self.dates_over_time.append(self.date)
+        self.position_over_time.append(self.position)
+        self.shares_over_time.append(self.shares)
+        self.stock_prices_over_time.append(self.stock_prices)
+        self.portfolio_value = self.calculate_portfolio_value()
         self.portfolio_value_over_time.append(self.portfolio_value)
-        if self.stock_pair_prices[0] is not None and self.stock_pair_prices[1] is not None:
-            self.ratio_over_time.append(self.stock_pair_prices[0] / self.stock_pair_prices[1])
+        self.basket_value_over_time.append(self.weights @ self.stock_prices)
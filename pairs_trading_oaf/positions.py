@@ -0,0 +1,70 @@
+"""
+The positions that a pair portfolio can hold.
+
+Positions are stored as the integer codes of the Position enum: 0 for no position, 1 for
+long stock A and short stock B, and -1 for long stock B and short stock A. The codes fit in
+an int8 array and are also the sign of the stock A holding, so the engine never has to
+compare strings. The strings "no position", "long A short B" and "long B short A" are only
+used when reporting, e.g. in plots and CSV files.
+
+A Position only compares equal to its integer code, never to its string, so that equal
+values hash alike. str() and f-strings give the string, and to_position() converts the
+strings returned by older strategies at the boundaries of the engine.
+"""
+from enum import IntEnum
+import numpy as np
+
+class Position(IntEnum):
+    """
+    Integer codes for the positions of a pair portfolio.
+    """
+    NO_POSITION = 0
+    LONG_A_SHORT_B = 1
+    LONG_B_SHORT_A = -1
+
+    def __str__(self):
+        return POSITION_STRINGS[self]
+
+    def __format__(self, format_spec):
+        return format(str(self), format_spec)
+
+POSITION_STRINGS = {Position.NO_POSITION: "no position",
+                    Position.LONG_A_SHORT_B: "long A short B",
+                    Position.LONG_B_SHORT_A: "long B short A"}
+STRING_POSITIONS = {string: position for position, string in POSITION_STRINGS.items()}
+
+def to_position(position):
+    """
+    Convert a position string, integer code or Position to a Position.
+
+    Raises a ValueError for anything else.
+    """
+    if isinstance(position, Position):
+        return position
+    if isinstance(position, str):
+        try:
+            return STRING_POSITIONS[position]
+        except KeyError:
+            raise ValueError(f"{position!r} is not a valid position") from None
+    return Position(position)
+
+def to_codes(positions):
+    """
+    Convert an array (or list) of Positions, position codes or position strings to an int8
+    array of position codes.
+    """
+    codes = np.asarray(positions)
+    if codes.dtype.kind in 'OUS':
+        codes = np.array([to_position(position) for position in codes.ravel()],
+                         dtype=np.int8).reshape(codes.shape)
+    return codes.astype(np.int8, copy=False)
+
+def to_strings(positions):
+    """
+    Convert an array (or list) of position codes to an object array of position strings.
+    """
+    codes = np.asarray(positions, dtype=np.int8)
+    strings = np.empty(codes.shape, dtype=object)
+    for position, string in POSITION_STRINGS.items():
+        strings[codes == position] = string
+    return strings
@@ -0,0 +1,224 @@
+"""
+A single-file columnar store of the daily histories of simulated pair portfolios.
+
+Rather than writing CSV files and images for every strategy and pair, the cash, position and
+portfolio value of every pair portfolio of a run are appended to one results file:
+
+    results_store.write_results("results.store", master_portfolio, run_id="Stocks")
+    df = results_store.read_results("results.store", strategy="StrategyD",
+                                    stock_pair_labels=("Walmart Inc. (NYSE:WMT)",
+                                                       "Target Corporation (NYSE:TGT)"),
+                                    start="2022-03-01", end="2022-06-30")
+
+The file starts with MAGIC and is followed by chunks, one per call to write_results. Each
+chunk is:
+- the length of its header as an 8-byte little-endian integer,
+- its header, a JSON object with the number of rows, the dtype, offset and length in bytes of
+  each column, and one segment per pair portfolio giving its run id, strategy, parameters,
+  stock pair, first row, number of rows and first and last dates,
+- the data of each column in turn (see COLUMNS), with the rows of each segment next to each
+  other in date order.
+
+The run id, strategy and pair are the same on every row of a segment, so they are only stored
+in the header. Appending a run writes one chunk at the end of the file without reading or
+rewriting what is already there, and reading only reads the chunk headers and then the rows of
+the matching segments and dates, so a query never reads the whole file. A chunk which was only
+partly written, e.g. because the process was killed, is ignored by readers and overwritten by
+the next write. The store expects one writer at a time.
+"""
+import json
+import os
+import struct
+import numpy as np
+import pandas as pd
+
+MAGIC = b'PAIRS TRADING RESULTS 1\n'
+# The dtype of each column, and the *_over_time value of the pair portfolios it is taken from
+COLUMNS = {'date': ('<i8', 'dates'),
+           'cash': ('<f8', 'cash'),
+           'position': ('i1', 'position'),
+           'portfolio_value': ('<f8', 'portfolio_value')}
+_HEADER_LENGTH = struct.Struct('<Q')
+
+def write_results(filename: str, master_portfolio, run_id: str):
+    """
+    Append the daily histories of every pair portfolio of a simulated master portfolio to a
+    results file, which is created if it does not exist.
+
+    Inputs:
+    - filename: the path of the results file.
+    - master_portfolio: the simulated master portfolio.
+    - run_id: the name of the run, which identifies its rows when reading the file back, e.g.
+      the name of the experiment (see runner.py).
+    """
+    segments = []
+    columns = {column: [] for column in COLUMNS}
+    num_rows = 0
+    for pair_portfolio in master_portfolio.pair_portfolios:
+        dates = pair_portfolio.dates_over_time.values().astype('datetime64[ns]').view(np.int64)
+        segments.append({'run_id': run_id,
+                         'strategy': pair_portfolio.strategy.__class__.__name__,
+                         'params': pair_portfolio.strategy_kwargs,
+                         'stock_a': pair_portfolio.stock_pair_labels[0],
+                         'stock_b': pair_portfolio.stock_pair_labels[1],
+                         'start': num_rows,
+                         'num_rows': len(dates),
+                         'first_date': int(dates[0]) if len(dates) > 0 else None,
+                         'last_date': int(dates[-1]) if len(dates) > 0 else None})
+        num_rows += len(dates)
+        columns['date'].append(dates)
+        for column, (_, value_string) in COLUMNS.items():
+            if column != 'date':
+                columns[column].append(
+                    getattr(pair_portfolio, value_string + "_over_time").values())
+    _append_chunk(filename, segments, num_rows,
+                  {column: np.concatenate(values).astype(COLUMNS[column][0]) if values
+                   else np.empty(0, dtype=COLUMNS[column][0])
+                   for column, values in columns.items()})
+
+def list_segments(filename: str):
+    """
+    Return a DataFrame with one row per pair portfolio stored in a results file and the
+    columns 'run_id', 'strategy', 'params', 'stock_a', 'stock_b', 'num_rows', 'first_date'
+    and 'last_date'.
+    """
+    rows = []
+    with open(filename, 'rb') as f:
+        for _, header in _read_chunk_headers(f):
+            for segment in header['segments']:
+                rows.append({key: segment[key] for key in ['run_id', 'strategy', 'params',
+                                                           'stock_a', 'stock_b', 'num_rows']})
+                for key in ['first_date', 'last_date']:
+                    rows[-1][key] = pd.NaT if segment[key] is None else pd.Timestamp(segment[key])
+    return pd.DataFrame(rows, columns=['run_id', 'strategy', 'params', 'stock_a', 'stock_b',
+                                       'num_rows', 'first_date', 'last_date'])
+
+def read_results(filename: str, run_id: str = None, strategy: str = None,
+                 stock_pair_labels=None, start=None, end=None):
+    """
+    Read the rows of a results file which match every filter that is given.
+
+    Inputs:
+    - filename: the path of the results file.
+    - run_id: the run id given to write_results.
+    - strategy: the name of the strategy class, e.g. "StrategyA".
+    - stock_pair_labels: the (stock A label, stock B label) of the pair.
+    - start, end: the first and last dates to read (inclusive), as anything pandas.Timestamp
+      accepts.
+
+    Returns:
+    - A DataFrame with the columns 'run_id', 'strategy', 'stock_a', 'stock_b', 'date', 'cash',
+      'position' (the int8 codes of positions.Position) and 'portfolio_value', in the order
+      the rows were written.
+    """
+    start = None if start is None else pd.Timestamp(start).value
+    end = None if end is None else pd.Timestamp(end).value
+    labels = {'run_id': [], 'strategy': [], 'stock_a': [], 'stock_b': []}
+    columns = {column: [] for column in COLUMNS}
+    with open(filename, 'rb') as f:
+        for data_start, header in _read_chunk_headers(f):
+            for segment in header['segments']:
+                if not _matches(segment, run_id, strategy, stock_pair_labels, start, end):
+                    continue
+                first_row, num_rows = segment['start'], segment['num_rows']
+                dates = _read_rows(f, data_start, header['columns']['date'], first_row,
+                                   num_rows)
+                first = 0 if start is None else np.searchsorted(dates, start, side='left')
+                last = num_rows if end is None else np.searchsorted(dates, end, side='right')
+                if last <= first:
+                    continue
+                columns['date'].append(dates[first:last])
+                for column in COLUMNS:
+                    if column != 'date':
+                        columns[column].append(_read_rows(f, data_start,
+                                                          header['columns'][column],
+                                                          first_row + first, last - first))
+                for key in labels:
+                    labels[key].append(np.repeat(segment[key], last - first))
+
+    results = {key: np.concatenate(values) if values else np.empty(0, dtype=object)
+               for key, values in labels.items()}
+    for column, (dtype, _) in COLUMNS.items():
+        results[column] = np.concatenate(columns[column]) if columns[column] \
+            else np.empty(0, dtype=dtype)
+    results['date'] = results['date'].astype(np.int64).view('datetime64[ns]')
+    return pd.DataFrame(results)
+
+def _matches(segment, run_id, strategy, stock_pair_labels, start, end):
+    """
+    Return whether a segment can hold rows which match the filters of read_results.
+    """
+    if run_id is not None and segment['run_id'] != run_id:
+        return False
+    if strategy is not None and segment['strategy'] != strategy:
+        return False
+    if stock_pair_labels is not None \
+            and (segment['stock_a'], segment['stock_b']) != tuple(stock_pair_labels):
+        return False
+    if segment['num_rows'] == 0:
+        return False
+    if start is not None and segment['last_date'] < start:
+        return False
+    return end is None or segment['first_date'] <= end
+
+def _read_rows(f, data_start, column, first_row, num_rows):
+    """
+    Read num_rows rows of a column of a chunk, starting at row first_row.
+    """
+    dtype, offset, _ = column
+    dtype = np.dtype(dtype)
+    f.seek(data_start + offset + first_row * dtype.itemsize)
+    return np.frombuffer(f.read(num_rows * dtype.itemsize), dtype=dtype)
+
+def _read_chunk_headers(f):
+    """
+    Yield the (start of the column data, header) of each complete chunk of an open results
+    file, and leave the file positioned after the last complete chunk.
+    """
+    file_size = os.fstat(f.fileno()).st_size
+    if f.read(len(MAGIC)) != MAGIC:
+        raise ValueError(f"{f.name} is not a results file")
+    chunk_start = len(MAGIC)
+    while True:
+        f.seek(chunk_start)
+        header_length = f.read(_HEADER_LENGTH.size)
+        if len(header_length) < _HEADER_LENGTH.size:
+            break
+        header_bytes = f.read(_HEADER_LENGTH.unpack(header_length)[0])
+        data_start = f.tell()
+        try:
+            header = json.loads(header_bytes)
+        except ValueError:
+            break
+        next_chunk_start = data_start + header['data_length']
+        if next_chunk_start > file_size:
+            break
+        yield data_start, header
+        chunk_start = next_chunk_start
+    f.seek(chunk_start)
+
+def _append_chunk(filename, segments, num_rows, columns):
+    """
+    Write a chunk at the end of the complete chunks of a results file.
+    """
+    column_headers = {}
+    offset = 0
+    for column, values in columns.items():
+        column_headers[column] = [values.dtype.str, offset, values.nbytes]
+        offset += values.nbytes
+    header = {'num_rows': num_rows, 'data_length': offset, 'columns': column_headers,
+              'segments': segments}
+    header_bytes = json.dumps(header).encode('utf-8')
+
+    if not os.path.exists(filename) or os.path.getsize(filename) == 0:
+        with open(filename, 'wb') as f:
+            f.write(MAGIC)
+    with open(filename, 'r+b') as f:
+        for _ in _read_chunk_headers(f):
+            pass
+        # Overwrite any partly written chunk left at the end of the file
+        f.truncate()
+        f.write(_HEADER_LENGTH.pack(len(header_bytes)))
+        f.write(header_bytes)
+        for values in columns.values():
+            f.write(np.ascontiguousarray(values).tobytes())
@@ -0,0 +1,169 @@
+"""
+Rolling-window statistics shared by the strategies.
+
+The functions in this module work on whole arrays at once, with time running along the
+last axis, so that a strategy can compute its indicators for an entire trading period
+without looping over the days in Python.
+"""
+import math
+import warnings
+import numpy as np
+import pandas as pd
+
+def rolling_mean_std(values, window_size: int):
+    """
+    Calculate the mean and standard deviation (ddof=1) of each trailing window.
+
+    NaNs are skipped in the same way as pandas.Series.mean() and pandas.Series.std(), so a
+    window containing NaNs uses only its valid values and the standard deviation is NaN if
+    fewer than two values are valid.
+
+    Inputs:
+    - values: array with time along the last axis.
+    - window_size: the number of values in each window.
+
+    Returns:
+    - mean, std: arrays whose last axis has length values.shape[-1] - window_size + 1.
+      Element i contains the statistics of values[..., i:i + window_size].
+    """
+    values = np.asarray(values, dtype=float)
+    windows = np.lib.stride_tricks.sliding_window_view(values, window_size, axis=-1)
+    with warnings.catch_warnings():
+        # All-NaN windows and windows with a single valid value give NaN, as in pandas
+        warnings.simplefilter("ignore", category=RuntimeWarning)
+        mean = np.nanmean(windows, axis=-1)
+        std = np.nanstd(windows, axis=-1, ddof=1)
+    return mean, std
+
+def ewma(values, alpha: float):
+    """
+    Calculate the exponentially weighted moving average along the last axis using the
+    recursion ewma[0] = values[0] and ewma[i] = alpha * values[i] + (1 - alpha) * ewma[i - 1].
+
+    Once a NaN has been seen every later value of the average is NaN, which matches what the
+    recursion gives when it is evaluated one value at a time.
+    """
+    values = np.asarray(values, dtype=float)
+    flat_values = values.reshape(-1, values.shape[-1])
+    smoothed = pd.DataFrame(flat_values.T).ewm(alpha=alpha, adjust=False).mean().to_numpy().T
+    smoothed = np.ascontiguousarray(smoothed)
+    smoothed[np.logical_or.accumulate(np.isnan(flat_values), axis=-1)] = np.nan
+    return smoothed.reshape(values.shape)
+
+class RollingStatistics:
+    """
+    Mean and standard deviation (ddof=1) of a fixed-size window of values which is updated
+    one value at a time, as in the daily trading loop.
+
+    The window is stored in a ring buffer (a list of floats) together with the number of
+    valid values, their mean and their sum of squared deviations from the mean (Welford's
+    algorithm), so pushing a new value onto the window takes constant time and does not
+    allocate any arrays. NaNs are stored in the window but skipped in the statistics, as
+    in pandas.
+
+    To stop rounding errors building up, the statistics are recalculated from the window
+    once every window_size updates, which keeps the cost of an update constant on average.
+    The recalculation is a plain Python pass over the ring buffer with exactly rounded sums
+    (math.fsum), so it does not allocate any arrays either, and the rounding error of the
+    statistics is at most that of the window_size - 1 updates since the last one.
+    """
+    def __init__(self, initial_values):
+        self.window_size = len(initial_values)
+        self._buffer = [np.nan] * self.window_size
+        self._oldest_index = 0
+        self._count = 0
+        self._mean = 0.0
+        self._sum_squared_deviations = 0.0
+        self._updates_since_recalculation = 0
+        self.reset(initial_values)
+
+    def reset(self, values):
+        """
+        Replace the window with values, which must have length window_size.
+        """
+        self._buffer[:] = [float(value) for value in values]
+        self._oldest_index = 0
+        self._recalculate()
+
+    def push(self, value):
+        """
+        Add value to the end of the window and drop the oldest value.
+        """
+        value = float(value)
+        old_value = self._buffer[self._oldest_index]
+        self._buffer[self._oldest_index] = value
+        self._oldest_index += 1
+        if self._oldest_index == self.window_size:
+            self._oldest_index = 0
+        self._updates_since_recalculation += 1
+        if self._updates_since_recalculation >= self.window_size:
+            self._recalculate()
+            return
+
+        old_is_valid = old_value == old_value # False for NaN
+        new_is_valid = value == value
+        if old_is_valid and new_is_valid:
+            # Replace the old value without changing the count
+            delta = value - old_value
+            old_mean = self._mean
+            self._mean += delta / self._count
+            self._sum_squared_deviations += delta * (value - self._mean + old_value - old_mean)
+        elif old_is_valid:
+            self._remove(old_value)
+        elif new_is_valid:
+            self._add(value)
+
+    def mean(self):
+        """
+        Return the mean of the valid values in the window, or NaN if there are none.
+        """
+        if self._count == 0:
+            return np.nan
+        return self._mean
+
+    def std(self):
+        """
+        Return the standard deviation (ddof=1) of the valid values in the window,
+        or NaN if there are fewer than two.
+        """
+        if self._count < 2:
+            return np.nan
+        return math.sqrt(max(self._sum_squared_deviations, 0.0) / (self._count - 1))
+
+    def values(self):
+        """
+        Return a copy of the values in the window from oldest to newest.
+        """
+        return np.array(self._buffer[self._oldest_index:] + self._buffer[:self._oldest_index])
+
+    def _add(self, value):
+        self._count += 1
+        delta = value - self._mean
+        self._mean += delta / self._count
+        self._sum_squared_deviations += delta * (value - self._mean)
+
+    def _remove(self, value):
+        if self._count == 1:
+            self._count = 0
+            self._mean = 0.0
+            self._sum_squared_deviations = 0.0
+            return
+        self._count -= 1
+        delta = value - self._mean
+        self._mean -= delta / self._count
+        self._sum_squared_deviations -= delta * (value - self._mean)
+
+    def _recalculate(self):
+        # value == value is False for NaN
+        self._count = sum(value == value for value in self._buffer)
+        if self._count > 0:
+            mean = math.fsum(value for value in self._buffer if value == value) / self._count
+            self._mean = mean
+            # Squared by multiplying, which unlike ** 2 (pow) is always exactly rounded
+            self._sum_squared_deviations = math.fsum((value - mean) * (value - mean)
+                                                     for value in self._buffer
+                                                     if value == value)
+        else:
+            self._mean = 0.0
+            self._sum_squared_deviations = 0.0
+        self._updates_since_recalculation = 0
@@ -0,0 +1,384 @@
+"""
+Batch runs of experiments described by a run manifest.
+
+A run manifest is a JSON file with a list of experiments, each of which trades a list of
+strategies on a list of pairs over one training (formation) and testing (trading) dataset and
+then writes its outputs. Keys which are the same for every experiment can be given once under
+"defaults". For example:
+
+    {
+        "defaults": {"position_limit": 1.0, "cash": 10, "trading_fee": 0.0002},
+        "experiments": [
+            {"name": "Stocks",
+             "training_data": "Price Data - CSV - Formation Period.csv",
+             "testing_data": "Price Data - CSV - Trading Period.csv",
+             "pairs": [["Walmart Inc. (NYSE:WMT)", "Target Corporation (NYSE:TGT)"]],
+             "strategies": ["StrategyA", {"class": "StrategyC", "params": {"num_std": 1.5}}],
+             "outputs": ["metrics", "plot_values_over_time"]}
+        ]
+    }
+
+An entry of "pairs" can also be a basket of any number of stocks with their weights, e.g.
+{"stocks": ["StockA", "StockB", "StockC"], "weights": [0.5, -1, 0.5]}, which is traded as a
+portfolio.BasketPortfolio. Baskets can only be traded by the strategies in
+BASKET_STRATEGY_CLASSES, and pairs only by the others, so an experiment trades either pairs
+or baskets. An experiment of baskets can only have the outputs in BASKET_OUTPUTS.
+
+The keys of an experiment are given in EXPERIMENT_DEFAULTS, and the possible outputs in
+OUTPUTS. The whole manifest is checked before the first experiment runs, so a mistake in the
+last experiment does not waste the runs before it.
+
+The "results" output saves the daily histories of every pair portfolio to a results_store
+file, plots/<name>/results.store unless the experiment gives a results_file. Experiments which
+give the same results_file share one file, in which the rows of each experiment have its name
+as their run id. The results are appended to an existing results file, so earlier runs are
+kept, unless the experiment sets "overwrite" to true or the runner is given overwrite=True
+(the --overwrite flag of main.py), in which case the file is started afresh the first time
+the runner writes to it.
+
+All of the experiments run in one process, which saves the start-up cost of a process per
+experiment and lets the experiments share work:
+- each dataset is parsed once, through the cache of data.read_csv,
+- the strategies are warmed up on their training data once for each combination of training
+  data, pair, strategy class and parameters, and later experiments start from a copy of the
+  warmed-up strategy,
+- with num_workers > 1, one pool of worker processes simulates the pair portfolios (with the
+  "trading" engine) and renders the figures of every experiment, and each worker keeps its own
+  data cache from one experiment to the next.
+
+Run a manifest from the command line with
+
+    python -m pairs_trading_oaf.main manifests/main.json --num-workers 4
+"""
+import copy
+import json
+import os
+from typing import NamedTuple, Tuple
+import pandas as pd
+from pairs_trading_oaf import (events, metrics, plotting, portfolio, results_store, strategies,
+                               trading, vectorized)
+
+EXPERIMENT_DEFAULTS = {'name': None,
+                       'training_data': None,
+                       'testing_data': None,
+                       'pairs': None,
+                       'strategies': None,
+                       'position_limit': 1.0,
+                       'cash': 10,
+                       'trading_fee': 0.0,
+                       'engine': 'trading',
+                       'outputs': [],
+                       'plot_quality': 'final',
+                       'results_file': None,
+                       'overwrite': False}
+REQUIRED_KEYS = ['name', 'training_data', 'testing_data', 'pairs', 'strategies']
+ENGINES = {'trading': trading, 'vectorized': vectorized, 'events': events}
+STRATEGY_CLASSES = {strategy_class.__name__: strategy_class
+                    for strategy_class in [strategies.StrategyA, strategies.StrategyB,
+                                           strategies.StrategyC, strategies.StrategyD,
+                                           strategies.StrategyE, strategies.StrategyF]}
+# The strategies which trade baskets rather than pairs
+BASKET_STRATEGY_CLASSES = {'StrategyF'}
+# The plot functions which render their figures with plotting.plot_all
+FIGURE_OUTPUTS = {plot_function.__name__: plot_function
+                  for plot_function in plotting.FIGURE_BUILDERS}
+OUTPUTS = ['metrics', 'results', 'make_csv_strategy_d_and_b',
+           'make_csv_position_strategy_b_d'] + list(FIGURE_OUTPUTS)
+# The outputs of an experiment of baskets, as the other outputs only cover pair portfolios
+BASKET_OUTPUTS = ['metrics']
+METRICS_FILENAME = 'metrics.csv'
+RESULTS_FILENAME = 'results.store'
+
+class Basket(NamedTuple):
+    """
+    A basket of the pairs of a parsed experiment, with the labels of its stocks and their
+    weights (see portfolio.BasketPortfolio).
+    """
+    stocks: Tuple[str, ...]
+    weights: Tuple[float, ...]
+
+def load_manifest(filename: str):
+    """
+    Read a run manifest from a JSON file and return its list of experiments, with the
+    defaults filled in.
+
+    Raises a ValueError if the manifest is not valid.
+    """
+    with open(filename, encoding='utf-8') as f:
+        manifest = json.load(f)
+    return parse_manifest(manifest)
+
+def parse_manifest(manifest: dict):
+    """
+    Check a run manifest, i.e. the dictionary read from its JSON file, and return its list of
+    experiments with the defaults filled in.
+
+    Raises a ValueError if the manifest is not valid.
+    """
+    unknown_keys = set(manifest) - {'defaults', 'experiments'}
+    if unknown_keys:
+        raise ValueError(f"Unknown manifest keys {sorted(unknown_keys)}")
+    if not manifest.get('experiments'):
+        raise ValueError("The manifest has no experiments")
+    experiments = []
+    names = set()
+    for index, experiment in enumerate(manifest['experiments']):
+        experiment = {**EXPERIMENT_DEFAULTS, **manifest.get('defaults', {}), **experiment}
+        error = _check_experiment(experiment)
+        if error is None and experiment['name'] in names:
+            error = f"the name {experiment['name']!r} is used by another experiment"
+        if error is not None:
+            raise ValueError(f"Experiment {index} ({experiment.get('name')}): {error}")
+        names.add(experiment['name'])
+        experiment['pairs'] = [_parse_pair(pair) for pair in experiment['pairs']]
+        experiment['strategies'] = [_parse_strategy(strategy)
+                                    for strategy in experiment['strategies']]
+        experiments.append(experiment)
+    return experiments
+
+class BatchRunner:
+    """
+    Runs experiments one after another, sharing warmed-up strategies and a pool of worker
+    processes between them. Use it as a context manager so that the pool is shut down:
+
+        with runner.BatchRunner(num_workers=4) as batch_runner:
+            for experiment in runner.load_manifest(filename):
+                master_portfolio = batch_runner.run_experiment(experiment)
+
+    Attributes:
+    - num_workers: the number of worker processes. With one worker everything runs in this
+      process.
+    - overwrite: whether to start every results file afresh the first time it is written,
+      rather than appending to it, as if every experiment set "overwrite".
+    - results_files: the absolute paths of the results files written so far.
+    - warm_strategies: dictionary of the warmed-up strategies, not linked to any pair
+      portfolio, keyed by (training data, pair, strategy class name, parameters). It is only
+      filled for training data given as a filename, and is not refreshed if the file changes
+      while the runner is in use.
+    """
+    def __init__(self, num_workers: int = 1, overwrite: bool = False):
+        self.num_workers = num_workers
+        self.overwrite = overwrite
+        self.warm_strategies = {}
+        # The results files written by this runner, which are only overwritten on their first
+        # write, so that the experiments which share a file all keep their results
+        self.results_files = set()
+        self._executor = None
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+    def close(self):
+        """
+        Shut down the pool of worker processes, if one was started.
+        """
+        if self._executor is not None:
+            self._executor.shutdown()
+            self._executor = None
+
+    @property
+    def executor(self):
+        """
+        The pool of worker processes, which is started the first time it is needed, or None
+        with one worker.
+        """
+        if self._executor is None and self.num_workers > 1:
+            # Imported here, so that runs with one worker do not import concurrent.futures
+            # pylint: disable-next=import-outside-toplevel
+            from concurrent.futures import ProcessPoolExecutor
+            # The workers also render figures, which needs a non-interactive backend
+            self._executor = ProcessPoolExecutor(max_workers=self.num_workers,
+                                                 initializer=plotting.init_worker)
+        return self._executor
+
+    def make_master_portfolio(self, experiment: dict):
+        """
+        Make the master portfolio of an experiment, with a pair or basket portfolio for each
+        strategy and entry of its pairs, starting each strategy from a copy of a warmed-up
+        strategy where possible. Every portfolio pays the trading fee of the experiment.
+        """
+        master_portfolio = portfolio.MasterPortfolio(experiment['position_limit'],
+                                                     experiment['training_data'],
+                                                     experiment['testing_data'],
+                                                     trading_fee=experiment['trading_fee'],
+                                                     name=experiment['name'])
+        for strategy_class, strategy_kwargs in experiment['strategies']:
+            for pair in experiment['pairs']:
+                key = None
+                if isinstance(experiment['training_data'], str):
+                    key = (experiment['training_data'], pair,
+                           strategy_class.__name__, json.dumps(strategy_kwargs, sort_keys=True))
+                warm_strategy = self.warm_strategies.get(key)
+                portfolio_kwargs = {
+                    'cash': experiment['cash'], 'strategy_kwargs': strategy_kwargs,
+                    'strategy': copy.deepcopy(warm_strategy) if warm_strategy is not None
+                                else None}
+                if isinstance(pair, Basket):
+                    pair_portfolio = portfolio.BasketPortfolio(
+                        pair.stocks, pair.weights, strategy_class, master_portfolio,
+                        **portfolio_kwargs)
+                else:
+                    pair_portfolio = portfolio.PairPortfolio(pair, strategy_class,
+                                                             master_portfolio, **portfolio_kwargs)
+                pair_portfolio.trading_fee = experiment['trading_fee']
+                if key is not None and warm_strategy is None:
+                    # Copy the strategy before it trades, leaving out its pair portfolio
+                    self.warm_strategies[key] = copy.deepcopy(
+                        pair_portfolio.strategy, {id(pair_portfolio): None})
+                if isinstance(pair, Basket):
+                    master_portfolio.add_basket_portfolio(pair_portfolio)
+                else:
+                    master_portfolio.add_pair_portfolio(pair_portfolio)
+        return master_portfolio
+
+    def run_experiment(self, experiment: dict):
+        """
+        Simulate one experiment of a parsed manifest (see parse_manifest), write its outputs
+        and return its master portfolio.
+        """
+        master_portfolio = self.make_master_portfolio(experiment)
+        if experiment['engine'] == 'trading' and self.executor is not None:
+            trading.simulate_trading_parallel(master_portfolio, executor=self.executor)
+        elif experiment['engine'] == 'events':
+            # The outputs are calculated from the daily values, so reconstruct them
+            events.simulate_trading(master_portfolio, reconstruct=True)
+        else:
+            ENGINES[experiment['engine']].simulate_trading(master_portfolio)
+        self.write_outputs(master_portfolio, experiment)
+        return master_portfolio
+
+    def write_outputs(self, master_portfolio, experiment: dict):
+        """
+        Write the outputs of a simulated experiment to plots/<experiment name>.
+        """
+        quality = experiment['plot_quality']
+        outputs = experiment['outputs']
+        if 'metrics' in outputs:
+            metrics.calc_metrics(master_portfolio.traded_portfolios).to_csv(
+                os.path.join(plotting.get_plots_dir(master_portfolio), METRICS_FILENAME),
+                index=False)
+        if 'results' in outputs:
+            results_file = experiment['results_file']
+            if results_file is None:
+                results_file = os.path.join(plotting.get_plots_dir(master_portfolio),
+                                            RESULTS_FILENAME)
+            results_file = os.path.abspath(results_file)
+            overwrite = self.overwrite or experiment['overwrite']
+            if overwrite and results_file not in self.results_files \
+                    and os.path.exists(results_file):
+                os.remove(results_file)
+            self.results_files.add(results_file)
+            results_store.write_results(results_file, master_portfolio, experiment['name'])
+        if 'make_csv_strategy_d_and_b' in outputs:
+            plotting.make_csv_strategy_d_and_b(master_portfolio, quality=quality,
+                                               executor=self.executor)
+        if 'make_csv_position_strategy_b_d' in outputs:
+            plotting.make_csv_position_strategy_b_d(master_portfolio)
+        plot_functions = [FIGURE_OUTPUTS[output] for output in outputs
+                          if output in FIGURE_OUTPUTS]
+        if plot_functions:
+            plotting.plot_all(master_portfolio, plot_functions, quality=quality, num_workers=1,
+                              executor=self.executor)
+
+def run_manifest(experiments, num_workers: int = 1, overwrite: bool = False):
+    """
+    Run every experiment of a parsed manifest (see load_manifest) in one BatchRunner, which
+    starts the results files afresh rather than appending to them if overwrite is True.
+
+    Returns:
+    - A DataFrame of the metrics of every pair portfolio (see metrics.calc_metrics), with the
+      name of its experiment in an 'experiment' column.
+    """
+    experiment_metrics = []
+    with BatchRunner(num_workers=num_workers, overwrite=overwrite) as batch_runner:
+        for experiment in experiments:
+            master_portfolio = batch_runner.run_experiment(experiment)
+            metrics_df = metrics.calc_metrics(master_portfolio.traded_portfolios)
+            metrics_df.insert(0, 'experiment', experiment['name'])
+            experiment_metrics.append(metrics_df)
+    return pd.concat(experiment_metrics, ignore_index=True)
+
+def _check_experiment(experiment: dict):
+    """
+    Return a description of what is wrong with an experiment, or None if it is valid.
+    """
+    unknown_keys = set(experiment) - set(EXPERIMENT_DEFAULTS)
+    if unknown_keys:
+        return f"unknown keys {sorted(unknown_keys)}"
+    missing_keys = [key for key in REQUIRED_KEYS if experiment[key] is None]
+    if missing_keys:
+        return f"missing keys {missing_keys}"
+    if not experiment['pairs'] or not isinstance(experiment['pairs'], (list, tuple)):
+        return "pairs must be a non-empty list"
+    for pair in experiment['pairs']:
+        error = _check_pair(pair)
+        if error is not None:
+            return error
+    if not experiment['strategies']:
+        return "strategies must be a non-empty list"
+    has_baskets = any(isinstance(pair, dict) for pair in experiment['pairs'])
+    has_pairs = any(not isinstance(pair, dict) for pair in experiment['pairs'])
+    for strategy in experiment['strategies']:
+        strategy_name = strategy if isinstance(strategy, str) else strategy.get('class')
+        if strategy_name not in STRATEGY_CLASSES:
+            return f"unknown strategy {strategy_name!r}, expected one of " \
+                   f"{sorted(STRATEGY_CLASSES)}"
+        if not isinstance(strategy, str) and set(strategy) - {'class', 'params'}:
+            return f"strategy {strategy_name} may only have the keys 'class' and 'params'"
+        if has_baskets and strategy_name not in BASKET_STRATEGY_CLASSES:
+            return f"strategy {strategy_name} cannot trade baskets, only " \
+                   f"{sorted(BASKET_STRATEGY_CLASSES)} can"
+        if has_pairs and strategy_name in BASKET_STRATEGY_CLASSES:
+            return f"strategy {strategy_name} can only trade baskets"
+    if experiment['engine'] not in ENGINES:
+        return f"unknown engine {experiment['engine']!r}, expected one of {sorted(ENGINES)}"
+    unknown_outputs = [output for output in experiment['outputs'] if output not in OUTPUTS]
+    if unknown_outputs:
+        return f"unknown outputs {unknown_outputs}, expected some of {OUTPUTS}"
+    if has_baskets and set(experiment['outputs']) - set(BASKET_OUTPUTS):
+        return f"an experiment of baskets can only have the outputs {BASKET_OUTPUTS}"
+    if experiment['plot_quality'] not in plotting.QUALITIES:
+        return f"plot_quality must be one of {plotting.QUALITIES}"
+    if not isinstance(experiment['overwrite'], bool):
+        return "overwrite must be true or false"
+    return None
+
+def _check_pair(pair):
+    """
+    Return a description of what is wrong with an entry of the pairs of an experiment, or
+    None if it is valid.
+    """
+    if isinstance(pair, dict):
+        if set(pair) != {'stocks', 'weights'}:
+            return "a basket must have the keys 'stocks' and 'weights'"
+        if not isinstance(pair['stocks'], (list, tuple)) or len(pair['stocks']) < 2 \
+                or not isinstance(pair['weights'], (list, tuple)) \
+                or len(pair['weights']) != len(pair['stocks']):
+            return "a basket must have a list of at least two stocks and a weight for each"
+        return None
+    if not isinstance(pair, (list, tuple)) or len(pair) != 2:
+        return "each entry of pairs must be [stock A label, stock B label] or a basket " \
+               "{\"stocks\": [...], \"weights\": [...]}"
+    return None
+
+def _parse_pair(pair):
+    """
+    Return an entry of the pairs of a manifest as a tuple of the stock labels of a pair, or
+    as a Basket.
+    """
+    if isinstance(pair, dict):
+        return Basket(tuple(pair['stocks']), tuple(float(weight) for weight in pair['weights']))
+    return tuple(pair)
+
+def _parse_strategy(strategy):
+    """
+    Return the (strategy class, keyword arguments) of a strategy of a manifest, which is
+    either the name of the strategy class or a dictionary with the name under 'class' and
+    the keyword arguments under 'params'.
+    """
+    if isinstance(strategy, str):
+        return STRATEGY_CLASSES[strategy], {}
+    return STRATEGY_CLASSES[strategy['class']], dict(strategy.get('params', {}))
@@ -6,10 +6,13 @@ When adding a new strategy, e.g. StrategyX make sure to use class StrategyX(Base
 to ensure you are inheriting from the abstract base class.
 
 The stategy class simply needs to calculate the position for the pair portfolio
-given the latest prices of the stock pair. The position can be one of the following strings:
-- "no position"
-- "long A short B"
-- "long B short A"
+given the latest prices of the stock pair. The position is one of the members of
+positions.Position:
+- Position.NO_POSITION
+- Position.LONG_A_SHORT_B
+- Position.LONG_B_SHORT_A
+Strategies which return the strings "no position", "long A short B" or "long B short A"
+still work, because the trading engine converts them with positions.to_position.
 
 A new strategy should follow this format:
 class StrategyX(BaseStrategy):
@@ -20,17 +23,52 @@ class StrategyX(BaseStrategy):
     def calculate_new_position(self):
         <code to calculate the new position>
         return new_position
+
+A strategy can optionally also implement calculate_new_positions(self, stock_pair_prices),
+which calculates the positions for the whole trading period at once and is used by the
+vectorized engine in vectorized.py. It returns an int8 array of the Position codes, with
+HOLD_POSITION on the days where the position is left unchanged. Strategies without this method
+are simulated one day at a time by the vectorized engine. The built-in strategies also accept
+a batch of price paths of shape (num_paths, num_days, 2), as used by montecarlo.py, and then
+return positions of shape (num_paths, num_days) and leave their stored state unchanged.
+
+A strategy can also optionally implement carry_state(self, previous_strategy), which the
+walk-forward driver in walk_forward.py calls on the strategy of each new trading window with
+the strategy of the same pair from the window before, so that state which cannot be rebuilt
+from the formation data (e.g. exponential moving averages) carries on from one window to the
+next. Strategies without this method start each window from their formation data.
+
+The training data of a pair may start before both of its stocks were listed, so the strategies
+warm up on the days on which both are (see BaseStrategy.calculate_initial_window). If there are
+fewer of those than a strategy needs, it sets warm_up_days to the number of days it is short,
+and the trading engines then ask it for its positions on that many days of the trading period,
+on which both stocks are listed, without trading. The engines never ask a strategy for a
+position on a day on which a stock of its pair is not listed.
+
+A strategy class can also optionally implement the classmethod
+calculate_batch_new_positions(cls, batch_strategies, stock_pair_prices), which the vectorized
+engine calls once with every pair portfolio using that strategy class and their prices stacked
+into an array of shape (num_pairs, num_days, 2), so that the pairs are calculated together.
 """
 
 from abc import ABC, abstractmethod
 import numpy as np
-import pandas as pd
-from pairs_trading_oaf import data
+from pairs_trading_oaf import data, rolling
+from pairs_trading_oaf.positions import Position
+
+NO_POSITION = Position.NO_POSITION
+LONG_A_SHORT_B = Position.LONG_A_SHORT_B
+LONG_B_SHORT_A = Position.LONG_B_SHORT_A
+# Code used by calculate_new_positions for the days where the position is left unchanged
+HOLD_POSITION = 2
 
 class BaseStrategy(ABC):
     """
     Abstract base class for all trading strategies.
     """
+    # The number of days on which both stocks are listed that the strategy still has to see
+    # in the trading data before it has warmed up and may trade
+    warm_up_days = 0
 
     @abstractmethod
     def calculate_new_position(self):
@@ -39,30 +77,86 @@ class BaseStrategy(ABC):
         This method needs to be implemented by all concrete strategy classes.
 
         Returns:
-        - new_position: the new position for the pair portfolio. Which can be one of the following
-        strings:
-          - "no position"
-          - "long A short B"
-          - "long B short A"
+        - new_position: the new position for the pair portfolio, a positions.Position.
         """
 
-    def calculate_initial_window(self, window_size: int):
+    def calculate_initial_window(self, window_size: int, stock_labels=None):
         """
         Calculate the initial window for the pair portfolio using the training data.
 
+        The window holds the last window_size days of the training data on which every stock
+        is listed (see data.get_availability), so the warm-up of a stock which was listed late
+        starts from its first valid date. If the training data has fewer of those days the
+        window is shorter.
+
         Inputs:
-        - master_portfolio: the master portfolio
-        - stock_pair_labels: the labels of the stock pair
+        - window_size: the number of days in the window.
+        - stock_labels: the labels of the stocks. Defaults to the stock pair labels of the
+          pair portfolio.
 
         Outputs:
         - window_data: a pandas DataFrame containing the stock A and stock B prices as columns
         and the dates as the index.
         """
-        df_train = data.read_csv(self.pair_portfolio.training_data_str) # pylint: disable=no-member
-        df_train = df_train.tail(window_size)
-        window_prices = df_train[list(self.pair_portfolio.stock_pair_labels)] # pylint: disable=no-member
+        training_data_source = self.pair_portfolio.training_data_source # pylint: disable=no-member
+        if stock_labels is None:
+            stock_labels = self.pair_portfolio.stock_pair_labels # pylint: disable=no-member
+        stock_labels = list(stock_labels)
+        df_train = data.get_data(training_data_source)
+        available = data.get_availability(training_data_source)[stock_labels].to_numpy()
+        listed_days = np.flatnonzero(available.all(axis=1))
+        window_days = listed_days[max(len(listed_days) - window_size, 0):]
+
+        return df_train[stock_labels].iloc[window_days]
+
+    def calculate_initial_ratio_window(self, window_size: int):
+        """
+        Calculate the rolling window of stock A / stock B price ratios for the pair portfolio
+        using the initial window from the training data.
 
-        return window_prices
+        Outputs:
+        - window_ratios: a rolling.RollingStatistics object containing the price ratios of
+        the initial window.
+        """
+        window_prices = self.calculate_initial_window(window_size)
+        stock_pair_labels = self.pair_portfolio.stock_pair_labels # pylint: disable=no-member
+        window_ratios = window_prices[stock_pair_labels[0]].to_numpy(dtype=float) \
+                      / window_prices[stock_pair_labels[1]].to_numpy(dtype=float)
+        return self.make_warm_up_window(window_ratios, window_size)
+
+    def make_warm_up_window(self, initial_values, window_size: int):
+        """
+        Make a rolling.RollingStatistics window of window_size values from initial_values,
+        which may be fewer. The missing values are NaNs at the start of the window, which the
+        statistics skip, and warm_up_days is raised so that the strategy fills the window
+        from the trading data before it trades.
+        """
+        num_missing = window_size - len(initial_values)
+        self.warm_up_days = max(self.warm_up_days, num_missing)
+        return rolling.RollingStatistics(np.concatenate([np.full(num_missing, np.nan),
+                                                         initial_values]))
+
+    @staticmethod
+    def calculate_ratios(stock_pair_prices):
+        """
+        Calculate the stock A / stock B price ratios from an array of shape (num_days, 2)
+        containing the stock A and stock B prices for each day, or from a batch of such arrays
+        of shape (num_paths, num_days, 2).
+        """
+        stock_pair_prices = np.asarray(stock_pair_prices, dtype=float)
+        with np.errstate(divide='ignore', invalid='ignore'):
+            return stock_pair_prices[..., 0] / stock_pair_prices[..., 1]
+
+    @staticmethod
+    def prepend_values(initial_values, values):
+        """
+        Prepend initial_values, e.g. the ratios of a window from the training data, to values
+        along the last axis, repeating them for each path when values is a batch of paths.
+        """
+        initial_values = np.asarray(initial_values, dtype=float)
+        initial_values = np.broadcast_to(initial_values,
+                                         values.shape[:-1] + initial_values.shape[-1:])
+        return np.concatenate([initial_values, values], axis=-1)
 
 class StrategyA(BaseStrategy):
     """
@@ -78,39 +172,52 @@ class StrategyA(BaseStrategy):
         self.pair_portfolio = pair_portfolio
         self.window_size = window_size
         self.z_threshold = z_threshold
-        self.window_prices = self.calculate_initial_window(self.window_size)
+        self.window_ratios = self.calculate_initial_ratio_window(self.window_size)
 
     def calculate_new_position(self):
         """
         Calculate the new position for the pair portfolio.
 
         Takes the latest prices of the stock pair and calculates the new position based on the
-        z-score of the ratio of the stock prices. The new position can be one of the following
-        strings:
-        - "no position"
-        - "long A short B"
-        - "long B short A"
+        z-score of the ratio of the stock prices.
         """
         new_prices = self.pair_portfolio.stock_pair_prices
-        current_date = self.pair_portfolio.date
-        stock_pair_labels = self.pair_portfolio.stock_pair_labels
-        new_data = pd.DataFrame([new_prices],
-                                columns=stock_pair_labels,
-                                index=[current_date])
-        self.window_prices = pd.concat([self.window_prices, new_data])
-        self.window_prices = self.window_prices.iloc[1:]
-        ratio = self.window_prices[stock_pair_labels[0]] / self.window_prices[stock_pair_labels[1]]
-        mean = ratio.mean()
-        std = max([ratio.std(), 1e-8])
-        z_score = (ratio.iloc[-1] - mean) / std
+        ratio = new_prices[0] / new_prices[1]
+        self.window_ratios.push(ratio)
+        mean = self.window_ratios.mean()
+        std = max([self.window_ratios.std(), 1e-8])
+        z_score = (ratio - mean) / std
 
         if z_score < -self.z_threshold:
-            return 'long A short B'
+            return LONG_A_SHORT_B
         elif z_score > self.z_threshold:
-            return 'long B short A'
+            return LONG_B_SHORT_A
         else:
             return self.pair_portfolio.position
 
+    def calculate_new_positions(self, stock_pair_prices):
+        """
+        Calculate the new positions for the whole trading period at once.
+
+        Gives the same positions as calling calculate_new_position once per day. Returns an
+        int8 array of position codes, with HOLD_POSITION on the days where
+        calculate_new_position would return the current position.
+        """
+        window_length = self.window_ratios.window_size
+        ratios = self.prepend_values(self.window_ratios.values(),
+                                     self.calculate_ratios(stock_pair_prices))
+        mean, std = rolling.rolling_mean_std(ratios[..., 1:], window_length)
+        # Same as max([std, 1e-8]), which keeps a NaN standard deviation
+        std = np.where(1e-8 > std, 1e-8, std)
+        z_score = (ratios[..., window_length:] - mean) / std
+        if ratios.ndim == 1:
+            self.window_ratios.reset(ratios[-window_length:])
+
+        new_positions = np.full(z_score.shape, HOLD_POSITION, dtype=np.int8)
+        new_positions[z_score < -self.z_threshold] = LONG_A_SHORT_B
+        new_positions[z_score > self.z_threshold] = LONG_B_SHORT_A
+        return new_positions
+
 class StrategyB(BaseStrategy):
     """
     Moving Average Convergence Divergence (MACD) strategy.
@@ -182,44 +289,71 @@ class StrategyB(BaseStrategy):
     def calc_initial_macd_signal(self, training_period):
         """
         Calculate the initial MACD and signal values using the training data.
+
+        If none of the training data has both prices the values are left as None, and the
+        averages start from the first ratio of the trading data instead.
         """
-        df_train = data.read_csv(self.pair_portfolio.training_data_str)
-        df_train = df_train.tail(training_period)
+        df_train = self.calculate_initial_window(training_period)
         ratios = df_train[self.pair_portfolio.stock_pair_labels[0]] \
                / df_train[self.pair_portfolio.stock_pair_labels[1]]
+        self.warm_up_days = max(self.warm_up_days, training_period - len(ratios))
         for i, ratio in enumerate(ratios):
             if i == 0:
-                self.macd.fast_ewma = ratio
-                self.macd.slow_ewma = ratio
-                self.macd.macd = 0
-                self.macd.signal = 0
+                self.start_macd_signal(ratio)
             else:
                 new_macd, new_signal = self.calc_macd_signal(ratio)
                 self.macd.macd = new_macd
                 self.macd.signal = new_signal
 
+    def start_macd_signal(self, ratio):
+        """
+        Start the exponential moving averages from ratio, with MACD and signal values of 0.
+        """
+        self.macd.fast_ewma = ratio
+        self.macd.slow_ewma = ratio
+        self.macd.macd = 0
+        self.macd.signal = 0
+
+    def carry_state(self, previous_strategy):
+        """
+        Carry on the MACD and signal values from the strategy of the previous trading window,
+        rather than starting them again from the tail of the formation data, so that the
+        values are the same as if both windows were traded in one run.
+        """
+        if (previous_strategy.macd.fast_period, previous_strategy.macd.slow_period,
+                previous_strategy.macd.signal_period) != \
+                (self.macd.fast_period, self.macd.slow_period, self.macd.signal_period):
+            return
+        self.macd.fast_ewma = previous_strategy.macd.fast_ewma
+        self.macd.slow_ewma = previous_strategy.macd.slow_ewma
+        self.macd.macd = previous_strategy.macd.macd
+        self.macd.signal = previous_strategy.macd.signal
+        self.warm_up_days = previous_strategy.warm_up_days
+
     def calculate_new_position(self):
         """
         Calculate the new position for the pair portfolio.
 
         Takes the latest prices of the stock pair and calculates the new position based on the
-        MACD and signal line. The new position can be one of the following strings:
-        - "no position"
-        - "long A short B"
-        - "long B short A"
+        MACD and signal line.
         """
         new_prices = self.pair_portfolio.stock_pair_prices
         ratio = new_prices[0] / new_prices[1]
+        if self.macd.fast_ewma is None:
+            # There was no training data to start the averages from
+            self.start_macd_signal(ratio)
+            self.record_macd_signal()
+            return self.pair_portfolio.position
         new_macd, new_signal = self.calc_macd_signal(ratio)
         old_macd = self.macd.macd
         old_signal = self.macd.signal
 
         if new_macd > new_signal and old_macd < old_signal:
             # MACD crossed above signal line so long stock A and short stock B
-            position = 'long A short B'
+            position = LONG_A_SHORT_B
         elif new_macd < new_signal and old_macd > old_signal:
             # MACD crossed below signal line so long stock B and short stock A
-            position = 'long B short A'
+            position = LONG_B_SHORT_A
         else:
             # Don't change the position if the MACD and signal line do not cross
             position = self.pair_portfolio.position
@@ -227,13 +361,89 @@ class StrategyB(BaseStrategy):
         # Update the stored MACD and signal values ready for the next day
         self.macd.macd = new_macd
         self.macd.signal = new_signal
+        self.record_macd_signal()
 
+        return position
+
+    def record_macd_signal(self):
+        """
+        Append the stored averages, MACD and signal values to over_time_vals.
+        """
         self.over_time_vals.fast_ewma.append(self.macd.fast_ewma)
         self.over_time_vals.slow_ewma.append(self.macd.slow_ewma)
         self.over_time_vals.macd.append(self.macd.macd)
         self.over_time_vals.signal.append(self.macd.signal)
 
-        return position
+    def calculate_new_positions(self, stock_pair_prices):
+        """
+        Calculate the new positions for the whole trading period at once.
+
+        Gives the same positions as calling calculate_new_position once per day, and leaves
+        the stored MACD values and over_time_vals as the daily calls would. Returns an int8
+        array of position codes, with HOLD_POSITION on the days where the MACD and signal
+        line do not cross.
+        """
+        ratios = self.calculate_ratios(stock_pair_prices)
+        if self.macd.fast_ewma is not None:
+            new_positions, values = self.calculate_macd_positions(
+                ratios, [[self.macd.fast_ewma], [self.macd.slow_ewma], [self.macd.macd],
+                         [self.macd.signal]])
+        elif ratios.shape[-1] == 0:
+            return np.full(ratios.shape, HOLD_POSITION, dtype=np.int8)
+        else:
+            # There was no training data, so the first ratio starts the averages and the
+            # position is held, as in calculate_new_position
+            first_ratios = ratios[..., :1]
+            zeros = np.zeros_like(first_ratios)
+            start_values = [first_ratios, first_ratios, zeros, zeros]
+            new_positions, values = self.calculate_macd_positions(ratios[..., 1:], start_values)
+            new_positions = np.concatenate(
+                [np.full(first_ratios.shape, HOLD_POSITION, dtype=np.int8), new_positions],
+                axis=-1)
+            values = [np.concatenate([start_value, value], axis=-1)
+                      for start_value, value in zip(start_values, values)]
+        if ratios.ndim > 1:
+            return new_positions
+
+        fast_ewma, slow_ewma, macd, signal = values
+        if len(ratios) > 0:
+            self.macd.fast_ewma = fast_ewma[-1]
+            self.macd.slow_ewma = slow_ewma[-1]
+            self.macd.macd = macd[-1]
+            self.macd.signal = signal[-1]
+        self.over_time_vals.fast_ewma.extend(fast_ewma.tolist())
+        self.over_time_vals.slow_ewma.extend(slow_ewma.tolist())
+        self.over_time_vals.macd.extend(macd.tolist())
+        self.over_time_vals.signal.extend(signal.tolist())
+        return new_positions
+
+    def calculate_macd_positions(self, ratios, initial_values):
+        """
+        Calculate the positions and the averages, MACD and signal values of each day from
+        the ratios, continuing from initial_values, the [fast_ewma], [slow_ewma], [macd] and
+        [signal] values before the first day (or arrays of shape (..., 1) of them).
+
+        Returns:
+        - new_positions: the position codes, as in calculate_new_positions.
+        - values: the list of the fast_ewma, slow_ewma, macd and signal arrays.
+        """
+        fast_ewma, slow_ewma, initial_macd, initial_signal = initial_values
+        alpha_fast = 2 / (self.macd.fast_period + 1)
+        alpha_slow = 2 / (self.macd.slow_period + 1)
+        alpha_signal = 2 / (self.macd.signal_period + 1)
+        # Prepend the stored values so that the averages continue from the training data
+        fast_ewma = rolling.ewma(self.prepend_values(fast_ewma, ratios), alpha_fast)[..., 1:]
+        slow_ewma = rolling.ewma(self.prepend_values(slow_ewma, ratios), alpha_slow)[..., 1:]
+        macd = fast_ewma - slow_ewma
+        signal = rolling.ewma(self.prepend_values(initial_signal, macd), alpha_signal)
+        old_macd = self.prepend_values(initial_macd, macd[..., :-1])
+        old_signal = signal[..., :-1]
+        signal = signal[..., 1:]
+
+        new_positions = np.full(ratios.shape, HOLD_POSITION, dtype=np.int8)
+        new_positions[(macd > signal) & (old_macd < old_signal)] = LONG_A_SHORT_B
+        new_positions[(macd < signal) & (old_macd > old_signal)] = LONG_B_SHORT_A
+        return new_positions, [fast_ewma, slow_ewma, macd, signal]
 
 class StrategyC(BaseStrategy):
     """
@@ -249,7 +459,7 @@ class StrategyC(BaseStrategy):
         self.pair_portfolio = pair_portfolio
         self.window_size = window_size
         self.num_std = num_std
-        self.window_prices = self.calculate_initial_window(self.window_size)
+        self.window_ratios = self.calculate_initial_ratio_window(self.window_size)
         self.upper_band_over_time = []
         self.lower_band_over_time = []
 
@@ -258,33 +468,51 @@ class StrategyC(BaseStrategy):
         Calculate the new position for the pair portfolio.
 
         Takes the latest prices of the stock pair and calculates the new position based on the
-        Bollinger Bands. The new position can be one of the following strings:
-        - "no position"
-        - "long A short B"
-        - "long B short A"
+        Bollinger Bands.
         """
         new_prices = self.pair_portfolio.stock_pair_prices
-        current_date = self.pair_portfolio.date
-        stock_pair_labels = self.pair_portfolio.stock_pair_labels
-        new_data = pd.DataFrame([new_prices],
-                                columns=stock_pair_labels,
-                                index=[current_date])
-        self.window_prices = pd.concat([self.window_prices, new_data])
-        self.window_prices = self.window_prices.iloc[1:]
-        ratio = self.window_prices[stock_pair_labels[0]] / self.window_prices[stock_pair_labels[1]]
-        mean = ratio.mean()
-        std = max([ratio.std(), 1e-8])
+        ratio = new_prices[0] / new_prices[1]
+        self.window_ratios.push(ratio)
+        mean = self.window_ratios.mean()
+        std = max([self.window_ratios.std(), 1e-8])
         upper_band = mean + self.num_std * std
         lower_band = mean - self.num_std * std
         self.upper_band_over_time.append(upper_band)
         self.lower_band_over_time.append(lower_band)
-        if ratio.iloc[-1] > upper_band:
-            return 'long B short A'
-        elif ratio.iloc[-1] < lower_band:
-            return 'long A short B'
+        if ratio > upper_band:
+            return LONG_B_SHORT_A
+        elif ratio < lower_band:
+            return LONG_A_SHORT_B
         else:
             return self.pair_portfolio.position
 
+    def calculate_new_positions(self, stock_pair_prices):
+        """
+        Calculate the new positions for the whole trading period at once.
+
+        Gives the same positions and Bollinger Bands as calling calculate_new_position once
+        per day. Returns an int8 array of position codes, with HOLD_POSITION on the days where
+        the ratio is inside the bands.
+        """
+        window_length = self.window_ratios.window_size
+        ratios = self.prepend_values(self.window_ratios.values(),
+                                     self.calculate_ratios(stock_pair_prices))
+        mean, std = rolling.rolling_mean_std(ratios[..., 1:], window_length)
+        # Same as max([std, 1e-8]), which keeps a NaN standard deviation
+        std = np.where(1e-8 > std, 1e-8, std)
+        upper_band = mean + self.num_std * std
+        lower_band = mean - self.num_std * std
+        if ratios.ndim == 1:
+            self.window_ratios.reset(ratios[-window_length:])
+            self.upper_band_over_time.extend(upper_band.tolist())
+            self.lower_band_over_time.extend(lower_band.tolist())
+        ratios = ratios[..., window_length:]
+
+        new_positions = np.full(ratios.shape, HOLD_POSITION, dtype=np.int8)
+        new_positions[ratios > upper_band] = LONG_B_SHORT_A
+        new_positions[ratios < lower_band] = LONG_A_SHORT_B
+        return new_positions
+
 class StrategyD(BaseStrategy):
     """
     This strategy is meant to be as close to Golden's as possible.
@@ -306,8 +534,8 @@ class StrategyD(BaseStrategy):
         self.open_threshold = open_threshold
         self.stop_threshold = stop_threshold
         self.close_threshold = close_threshold
-        self.tight_window_prices = self.calculate_initial_window(self.tight_window_size)
-        self.wider_window_prices = self.calculate_initial_window(self.wider_window_size)
+        self.tight_window_ratios = self.calculate_initial_ratio_window(self.tight_window_size)
+        self.wider_window_ratios = self.calculate_initial_ratio_window(self.wider_window_size)
 
     def calculate_new_position(self):
         """
@@ -318,37 +546,385 @@ class StrategyD(BaseStrategy):
         |z| > 2: Close (stop loss)
         """
         new_prices = self.pair_portfolio.stock_pair_prices
-        current_date = self.pair_portfolio.date
-        stock_pair_labels = self.pair_portfolio.stock_pair_labels
-        new_data = pd.DataFrame([new_prices],
-                                columns=stock_pair_labels,
-                                index=[current_date])
-        self.tight_window_prices = pd.concat([self.tight_window_prices, new_data])
-        self.tight_window_prices = self.tight_window_prices.iloc[1:]
-        self.wider_window_prices = pd.concat([self.wider_window_prices, new_data])
-        self.wider_window_prices = self.wider_window_prices.iloc[1:]
-        tight_ratio = self.tight_window_prices[stock_pair_labels[0]] \
-                    / self.tight_window_prices[stock_pair_labels[1]]
-        wider_ratio = self.wider_window_prices[stock_pair_labels[0]] \
-                    / self.wider_window_prices[stock_pair_labels[1]]
-        tight_ratio_mean = tight_ratio.mean()
-        wider_ratio_mean = wider_ratio.mean()
-        wider_ratio_std = wider_ratio.std()
-        z_score = (tight_ratio_mean - wider_ratio_mean) / wider_ratio_std
+        ratio = new_prices[0] / new_prices[1]
+        self.tight_window_ratios.push(ratio)
+        self.wider_window_ratios.push(ratio)
+        tight_ratio_mean = self.tight_window_ratios.mean()
+        wider_ratio_mean = self.wider_window_ratios.mean()
+        wider_ratio_std = self.wider_window_ratios.std()
+        with np.errstate(divide='ignore', invalid='ignore'):
+            z_score = np.float64(tight_ratio_mean - wider_ratio_mean) / wider_ratio_std
 
         if np.abs(z_score) <= self.close_threshold:
             # |z| ≤ 1 (Close position, profit)
-            return 'no position'
+            return NO_POSITION
         elif np.abs(z_score) > self.stop_threshold:
             # |z| > 2 (Close position, stop loss)
-            return 'no position'
+            return NO_POSITION
         elif np.abs(z_score) <= self.open_threshold:
             #1 < |z| ≤ 1.5 (Don't change position)
             return self.pair_portfolio.position
         else:
             # 1.5 < |z| ≤ 2 (Open position)
             if z_score > 0:
-                return 'long B short A'
+                return LONG_B_SHORT_A
             else:
-                return 'long A short B'
+                return LONG_A_SHORT_B
+
+    def calculate_new_positions(self, stock_pair_prices):
+        """
+        Calculate the new positions for the whole trading period at once.
+
+        Gives the same positions as calling calculate_new_position once per day. Returns an
+        int8 array of position codes, with HOLD_POSITION on the days where 1 < |z| ≤ 1.5.
+        """
+        tight_window_length = self.tight_window_ratios.window_size
+        wider_window_length = self.wider_window_ratios.window_size
+        ratios = self.calculate_ratios(stock_pair_prices)
+        tight_ratios = self.prepend_values(self.tight_window_ratios.values(), ratios)
+        wider_ratios = self.prepend_values(self.wider_window_ratios.values(), ratios)
+        tight_ratio_mean, _ = rolling.rolling_mean_std(tight_ratios[..., 1:], tight_window_length)
+        wider_ratio_mean, wider_ratio_std = rolling.rolling_mean_std(wider_ratios[..., 1:],
+                                                                     wider_window_length)
+        if ratios.ndim == 1:
+            self.tight_window_ratios.reset(tight_ratios[-tight_window_length:])
+            self.wider_window_ratios.reset(wider_ratios[-wider_window_length:])
+        with np.errstate(divide='ignore', invalid='ignore'):
+            z_score = (tight_ratio_mean - wider_ratio_mean) / wider_ratio_std
+
+        # A NaN z-score fails every comparison and so opens LONG_A_SHORT_B,
+        # exactly as in calculate_new_position
+        new_positions = np.where(z_score > 0, LONG_B_SHORT_A, LONG_A_SHORT_B).astype(np.int8)
+        new_positions[np.abs(z_score) <= self.open_threshold] = HOLD_POSITION
+        new_positions[np.abs(z_score) > self.stop_threshold] = NO_POSITION
+        new_positions[np.abs(z_score) <= self.close_threshold] = NO_POSITION
+        return new_positions
+
+
+def kalman_filter(stock_pair_prices, state, state_covariance, observation_variance,
+                  transition_covariance):
+    """
+    Run the Kalman filter of StrategyE over the days of one or more stock pairs at once.
+
+    The observation on each day is the stock A price, modelled as
+    hedge_ratio * stock B price + intercept plus noise of variance observation_variance, and
+    the state [hedge_ratio, intercept] follows a random walk whose steps have covariance
+    transition_covariance. Days where either price is NaN only widen the state covariance.
+
+    Inputs:
+    - stock_pair_prices: array of shape (..., num_days, 2) containing the stock A and stock B
+      prices, where the leading axes stack the pairs or price paths which are filtered together.
+    - state: array of shape (..., 2) containing the [hedge_ratio, intercept] before the first day.
+    - state_covariance: array of shape (..., 2, 2) containing the covariance of the state.
+    - observation_variance: array of shape (...).
+    - transition_covariance: array of shape (..., 2, 2).
+
+    Returns:
+    - z_scores: array of shape (..., num_days) containing the spread (the stock A price minus
+      its prediction from the stock B price) divided by its predicted standard deviation.
+    - states: array of shape (..., num_days, 2) containing the state after each day.
+    - state_covariance: the covariance of the state after the last day.
+
+    The stacked 2x2 matrices are updated element by element, in the same order as the
+    arithmetic in StrategyE.update_state, so that both give exactly the same floats.
+    """
+    stock_pair_prices = np.asarray(stock_pair_prices, dtype=float)
+    state = np.asarray(state, dtype=float)
+    state_covariance = np.asarray(state_covariance, dtype=float)
+    observation_variance = np.asarray(observation_variance, dtype=float)
+    transition_covariance = np.asarray(transition_covariance, dtype=float)
+    batch_shape = stock_pair_prices.shape[:-2]
+    num_days = stock_pair_prices.shape[-2]
+    hedge_ratio = np.broadcast_to(state[..., 0], batch_shape).copy()
+    intercept = np.broadcast_to(state[..., 1], batch_shape).copy()
+    p00 = np.broadcast_to(state_covariance[..., 0, 0], batch_shape).copy()
+    p01 = np.broadcast_to(state_covariance[..., 0, 1], batch_shape).copy()
+    p11 = np.broadcast_to(state_covariance[..., 1, 1], batch_shape).copy()
+    q00 = transition_covariance[..., 0, 0]
+    q01 = transition_covariance[..., 0, 1]
+    q11 = transition_covariance[..., 1, 1]
+
+    z_scores = np.empty(batch_shape + (num_days,))
+    states = np.empty(batch_shape + (num_days, 2))
+    with np.errstate(divide='ignore', invalid='ignore'):
+        for day in range(num_days):
+            price_a = stock_pair_prices[..., day, 0]
+            price_b = stock_pair_prices[..., day, 1]
+            p00 = p00 + q00
+            p01 = p01 + q01
+            p11 = p11 + q11
+            ph0 = p00 * price_b + p01
+            ph1 = p01 * price_b + p11
+            spread_variance = price_b * ph0 + ph1 + observation_variance
+            spread = price_a - (hedge_ratio * price_b + intercept)
+            gain0 = ph0 / spread_variance
+            gain1 = ph1 / spread_variance
+            valid = ~(np.isnan(price_a) | np.isnan(price_b))
+            hedge_ratio = np.where(valid, hedge_ratio + gain0 * spread, hedge_ratio)
+            intercept = np.where(valid, intercept + gain1 * spread, intercept)
+            p00 = np.where(valid, p00 - gain0 * ph0, p00)
+            p01 = np.where(valid, p01 - gain0 * ph1, p01)
+            p11 = np.where(valid, p11 - gain1 * ph1, p11)
+            z_scores[..., day] = spread / np.sqrt(spread_variance)
+            states[..., day, 0] = hedge_ratio
+            states[..., day, 1] = intercept
+
+    state_covariance = np.stack([np.stack([p00, p01], axis=-1),
+                                 np.stack([p01, p11], axis=-1)], axis=-2)
+    return z_scores, states, state_covariance
+
+class StrategyE(BaseStrategy):
+    """
+    Kalman filter mean reversion strategy with a time-varying hedge ratio.
+
+    Rather than trading the ratio of the prices, the stock A price is regressed on the stock B
+    price, stock A = hedge_ratio * stock B + intercept, and the hedge ratio and intercept are
+    tracked from day to day with a Kalman filter (see kalman_filter). The initial hedge ratio,
+    intercept, their covariance and the observation noise are estimated by least squares on
+    the last training_period days of the formation data, and delta sets how quickly the hedge
+    ratio and intercept can drift, as a fraction of the formation estimate's uncertainty per
+    day.
+
+    The z-score is the latest spread, stock A minus its prediction, divided by its predicted
+    standard deviation.
+    z < -entry_threshold: long stock A and short stock B
+    z > entry_threshold: long stock B and short stock A
+    |z| <= exit_threshold: close the position
+    Otherwise the position is unchanged.
+
+    The positions are opened with the same dollar amounts of each stock as the other
+    strategies; the hedge ratio is only used to calculate the spread.
+    """
+    def __init__(self, pair_portfolio,
+                 training_period: int = 60,
+                 delta: float = 1e-3,
+                 entry_threshold: float = 1.0,
+                 exit_threshold: float = 0.5):
+        self.pair_portfolio = pair_portfolio
+        self.training_period = training_period
+        self.delta = delta
+        self.entry_threshold = entry_threshold
+        self.exit_threshold = exit_threshold
+        self.state = [np.nan, np.nan]
+        self.state_covariance = [[np.nan, np.nan], [np.nan, np.nan]]
+        self.observation_variance = np.nan
+        self.transition_covariance = [[np.nan, np.nan], [np.nan, np.nan]]
+        self.hedge_ratio_over_time = []
+        self.intercept_over_time = []
+        self.z_score_over_time = []
+        self.calc_initial_state(training_period)
+
+    def calc_initial_state(self, training_period):
+        """
+        Estimate the initial state, its covariance, the observation variance and the
+        transition covariance by least squares on the tail of the training data.
 
+        The window only holds days on which both stocks are listed (see
+        calculate_initial_window). If there are fewer than three of them the estimates are
+        left as NaN, so every z-score is NaN and the position is never changed.
+        """
+        window_prices = self.calculate_initial_window(training_period).to_numpy(dtype=float)
+        num_days = len(window_prices)
+        if num_days < 3:
+            return
+        regressors = np.column_stack([window_prices[:, 1], np.ones(num_days)])
+        moment_matrix = regressors.T @ regressors
+        if np.linalg.matrix_rank(moment_matrix) < 2:
+            return
+        state = np.linalg.solve(moment_matrix, regressors.T @ window_prices[:, 0])
+        residuals = window_prices[:, 0] - regressors @ state
+        observation_variance = residuals @ residuals / (num_days - 2)
+        state_covariance = observation_variance * np.linalg.inv(moment_matrix)
+        # The state may drift by a delta / (1 - delta) fraction of the uncertainty of a
+        # single day's observation each day
+        transition_covariance = self.delta / (1 - self.delta) * num_days * state_covariance
+        self.state = state.tolist()
+        self.state_covariance = state_covariance.tolist()
+        self.observation_variance = float(observation_variance)
+        self.transition_covariance = transition_covariance.tolist()
+
+    def carry_state(self, previous_strategy):
+        """
+        Carry on the filtered state from the strategy of the previous trading window, rather
+        than estimating it again from the tail of the formation data.
+        """
+        if previous_strategy.delta != self.delta:
+            return
+        self.state = list(previous_strategy.state)
+        self.state_covariance = [list(row) for row in previous_strategy.state_covariance]
+        self.observation_variance = previous_strategy.observation_variance
+        self.transition_covariance = [list(row)
+                                      for row in previous_strategy.transition_covariance]
+
+    def update_state(self, price_a, price_b):
+        """
+        Update the filtered state with one day's prices in constant time and return the
+        z-score of the spread. The arithmetic is on plain floats, in the same order as in
+        kalman_filter.
+        """
+        hedge_ratio, intercept = self.state
+        (p00, p01), (_, p11) = self.state_covariance
+        (q00, q01), (_, q11) = self.transition_covariance
+        p00 = p00 + q00
+        p01 = p01 + q01
+        p11 = p11 + q11
+        ph0 = p00 * price_b + p01
+        ph1 = p01 * price_b + p11
+        spread_variance = price_b * ph0 + ph1 + self.observation_variance
+        spread = price_a - (hedge_ratio * price_b + intercept)
+        with np.errstate(divide='ignore', invalid='ignore'):
+            z_score = float(np.float64(spread) / np.sqrt(spread_variance))
+        if not (np.isnan(price_a) or np.isnan(price_b)):
+            with np.errstate(divide='ignore', invalid='ignore'):
+                gain0 = float(np.float64(ph0) / spread_variance)
+                gain1 = float(np.float64(ph1) / spread_variance)
+            hedge_ratio = hedge_ratio + gain0 * spread
+            intercept = intercept + gain1 * spread
+            p00 = p00 - gain0 * ph0
+            p01 = p01 - gain0 * ph1
+            p11 = p11 - gain1 * ph1
+        self.state = [hedge_ratio, intercept]
+        self.state_covariance = [[p00, p01], [p01, p11]]
+        return z_score
+
+    def calculate_new_position(self):
+        """
+        Calculate the new position for the pair portfolio.
+
+        Takes the latest prices of the stock pair, updates the Kalman filter and calculates
+        the new position based on the z-score of the spread.
+        """
+        new_prices = self.pair_portfolio.stock_pair_prices
+        z_score = self.update_state(float(new_prices[0]), float(new_prices[1]))
+        self.hedge_ratio_over_time.append(self.state[0])
+        self.intercept_over_time.append(self.state[1])
+        self.z_score_over_time.append(z_score)
+
+        if abs(z_score) <= self.exit_threshold:
+            return NO_POSITION
+        elif z_score < -self.entry_threshold:
+            return LONG_A_SHORT_B
+        elif z_score > self.entry_threshold:
+            return LONG_B_SHORT_A
+        else:
+            return self.pair_portfolio.position
+
+    def positions_from_z_scores(self, z_scores):
+        """
+        Return the int8 position codes for an array of z-scores, with HOLD_POSITION on the
+        days where calculate_new_position would return the current position.
+        """
+        new_positions = np.full(z_scores.shape, HOLD_POSITION, dtype=np.int8)
+        new_positions[z_scores < -self.entry_threshold] = LONG_A_SHORT_B
+        new_positions[z_scores > self.entry_threshold] = LONG_B_SHORT_A
+        new_positions[np.abs(z_scores) <= self.exit_threshold] = NO_POSITION
+        return new_positions
+
+    def calculate_new_positions(self, stock_pair_prices):
+        """
+        Calculate the new positions for the whole trading period at once.
+
+        Gives the same positions, states and over time values as calling
+        calculate_new_position once per day. Returns an int8 array of position codes, with
+        HOLD_POSITION on the days where exit_threshold < |z| <= entry_threshold.
+        """
+        stock_pair_prices = np.asarray(stock_pair_prices, dtype=float)
+        z_scores, states, state_covariance = kalman_filter(
+            stock_pair_prices, self.state, self.state_covariance, self.observation_variance,
+            self.transition_covariance)
+        if stock_pair_prices.ndim == 2:
+            self.record_filtered_values(z_scores, states, state_covariance)
+        return self.positions_from_z_scores(z_scores)
+
+    @classmethod
+    def calculate_batch_new_positions(cls, batch_strategies, stock_pair_prices):
+        """
+        Calculate the new positions of several pair portfolios at once by filtering the
+        states of all of their pairs together, one day at a time.
+
+        Inputs:
+        - batch_strategies: a list of StrategyE objects, one per pair portfolio.
+        - stock_pair_prices: array of shape (num_pairs, num_days, 2) containing the stock A
+          and stock B prices of each pair.
+
+        Returns:
+        - new_positions: int8 array of shape (num_pairs, num_days), the same as calling
+          calculate_new_positions on each strategy, whose states are updated in the same way.
+        """
+        stock_pair_prices = np.asarray(stock_pair_prices, dtype=float)
+        z_scores, states, state_covariances = kalman_filter(
+            stock_pair_prices,
+            [strategy.state for strategy in batch_strategies],
+            [strategy.state_covariance for strategy in batch_strategies],
+            [strategy.observation_variance for strategy in batch_strategies],
+            [strategy.transition_covariance for strategy in batch_strategies])
+        new_positions = np.empty(z_scores.shape, dtype=np.int8)
+        for i, strategy in enumerate(batch_strategies):
+            strategy.record_filtered_values(z_scores[i], states[i], state_covariances[i])
+            new_positions[i] = strategy.positions_from_z_scores(z_scores[i])
+        return new_positions
+
+    def record_filtered_values(self, z_scores, states, state_covariance):
+        """
+        Store the state at the end of a filtered trading period and append the over time
+        values of each day.
+        """
+        if len(z_scores) > 0:
+            self.state = states[-1].tolist()
+            self.state_covariance = state_covariance.tolist()
+        self.hedge_ratio_over_time.extend(states[:, 0].tolist())
+        self.intercept_over_time.extend(states[:, 1].tolist())
+        self.z_score_over_time.extend(z_scores.tolist())
+
+class StrategyF(BaseStrategy):
+    """
+    Z-score mean reversion strategy for a basket portfolio (see portfolio.BasketPortfolio).
+
+    The spread of the basket is the dot product of its weights with the logs of the stock
+    prices, which for a pair with the weights (1, -1) is the log of the ratio of the prices.
+    As in StrategyA, the z-score of the spread is calculated using a moving average and
+    standard deviation.
+    z < -z_threshold: long the basket (Position.LONG_A_SHORT_B)
+    z > z_threshold: short the basket (Position.LONG_B_SHORT_A)
+    Otherwise the position is unchanged.
+    """
+    def __init__(self, pair_portfolio,
+                 window_size: int = 60,
+                 z_threshold: float = 1.0):
+        self.pair_portfolio = pair_portfolio
+        self.window_size = window_size
+        self.z_threshold = z_threshold
+        self.window_spreads = self.calculate_initial_spread_window(window_size)
+
+    def calculate_initial_spread_window(self, window_size: int):
+        """
+        Calculate the rolling window of basket spreads from the tail of the training data on
+        which every stock is listed.
+        """
+        window_prices = self.calculate_initial_window(window_size,
+                                                      self.pair_portfolio.stock_labels)
+        with np.errstate(divide='ignore', invalid='ignore'):
+            window_spreads = np.log(window_prices.to_numpy(dtype=float)) \
+                           @ self.pair_portfolio.weights
+        return self.make_warm_up_window(window_spreads, window_size)
+
+    def calculate_new_position(self):
+        """
+        Calculate the new position for the basket portfolio.
+
+        Takes the latest prices of the stocks and calculates the new position based on the
+        z-score of the spread of the basket.
+        """
+        with np.errstate(divide='ignore', invalid='ignore'):
+            spread = float(np.log(self.pair_portfolio.stock_prices) @ self.pair_portfolio.weights)
+        self.window_spreads.push(spread)
+        mean = self.window_spreads.mean()
+        std = max([self.window_spreads.std(), 1e-8])
+        z_score = (spread - mean) / std
+
+        if z_score < -self.z_threshold:
+            return LONG_A_SHORT_B
+        elif z_score > self.z_threshold:
+            return LONG_B_SHORT_A
+        else:
+            return self.pair_portfolio.position
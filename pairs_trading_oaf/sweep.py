@@ -0,0 +1,160 @@
+"""
+Parameter sweeps (grid searches) over the hyperparameters of the strategies.
+
+A sweep takes a parameter grid for each strategy class, e.g.
+
+    strategy_grids = {strategies.StrategyA: {'window_size': [30, 60], 'z_threshold': [1, 1.5]},
+                      strategies.StrategyC: {'num_std': [1.5, 2, 2.5]}}
+
+and a list of stock pairs, and simulates every combination of parameters on every pair with
+the vectorized engine. Parameters which are left out of a grid keep the default value of the
+strategy.
+
+Each combination of parameters is simulated as one task, which contains all of the pairs.
+The tasks run in a pool of worker processes. The training and testing data are published once
+into shared memory (see data.share_data), and every task reads them from there without copying
+them, including the training data used to warm up the windows of the strategies. The results
+are returned as a tidy pandas DataFrame with one row per combination of strategy, parameters
+and pair.
+"""
+import itertools
+import os
+import pandas as pd
+from pairs_trading_oaf import data, metrics, portfolio, vectorized
+from pairs_trading_oaf.positions import Position
+
+def expand_grid(param_grid):
+    """
+    Expand a parameter grid into a list of every combination of parameters.
+
+    Inputs:
+    - param_grid: dictionary mapping each parameter name to a list of values to try.
+
+    Returns:
+    - A list of dictionaries mapping each parameter name to a single value, in the order of
+      itertools.product. An empty grid gives a single empty dictionary, i.e. the defaults.
+    """
+    names = list(param_grid)
+    return [dict(zip(names, values))
+            for values in itertools.product(*(param_grid[name] for name in names))]
+
+def run_sweep(strategy_grids, stock_pair_labels_list, training_data_source, testing_data_source,
+              position_limit, cash=10, trading_fee=0.0, num_workers=None, executor=None):
+    """
+    Simulate trading for every combination of strategy parameters and stock pairs.
+
+    Inputs:
+    - strategy_grids: dictionary mapping each strategy class to its parameter grid
+      (see expand_grid).
+    - stock_pair_labels_list: list of the (stock A label, stock B label) pairs to trade.
+    - training_data_source, testing_data_source: the training and testing data files,
+      as in portfolio.MasterPortfolio.
+    - position_limit: the position limit of each pair portfolio.
+    - cash: the initial cash of each pair portfolio.
+    - trading_fee: the transaction fee of each pair portfolio, as a fraction of the amount
+      traded (see trading.execute_trades).
+    - num_workers: the number of worker processes. Defaults to the number of CPUs. With one
+      worker and no executor the sweep runs in this process.
+    - executor: an existing concurrent.futures executor to run the tasks on, so that a pool
+      of workers can be reused across sweeps. If None a new process pool is created.
+
+    Returns:
+    - A DataFrame with one row per combination of strategy, parameters and pair, in the order
+      of strategy_grids, expand_grid and stock_pair_labels_list. The columns are 'strategy',
+      'stock_a', 'stock_b', one column per swept parameter (missing for strategies which do
+      not take that parameter), 'final_value', 'max_drawdown' and 'num_trades'.
+    """
+    stock_pair_labels_list = [tuple(stock_pair_labels)
+                              for stock_pair_labels in stock_pair_labels_list]
+    tasks = _make_tasks(strategy_grids, stock_pair_labels_list, training_data_source,
+                        testing_data_source, position_limit, cash, trading_fee)
+
+    if num_workers is None:
+        num_workers = os.cpu_count() or 1
+    num_workers = max(1, min(num_workers, len(tasks)))
+    if executor is None and num_workers == 1:
+        task_results = [_run_task(task) for task in tasks]
+    else:
+        # Publish the datasets once, so the workers share one copy of the prices rather than
+        # each task pickling or loading its own
+        with data.shared_data_sources(training_data_source, testing_data_source) as shared_sources:
+            tasks = _make_tasks(strategy_grids, stock_pair_labels_list, *shared_sources,
+                                position_limit, cash, trading_fee)
+            if executor is not None:
+                task_results = list(executor.map(_run_task, tasks))
+            else:
+                chunksize = max(1, len(tasks) // (4 * num_workers))
+                # Imported here, as starting worker processes is the only use of
+                # concurrent.futures and importing it slows down the start of every backtest
+                # pylint: disable-next=import-outside-toplevel
+                from concurrent.futures import ProcessPoolExecutor
+                with ProcessPoolExecutor(max_workers=num_workers) as new_executor:
+                    task_results = list(new_executor.map(_run_task, tasks,
+                                                         chunksize=chunksize))
+
+    param_names = []
+    for param_grid in strategy_grids.values():
+        param_names.extend(name for name in param_grid if name not in param_names)
+    rows = [row for task_result in task_results for row in task_result]
+    columns = ['strategy', 'stock_a', 'stock_b'] + param_names \
+            + ['final_value', 'max_drawdown', 'num_trades']
+    results = pd.DataFrame(rows, columns=columns)
+    # Nullable dtypes keep integer parameters as integers when other strategies leave them out
+    results[param_names] = results[param_names].convert_dtypes()
+    return results
+
+def calc_max_drawdown(portfolio_values):
+    """
+    Calculate the maximum drawdown of a series of portfolio values, i.e. the largest fall
+    from a running peak as a fraction of that peak. Returns 0 if the value never falls.
+    """
+    return float(metrics.calc_max_drawdown(portfolio_values))
+
+def calc_num_trades(position_over_time, initial_position=Position.NO_POSITION):
+    """
+    Calculate the number of times the position changed, starting from initial_position.
+    """
+    return int(metrics.calc_num_position_changes(position_over_time, initial_position))
+
+def _make_tasks(strategy_grids, stock_pair_labels_list, training_data_source, testing_data_source,
+                position_limit, cash, trading_fee):
+    """
+    Return the list of tasks for _run_task, one per combination of strategy parameters.
+    """
+    tasks = []
+    for strategy_class, param_grid in strategy_grids.items():
+        for strategy_kwargs in expand_grid(param_grid):
+            tasks.append((strategy_class, strategy_kwargs, stock_pair_labels_list,
+                          training_data_source, testing_data_source, position_limit, cash,
+                          trading_fee))
+    return tasks
+
+def _run_task(task):
+    """
+    Simulate one combination of strategy parameters on every pair and return a list of
+    result rows.
+    """
+    (strategy_class, strategy_kwargs, stock_pair_labels_list,
+     training_data_source, testing_data_source, position_limit, cash, trading_fee) = task
+    master_portfolio = portfolio.MasterPortfolio(position_limit, training_data_source,
+                                                 testing_data_source, trading_fee=trading_fee)
+    for stock_pair_labels in stock_pair_labels_list:
+        pair_portfolio = portfolio.PairPortfolio(stock_pair_labels, strategy_class,
+                                                 master_portfolio, cash=cash,
+                                                 strategy_kwargs=strategy_kwargs)
+        pair_portfolio.trading_fee = trading_fee
+        master_portfolio.add_pair_portfolio(pair_portfolio)
+    df_test = data.get_data(testing_data_source)
+    vectorized.simulate_pair_portfolios(df_test, master_portfolio.pair_portfolios)
+
+    rows = []
+    for pair_portfolio in master_portfolio.pair_portfolios:
+        row = {'strategy': strategy_class.__name__,
+               'stock_a': pair_portfolio.stock_pair_labels[0],
+               'stock_b': pair_portfolio.stock_pair_labels[1]}
+        row.update(strategy_kwargs)
+        row['final_value'] = pair_portfolio.portfolio_value
+        row['max_drawdown'] = calc_max_drawdown(pair_portfolio.portfolio_value_over_time)
+        row['num_trades'] = calc_num_trades(pair_portfolio.position_over_time)
+        rows.append(row)
+    return rows
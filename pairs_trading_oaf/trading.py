@@ -2,68 +2,270 @@
 Contains the routines for trading and updating the portfolios.
 This module does not contain any strategy-specific code.
 """
+import itertools
+import os
+import time
+import numpy as np
 from pairs_trading_oaf import data
+from pairs_trading_oaf.positions import Position, to_position
 
-def simulate_trading(master_portfolio):
+# The states of a pair portfolio on each day of the trading loop, see get_day_states
+NOT_LISTED = 0
+WARMING_UP = 1
+TRADING = 2
+
+# The clock of the trading loop when it is not instrumented, which returns 0 without the cost
+# of reading the time
+_stopped_clock = itertools.repeat(0.0).__next__
+
+def simulate_trading(master_portfolio, collectors=None):
     """
-    Simulate trading for the master portfolio by iterating through the testing data.
+    Simulate trading for the master portfolio, both its pair portfolios and its basket
+    portfolios, by iterating through the testing data.
+
+    collectors is an optional list of instrumentation.Collector objects which are given the
+    time spent in each phase of the loop and the trades, see instrumentation.py.
     """
 
-    df_test = data.read_csv(master_portfolio.testing_data_str)
+    df_test = data.get_data(master_portfolio.testing_data_source)
+    simulate_pair_portfolios(df_test, master_portfolio.traded_portfolios, collectors,
+                             data.get_availability(master_portfolio.testing_data_source))
+
+def simulate_pair_portfolios(df_test, pair_portfolios, collectors=None, available=None):
+    """
+    Simulate trading for a list of pair portfolios by iterating through the rows of df_test.
+    The list can also contain basket portfolios, which are simulated in the same loop.
 
-    for date, row in df_test.iterrows():
-        for pair_portfolio in master_portfolio.pair_portfolios:
-            pair_portfolio.update_prices_and_date(date, row)
-            new_position = pair_portfolio.strategy.calculate_new_position()
-            if pair_portfolio.portfolio_value < 0:
-                new_position = "no position"
-            execute_trades(pair_portfolio, new_position)
+    The price columns of each pair portfolio are looked up once (see get_price_rows), so each
+    day only indexes a list of plain floats rather than building a pandas Series of the row.
+
+    available is the availability mask of df_test (see data.get_availability), which is
+    calculated from df_test if it is None. On the days on which a stock of a pair portfolio is
+    not listed the strategy is not asked for a position, and the pair portfolio keeps the
+    prices of the last day on which every stock was listed, so it is valued at them. The
+    strategy is asked for its position without trading on the first warm_up_days days on
+    which every stock is listed (see strategies.BaseStrategy.calculate_initial_window), and
+    its warm_up_days go down by one on each of them.
+    """
+    for pair_portfolio in pair_portfolios:
+        pair_portfolio.reserve_over_time_values(len(df_test))
+    price_rows, column_indices = get_price_rows(df_test, pair_portfolios)
+    if available is None:
+        available = data.get_availability(df_test)
+    day_states = get_day_states(available, pair_portfolios)
+    collectors = collectors or []
+    # Without collectors the phases are not timed, and the clock always reads 0
+    clock = time.perf_counter if collectors else _stopped_clock
+    for collector in collectors:
+        collector.on_start(pair_portfolios)
+    for date, row, row_states in zip(df_test.index, price_rows, day_states):
+        for pair_portfolio, indices, state in zip(pair_portfolios, column_indices, row_states):
+            start = clock()
+            old_position = pair_portfolio.position
+            if state == NOT_LISTED:
+                pair_portfolio.date = date
+                prices_updated = position_calculated = trades_executed = clock()
+            else:
+                pair_portfolio.update_prices_from_row(date, row, indices)
+                prices_updated = clock()
+                new_position = pair_portfolio.strategy.calculate_new_position()
+                position_calculated = clock()
+                if state == WARMING_UP:
+                    # The strategy has used up one of its warm-up days
+                    pair_portfolio.strategy.warm_up_days -= 1
+                    new_position = old_position
+                if pair_portfolio.portfolio_value < 0:
+                    new_position = Position.NO_POSITION
+                elif not isinstance(new_position, Position):
+                    # Strategies may still return the position as a string
+                    new_position = to_position(new_position)
+                execute_trades(pair_portfolio, new_position)
+                trades_executed = clock()
             pair_portfolio.update_over_time_values()
+            if collectors:
+                end = clock()
+                phase_seconds = (prices_updated - start,
+                                 position_calculated - prices_updated,
+                                 trades_executed - position_calculated,
+                                 end - trades_executed)
+                for collector in collectors:
+                    collector.on_day(pair_portfolio, date, phase_seconds)
+                    if pair_portfolio.position != old_position:
+                        collector.on_trade(pair_portfolio, date, old_position,
+                                           pair_portfolio.position)
+    for collector in collectors:
+        collector.on_finish()
+
+def get_pair_availability(available, pair_portfolios):
+    """
+    Return a boolean array of shape (num_days, num_pair_portfolios) which is True on the days
+    on which every stock of each pair portfolio is listed, from the availability mask of the
+    testing data (see data.get_availability).
+    """
+    label_indices = {label: i for i, label in enumerate(available.columns)}
+    available = available.to_numpy()
+    pair_available = np.empty((len(available), len(pair_portfolios)), dtype=bool)
+    for i, pair_portfolio in enumerate(pair_portfolios):
+        indices = [label_indices[label] for label in pair_portfolio.stock_labels]
+        pair_available[:, i] = available[:, indices].all(axis=1)
+    return pair_available
+
+def get_day_states(available, pair_portfolios):
+    """
+    Return the state of each pair portfolio on each day of the trading loop, as lists of
+    NOT_LISTED, WARMING_UP or TRADING for each day. The warm_up_days of the strategies are left
+    unchanged, and are used up by the trading loops on the WARMING_UP days.
+
+    A pair portfolio is NOT_LISTED on the days on which a stock is not listed according to the
+    availability mask available (see data.get_availability). The first warm_up_days of the
+    other days are WARMING_UP and the rest are TRADING.
+    """
+    pair_available = get_pair_availability(available, pair_portfolios)
+    day_states = np.where(pair_available, TRADING, NOT_LISTED).astype(np.int8)
+    for i, pair_portfolio in enumerate(pair_portfolios):
+        warm_up_days = getattr(pair_portfolio.strategy, 'warm_up_days', 0)
+        if warm_up_days > 0:
+            listed_days = np.flatnonzero(pair_available[:, i])
+            day_states[listed_days[:warm_up_days], i] = WARMING_UP
+    return day_states.tolist()
+
+def get_price_rows(df_test, pair_portfolios):
+    """
+    Look up the price columns of every pair portfolio once, before the trading loop.
+
+    Returns:
+    - price_rows: the prices of the stocks traded by the pair portfolios on each day of
+      df_test, as lists of plain floats. Missing prices are NaN, as in df_test.
+    - column_indices: the indices into the rows of the stocks of each pair portfolio, e.g.
+      (stock A index, stock B index), in the order of its stock_labels.
+    """
+    labels = list(dict.fromkeys(label for pair_portfolio in pair_portfolios
+                                for label in pair_portfolio.stock_labels))
+    label_indices = {label: i for i, label in enumerate(labels)}
+    price_rows = df_test[labels].to_numpy(dtype=float).tolist()
+    column_indices = [tuple(label_indices[label] for label in pair_portfolio.stock_labels)
+                      for pair_portfolio in pair_portfolios]
+    return price_rows, column_indices
+
+def simulate_trading_parallel(master_portfolio, num_workers=None, executor=None):
+    """
+    Simulate trading for the master portfolio like simulate_trading, but split the pair
+    portfolios into shards which are simulated in a pool of worker processes.
+
+    Each pair portfolio evolves independently of the others, so the results are identical to
+    those of simulate_trading. The simulated pair portfolios, including their *_over_time
+    values and strategy state, are merged back into the pair portfolios of master_portfolio.
+
+    Inputs:
+    - master_portfolio: the master portfolio to simulate.
+    - num_workers: the number of shards to split the pair portfolios into. Defaults to the
+      number of CPUs. With one worker and no executor the simulation runs in this process.
+    - executor: an existing concurrent.futures executor to run the shards on, so that a pool
+      of workers can be reused across simulations. If None a new process pool is created.
+    """
+    pair_portfolios = master_portfolio.traded_portfolios
+    if num_workers is None:
+        num_workers = os.cpu_count() or 1
+    num_shards = max(1, min(num_workers, len(pair_portfolios)))
+    if num_shards == 1 and executor is None:
+        simulate_trading(master_portfolio)
+        return
+
+    shard_size, remainder = divmod(len(pair_portfolios), num_shards)
+    shards = []
+    start = 0
+    for i in range(num_shards):
+        end = start + shard_size + (1 if i < remainder else 0)
+        shards.append(pair_portfolios[start:end])
+        start = end
+
+    # Publish the training and testing data once and point the pair portfolios at the shared
+    # copies while they are sent to the workers, so no shard pickles or loads its own copy
+    with data.shared_data_sources(master_portfolio.training_data_source,
+                                  master_portfolio.testing_data_source) as shared_sources:
+        training_data_source, testing_data_source = shared_sources
+        for pair_portfolio in pair_portfolios:
+            pair_portfolio.training_data_source = training_data_source
+            pair_portfolio.testing_data_source = testing_data_source
+        testing_data_sources = [testing_data_source] * num_shards
+        try:
+            if executor is None:
+                # Imported here, as starting worker processes is the only use of
+                # concurrent.futures and importing it slows down the start of every backtest
+                # pylint: disable-next=import-outside-toplevel
+                from concurrent.futures import ProcessPoolExecutor
+                with ProcessPoolExecutor(max_workers=num_shards) as new_executor:
+                    simulated_shards = list(new_executor.map(_simulate_shard, testing_data_sources,
+                                                             shards))
+            else:
+                simulated_shards = list(executor.map(_simulate_shard, testing_data_sources, shards))
+            for shard, simulated_shard in zip(shards, simulated_shards):
+                for pair_portfolio, simulated_pair_portfolio in zip(shard, simulated_shard):
+                    merge_pair_portfolio(pair_portfolio, simulated_pair_portfolio)
+        finally:
+            for pair_portfolio in pair_portfolios:
+                pair_portfolio.training_data_source = master_portfolio.training_data_source
+                pair_portfolio.testing_data_source = master_portfolio.testing_data_source
+
+def _simulate_shard(testing_data_source, pair_portfolios):
+    """
+    Simulate trading for a shard of pair portfolios in a worker process.
+    """
+    df_test = data.get_data(testing_data_source)
+    simulate_pair_portfolios(df_test, pair_portfolios,
+                             available=data.get_availability(testing_data_source))
+    return pair_portfolios
+
+def merge_pair_portfolio(pair_portfolio, simulated_pair_portfolio):
+    """
+    Copy the state of a pair portfolio that was simulated in another process, including its
+    *_over_time values and strategy, into the original pair portfolio.
+    """
+    pair_portfolio.__dict__.update(simulated_pair_portfolio.__dict__)
+    if getattr(pair_portfolio.strategy, 'pair_portfolio', None) is simulated_pair_portfolio:
+        pair_portfolio.strategy.pair_portfolio = pair_portfolio
 
 def execute_trades(pair_portfolio, new_position):
     """
-    Execute trades at the end of the day based on the new position.
+    Execute trades at the end of the day based on the new position, which may be a Position, a
+    position code or a position string.
     """
+    new_position = to_position(new_position)
     if new_position == pair_portfolio.position:
         # No change in position so do nothing
         return
-    else:
-        close_position(pair_portfolio)
-        open_position(pair_portfolio, new_position)
+    close_position(pair_portfolio)
+    open_position(pair_portfolio, new_position)
 
 def close_position(pair_portfolio):
     """
-    Close the current position.
+    Close the current position of a pair or basket portfolio.
     """
-    total_value = pair_portfolio.shares[0] * pair_portfolio.stock_pair_prices[0] \
-                + pair_portfolio.shares[1] * pair_portfolio.stock_pair_prices[1]
-    trade_amount = abs(pair_portfolio.shares[0]) * pair_portfolio.stock_pair_prices[0] \
-                 + abs(pair_portfolio.shares[1]) * pair_portfolio.stock_pair_prices[1]
+    # The legs are added up one by one in plain Python, as numpy is slower for a few legs
+    prices = pair_portfolio.prices
+    total_value = sum(shares * price for shares, price in zip(pair_portfolio.shares, prices))
+    trade_amount = sum(abs(shares) * price
+                       for shares, price in zip(pair_portfolio.shares, prices))
     transaction_fee = trade_amount * pair_portfolio.trading_fee
-    pair_portfolio.cash = pair_portfolio.cash + total_value - transaction_fee
-    pair_portfolio.shares = (0, 0)
+    pair_portfolio.cash = float(pair_portfolio.cash + total_value - transaction_fee)
+    pair_portfolio.shares = (0.0,) * len(prices)
 
 def open_position(pair_portfolio, new_position):
     """
-    Open a new position.
+    Open a new position of a pair or basket portfolio, buying weights[i] * position_limit
+    dollars of each stock i when long the basket ("long A short B" for a pair) and selling
+    them when short the basket.
     """
+    new_position = to_position(new_position)
     pair_portfolio.position = new_position
-    if new_position == "no position":
+    if new_position == Position.NO_POSITION:
         close_position(pair_portfolio)
     else:
-        if new_position == "long A short B":
-            shares_to_trade = (+pair_portfolio.position_limit /
-                               pair_portfolio.stock_pair_prices[0],
-                               -pair_portfolio.position_limit /
-                               pair_portfolio.stock_pair_prices[1])
-        elif new_position == "long B short A":
-            shares_to_trade = (-pair_portfolio.position_limit /
-                               pair_portfolio.stock_pair_prices[0],
-                               +pair_portfolio.position_limit /
-                               pair_portfolio.stock_pair_prices[1])
-
-        trade_amount = abs(shares_to_trade[0]) * pair_portfolio.stock_pair_prices[0] \
-                     + abs(shares_to_trade[1]) * pair_portfolio.stock_pair_prices[1]
+        sign = 1.0 if new_position == Position.LONG_A_SHORT_B else -1.0
+        prices = pair_portfolio.prices
+        shares_to_trade = tuple(sign * weight * pair_portfolio.position_limit / price
+                                for weight, price in zip(pair_portfolio.weights, prices))
+        trade_amount = sum(abs(shares) * price for shares, price in zip(shares_to_trade, prices))
         transaction_fee = trade_amount * pair_portfolio.trading_fee
-        pair_portfolio.cash -= transaction_fee
+        pair_portfolio.cash = float(pair_portfolio.cash - transaction_fee)
         pair_portfolio.shares = shares_to_trade
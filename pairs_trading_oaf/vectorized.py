@@ -0,0 +1,330 @@
+"""
+A vectorized alternative to trading.simulate_trading.
+
+Rather than looping over the rows of the testing data, this engine asks each strategy for its
+positions over the whole trading period at once (see calculate_new_positions in strategies.py)
+and then calculates the trades, cash, shares and portfolio values as numpy array operations.
+The results are written into the same *_over_time values as trading.simulate_trading, so the
+plotting routines work unchanged.
+
+As in trading.simulate_trading, the strategy of a pair portfolio is only given the days on
+which both of its stocks are listed (see data.get_availability), and its positions are held on
+the first warm_up_days of them. The trades are calculated over those days, and the other days
+keep the state of the last listed day before them.
+"""
+import numpy as np
+from pairs_trading_oaf import data, trading
+from pairs_trading_oaf.portfolio import BasketPortfolio
+from pairs_trading_oaf.positions import Position, to_position
+from pairs_trading_oaf.strategies import NO_POSITION, HOLD_POSITION
+
+def simulate_trading(master_portfolio):
+    """
+    Simulate trading for the master portfolio over the whole of the testing data.
+    """
+    df_test = data.get_data(master_portfolio.testing_data_source)
+    simulate_pair_portfolios(df_test, master_portfolio.traded_portfolios,
+                             data.get_availability(master_portfolio.testing_data_source))
+
+def simulate_pair_portfolios(df_test, pair_portfolios, available=None):
+    """
+    Simulate trading for a list of pair portfolios over the whole of df_test.
+
+    Pair portfolios whose strategy class implements calculate_batch_new_positions are
+    calculated together, one batch per strategy class, unless a stock is not listed on some
+    of the days. Pair portfolios whose strategy does not implement calculate_new_positions,
+    and basket portfolios, are simulated with the daily loop in
+    trading.simulate_pair_portfolios instead.
+
+    available is the availability mask of df_test (see data.get_availability), which is
+    calculated from df_test if it is None.
+    """
+    if available is None:
+        available = data.get_availability(df_test)
+    daily_pair_portfolios = []
+    batches = {}
+    vectorized_pair_portfolios = []
+    for pair_portfolio in pair_portfolios:
+        if isinstance(pair_portfolio, BasketPortfolio) \
+                or not hasattr(pair_portfolio.strategy, 'calculate_new_positions'):
+            daily_pair_portfolios.append(pair_portfolio)
+        else:
+            vectorized_pair_portfolios.append(pair_portfolio)
+    pair_available = trading.get_pair_availability(available, vectorized_pair_portfolios)
+
+    for pair_portfolio, listed in zip(vectorized_pair_portfolios, pair_available.T):
+        strategy_class = type(pair_portfolio.strategy)
+        if hasattr(strategy_class, 'calculate_batch_new_positions') and listed.all():
+            batches.setdefault(strategy_class, []).append(pair_portfolio)
+            continue
+        stock_pair_prices = df_test[list(pair_portfolio.stock_pair_labels)].to_numpy(dtype=float)
+        listed_positions = pair_portfolio.strategy.calculate_new_positions(
+            stock_pair_prices[listed])
+        new_positions = np.full(len(listed), HOLD_POSITION, dtype=np.int8)
+        new_positions[listed] = hold_warm_up_positions(pair_portfolio.strategy,
+                                                       listed_positions)
+        execute_trades(pair_portfolio, df_test.index, stock_pair_prices, new_positions, listed)
+    for strategy_class, batch_pair_portfolios in batches.items():
+        stock_pair_prices = np.stack(
+            [df_test[list(pair_portfolio.stock_pair_labels)].to_numpy(dtype=float)
+             for pair_portfolio in batch_pair_portfolios])
+        new_positions = strategy_class.calculate_batch_new_positions(
+            [pair_portfolio.strategy for pair_portfolio in batch_pair_portfolios],
+            stock_pair_prices)
+        for i, pair_portfolio in enumerate(batch_pair_portfolios):
+            execute_trades(pair_portfolio, df_test.index, stock_pair_prices[i],
+                           hold_warm_up_positions(pair_portfolio.strategy, new_positions[i]))
+    if daily_pair_portfolios:
+        trading.simulate_pair_portfolios(df_test, daily_pair_portfolios, available=available)
+
+def hold_warm_up_positions(strategy, new_positions):
+    """
+    Replace the first warm_up_days of the position codes calculated by a strategy with
+    HOLD_POSITION, and use up its warm_up_days, as the daily loop of
+    trading.simulate_pair_portfolios does on each of them.
+    """
+    warm_up_days = min(getattr(strategy, 'warm_up_days', 0), len(new_positions))
+    if warm_up_days > 0:
+        new_positions = np.array(new_positions, dtype=np.int8)
+        new_positions[:warm_up_days] = HOLD_POSITION
+        strategy.warm_up_days -= warm_up_days
+    return new_positions
+
+def resolve_positions(new_positions, initial_position):
+    """
+    Replace each HOLD_POSITION code by the position held on the previous day,
+    starting from initial_position. Works along the last axis, so new_positions can also be
+    a batch of paths of shape (num_paths, num_days).
+    """
+    new_positions = np.asarray(new_positions)
+    day_indices = np.where(new_positions != HOLD_POSITION,
+                           np.arange(new_positions.shape[-1]), -1)
+    np.maximum.accumulate(day_indices, axis=-1, out=day_indices)
+    held_positions = np.take_along_axis(new_positions, np.maximum(day_indices, 0), axis=-1)
+    return np.where(day_indices >= 0, held_positions, initial_position).astype(np.int8)
+
+def calc_target_shares(positions, stock_pair_prices, position_limit):
+    """
+    Calculate the shares bought when opening each position, as in trading.open_position.
+    Works on any leading axes, so the positions can also be a batch of paths of shape
+    (num_paths, num_days).
+
+    Inputs:
+    - positions: array of position codes.
+    - stock_pair_prices: array of the stock A and stock B prices on the days of the
+      positions, of shape positions.shape + (2,).
+    - position_limit: as in portfolio.PairPortfolio.
+
+    Returns:
+    - An array of the stock A and stock B shares, of the same shape as stock_pair_prices,
+      which are 0 for "no position".
+    """
+    signs = np.asarray(positions).astype(float)
+    target_shares = np.zeros(stock_pair_prices.shape)
+    is_open = signs != NO_POSITION
+    target_shares[is_open, 0] = signs[is_open] * position_limit \
+                              / stock_pair_prices[is_open, 0]
+    target_shares[is_open, 1] = -signs[is_open] * position_limit \
+                              / stock_pair_prices[is_open, 1]
+    return target_shares
+
+def calc_cash_changes(closed_shares, target_shares, trade_prices, trading_fee):
+    """
+    Calculate the changes in cash of trades which close closed_shares and then open
+    target_shares at trade_prices, as in trading.close_position and trading.open_position.
+    Works on any leading axes, like calc_target_shares.
+
+    Returns:
+    - An array of shape trade_prices.shape[:-1] + (3,) of the value of the closed shares,
+      minus the fee for closing them and minus the fee for opening the target shares. Add
+      them to the cash one at a time in this order for the rounding to match the daily loop.
+    """
+    total_value = closed_shares[..., 0] * trade_prices[..., 0] \
+                + closed_shares[..., 1] * trade_prices[..., 1]
+    close_amount = np.abs(closed_shares[..., 0]) * trade_prices[..., 0] \
+                 + np.abs(closed_shares[..., 1]) * trade_prices[..., 1]
+    open_amount = np.abs(target_shares[..., 0]) * trade_prices[..., 0] \
+                + np.abs(target_shares[..., 1]) * trade_prices[..., 1]
+    return np.stack([total_value, -close_amount * trading_fee, -open_amount * trading_fee],
+                    axis=-1)
+
+def calc_portfolio_values(cash, shares, stock_pair_prices):
+    """
+    Calculate the portfolio values of the cash and the stock A and stock B shares, adding up
+    in the same order as the daily loop. Works on any leading axes, like calc_target_shares.
+    """
+    portfolio_values = cash + shares[..., 0] * stock_pair_prices[..., 0]
+    portfolio_values += shares[..., 1] * stock_pair_prices[..., 1]
+    return portfolio_values
+
+def execute_trades(pair_portfolio, dates, stock_pair_prices, new_positions, listed=None):
+    """
+    Execute the trades for a whole trading period and record the over time values.
+
+    Inputs:
+    - pair_portfolio: the pair portfolio to trade.
+    - dates: the dates of the trading period.
+    - stock_pair_prices: array of shape (num_days, 2) containing the stock A and stock B prices.
+    - new_positions: the position codes returned by the strategy's calculate_new_positions.
+    - listed: optional boolean array which is True on the days on which both stocks are
+      listed. The trades are only executed on those days, and the other days keep the
+      state, and the prices, of the last listed day before them, as in
+      trading.simulate_trading. If None every day is listed.
+
+    As in trading.simulate_trading, the position is forced to "no position" on the day after
+    the portfolio value goes negative. Later days depend on that forced position, so the
+    trading period is processed in segments which each end on a day with a negative value.
+    """
+    if len(new_positions) == 0:
+        return
+    if listed is None or listed.all():
+        outputs = _execute_listed_days(pair_portfolio, stock_pair_prices, new_positions)
+        _record_over_time_values(pair_portfolio, dates, stock_pair_prices, *outputs)
+        return
+
+    listed_days = np.flatnonzero(listed)
+    outputs = _execute_listed_days(pair_portfolio, stock_pair_prices[listed_days],
+                                   new_positions[listed_days])
+    # Each day takes the values of the last listed day. Days before the first listed day have
+    # index -1, which picks out the state at the start, appended below.
+    last_listed = np.full(len(listed), -1)
+    last_listed[listed_days] = np.arange(len(listed_days))
+    np.maximum.accumulate(last_listed, out=last_listed)
+    initial_prices = [np.nan if price is None else price
+                      for price in pair_portfolio.stock_pair_prices]
+    initial_state = (to_position(pair_portfolio.position), pair_portfolio.shares,
+                     pair_portfolio.cash, pair_portfolio.portfolio_value)
+    marked_prices = np.concatenate([stock_pair_prices[listed_days], [initial_prices]])
+    outputs = [np.concatenate([values, [initial_value]])[last_listed]
+               for values, initial_value in zip(outputs, initial_state)]
+    _record_over_time_values(pair_portfolio, dates, marked_prices[last_listed], *outputs)
+
+def _execute_listed_days(pair_portfolio, stock_pair_prices, new_positions):
+    """
+    Execute the trades on days on which both stocks are listed, starting from the state of
+    the pair portfolio, and return the positions, shares, cash and portfolio values of each
+    day, without changing the pair portfolio.
+    """
+    num_days = len(new_positions)
+    if num_days == 0:
+        return (np.empty(0, dtype=np.int8), np.empty((0, 2)), np.empty(0), np.empty(0))
+    positions = np.empty(num_days, dtype=np.int8)
+    shares = np.empty((num_days, 2))
+    cash = np.empty(num_days)
+    portfolio_values = np.empty(num_days)
+
+    position = to_position(pair_portfolio.position)
+    current_shares = np.array(pair_portfolio.shares, dtype=float)
+    current_cash = pair_portfolio.cash
+    portfolio_value = pair_portfolio.portfolio_value
+    start = 0
+    while start < num_days:
+        if portfolio_value < 0:
+            end = _execute_forced_close(pair_portfolio, stock_pair_prices, start, position,
+                                        current_shares, current_cash,
+                                        (positions, shares, cash, portfolio_values))
+        else:
+            end = _execute_segment(pair_portfolio, stock_pair_prices, new_positions, start,
+                                   position, current_shares, current_cash,
+                                   (positions, shares, cash, portfolio_values))
+        position = positions[end - 1]
+        current_shares = shares[end - 1]
+        current_cash = cash[end - 1]
+        portfolio_value = portfolio_values[end - 1]
+        start = end
+    return positions, shares, cash, portfolio_values
+
+def _execute_segment(pair_portfolio, stock_pair_prices, new_positions, start,
+                     position, current_shares, current_cash, outputs):
+    """
+    Execute the trades from day start onwards, up to and including the first day on which
+    the portfolio value is negative. Writes the results into outputs and returns the index of
+    the day after the segment.
+    """
+    positions, shares, cash, portfolio_values = outputs
+    prices = stock_pair_prices[start:]
+    segment_positions = resolve_positions(new_positions[start:], position)
+    previous_positions = np.concatenate([[position], segment_positions[:-1]])
+    trade_days = np.flatnonzero(segment_positions != previous_positions)
+
+    trade_prices = prices[trade_days]
+    target_shares = calc_target_shares(segment_positions[trade_days], trade_prices,
+                                       pair_portfolio.position_limit)
+    closed_shares = np.concatenate([[current_shares], target_shares[:-1]])
+    # The changes are accumulated strictly in order so that the rounding matches the daily
+    # loop
+    cash_changes = calc_cash_changes(closed_shares, target_shares, trade_prices,
+                                     pair_portfolio.trading_fee)
+    cash_after_trades = np.add.accumulate(np.concatenate([[current_cash],
+                                                          cash_changes.ravel()]))[3::3]
+
+    # Carry the state after the latest trade forward to each day. Days before the first trade
+    # have index -1, which picks out the state at the start of the segment appended below.
+    last_trade = np.full(len(prices), -1)
+    last_trade[trade_days] = np.arange(len(trade_days))
+    np.maximum.accumulate(last_trade, out=last_trade)
+    segment_shares = np.concatenate([target_shares, [current_shares]])[last_trade]
+    segment_cash = np.append(cash_after_trades, current_cash)[last_trade]
+    segment_values = calc_portfolio_values(segment_cash, segment_shares, prices)
+
+    negative_days = np.flatnonzero(segment_values < 0)
+    length = negative_days[0] + 1 if len(negative_days) > 0 else len(prices)
+    end = start + length
+    positions[start:end] = segment_positions[:length]
+    shares[start:end] = segment_shares[:length]
+    cash[start:end] = segment_cash[:length]
+    portfolio_values[start:end] = segment_values[:length]
+    return end
+
+def _execute_forced_close(pair_portfolio, stock_pair_prices, start, position,
+                          current_shares, current_cash, outputs):
+    """
+    Close the position on day start because the portfolio value went negative, then stay
+    without a position for as long as the portfolio value stays negative. Writes the results
+    into outputs and returns the index of the day after the forced period.
+    """
+    positions, shares, cash, portfolio_values = outputs
+    prices = stock_pair_prices[start:]
+    if position != NO_POSITION:
+        total_value = current_shares[0] * prices[0, 0] + current_shares[1] * prices[0, 1]
+        trade_amount = abs(current_shares[0]) * prices[0, 0] \
+                     + abs(current_shares[1]) * prices[0, 1]
+        current_cash = current_cash + total_value - trade_amount * pair_portfolio.trading_fee
+        # Closing again when opening "no position" changes the cash by 0 * price
+        current_cash = current_cash + (0.0 * prices[0, 0] + 0.0 * prices[0, 1]) \
+                     - (0.0 * prices[0, 0] + 0.0 * prices[0, 1]) * pair_portfolio.trading_fee
+    flat_values = current_cash + 0.0 * prices[:, 0]
+    flat_values += 0.0 * prices[:, 1]
+
+    non_negative_days = np.flatnonzero(~(flat_values < 0))
+    length = non_negative_days[0] + 1 if len(non_negative_days) > 0 else len(prices)
+    end = start + length
+    positions[start:end] = NO_POSITION
+    shares[start:end] = 0.0
+    cash[start:end] = current_cash
+    portfolio_values[start:end] = flat_values[:length]
+    return end
+
+def _record_over_time_values(pair_portfolio, dates, stock_pair_prices,
+                             positions, shares, cash, portfolio_values):
+    """
+    Append the results to the over time values of the pair portfolio and leave the pair
+    portfolio in its state at the end of the trading period.
+    """
+    with np.errstate(divide='ignore', invalid='ignore'):
+        ratios = stock_pair_prices[:, 0] / stock_pair_prices[:, 1]
+
+    pair_portfolio.cash_over_time.extend(cash)
+    pair_portfolio.dates_over_time.extend(dates)
+    pair_portfolio.position_over_time.extend(positions)
+    pair_portfolio.shares_over_time.extend(shares)
+    pair_portfolio.stock_pair_prices_over_time.extend(stock_pair_prices)
+    pair_portfolio.portfolio_value_over_time.extend(portfolio_values)
+    pair_portfolio.ratio_over_time.extend(ratios)
+
+    pair_portfolio.cash = pair_portfolio.cash_over_time[-1]
+    pair_portfolio.date = pair_portfolio.dates_over_time[-1]
+    pair_portfolio.position = Position(pair_portfolio.position_over_time[-1])
+    pair_portfolio.shares = pair_portfolio.shares_over_time[-1]
+    pair_portfolio.stock_pair_prices = pair_portfolio.stock_pair_prices_over_time[-1]
+    pair_portfolio.portfolio_value = pair_portfolio.portfolio_value_over_time[-1]
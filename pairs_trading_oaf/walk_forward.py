@@ -0,0 +1,209 @@
+"""
+Walk-forward backtests with rolling formation and trading windows.
+
+Rather than one fixed formation (training) period and one fixed trading (testing) period, a
+walk-forward backtest slices a single dataset, by default "Price Data - CSV - Full Periods.csv",
+into a sequence of windows. Each window has a formation period of formation_days rows, which
+the strategies warm up on, followed by a trading period of trading_days rows, and each window
+starts step_days rows after the one before:
+
+    formation | trading
+    <- step ->formation | trading
+              <- step ->formation | trading
+
+The strategies are created again for each window, from the formation period of that window.
+The windows are sliced out of one price matrix in memory, which the portfolios use directly as
+their training and testing data (see data.get_data), so no CSV file is written or read for each
+window. The windows are independent, so they run in a pool of worker processes. The dataset is
+published once into shared memory (see data.share_data), which the workers read without
+copying it.
+
+With carry_state=True, strategies which implement carry_state (see strategies.py) carry their
+state on from the window before whenever the trading periods of the two windows are
+contiguous. The windows then depend on each other, so they run one after another, with one
+task per strategy class.
+"""
+import os
+import pandas as pd
+from pairs_trading_oaf import data, portfolio, vectorized
+from pairs_trading_oaf.sweep import calc_max_drawdown, calc_num_trades
+
+FULL_PERIODS_DATA_SOURCE = "Price Data - CSV - Full Periods.csv"
+
+def make_windows(num_days: int, formation_days: int, trading_days: int, step_days: int = None):
+    """
+    Make the rolling formation and trading windows of a dataset.
+
+    Inputs:
+    - num_days: the number of rows of the dataset.
+    - formation_days, trading_days: the number of rows in the formation and trading period of
+      each window.
+    - step_days: the number of rows between the starts of consecutive windows. Defaults to
+      trading_days, so that the trading periods follow on from each other.
+
+    Returns:
+    - A list of (formation_start, trading_start, trading_end) row indices, where the formation
+      period is rows formation_start:trading_start and the trading period is rows
+      trading_start:trading_end. Only windows which fit in the dataset are included.
+    """
+    if step_days is None:
+        step_days = trading_days
+    if formation_days < 1 or trading_days < 1 or step_days < 1:
+        raise ValueError("formation_days, trading_days and step_days must be positive")
+    windows = []
+    formation_start = 0
+    while formation_start + formation_days + trading_days <= num_days:
+        trading_start = formation_start + formation_days
+        windows.append((formation_start, trading_start, trading_start + trading_days))
+        formation_start += step_days
+    return windows
+
+def run_walk_forward(strategy_classes, stock_pair_labels_list, position_limit,
+                     data_source=FULL_PERIODS_DATA_SOURCE, formation_days=252, trading_days=63,
+                     step_days=None, cash=10, trading_fee=0.0, carry_state=False,
+                     num_workers=None, executor=None):
+    """
+    Run a walk-forward backtest of every strategy on every pair.
+
+    Inputs:
+    - strategy_classes: list of the strategy classes to trade.
+    - stock_pair_labels_list: list of the (stock A label, stock B label) pairs to trade.
+    - position_limit: the position limit of each pair portfolio.
+    - data_source: the dataset to slice into windows, either the filename of a CSV file in the
+      data directory or a DataFrame.
+    - formation_days, trading_days, step_days: the sizes of the windows (see make_windows).
+    - cash: the initial cash of each pair portfolio in each window.
+    - trading_fee: the transaction fee of each pair portfolio, as a fraction of the amount
+      traded (see trading.execute_trades).
+    - carry_state: whether strategies carry their state on from the window before.
+    - num_workers: the number of worker processes. Defaults to the number of CPUs. With one
+      worker and no executor the windows run in this process.
+    - executor: an existing concurrent.futures executor to run the windows on. If None a new
+      process pool is created.
+
+    Returns:
+    - A DataFrame with one row per window, strategy and pair, in that order. The columns are
+      'window', 'formation_start', 'trading_start' and 'trading_end' (the first and last
+      dates of the periods), 'strategy', 'stock_a', 'stock_b', 'final_value', 'return',
+      'max_drawdown' and 'num_trades'.
+    """
+    stock_pair_labels_list = [tuple(stock_pair_labels)
+                              for stock_pair_labels in stock_pair_labels_list]
+    num_days = len(data.get_data(data_source))
+    windows = list(enumerate(make_windows(num_days, formation_days, trading_days, step_days)))
+    tasks = _make_tasks(data_source, windows, strategy_classes, stock_pair_labels_list,
+                        position_limit, cash, trading_fee, carry_state)
+
+    if num_workers is None:
+        num_workers = os.cpu_count() or 1
+    num_workers = max(1, min(num_workers, len(tasks)))
+    if executor is None and num_workers == 1:
+        task_results = [_run_task(task) for task in tasks]
+    else:
+        # Publish the dataset once, so the workers share one copy of the prices rather than
+        # each task pickling or loading its own
+        with data.shared_data_sources(data_source) as (shared_data_source,):
+            tasks = _make_tasks(shared_data_source, windows, strategy_classes,
+                                stock_pair_labels_list, position_limit, cash, trading_fee,
+                                carry_state)
+            if executor is not None:
+                task_results = list(executor.map(_run_task, tasks))
+            else:
+                # Imported here, as starting worker processes is the only use of
+                # concurrent.futures and importing it slows down the start of every backtest
+                # pylint: disable-next=import-outside-toplevel
+                from concurrent.futures import ProcessPoolExecutor
+                with ProcessPoolExecutor(max_workers=num_workers) as new_executor:
+                    task_results = list(new_executor.map(_run_task, tasks))
+
+    rows = [row for task_result in task_results for row in task_result]
+    columns = ['window', 'formation_start', 'trading_start', 'trading_end', 'strategy',
+               'stock_a', 'stock_b', 'final_value', 'return', 'max_drawdown', 'num_trades']
+    results = pd.DataFrame(rows, columns=columns)
+    # The tasks of carry_state=True each hold one strategy, so put the rows in window order
+    return results.sort_values('window', kind='stable', ignore_index=True)
+
+def simulate_window(df, window, strategy_classes, stock_pair_labels_list, position_limit,
+                    cash=10, trading_fee=0.0, previous_master_portfolio=None):
+    """
+    Simulate one walk-forward window and return its master portfolio.
+
+    Inputs:
+    - df: the DataFrame of the whole dataset.
+    - window: the (formation_start, trading_start, trading_end) row indices of the window.
+    - strategy_classes, stock_pair_labels_list, position_limit, cash, trading_fee: as in
+      run_walk_forward.
+    - previous_master_portfolio: the master portfolio of the window before, whose trading
+      period ends the day before the trading period of this window starts, to carry the
+      state of the strategies on from. If None every strategy starts from the formation
+      period.
+    """
+    formation_start, trading_start, trading_end = window
+    # iloc slices of the price matrix are views, so no prices are copied
+    df_formation = df.iloc[formation_start:trading_start]
+    df_trading = df.iloc[trading_start:trading_end]
+    master_portfolio = portfolio.MasterPortfolio(
+        position_limit, df_formation, df_trading, trading_fee=trading_fee,
+        name=f"{df_trading.index[0]:%Y-%m-%d} to {df_trading.index[-1]:%Y-%m-%d}")
+    for strategy_class in strategy_classes:
+        for stock_pair_labels in stock_pair_labels_list:
+            pair_portfolio = portfolio.PairPortfolio(stock_pair_labels, strategy_class,
+                                                     master_portfolio, cash=cash)
+            pair_portfolio.trading_fee = trading_fee
+            master_portfolio.add_pair_portfolio(pair_portfolio)
+
+    if previous_master_portfolio is not None:
+        for pair_portfolio, previous_pair_portfolio in \
+                zip(master_portfolio.pair_portfolios, previous_master_portfolio.pair_portfolios):
+            carry_state = getattr(pair_portfolio.strategy, 'carry_state', None)
+            if carry_state is not None:
+                carry_state(previous_pair_portfolio.strategy)
+
+    vectorized.simulate_pair_portfolios(df_trading, master_portfolio.pair_portfolios)
+    return master_portfolio
+
+def _make_tasks(data_source, windows, strategy_classes, stock_pair_labels_list, position_limit,
+                cash, trading_fee, carry_state):
+    """
+    Return the list of tasks for _run_task: one per strategy class with carry_state=True, as
+    the windows of each strategy then depend on each other, and otherwise one per window.
+    """
+    if carry_state:
+        return [(data_source, windows, [strategy_class], stock_pair_labels_list, position_limit,
+                 cash, trading_fee, True) for strategy_class in strategy_classes]
+    return [(data_source, [window], strategy_classes, stock_pair_labels_list, position_limit,
+             cash, trading_fee, False) for window in windows]
+
+def _run_task(task):
+    """
+    Simulate a list of windows one after another and return a list of result rows.
+    """
+    (data_source, windows, strategy_classes, stock_pair_labels_list, position_limit, cash,
+     trading_fee, carry_state) = task
+    df = data.get_data(data_source)
+    rows = []
+    previous_master_portfolio, previous_trading_end = None, None
+    for window_index, window in windows:
+        formation_start, trading_start, trading_end = window
+        if previous_trading_end != trading_start:
+            # The trading periods are not contiguous, so there is no state to carry on
+            previous_master_portfolio = None
+        master_portfolio = simulate_window(df, window, strategy_classes, stock_pair_labels_list,
+                                           position_limit, cash, trading_fee,
+                                           previous_master_portfolio)
+        for pair_portfolio in master_portfolio.pair_portfolios:
+            rows.append({
+                'window': window_index,
+                'formation_start': df.index[formation_start],
+                'trading_start': df.index[trading_start],
+                'trading_end': df.index[trading_end - 1],
+                'strategy': pair_portfolio.strategy.__class__.__name__,
+                'stock_a': pair_portfolio.stock_pair_labels[0],
+                'stock_b': pair_portfolio.stock_pair_labels[1],
+                'final_value': pair_portfolio.portfolio_value,
+                'return': pair_portfolio.portfolio_value / cash - 1,
+                'max_drawdown': calc_max_drawdown(pair_portfolio.portfolio_value_over_time),
+                'num_trades': calc_num_trades(pair_portfolio.position_over_time)})
+        if carry_state:
+            previous_master_portfolio, previous_trading_end = master_portfolio, trading_end
+    return rows
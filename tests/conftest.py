@@ -0,0 +1,66 @@
+"""
+Helpers shared by the tests which run the engines (trading.py, vectorized.py and events.py)
+on the same mock data and compare their results.
+"""
+from unittest.mock import patch
+import numpy as np
+import pandas as pd
+import pytest
+from pairs_trading_oaf import portfolio, strategies
+
+STRATEGY_CLASSES = [strategies.StrategyA,
+                    strategies.StrategyB,
+                    strategies.StrategyC,
+                    strategies.StrategyD,
+                    strategies.StrategyE]
+VALUE_STRINGS = ["cash", "portfolio_value", "ratio", "shares", "stock_pair_prices"]
+
+def make_mock_data(seed, num_days=300):
+    """
+    Make mock training and testing data for three stocks that follow random walks.
+    """
+    rng = np.random.default_rng(seed)
+    mock_data = pd.DataFrame(
+        {label: 100 * np.exp(np.cumsum(rng.normal(0, 0.03, num_days)))
+         for label in ['StockA', 'StockB', 'StockC']},
+        index=pd.date_range(start='2021-01-01', periods=num_days, freq='D'))
+    return mock_data.iloc[:num_days // 2], mock_data.iloc[num_days // 2:]
+
+def run_engine(simulate_trading, strategy_class, df_train, df_test, position_limit=1,
+               trading_fee=0.001, weights=None):
+    """
+    Run one pair portfolio of stock A and stock B through simulate_trading on the mock data,
+    or a basket portfolio of the three stocks if weights are given.
+    """
+    def mock_read_csv(filename):
+        return df_train if filename == "training" else df_test
+
+    with patch('pairs_trading_oaf.data.read_csv', side_effect=mock_read_csv):
+        master_portfolio = portfolio.MasterPortfolio(position_limit, "training", "testing")
+        if weights is None:
+            traded_portfolio = portfolio.PairPortfolio(('StockA', 'StockB'), strategy_class,
+                                                       master_portfolio, cash=10)
+            master_portfolio.add_pair_portfolio(traded_portfolio)
+        else:
+            traded_portfolio = portfolio.BasketPortfolio(('StockA', 'StockB', 'StockC'),
+                                                         weights, strategy_class,
+                                                         master_portfolio, cash=10)
+            master_portfolio.add_basket_portfolio(traded_portfolio)
+        traded_portfolio.trading_fee = trading_fee
+        simulate_trading(master_portfolio)
+    return traded_portfolio
+
+def assert_same_over_time_values(expected, actual, value_strings=None):
+    """
+    Assert that two pair portfolios have the same over time values and end in the same state.
+    """
+    assert actual.position_over_time == expected.position_over_time
+    assert actual.dates_over_time == expected.dates_over_time
+    for value_string in value_strings or VALUE_STRINGS:
+        np.testing.assert_allclose(np.array(getattr(actual, value_string + "_over_time")),
+                                   np.array(getattr(expected, value_string + "_over_time")),
+                                   rtol=1e-12)
+    assert actual.position == expected.position
+    assert actual.cash == expected.cash
+    assert actual.portfolio_value == pytest.approx(expected.portfolio_value, rel=1e-12)
+    assert actual.date == expected.date
@@ -0,0 +1,84 @@
+"""
+Test routines for the pairs_trading_oaf.benchmarks module.
+"""
+import copy
+import json
+from unittest.mock import patch
+from pairs_trading_oaf import benchmarks
+
+TINY_SUITE = {'num_pairs': [2], 'num_days': [30], 'window_sizes': [10], 'repeat': 1}
+
+def test_run_benchmarks(tmp_path):
+    """
+    Test that a run writes every benchmark to the JSON results file.
+    """
+    output = tmp_path / "results.json"
+    with patch.dict(benchmarks.SUITES, {'tiny': TINY_SUITE}):
+        results = benchmarks.run_benchmarks('tiny', output=str(output), include_exports=False)
+
+    assert json.loads(output.read_text(encoding='utf-8')) == results
+    assert results['metadata']['suite'] == 'tiny'
+    names = [result['name'] for result in results['results']]
+    assert names.count('simulate_trading') == 3
+    assert names.count('read_csv') == 3
+    assert names.count('calculate_new_position') == len(benchmarks.STRATEGY_CLASSES)
+    assert names.count('import') == 1
+    for result in results['results']:
+        if result['name'] == 'import':
+            continue
+        assert result['seconds'] > 0
+        assert result['pair_days_per_second'] > 0
+        assert result['peak_memory_bytes'] >= 0
+
+def test_bench_import_time():
+    """
+    Test that the core modules do not import the deferred modules, and that importing a
+    deferred module is reported.
+    """
+    result = benchmarks.bench_import_time(1)
+    assert result['seconds'] > 0
+    assert result['peak_memory_bytes'] > 0
+    assert result['deferred_modules_imported'] == []
+
+    result = benchmarks.bench_import_time(1, ['matplotlib.pyplot'])
+    assert result['deferred_modules_imported'] == ['matplotlib']
+
+def test_compare_results(tmp_path):
+    """
+    Test that comparing two result files finds the benchmark which got slower.
+    """
+    old_results = {'metadata': {}, 'results': [
+        {'name': 'simulate_trading', 'params': {'num_pairs': 4}, 'seconds': 1.0,
+         'median_seconds': 1.0, 'pair_days_per_second': 1000, 'peak_memory_bytes': 10},
+        {'name': 'read_csv', 'params': {'source': 'csv'}, 'seconds': 1.0,
+         'median_seconds': 1.0, 'pair_days_per_second': 1000, 'peak_memory_bytes': 10}]}
+    new_results = copy.deepcopy(old_results)
+    new_results['results'][0]['seconds'] = 1.5
+    new_results['results'][1]['seconds'] = 0.5
+
+    comparison = benchmarks.compare_results(old_results, new_results)
+    assert comparison['status'].tolist() == ['slower', 'faster']
+    assert comparison['ratio'].tolist() == [1.5, 0.5]
+
+    old_file, new_file = tmp_path / "old.json", tmp_path / "new.json"
+    old_file.write_text(json.dumps(old_results), encoding='utf-8')
+    new_file.write_text(json.dumps(new_results), encoding='utf-8')
+    assert benchmarks.main(['compare', str(old_file), str(new_file)]) == 1
+    assert benchmarks.main(['compare', str(old_file), str(old_file)]) == 0
+
+def test_bench_exports_keeps_backend(tmp_path):
+    """
+    Test that the exports are benchmarked without changing the matplotlib backend of the
+    calling process.
+    """
+    import matplotlib # pylint: disable=import-outside-toplevel
+    original_backend = matplotlib.get_backend()
+    matplotlib.use('pdf')
+    try:
+        training_csv, testing_csv = benchmarks.write_synthetic_data(str(tmp_path), 2, 20, 30, 0)
+        results = benchmarks.bench_exports(training_csv, testing_csv, 1,
+                                           str(tmp_path / 'plots'))
+        assert [result['name'] for result in results] == ['export'] * 3
+        assert matplotlib.get_backend() == 'pdf'
+    finally:
+        matplotlib.use(original_backend)
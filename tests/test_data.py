@@ -2,6 +2,15 @@
 Test routines for the pairs_trading_oaf.data module.
 """
 
+import os
+import pickle
+import subprocess
+import sys
+import time
+from concurrent.futures import ProcessPoolExecutor
+from multiprocessing import shared_memory
+from unittest.mock import patch
+import numpy as np
 import pytest
 import pandas as pd
 from pairs_trading_oaf import data  # Replace with your actual module import
@@ -54,3 +63,212 @@ def test_read_csv_content_check(mock_csv):
     df = data.read_csv(str(mock_csv))
     assert 'SomeColumnName' in df.columns, "DataFrame should have a specific column."
     assert len(df) > 0, "DataFrame should not be empty."
+
+# pylint: disable=redefined-outer-name
+def test_read_csv_is_cached(mock_csv):
+    """
+    Test whether a file is only parsed once when it is read several times.
+    """
+    data.clear_cache()
+    with patch('pandas.read_csv', wraps=pd.read_csv) as mock_pandas_read_csv:
+        df1 = data.read_csv(str(mock_csv))
+        df2 = data.read_csv(str(mock_csv))
+    assert mock_pandas_read_csv.call_count == 1
+    assert df1.equals(df2)
+
+# pylint: disable=redefined-outer-name
+def test_read_csv_reparses_modified_file(mock_csv):
+    """
+    Test whether a file is parsed again when its modification time changes.
+    """
+    data.clear_cache()
+    df = data.read_csv(str(mock_csv))
+    new_df = df.copy()
+    new_df['SomeColumnName'] = [1, 2, 3, 4, 5]
+    new_df.to_csv(mock_csv)
+    stat = os.stat(mock_csv)
+    os.utime(mock_csv, ns=(stat.st_atime_ns, stat.st_mtime_ns + 10**9))
+    df = data.read_csv(str(mock_csv))
+    assert df['SomeColumnName'].tolist() == [1, 2, 3, 4, 5]
+
+# pylint: disable=redefined-outer-name
+def test_read_csv_cache_eviction_and_invalidation(mock_csv, tmp_path):
+    """
+    Test the least recently used eviction and the invalidate function.
+    """
+    data.clear_cache()
+    other_csv = tmp_path / "other_mock_data.csv"
+    pd.read_csv(mock_csv).to_csv(other_csv, index=False)
+    with patch('pairs_trading_oaf.data.CACHE_MAX_SIZE', 1), \
+         patch('pandas.read_csv', wraps=pd.read_csv) as mock_pandas_read_csv:
+        data.read_csv(str(mock_csv))
+        data.read_csv(str(other_csv))
+        data.read_csv(str(mock_csv))
+        assert mock_pandas_read_csv.call_count == 3
+        data.invalidate(str(mock_csv))
+        data.read_csv(str(mock_csv))
+        assert mock_pandas_read_csv.call_count == 4
+
+# pylint: disable=redefined-outer-name
+def test_read_csv_returns_read_only_data(mock_csv):
+    """
+    Test whether changing the returned DataFrame in place raises an error and does not
+    change the cached data.
+    """
+    data.clear_cache()
+    df = data.read_csv(str(mock_csv))
+    with pytest.raises(ValueError):
+        df.iloc[0, 0] = -1
+    assert data.read_csv(str(mock_csv)).iloc[0, 0] == 100
+
+@pytest.fixture
+def mock_price_csv(tmp_path):
+    """
+    Create a mock CSV file of price data, with float columns, for testing.
+    """
+    df = pd.DataFrame({
+        'Closing Date': pd.date_range(start='2021-01-01', periods=5, freq='D'),
+        'StockA': [100.0, 101.0, 102.0, 103.0, 104.0],
+        'StockB': [200.0, 201.0, float('nan'), 203.0, 204.0]
+    })
+    df.set_index('Closing Date', inplace=True)
+
+    csv_file = tmp_path / "mock_price_data.csv"
+    df.to_csv(csv_file)
+    return csv_file
+
+# pylint: disable=redefined-outer-name
+def test_load_price_store(mock_price_csv):
+    """
+    Test whether the price store is memory-mapped and holds the same data as the CSV file.
+    """
+    price_matrix = data.load_price_store(str(mock_price_csv))
+    assert isinstance(price_matrix.prices, np.memmap)
+    assert price_matrix.labels == ['StockA', 'StockB']
+    expected = pd.read_csv(mock_price_csv, index_col=0, parse_dates=True)
+    assert price_matrix.to_frame().equals(expected)
+
+# pylint: disable=redefined-outer-name
+def test_read_csv_uses_price_store(mock_price_csv):
+    """
+    Test whether read_csv opens the price store instead of parsing the CSV file again,
+    and rebuilds the store when the CSV file changes without replacing the memory-mapped
+    arrays of the old store.
+    """
+    data.build_price_store(str(mock_price_csv))
+    data.clear_cache()
+    with patch('pandas.read_csv', wraps=pd.read_csv) as mock_pandas_read_csv:
+        df = data.read_csv(str(mock_price_csv))
+    assert mock_pandas_read_csv.call_count == 0
+    assert df['StockA'].tolist() == [100.0, 101.0, 102.0, 103.0, 104.0]
+    old_prices_filename = data.load_price_store(str(mock_price_csv)).prices.filename
+
+    new_df = df.copy()
+    new_df['StockA'] = [1.0, 2.0, 3.0, 4.0, 5.0]
+    new_df.to_csv(mock_price_csv)
+    stat = os.stat(mock_price_csv)
+    os.utime(mock_price_csv, ns=(stat.st_atime_ns, stat.st_mtime_ns + 10**9))
+    price_matrix = data.load_price_store(str(mock_price_csv))
+    assert price_matrix.prices[:, 0].tolist() == [1.0, 2.0, 3.0, 4.0, 5.0]
+    # The arrays of the old store, which df still maps, were not overwritten
+    assert df['StockA'].tolist() == [100.0, 101.0, 102.0, 103.0, 104.0]
+    assert os.path.samefile(os.path.dirname(price_matrix.prices.filename),
+                            os.path.dirname(old_prices_filename))
+    assert price_matrix.prices.filename != old_prices_filename
+
+# pylint: disable=redefined-outer-name
+def test_build_price_store_rejects_non_price_data(mock_csv):
+    """
+    Test whether building a price store from a CSV file without float columns raises an error.
+    """
+    with pytest.raises(ValueError):
+        data.build_price_store(str(mock_csv))
+
+# pylint: disable=redefined-outer-name
+def test_share_data(mock_price_csv):
+    """
+    Test whether shared price data pickles without its prices, is read through read-only views
+    of the segment here and in a worker process, and is unlinked when it is closed.
+    """
+    expected = data.read_csv(str(mock_price_csv))
+    with data.share_data(str(mock_price_csv)) as shared:
+        assert shared.is_owner
+        unpickled = pickle.loads(pickle.dumps(shared))
+        assert not unpickled.is_owner
+        assert len(pickle.dumps(shared)) < 500
+
+        df = data.get_data(unpickled)
+        assert df.equals(expected)
+        assert np.shares_memory(df['StockB'].to_numpy(), shared.to_price_matrix().prices)
+        with pytest.raises(ValueError):
+            df.iloc[0, 0] = -1
+        with ProcessPoolExecutor(max_workers=1) as executor:
+            assert executor.submit(data.get_data, unpickled).result().equals(expected)
+
+    # Views which are still in use stay valid, but the segment can no longer be attached to
+    assert df['StockA'].tolist() == [100.0, 101.0, 102.0, 103.0, 104.0]
+    data.clear_cache()
+    with pytest.raises(ValueError):
+        data.get_data(shared)
+
+def test_share_data_unlinked_after_crash(mock_price_csv):
+    """
+    Test whether the segment of a process which is killed is unlinked.
+    """
+    # The process waits to be killed with Popen.kill, which also works on Windows
+    code = ("import time\n"
+            "from pairs_trading_oaf import data\n"
+            f"shared = data.share_data({str(mock_price_csv)!r})\n"
+            "print(shared.name, flush=True)\n"
+            "time.sleep(60)\n")
+    with subprocess.Popen([sys.executable, '-c', code], stdout=subprocess.PIPE, text=True,
+                          cwd=os.path.dirname(os.path.dirname(__file__))) as process:
+        name = process.stdout.readline().strip()
+        process.kill()
+        process.wait()
+    assert name
+    for _ in range(100):
+        try:
+            shared_memory.SharedMemory(name=name).close()
+        except FileNotFoundError:
+            break
+        time.sleep(0.05)
+    else:
+        pytest.fail(f"shared memory segment {name} was not unlinked")
+
+# pylint: disable=redefined-outer-name
+def test_shared_data_sources(mock_price_csv, mock_csv):
+    """
+    Test whether each data source of price data is shared once for the duration of the block,
+    and other data sources are passed through.
+    """
+    price_csv, other_csv = str(mock_price_csv), str(mock_csv)
+    with pytest.raises(ValueError):
+        data.share_data(other_csv)
+    with data.shared_data_sources(price_csv, other_csv, price_csv) as data_sources:
+        shared, other, shared_again = data_sources
+        assert isinstance(shared, data.SharedPriceMatrix)
+        assert shared_again is shared
+        assert other == other_csv
+        assert data.get_data(shared).equals(data.read_csv(price_csv))
+    data.clear_cache()
+    with pytest.raises(ValueError):
+        data.get_data(shared)
+
+# pylint: disable=redefined-outer-name
+def test_get_availability(mock_price_csv):
+    """
+    Test whether the availability mask marks the missing prices, is computed once for a CSV
+    file, and is the same for shared price data.
+    """
+    available = data.get_availability(str(mock_price_csv))
+    assert available['StockA'].all()
+    assert available['StockB'].tolist() == [True, True, False, True, True]
+    assert data.get_availability(str(mock_price_csv)) is available
+    with pytest.raises(ValueError):
+        available.iloc[0, 0] = False
+
+    df = data.read_csv(str(mock_price_csv)).copy()
+    assert data.get_availability(df).equals(available)
+    with data.share_data(str(mock_price_csv)) as shared:
+        assert data.get_availability(shared).equals(available)
@@ -0,0 +1,184 @@
+"""
+Test routines for the pairs_trading_oaf.equivalence module, and of the candidate engines
+against the daily loop of trading.simulate_trading on mock data.
+"""
+import numpy as np
+import pandas as pd
+import pytest
+from pairs_trading_oaf import equivalence, strategies, trading, vectorized
+from pairs_trading_oaf.history import HistoryColumn
+from tests.conftest import (STRATEGY_CLASSES, assert_same_over_time_values, make_mock_data,
+                            run_engine)
+
+# The parallel engine is left out, as its worker processes do not see the mocked data
+ENGINE_NAMES = ['vectorized', 'events']
+
+def test_make_synthetic_dataset():
+    """
+    Test that the synthetic data is reproducible from the seed and has late-listed stocks.
+    """
+    df_train, df_test = equivalence.make_synthetic_dataset(3)
+    other_df_train, _ = equivalence.make_synthetic_dataset(3)
+    pd.testing.assert_frame_equal(df_train, other_df_train)
+    assert len(df_train) == 250 and len(df_test) == 250
+    assert np.isnan(df_train['Stock0'].iloc[0]) and not np.isnan(df_train['Stock0'].iloc[-1])
+    assert df_train['Stock1'].isna().all()
+    assert np.isnan(df_test['Stock1'].iloc[0]) and not np.isnan(df_test['Stock1'].iloc[-1])
+    assert equivalence.default_pairs(df_test) == [('Stock0', 'Stock1'), ('Stock2', 'Stock3'),
+                                                  ('Stock4', 'Stock5')]
+    assert equivalence.default_baskets(df_test) \
+        == [(('Stock0', 'Stock1', 'Stock2'), equivalence.BASKET_WEIGHTS),
+            (('Stock3', 'Stock4', 'Stock5'), equivalence.BASKET_WEIGHTS)]
+
+def test_check_engine():
+    """
+    Test that the vectorized engine reproduces the reference on synthetic data, including
+    the basket portfolios.
+    """
+    df_train, df_test = equivalence.make_synthetic_dataset(0)
+    divergences = equivalence.check_engine(vectorized.simulate_trading, df_train, df_test,
+                                           position_limit=20.0)
+    assert len(divergences) == 0
+    assert divergences.columns.tolist() == equivalence.DIVERGENCE_COLUMNS[2:]
+
+def test_check_engine_baskets():
+    """
+    Test that a divergence of a basket portfolio is reported.
+    """
+    df_train, df_test = equivalence.make_synthetic_dataset(1)
+
+    def perturbed_engine(master_portfolio):
+        vectorized.simulate_trading(master_portfolio)
+        basket_portfolio = master_portfolio.basket_portfolios[-1]
+        cash = basket_portfolio.cash_over_time.values().copy()
+        cash[3:] += 0.5
+        basket_portfolio.cash_over_time = HistoryColumn(float)
+        basket_portfolio.cash_over_time.extend(cash)
+
+    divergences = equivalence.check_engine(perturbed_engine, df_train, df_test)
+    assert divergences[['strategy', 'stocks', 'field', 'day']].values.tolist() \
+        == [['StrategyF', 'Stock3 / Stock4 / Stock5', 'cash', 3]]
+
+def test_check_engine_divergence():
+    """
+    Test that the first divergent day, pair and value of a broken engine are reported, and
+    that differences within the tolerances are accepted.
+    """
+    df_train, df_test = equivalence.make_synthetic_dataset(1)
+
+    def perturbed_engine(change):
+        def simulate_trading(master_portfolio):
+            vectorized.simulate_trading(master_portfolio)
+            pair_portfolio = master_portfolio.pair_portfolios[4]
+            cash = pair_portfolio.cash_over_time.values().copy()
+            cash[7:] += change
+            pair_portfolio.cash_over_time = HistoryColumn(float)
+            pair_portfolio.cash_over_time.extend(cash)
+        return simulate_trading
+
+    divergences = equivalence.check_engine(perturbed_engine(1e-12), df_train, df_test)
+    assert len(divergences) == 0
+    divergences = equivalence.check_engine(perturbed_engine(1e-12), df_train, df_test,
+                                           rtol=0, atol=0)
+    assert divergences['field'].tolist().count('cash') == 1
+
+    divergences = equivalence.check_engine(perturbed_engine(0.5), df_train, df_test)
+    assert len(divergences) == 1
+    divergence = divergences.iloc[0]
+    assert (divergence['strategy'], divergence['stocks']) == ('StrategyB', 'Stock2 / Stock3')
+    assert divergence['field'] == 'cash'
+    assert divergence['day'] == 7
+    assert divergence['date'] == df_test.index[7]
+    assert divergence['candidate'] == pytest.approx(divergence['reference'] + 0.5)
+
+def test_compare_pair_portfolios_missing_days():
+    """
+    Test that days missing from the candidate are reported as a divergence.
+    """
+    df_train, df_test = equivalence.make_synthetic_dataset(2)
+    divergences = equivalence.check_engine(
+        lambda master_portfolio: vectorized.simulate_pair_portfolios(
+            df_test.iloc[:-1], master_portfolio.traded_portfolios),
+        df_train, df_test, equivalence.default_pairs(df_test)[:1],
+        [equivalence.STRATEGY_CLASSES[0]])
+    assert divergences['day'].tolist() == [len(df_test) - 1] * len(divergences)
+    assert 'dates' in divergences['field'].tolist()
+    assert divergences['candidate'].isna().all()
+
+def test_main(capsys):
+    """
+    Test that the command line interface checks the engines and returns 0 when they
+    reproduce the reference.
+    """
+    assert equivalence.main(['--engines', 'vectorized', '--datasets', 'Crypto',
+                             '--num-synthetic', '1', '--seed', '4']) == 0
+    assert "All engines reproduce the reference." in capsys.readouterr().out
+
+@pytest.mark.parametrize("engine_name", ENGINE_NAMES)
+@pytest.mark.parametrize("strategy_class", STRATEGY_CLASSES)
+@pytest.mark.parametrize("seed", [0, 1, 2])
+def test_engine_matches_daily_loop(engine_name, strategy_class, seed):
+    """
+    Test that each engine gives the same results as the daily loop.
+    """
+    df_train, df_test = make_mock_data(seed)
+    expected = run_engine(trading.simulate_trading, strategy_class, df_train, df_test)
+    actual = run_engine(equivalence.CANDIDATE_ENGINES[engine_name], strategy_class, df_train,
+                        df_test)
+    assert_same_over_time_values(expected, actual)
+
+@pytest.mark.parametrize("engine_name", ENGINE_NAMES)
+@pytest.mark.parametrize("strategy_class", STRATEGY_CLASSES)
+@pytest.mark.parametrize("listing_day", [0, 50, 170])
+def test_engine_late_listing(engine_name, strategy_class, listing_day):
+    """
+    Test that each engine gives the same results as the daily loop when a stock is listed
+    during the training or the testing period and some prices are missing, and that the stock
+    is not traded before it is listed.
+    """
+    df_train, df_test = make_mock_data(6)
+    mock_data = pd.concat([df_train, df_test])
+    mock_data.iloc[:listing_day, 1] = np.nan
+    mock_data.iloc[[200, 201], 0] = np.nan
+    df_train, df_test = mock_data.iloc[:150], mock_data.iloc[150:]
+    expected = run_engine(trading.simulate_trading, strategy_class, df_train, df_test)
+    actual = run_engine(equivalence.CANDIDATE_ENGINES[engine_name], strategy_class, df_train,
+                        df_test)
+    assert_same_over_time_values(expected, actual)
+    assert actual.strategy.warm_up_days == expected.strategy.warm_up_days == 0
+
+    portfolio_values = np.array(expected.portfolio_value_over_time)
+    assert not np.isnan(portfolio_values).any()
+    unlisted_days = max(listing_day - 150, 0)
+    assert not np.array(expected.position_over_time)[:unlisted_days].any()
+    assert (portfolio_values[:unlisted_days] == 10).all()
+
+@pytest.mark.parametrize("engine_name", ENGINE_NAMES)
+@pytest.mark.parametrize("strategy_class", STRATEGY_CLASSES)
+def test_engine_negative_portfolio_value(engine_name, strategy_class):
+    """
+    Test each engine when the position limit is so large that the portfolio value goes
+    negative, which forces the position to "no position".
+    """
+    df_train, df_test = make_mock_data(3)
+    expected = run_engine(trading.simulate_trading, strategy_class, df_train, df_test,
+                          position_limit=500, trading_fee=0.01)
+    actual = run_engine(equivalence.CANDIDATE_ENGINES[engine_name], strategy_class, df_train,
+                        df_test, position_limit=500, trading_fee=0.01)
+    assert np.min(expected.portfolio_value_over_time) < 0
+    assert_same_over_time_values(expected, actual)
+
+@pytest.mark.parametrize("engine_name", ENGINE_NAMES)
+def test_engine_baskets(engine_name):
+    """
+    Test that each engine trades basket portfolios like the daily loop.
+    """
+    df_train, df_test = make_mock_data(2)
+    weights = [0.5, -1, 0.5]
+    expected = run_engine(trading.simulate_trading, strategies.StrategyF, df_train, df_test,
+                          weights=weights)
+    actual = run_engine(equivalence.CANDIDATE_ENGINES[engine_name], strategies.StrategyF,
+                        df_train, df_test, weights=weights)
+    assert np.any(expected.position_over_time)
+    assert_same_over_time_values(expected, actual, ["cash", "portfolio_value", "shares",
+                                                    "stock_prices", "basket_value"])
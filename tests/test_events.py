@@ -0,0 +1,78 @@
+"""
+Test routines for the pairs_trading_oaf.events module.
+
+The tests which compare the results of the event-driven engine with trading.simulate_trading
+are run for every engine in test_equivalence.py, so these tests cover the trade log.
+"""
+from unittest.mock import patch
+import numpy as np
+import pytest
+from pairs_trading_oaf import events, strategies, trading
+from tests.conftest import (STRATEGY_CLASSES, assert_same_over_time_values, make_mock_data,
+                            run_engine)
+
+@pytest.mark.parametrize("strategy_class", STRATEGY_CLASSES)
+def test_trade_log_records_changes_of_position(strategy_class):
+    """
+    Test that the trade log records one trade for each change of position.
+    """
+    df_train, df_test = make_mock_data(0)
+    expected = run_engine(trading.simulate_trading, strategy_class, df_train, df_test)
+    actual = run_engine(events.simulate_trading, strategy_class, df_train, df_test)
+    positions = np.array(expected.position_over_time)
+    num_changes = np.count_nonzero(np.diff(positions, prepend=strategies.NO_POSITION))
+    assert len(actual.trade_logs) == 1
+    assert len(actual.trade_logs[0]) == num_changes
+
+def test_trade_log():
+    """
+    Test that by default only the trades are recorded, and that the daily values are
+    reconstructed from them on demand.
+    """
+    df_train, df_test = make_mock_data(1)
+    expected = run_engine(trading.simulate_trading, strategies.StrategyA, df_train, df_test)
+    actual = run_engine(events.simulate_trading, strategies.StrategyA, df_train, df_test)
+    assert len(actual.cash_over_time) == 0
+    assert actual.cash == expected.cash
+
+    trade_log = actual.trade_logs[0]
+    trades = trade_log.to_frame()
+    assert trades.columns.tolist() == ['day', 'date', 'old_position', 'new_position', 'fee',
+                                       'cash', 'StockA', 'StockB']
+    assert len(trades) > 1
+    assert trades['date'].tolist() == [df_test.index[day] for day in trades['day']]
+    assert trades['old_position'].tolist()[1:] == trades['new_position'].tolist()[:-1]
+    assert trades['cash'].tolist() \
+        == [expected.cash_over_time[day] for day in trades['day']]
+    # The first trade only opens a position, of position_limit dollars in each stock
+    assert trades['fee'].iloc[0] == pytest.approx(2 * 0.001)
+
+    with patch('pairs_trading_oaf.data.read_csv', return_value=df_test):
+        events.reconstruct_over_time_values(actual)
+    assert_same_over_time_values(expected, actual)
+
+def test_trade_logs_over_periods():
+    """
+    Test that simulating two trading periods one after another keeps the trade log of each
+    period, and that the daily values of both periods are reconstructed from them.
+    """
+    df_train, df_test = make_mock_data(2)
+    df_first, df_second = df_test.iloc[:75], df_test.iloc[75:]
+
+    def simulate_periods(simulate_pair_portfolios):
+        def simulate_trading(master_portfolio):
+            for df_period in [df_first, df_second]:
+                simulate_pair_portfolios(df_period, master_portfolio.traded_portfolios)
+        return simulate_trading
+
+    expected = run_engine(simulate_periods(trading.simulate_pair_portfolios),
+                          strategies.StrategyA, df_train, df_test)
+    actual = run_engine(simulate_periods(events.simulate_pair_portfolios),
+                        strategies.StrategyA, df_train, df_test)
+    assert len(actual.trade_logs) == 2
+    assert all(len(trade_log) > 0 for trade_log in actual.trade_logs)
+    assert actual.trade_logs[1].to_frame()['date'].min() >= df_second.index[0]
+
+    for trade_log in actual.trade_logs:
+        events.reconstruct_over_time_values(actual, trade_log=trade_log)
+    assert_same_over_time_values(expected, actual)
@@ -0,0 +1,70 @@
+"""
+Test routines for the pairs_trading_oaf.history module.
+"""
+import pickle
+import numpy as np
+import pandas as pd
+from pairs_trading_oaf.history import HistoryColumn
+
+def test_history_column_reads_like_a_list():
+    """
+    Test that a column of floats can be read like the list it replaces.
+    """
+    column = HistoryColumn(float)
+    for value in [1.0, 2.5, 4.0]:
+        column.append(value)
+    column.extend(np.array([5.0, 6.0]))
+
+    assert len(column) == 5
+    assert column == [1.0, 2.5, 4.0, 5.0, 6.0]
+    assert column[-1] == 6.0 and isinstance(column[-1], float)
+    assert column[1:3] == [2.5, 4.0]
+    assert list(column) == [1.0, 2.5, 4.0, 5.0, 6.0]
+    assert np.array_equal(np.array(column), [1.0, 2.5, 4.0, 5.0, 6.0])
+
+def test_history_column_of_tuples():
+    """
+    Test that a column with a width stores tuples as rows of a 2D array.
+    """
+    column = HistoryColumn(float, width=2)
+    column.append((0, 0))
+    column.append((0.5, -0.25))
+
+    assert column == [(0.0, 0.0), (0.5, -0.25)]
+    assert column[-1] == (0.5, -0.25)
+    assert column.values().shape == (2, 2)
+
+def test_history_column_dates():
+    """
+    Test that timestamps are stored as datetime64 and read back as pandas Timestamps,
+    and that other dates are stored as objects.
+    """
+    dates = pd.date_range(start='2021-01-01', periods=3, freq='D')
+    column = HistoryColumn()
+    column.append(dates[0])
+    column.extend(dates[1:])
+    assert column.values().dtype == np.dtype('datetime64[ns]')
+    assert column == list(dates)
+    assert column[0] == dates[0]
+
+    column = HistoryColumn()
+    column.append("2021-01-01")
+    assert column == ["2021-01-01"]
+
+def test_history_column_reserve_and_pickle():
+    """
+    Test that reserving capacity keeps the recorded values and that pickling only keeps the
+    recorded values.
+    """
+    column = HistoryColumn(float)
+    column.append(1.0)
+    column.reserve(1000)
+    values = column.values()
+    column.append(2.0)
+    assert column == [1.0, 2.0]
+    assert np.shares_memory(values, column.values())
+    assert not column.values().flags.writeable
+
+    unpickled_column = pickle.loads(pickle.dumps(column))
+    assert unpickled_column == [1.0, 2.0]
+    assert len(pickle.dumps(column)) < 1000
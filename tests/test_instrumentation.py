@@ -0,0 +1,125 @@
+"""
+Test routines for the pairs_trading_oaf.instrumentation module.
+"""
+from unittest.mock import patch
+import pandas as pd
+from pairs_trading_oaf import instrumentation, portfolio, trading
+
+class MockStrategy:
+    """
+    Mock strategy which goes long A short B on the first and fourth of the month, long B
+    short A on the second and holds no position on the third and fifth.
+    """
+    def __init__(self, pair_portfolio):
+        self.pair_portfolio = pair_portfolio
+
+    def calculate_new_position(self):
+        """
+        Calculate the new position from the day of the month.
+        """
+        return {1: "long A short B", 2: "long B short A", 3: "no position",
+                4: "long A short B", 5: "no position"}[self.pair_portfolio.date.day]
+
+class RecordingCollector(instrumentation.Collector):
+    """
+    Collector which records every call to its hooks.
+    """
+    def __init__(self):
+        self.calls = []
+
+    def on_start(self, pair_portfolios):
+        self.calls.append(('start', len(pair_portfolios)))
+
+    def on_day(self, pair_portfolio, date, phase_seconds):
+        assert len(phase_seconds) == len(instrumentation.PHASES)
+        assert all(seconds >= 0 for seconds in phase_seconds)
+        self.calls.append(('day', date.day))
+
+    def on_trade(self, pair_portfolio, date, old_position, new_position):
+        self.calls.append(('trade', date.day, str(old_position), str(new_position)))
+
+    def on_finish(self):
+        self.calls.append(('finish',))
+
+def make_master_portfolio(with_basket=False):
+    """
+    Make a master portfolio with two pair portfolios which use the mock strategy, and a
+    basket portfolio of the three stocks if with_basket is True.
+    """
+    master_portfolio = portfolio.MasterPortfolio(1, None, None)
+    for stock_pair_labels in [('StockA', 'StockB'), ('StockB', 'StockA')]:
+        pair_portfolio = portfolio.PairPortfolio(stock_pair_labels, MockStrategy,
+                                                 master_portfolio)
+        master_portfolio.add_pair_portfolio(pair_portfolio)
+    if with_basket:
+        basket_portfolio = portfolio.BasketPortfolio(('StockA', 'StockB', 'StockC'),
+                                                     [0.5, -1, 0.5], MockStrategy,
+                                                     master_portfolio)
+        master_portfolio.add_basket_portfolio(basket_portfolio)
+    return master_portfolio
+
+@patch('pairs_trading_oaf.data.read_csv')
+def test_collectors(mock_read_csv):
+    """
+    Test that the collectors are called with the phases and trades, and that instrumenting
+    the loop does not change the results.
+    """
+    mock_read_csv.return_value = pd.DataFrame(
+        {'StockA': [100.0, 101.0, 102.0, 103.0, 104.0],
+         'StockB': [200.0, 199.0, 202.0, 205.0, 204.0]},
+        index=pd.date_range(start='2021-01-01', periods=5, freq='D'))
+    expected = make_master_portfolio()
+    trading.simulate_trading(expected)
+
+    master_portfolio = make_master_portfolio()
+    profile = instrumentation.ProfileCollector()
+    recorder = RecordingCollector()
+    trading.simulate_trading(master_portfolio, collectors=[profile, recorder])
+
+    for actual_pair, expected_pair in zip(master_portfolio.pair_portfolios,
+                                          expected.pair_portfolios):
+        assert actual_pair.cash_over_time == expected_pair.cash_over_time
+        assert actual_pair.position_over_time == expected_pair.position_over_time
+
+    assert recorder.calls[0] == ('start', 2)
+    assert recorder.calls[-1] == ('finish',)
+    assert recorder.calls.count(('day', 3)) == 2
+    assert ('trade', 2, "long A short B", "long B short A") in recorder.calls
+
+    report = profile.report()
+    assert report['num_days'].tolist() == [5, 5]
+    assert report['num_trades'].tolist() == [5, 5]
+    assert report['num_flips'].tolist() == [1, 1]
+    assert (report['total_seconds'] > 0).all()
+    summary = profile.summary()
+    assert summary.loc['MockStrategy', 'num_pair_portfolios'] == 2
+    assert summary.loc['MockStrategy', 'num_trades'] == 10
+
+@patch('pairs_trading_oaf.data.read_csv')
+def test_collectors_basket(mock_read_csv):
+    """
+    Test that basket portfolios are instrumented and reported next to the pair portfolios.
+    """
+    mock_read_csv.return_value = pd.DataFrame(
+        {'StockA': [100.0, 101.0, 102.0, 103.0, 104.0],
+         'StockB': [200.0, 199.0, 202.0, 205.0, 204.0],
+         'StockC': [50.0, 51.0, 49.0, 52.0, 53.0]},
+        index=pd.date_range(start='2021-01-01', periods=5, freq='D'))
+    expected = make_master_portfolio(with_basket=True)
+    trading.simulate_trading(expected)
+
+    master_portfolio = make_master_portfolio(with_basket=True)
+    profile = instrumentation.ProfileCollector()
+    trading.simulate_trading(master_portfolio, collectors=[profile])
+    actual_basket = master_portfolio.basket_portfolios[0]
+    expected_basket = expected.basket_portfolios[0]
+    assert actual_basket.cash_over_time == expected_basket.cash_over_time
+    assert actual_basket.position_over_time == expected_basket.position_over_time
+
+    report = profile.report()
+    assert report['stocks'].tolist() == ['StockA_StockB', 'StockB_StockA',
+                                         'StockA_StockB_StockC']
+    assert report['num_days'].tolist() == [5, 5, 5]
+    assert report['num_trades'].tolist() == [5, 5, 5]
+    summary = profile.summary()
+    assert summary.loc['MockStrategy', 'num_pair_portfolios'] == 3
@@ -0,0 +1,154 @@
+"""
+Test routines for the pairs_trading_oaf.metrics module.
+"""
+import numpy as np
+import pandas as pd
+import pytest
+from pairs_trading_oaf import metrics, portfolio, strategies, vectorized
+from pairs_trading_oaf.positions import Position
+
+STOCK_PAIR_LABELS_LIST = [('StockA', 'StockB'), ('StockB', 'StockC')]
+
+@pytest.fixture
+def master_portfolio():
+    """
+    A master portfolio of StrategyA and StrategyD on two pairs, traded with the vectorized
+    engine on mock prices.
+    """
+    rng = np.random.default_rng(0)
+    num_days = 300
+    df = pd.DataFrame({
+        'StockA': 100 * np.exp(np.cumsum(rng.normal(0, 0.02, num_days))),
+        'StockB': 100 * np.exp(np.cumsum(rng.normal(0, 0.02, num_days))),
+        'StockC': 100 * np.exp(np.cumsum(rng.normal(0, 0.02, num_days)))
+    }, index=pd.date_range(start='2021-01-01', periods=num_days, freq='D'))
+    traded_portfolio = portfolio.MasterPortfolio(1, df.iloc[:150], df.iloc[150:])
+    for strategy_class in [strategies.StrategyA, strategies.StrategyD]:
+        for stock_pair_labels in STOCK_PAIR_LABELS_LIST:
+            traded_portfolio.add_pair_portfolio(
+                portfolio.PairPortfolio(stock_pair_labels, strategy_class, traded_portfolio,
+                                        cash=10))
+    vectorized.simulate_trading(traded_portfolio)
+    return traded_portfolio
+
+def test_run_length_encode():
+    """
+    Test that the runs of each row are found and do not run on from one row to the next.
+    """
+    rows, starts, lengths, run_values = metrics.run_length_encode([[0, 0, 1, 1, 1],
+                                                                   [1, 1, -1, 0, 0]])
+    assert rows.tolist() == [0, 0, 1, 1, 1]
+    assert starts.tolist() == [0, 2, 0, 2, 3]
+    assert lengths.tolist() == [2, 3, 2, 1, 2]
+    assert run_values.tolist() == [0, 1, 1, -1, 0]
+    _, starts, lengths, run_values = metrics.run_length_encode([5, 5, 5])
+    assert (starts.tolist(), lengths.tolist(), run_values.tolist()) == ([0], [3], [5])
+
+def test_calc_max_drawdown():
+    """
+    Test the maximum drawdown and its duration along the last axis.
+    """
+    portfolio_values = [[10, 12, 9, 11, 6, 13], [1, 2, 3, 4, 5, 6]]
+    assert metrics.calc_max_drawdown(portfolio_values).tolist() == pytest.approx([0.5, 0])
+    assert metrics.calc_max_drawdown_duration(portfolio_values).tolist() == [3, 0]
+    assert metrics.calc_max_drawdown([]) == 0
+
+def test_calc_ratios():
+    """
+    Test the Sharpe and Sortino ratios against their definitions.
+    """
+    portfolio_values = np.array([10, 11, 10.5, 12, 11.5, 13])
+    returns = portfolio_values[1:] / portfolio_values[:-1] - 1
+    assert metrics.calc_sharpe_ratio(portfolio_values, 1) \
+        == pytest.approx(returns.mean() / returns.std(ddof=1))
+    downside_deviation = np.sqrt(np.mean(np.minimum(returns, 0) ** 2))
+    assert metrics.calc_sortino_ratio(portfolio_values, 1) \
+        == pytest.approx(returns.mean() / downside_deviation)
+    assert np.isnan(metrics.calc_sharpe_ratio([10, 10, 10]))
+    assert np.isnan(metrics.calc_sortino_ratio([10, 11, 12]))
+
+def test_calc_turnover():
+    """
+    Test that a reversal trades twice as much as opening or closing a position.
+    """
+    positions = [[0, 1, 1, -1, 0], [0, 0, 0, 0, 0]]
+    turnover = metrics.calc_turnover(positions, np.full((2, 5), 10.0), 1, periods_per_year=5)
+    assert metrics.calc_num_position_changes(positions).tolist() == [3, 0]
+    assert turnover.tolist() == pytest.approx([2 * (1 + 2 + 1) / 10, 0])
+
+def test_calc_trades():
+    """
+    Test the holding periods and profits of closed and open trades.
+    """
+    positions = [[0, 1, 1, 0, -1, -1]]
+    cash = [[10, 10, 10, 11.5, 11.5, 11.5]]
+    portfolio_values = [[10, 10.5, 11, 11.5, 11, 12]]
+    trades = metrics.calc_trades(positions, cash, portfolio_values)
+    assert trades['position'].tolist() == [Position.LONG_A_SHORT_B, Position.LONG_B_SHORT_A]
+    assert trades['start'].tolist() == [1, 4]
+    assert trades['holding_period'].tolist() == [2, 2]
+    assert trades['pnl'].tolist() == pytest.approx([1.5, 0.5])
+    assert trades['is_open'].tolist() == [False, True]
+
+# pylint: disable=redefined-outer-name
+def test_calc_metrics(master_portfolio):
+    """
+    Test that the metrics of all the pair portfolios calculated at once match the metrics of
+    each pair portfolio on its own.
+    """
+    pair_portfolios = master_portfolio.pair_portfolios
+    metrics_df = metrics.calc_metrics(pair_portfolios)
+    assert len(metrics_df) == len(pair_portfolios)
+    assert metrics_df['strategy'].tolist() == ['StrategyA'] * 2 + ['StrategyD'] * 2
+    for row, pair_portfolio in zip(metrics_df.itertuples(), pair_portfolios):
+        portfolio_values = np.asarray(pair_portfolio.portfolio_value_over_time)
+        positions = [Position(position) for position in pair_portfolio.position_over_time]
+        assert row.final_value == pair_portfolio.portfolio_value
+        # With no trading fee all of the profit is made by the trades
+        assert row.total_trade_pnl == pytest.approx(row.final_value - 10)
+        assert row.max_drawdown == pytest.approx(metrics.calc_max_drawdown(portfolio_values))
+        assert row.num_days_no_position + row.num_days_long_A_short_B \
+            + row.num_days_long_B_short_A == len(positions)
+        num_opens = sum(position != Position.NO_POSITION and previous_position != position
+                        for position, previous_position
+                        in zip(positions, [Position.NO_POSITION] + positions[:-1]))
+        assert row.num_trades == num_opens
+        if num_opens > 0:
+            assert 0 <= row.hit_rate <= 1
+    assert metrics_df['num_trades'].sum() > 0
+
+    summary = metrics.summarise_by_strategy(metrics_df)
+    assert summary.index.tolist() == ['StrategyA', 'StrategyD']
+    assert summary.loc['StrategyA', 'final_value'] \
+        == pytest.approx(metrics_df['final_value'][:2].mean())
+
+def test_calc_metrics_baskets():
+    """
+    Test that basket portfolios get a stock column for each leg and that their turnover
+    counts each leg at its weight.
+    """
+    rng = np.random.default_rng(1)
+    num_days = 300
+    df = pd.DataFrame({label: 100 * np.exp(np.cumsum(rng.normal(0, 0.02, num_days)))
+                       for label in ['StockA', 'StockB', 'StockC']},
+                      index=pd.date_range(start='2021-01-01', periods=num_days, freq='D'))
+    traded_portfolio = portfolio.MasterPortfolio(1, df.iloc[:150], df.iloc[150:])
+    traded_portfolio.add_pair_portfolio(
+        portfolio.PairPortfolio(('StockA', 'StockB'), strategies.StrategyA, traded_portfolio,
+                                cash=10))
+    traded_portfolio.add_basket_portfolio(
+        portfolio.BasketPortfolio(('StockA', 'StockB', 'StockC'), [1, -1, 1],
+                                  strategies.StrategyF, traded_portfolio, cash=10))
+    vectorized.simulate_trading(traded_portfolio)
+
+    metrics_df = metrics.calc_metrics(traded_portfolio.traded_portfolios)
+    assert metrics_df['strategy'].tolist() == ['StrategyA', 'StrategyF']
+    assert metrics_df['stock_a'].tolist() == ['StockA', 'StockA']
+    assert metrics_df['stock_c'].tolist() == [None, 'StockC']
+    basket_portfolio = traded_portfolio.basket_portfolios[0]
+    # Each trade of the basket is worth 1.5 trades of a pair, whose legs add up to 2
+    assert metrics_df['turnover'][1] == pytest.approx(metrics.calc_turnover(
+        basket_portfolio.position_over_time, basket_portfolio.portfolio_value_over_time, 1.5))
+    assert metrics_df['num_trades'][1] > 0
+    summary = metrics.summarise_by_strategy(metrics_df)
+    assert 'stock_c' not in summary.columns
@@ -0,0 +1,103 @@
+"""
+Test routines for the pairs_trading_oaf.montecarlo module.
+"""
+import numpy as np
+import pandas as pd
+import pytest
+from pairs_trading_oaf import metrics, montecarlo, portfolio, strategies, vectorized
+
+STRATEGY_CLASSES = [strategies.StrategyA, strategies.StrategyB,
+                    strategies.StrategyC, strategies.StrategyD]
+
+@pytest.fixture
+def mock_training_data():
+    """
+    Mock training data of two stocks over 300 days, with a missing price.
+    """
+    rng = np.random.default_rng(0)
+    num_days = 300
+    df_train = pd.DataFrame({
+        'StockA': 100 * np.exp(np.cumsum(rng.normal(0, 0.02, num_days))),
+        'StockB': 100 * np.exp(np.cumsum(rng.normal(0, 0.02, num_days)))
+    }, index=pd.date_range(start='2021-01-01', periods=num_days, freq='D'))
+    df_train.iloc[10, 0] = np.nan
+    return df_train
+
+def test_block_bootstrap_paths():
+    """
+    Test that the paths are made of consecutive blocks of the resampled returns.
+    """
+    log_returns = np.column_stack([np.arange(1, 101), -np.arange(1, 101)]) * 1e-3
+    paths = montecarlo.block_bootstrap_paths(log_returns, [10.0, 20.0], 3, 25, 10,
+                                             np.random.default_rng(0))
+    assert paths.shape == (3, 25, 2)
+    path_returns = np.diff(np.log(np.concatenate([np.broadcast_to([10.0, 20.0], (3, 1, 2)),
+                                                  paths], axis=1)), axis=1)
+    assert path_returns[..., 0] == pytest.approx(-path_returns[..., 1])
+    # Within each block the returns follow on from each other
+    block_steps = np.diff(path_returns[:, :10, 0] * 1e3, axis=1)
+    assert block_steps == pytest.approx(np.ones_like(block_steps))
+
+    same_paths = montecarlo.block_bootstrap_paths(log_returns, [10.0, 20.0], 3, 25, 10,
+                                                  np.random.default_rng(0))
+    assert np.array_equal(paths, same_paths)
+
+# pylint: disable=redefined-outer-name
+@pytest.mark.parametrize('position_limit', [1, 500])
+def test_run_monte_carlo_matches_single_paths(mock_training_data, position_limit):
+    """
+    Test that the final values and maximum drawdowns of a batch of paths are the same as
+    simulating each path on its own with the vectorized engine, including the paths whose
+    portfolio value goes negative when the position limit is large.
+    """
+    kwargs = {'num_paths': 8, 'num_days': 120, 'block_size': 5, 'chunk_size': 8, 'seed': 1}
+    results = montecarlo.run_monte_carlo(STRATEGY_CLASSES, [('StockA', 'StockB')],
+                                         mock_training_data, position_limit, **kwargs)
+
+    # The paths of the only chunk, drawn as in iter_monte_carlo
+    log_returns, initial_prices = montecarlo.calc_log_returns(mock_training_data,
+                                                              ('StockA', 'StockB'))
+    rng = np.random.default_rng(np.random.SeedSequence(kwargs['seed']).spawn(1)[0])
+    paths = montecarlo.block_bootstrap_paths(log_returns, initial_prices, kwargs['num_paths'],
+                                             kwargs['num_days'], kwargs['block_size'], rng)
+    dates = pd.date_range(start='2022-01-01', periods=kwargs['num_days'], freq='D')
+    master_portfolio = portfolio.MasterPortfolio(position_limit, mock_training_data, None)
+    num_negative_paths = 0
+    for strategy_class in STRATEGY_CLASSES:
+        strategy_results = results[results['strategy'] == strategy_class.__name__]
+        assert strategy_results['path'].tolist() == list(range(kwargs['num_paths']))
+        for path_prices, row in zip(paths, strategy_results.itertuples()):
+            path_portfolio = portfolio.PairPortfolio(('StockA', 'StockB'), strategy_class,
+                                                     master_portfolio, cash=10)
+            vectorized.execute_trades(path_portfolio, dates, path_prices,
+                                      path_portfolio.strategy.calculate_new_positions(
+                                          path_prices))
+            expected = np.asarray(path_portfolio.portfolio_value_over_time)
+            num_negative_paths += (expected < 0).any()
+            assert row.final_value == expected[-1]
+            assert row.max_drawdown == metrics.calc_max_drawdown(expected)
+    assert (num_negative_paths > 0) == (position_limit == 500)
+
+def test_run_monte_carlo(mock_training_data):
+    """
+    Test that the results are streamed in chunks and are reproducible from the seed.
+    """
+    kwargs = {'num_paths': 25, 'num_days': 60, 'block_size': 5, 'chunk_size': 10, 'seed': 3}
+    chunks = list(montecarlo.iter_monte_carlo(STRATEGY_CLASSES, [('StockA', 'StockB')],
+                                              mock_training_data, 1, **kwargs))
+    assert [len(chunk) for chunk in chunks] == [40, 40, 20]
+
+    results = montecarlo.run_monte_carlo(STRATEGY_CLASSES, [('StockA', 'StockB')],
+                                         mock_training_data, 1, **kwargs)
+    pd.testing.assert_frame_equal(results, pd.concat(chunks, ignore_index=True))
+    assert sorted(results['path'].unique()) == list(range(25))
+    assert (results['max_drawdown'] >= 0).all()
+    kwargs['seed'] = 4
+    other_results = montecarlo.run_monte_carlo(STRATEGY_CLASSES, [('StockA', 'StockB')],
+                                               mock_training_data, 1, **kwargs)
+    assert not np.array_equal(results['final_value'], other_results['final_value'])
+
+    summary = montecarlo.summarise(results)
+    assert len(summary) == len(STRATEGY_CLASSES)
+    assert (summary['num_paths'] == 25).all()
+    assert (summary['final_value_q0.05'] <= summary['final_value_q0.95']).all()
@@ -0,0 +1,87 @@
+"""
+Test routines for the pairs_trading_oaf.pair_selection module.
+"""
+import numpy as np
+import pandas as pd
+import pytest
+from pairs_trading_oaf import pair_selection
+
+@pytest.fixture
+def mock_prices():
+    """
+    Mock prices of four stocks: StockA and StockB are cointegrated, StockC and StockD are
+    independent random walks, and StockD is only listed after 100 days.
+    """
+    rng = np.random.default_rng(0)
+    num_days = 500
+    common = np.cumsum(rng.normal(0, 0.01, num_days))
+    prices = pd.DataFrame({
+        'StockA': 50 * np.exp(common + rng.normal(0, 0.005, num_days)),
+        'StockB': 80 * np.exp(common + rng.normal(0, 0.005, num_days)),
+        'StockC': 30 * np.exp(np.cumsum(rng.normal(0, 0.01, num_days))),
+        'StockD': 20 * np.exp(np.cumsum(rng.normal(0, 0.01, num_days)))
+    }, index=pd.date_range(start='2015-01-01', periods=num_days, freq='D'))
+    prices.iloc[:100, 3] = np.nan
+    return prices
+
+def engle_granger_one_pair(prices, stock_a, stock_b):
+    """
+    Calculate the hedge ratio and Engle-Granger test statistic of one pair directly.
+    """
+    log_prices = np.log(prices[[stock_a, stock_b]])
+    common = log_prices.dropna()
+    y, x = common[stock_a].to_numpy(), common[stock_b].to_numpy()
+    design = np.column_stack([np.ones_like(x), x])
+    (intercept, hedge_ratio), *_ = np.linalg.lstsq(design, y, rcond=None)
+    residuals = pd.Series(y - intercept - hedge_ratio * x, index=common.index)
+    residuals = residuals.reindex(prices.index)
+    lagged, diffs = residuals.shift(1), residuals.diff()
+    is_valid = lagged.notna() & diffs.notna()
+    lagged, diffs = lagged[is_valid].to_numpy(), diffs[is_valid].to_numpy()
+    gamma = lagged @ diffs / (lagged @ lagged)
+    errors = diffs - gamma * lagged
+    standard_error = np.sqrt(errors @ errors / (len(lagged) - 1) / (lagged @ lagged))
+    return hedge_ratio, gamma / standard_error
+
+# pylint: disable=redefined-outer-name
+def test_score_pairs_matches_direct_calculation(mock_prices):
+    """
+    Test that the batched scores match the scores calculated one pair at a time.
+    """
+    scores = pair_selection.score_pairs(mock_prices)
+
+    assert len(scores) == 6
+    for row in scores.itertuples():
+        hedge_ratio, eg_tstat = engle_granger_one_pair(mock_prices, row.stock_a, row.stock_b)
+        assert row.hedge_ratio == pytest.approx(hedge_ratio)
+        assert row.eg_tstat == pytest.approx(eg_tstat)
+        # The opposite direction is never more significant
+        assert row.eg_tstat <= engle_granger_one_pair(mock_prices, row.stock_b,
+                                                      row.stock_a)[1] + 1e-9
+
+        pair_prices = mock_prices[[row.stock_a, row.stock_b]]
+        returns = np.log(pair_prices).diff().dropna()
+        assert row.correlation == pytest.approx(returns.corr().iloc[0, 1])
+        normalised = pair_prices / pair_prices.apply(lambda prices: prices.dropna().iloc[0])
+        ssd = ((normalised[row.stock_a] - normalised[row.stock_b]) ** 2).sum()
+        assert row.ssd == pytest.approx(ssd)
+        assert row.num_obs == len(pair_prices.dropna())
+
+def test_select_pairs(mock_prices):
+    """
+    Test that the cointegrated pair is selected first by every method.
+    """
+    for method in ['cointegration', 'ssd', 'correlation']:
+        selected = pair_selection.select_pairs(mock_prices, k=1, method=method)
+        assert len(selected) == 1
+        assert set(selected[0]) == {'StockA', 'StockB'}
+    with pytest.raises(ValueError):
+        pair_selection.select_pairs(mock_prices, method='astrology')
+
+def test_engle_granger_critical_value():
+    """
+    Test the critical values against the asymptotic values of MacKinnon (2010).
+    """
+    assert pair_selection.engle_granger_critical_value(1e12, 0.05) == pytest.approx(-3.33613)
+    assert pair_selection.engle_granger_critical_value(100, 0.01) < \
+        pair_selection.engle_granger_critical_value(100, 0.10)
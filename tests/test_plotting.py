@@ -0,0 +1,101 @@
+"""
+Test routines for the pairs_trading_oaf.plotting module.
+"""
+import json
+import os
+from unittest.mock import patch
+import matplotlib
+matplotlib.use('Agg')
+import matplotlib.image # pylint: disable=wrong-import-position
+import matplotlib.pyplot as plt # pylint: disable=wrong-import-position
+import numpy as np # pylint: disable=wrong-import-position
+import pytest # pylint: disable=wrong-import-position
+from pairs_trading_oaf import plotting # pylint: disable=wrong-import-position
+from pairs_trading_oaf import portfolio, strategies, trading # pylint: disable=wrong-import-position
+from tests.conftest import make_mock_data # pylint: disable=wrong-import-position
+
+def draw_line(values):
+    """
+    Draw a line plot of values.
+    """
+    fig, ax = plt.subplots(figsize=(2, 2))
+    ax.plot(values)
+    return fig
+
+def make_jobs(tmp_path, values):
+    """
+    Make a job for each of two figures with the given values.
+    """
+    return [plotting.FigureJob(str(tmp_path / f'figure_{i}.png'), draw_line,
+                               {'values': values}, dpi=200) for i in range(2)]
+
+def test_render_figures_skips_unchanged_figures(tmp_path):
+    """
+    Test that figures are only rendered again when their data, quality or file changes.
+    """
+    rendered = plotting.render_figures(make_jobs(tmp_path, [1, 2, 3]))
+    assert len(rendered) == 2
+    hashes = json.loads((tmp_path / plotting.HASHES_FILENAME).read_text(encoding='utf-8'))
+    assert sorted(hashes) == ['figure_0.png', 'figure_1.png']
+
+    assert plotting.render_figures(make_jobs(tmp_path, [1, 2, 3])) == []
+    assert len(plotting.render_figures(make_jobs(tmp_path, [1, 2, 3]), force=True)) == 2
+    assert len(plotting.render_figures(make_jobs(tmp_path, [1, 2, 4]))) == 2
+    (tmp_path / 'figure_0.png').unlink()
+    assert plotting.render_figures(make_jobs(tmp_path, [1, 2, 4])) \
+        == [str(tmp_path / 'figure_0.png')]
+
+def test_render_figures_quality(tmp_path):
+    """
+    Test that draft figures are rendered at a lower resolution than final figures.
+    """
+    plotting.render_figures(make_jobs(tmp_path, [1, 2, 3]), quality='final')
+    final_shape = matplotlib.image.imread(tmp_path / 'figure_0.png').shape
+    assert len(plotting.render_figures(make_jobs(tmp_path, [1, 2, 3]), quality='draft')) == 2
+    draft_shape = matplotlib.image.imread(tmp_path / 'figure_0.png').shape
+    assert draft_shape[0] < final_shape[0]
+    assert draft_shape[0] == pytest.approx(final_shape[0] * plotting.DRAFT_DPI / 200, rel=0.1)
+    with pytest.raises(ValueError):
+        plotting.render_figures(make_jobs(tmp_path, [1, 2, 3]), quality='poster')
+
+def test_render_figures_in_parallel(tmp_path):
+    """
+    Test that figures rendered in worker processes are the same as in this process.
+    """
+    (tmp_path / 'serial').mkdir()
+    (tmp_path / 'parallel').mkdir()
+    plotting.render_figures(make_jobs(tmp_path / 'serial', np.arange(5.0)))
+    rendered = plotting.render_figures(make_jobs(tmp_path / 'parallel', np.arange(5.0)),
+                                       num_workers=2)
+    assert len(rendered) == 2
+    for i in range(2):
+        assert np.array_equal(matplotlib.image.imread(tmp_path / 'serial' / f'figure_{i}.png'),
+                              matplotlib.image.imread(tmp_path / 'parallel' / f'figure_{i}.png'))
+
+def test_cash_over_time_figures(tmp_path):
+    """
+    Test that the cash plots of make_csv_strategy_d_and_b are registered in FIGURE_BUILDERS,
+    so that plot_all renders the same figures as make_csv_strategy_d_and_b.
+    """
+    df_train, df_test = make_mock_data(0)
+    with patch('pairs_trading_oaf.data.read_csv',
+               side_effect=lambda filename: df_train if filename == "training" else df_test):
+        master_portfolio = portfolio.MasterPortfolio(1, "training", "testing")
+        for strategy_class in [strategies.StrategyB, strategies.StrategyD]:
+            master_portfolio.add_pair_portfolio(portfolio.PairPortfolio(
+                ('StockA', 'StockB'), strategy_class, master_portfolio, cash=10))
+        trading.simulate_trading(master_portfolio)
+
+    assert plotting.FIGURE_BUILDERS[plotting.plot_cash_over_time] \
+        is plotting._cash_over_time_figures # pylint: disable=protected-access
+    with patch('pairs_trading_oaf.plotting.get_plots_dir', return_value=str(tmp_path)):
+        rendered = plotting.plot_all(master_portfolio, [plotting.plot_cash_over_time],
+                                     num_workers=1)
+        assert sorted(rendered) \
+            == sorted(str(fname) for fname in (tmp_path / 'cash_over_time').glob('*.png'))
+        assert [os.path.basename(fname).split('_')[0] for fname in sorted(rendered)] \
+            == ['StrategyB', 'StrategyD']
+        # The figures are unchanged, so only the CSV files are written
+        assert plotting.make_csv_strategy_d_and_b(master_portfolio, quality='draft') == []
+    assert len(list((tmp_path / 'StrategyB').glob('MACD_strategy_*_filtered.csv'))) == 1
+    assert len(list((tmp_path / 'StrategyD').glob('*.csv'))) == 2
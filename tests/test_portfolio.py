@@ -4,6 +4,7 @@ Test the routines in the portfolio module.
 from unittest.mock import Mock
 import numpy as np
 import pandas as pd
+import pytest
 from pairs_trading_oaf import portfolio
 from pairs_trading_oaf import strategies
 
@@ -29,8 +30,12 @@ def test_master_portfolio_initialization():
     """
     master_portfolio = portfolio.MasterPortfolio(POSITION_LIMIT, TRAINING_DATA, TESTING_DATA)
     assert master_portfolio.position_limit == POSITION_LIMIT
+    assert master_portfolio.training_data_source == TRAINING_DATA
+    assert master_portfolio.testing_data_source == TESTING_DATA
+    # The old names of the data sources are kept as aliases
     assert master_portfolio.training_data_str == TRAINING_DATA
-    assert master_portfolio.testing_data_str == TESTING_DATA
+    master_portfolio.testing_data_str = TRAINING_DATA
+    assert master_portfolio.testing_data_source == TRAINING_DATA
     assert isinstance(master_portfolio.pair_portfolios, list)
 
 def test_add_pair_portfolio():
@@ -173,6 +178,41 @@ def test_update_prices_and_date():
     assert pair_portfolio.date == test_date
     assert pair_portfolio.stock_pair_prices == (100.0, 200.0)
 
+def test_update_prices_from_row():
+    """
+    Test the update_prices_from_row method of the PairPortfolio class.
+    """
+    master_portfolio = portfolio.MasterPortfolio(POSITION_LIMIT, TRAINING_DATA, TESTING_DATA)
+    pair_portfolio = portfolio.PairPortfolio(STOCK_PAIR_LABELS, MockStrategy, master_portfolio)
+    test_date = pd.Timestamp("2021-01-01")
+    pair_portfolio.update_prices_from_row(test_date, [np.nan, 300.0, 100.0], (2, 0))
+    assert pair_portfolio.date == test_date
+    assert pair_portfolio.stock_pair_prices[0] == 100.0
+    assert np.isnan(pair_portfolio.stock_pair_prices[1])
+    assert pair_portfolio.stock_labels == STOCK_PAIR_LABELS
+
+def test_basket_portfolio():
+    """
+    Test the initialisation and over time values of the BasketPortfolio class.
+    """
+    master_portfolio = portfolio.MasterPortfolio(POSITION_LIMIT, TRAINING_DATA, TESTING_DATA)
+    stock_labels = ("StockA", "StockB", "StockC")
+    basket_portfolio = portfolio.BasketPortfolio(stock_labels, [0.5, -1, 0.5], MockStrategy,
+                                                 master_portfolio, cash=100)
+    master_portfolio.add_basket_portfolio(basket_portfolio)
+    assert master_portfolio.traded_portfolios == [basket_portfolio]
+    with pytest.raises(TypeError):
+        master_portfolio.add_pair_portfolio(basket_portfolio)
+    with pytest.raises(ValueError):
+        portfolio.BasketPortfolio(stock_labels, [1, -1], MockStrategy, master_portfolio)
+
+    basket_portfolio.update_prices_from_row("2021-01-01", [10.0, 20.0, 40.0, 30.0], (0, 1, 3))
+    basket_portfolio.shares = np.array([1.0, -2.0, 3.0])
+    basket_portfolio.update_over_time_values()
+    assert basket_portfolio.stock_prices_over_time == [(10.0, 20.0, 30.0)]
+    assert basket_portfolio.portfolio_value_over_time == [100 + 10 - 40 + 90]
+    assert basket_portfolio.basket_value_over_time == [5 - 20 + 15]
+
 def test_update_over_time_values():
     """
     Test the update_over_time_values method of the PairPortfolio class.
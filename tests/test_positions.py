@@ -0,0 +1,51 @@
+"""
+Test routines for the pairs_trading_oaf.positions module.
+"""
+import numpy as np
+import pytest
+from pairs_trading_oaf.positions import Position, to_codes, to_position, to_strings
+
+def test_position_comparisons():
+    """
+    Test that a Position compares equal to its integer code but not to its string, hashes
+    like its code and is formatted as its string.
+    """
+    assert Position.LONG_A_SHORT_B == 1
+    assert Position.LONG_A_SHORT_B != "long A short B"
+    assert Position.NO_POSITION != Position.LONG_B_SHORT_A
+    assert str(Position.LONG_B_SHORT_A) == "long B short A"
+    assert f'{Position.NO_POSITION}' == "no position"
+    assert {Position.LONG_B_SHORT_A: 'x'}[-1] == 'x'
+    assert Position.NO_POSITION not in {"no position": 'x'}
+    codes = np.array([0, 1, -1], dtype=np.int8)
+    assert (Position.LONG_A_SHORT_B == codes).tolist() == [False, True, False]
+    assert (Position.LONG_A_SHORT_B != codes).tolist() == [True, False, True]
+
+def test_to_position():
+    """
+    Test the conversion of strings and integer codes to positions.
+    """
+    assert to_position("long B short A") is Position.LONG_B_SHORT_A
+    assert to_position(np.int8(1)) is Position.LONG_A_SHORT_B
+    assert to_position(Position.NO_POSITION) is Position.NO_POSITION
+    with pytest.raises(ValueError):
+        to_position("short everything")
+
+def test_to_strings():
+    """
+    Test the conversion of an array of position codes to strings.
+    """
+    strings = to_strings(np.array([0, 1, -1, 1], dtype=np.int8))
+    assert strings.tolist() == ["no position", "long A short B", "long B short A",
+                                "long A short B"]
+
+def test_to_codes():
+    """
+    Test the conversion of positions, codes and strings to an int8 array of position codes.
+    """
+    codes = to_codes(["no position", "long A short B", "long B short A"])
+    assert codes.dtype == np.int8
+    assert codes.tolist() == [0, 1, -1]
+    assert to_codes([Position.LONG_B_SHORT_A, Position.NO_POSITION]).tolist() == [-1, 0]
+    assert to_codes(np.array([[1, 0]])).tolist() == [[1, 0]]
+    assert to_codes([]).shape == (0,)
@@ -0,0 +1,94 @@
+"""
+Test routines for the pairs_trading_oaf.results_store module.
+"""
+import numpy as np
+import pandas as pd
+import pytest
+from pairs_trading_oaf import portfolio, results_store, strategies, vectorized
+
+STOCK_PAIR_LABELS_LIST = [('StockA', 'StockB'), ('StockB', 'StockC')]
+
+@pytest.fixture
+def master_portfolio():
+    """
+    A master portfolio of StrategyA and StrategyC on two pairs, traded with the vectorized
+    engine on mock prices.
+    """
+    rng = np.random.default_rng(0)
+    num_days = 250
+    df = pd.DataFrame({
+        'StockA': 100 * np.exp(np.cumsum(rng.normal(0, 0.02, num_days))),
+        'StockB': 100 * np.exp(np.cumsum(rng.normal(0, 0.02, num_days))),
+        'StockC': 100 * np.exp(np.cumsum(rng.normal(0, 0.02, num_days)))
+    }, index=pd.date_range(start='2021-01-01', periods=num_days, freq='D'))
+    traded_portfolio = portfolio.MasterPortfolio(1, df.iloc[:150], df.iloc[150:])
+    for strategy_class in [strategies.StrategyA, strategies.StrategyC]:
+        for stock_pair_labels in STOCK_PAIR_LABELS_LIST:
+            traded_portfolio.add_pair_portfolio(
+                portfolio.PairPortfolio(stock_pair_labels, strategy_class, traded_portfolio,
+                                        cash=10))
+    vectorized.simulate_trading(traded_portfolio)
+    return traded_portfolio
+
+# pylint: disable=redefined-outer-name
+def test_write_and_read_results(master_portfolio, tmp_path):
+    """
+    Test that the histories of every pair portfolio of every run are read back, and that the
+    filters select the rows of one strategy, pair and date range.
+    """
+    filename = str(tmp_path / "results.store")
+    results_store.write_results(filename, master_portfolio, "first")
+    results_store.write_results(filename, master_portfolio, "second")
+
+    segments = results_store.list_segments(filename)
+    assert segments['run_id'].tolist() == ['first'] * 4 + ['second'] * 4
+    assert (segments['num_rows'] == 100).all()
+    assert (segments['first_date'] == pd.Timestamp('2021-05-31')).all()
+
+    results = results_store.read_results(filename)
+    assert len(results) == 800
+    assert results.columns.tolist() == ['run_id', 'strategy', 'stock_a', 'stock_b', 'date',
+                                        'cash', 'position', 'portfolio_value']
+
+    pair_portfolio = master_portfolio.pair_portfolios[3]
+    results = results_store.read_results(filename, run_id="second", strategy="StrategyC",
+                                         stock_pair_labels=('StockB', 'StockC'),
+                                         start='2021-06-10', end=pd.Timestamp('2021-06-19'))
+    dates = pair_portfolio.dates_over_time.values()
+    in_range = (dates >= np.datetime64('2021-06-10')) & (dates <= np.datetime64('2021-06-19'))
+    assert results['date'].to_numpy().tolist() == dates[in_range].tolist()
+    assert results['cash'].tolist() == pair_portfolio.cash_over_time.values()[in_range].tolist()
+    assert results['position'].tolist() \
+        == pair_portfolio.position_over_time.values()[in_range].tolist()
+    assert results['portfolio_value'].tolist() \
+        == pair_portfolio.portfolio_value_over_time.values()[in_range].tolist()
+    assert (results['run_id'] == "second").all()
+
+    assert len(results_store.read_results(filename, strategy="StrategyB")) == 0
+    assert len(results_store.read_results(filename, start='2022-01-01')) == 0
+
+def test_partly_written_chunk(master_portfolio, tmp_path):
+    """
+    Test that a partly written chunk at the end of the file is ignored and then overwritten.
+    """
+    filename = tmp_path / "results.store"
+    results_store.write_results(str(filename), master_portfolio, "first")
+    complete_size = filename.stat().st_size
+    results_store.write_results(str(filename), master_portfolio, "second")
+    with open(filename, 'r+b') as f:
+        f.truncate(complete_size + 100)
+
+    assert results_store.list_segments(str(filename))['run_id'].unique().tolist() == ['first']
+    results_store.write_results(str(filename), master_portfolio, "third")
+    assert results_store.list_segments(str(filename))['run_id'].unique().tolist() \
+        == ['first', 'third']
+    assert len(results_store.read_results(str(filename))) == 800
+
+def test_not_a_results_file(tmp_path):
+    """
+    Test that reading a file which is not a results file raises a ValueError.
+    """
+    filename = tmp_path / "results.csv"
+    filename.write_text("date,cash\n", encoding='utf-8')
+    with pytest.raises(ValueError):
+        results_store.read_results(str(filename))
@@ -0,0 +1,91 @@
+"""
+Test routines for the pairs_trading_oaf.rolling module.
+"""
+import math
+import numpy as np
+import pandas as pd
+import pytest
+from pairs_trading_oaf import rolling
+
+def test_rolling_mean_std_matches_pandas():
+    """
+    Test that the rolling mean and standard deviation match pandas, including windows with NaNs.
+    """
+    rng = np.random.default_rng(0)
+    values = rng.random(50)
+    values[[3, 10, 11]] = np.nan
+
+    mean, std = rolling.rolling_mean_std(values, 5)
+
+    for i in range(len(mean)):
+        window = pd.Series(values[i:i + 5])
+        assert np.isclose(mean[i], window.mean())
+        assert np.isclose(std[i], window.std(), equal_nan=True)
+
+def test_ewma():
+    """
+    Test the exponentially weighted moving average against the recursion it implements,
+    and check that the average stays NaN once a NaN has been seen.
+    """
+    values = np.array([1.0, 2.0, 4.0, np.nan, 3.0])
+    alpha = 0.5
+
+    smoothed = rolling.ewma(values, alpha)
+
+    assert np.isclose(smoothed[0], 1.0)
+    assert np.isclose(smoothed[1], 1.5)
+    assert np.isclose(smoothed[2], 2.75)
+    assert np.all(np.isnan(smoothed[3:]))
+
+def test_rolling_statistics_matches_pandas():
+    """
+    Test that pushing values onto a RollingStatistics window gives the same mean and
+    standard deviation as pandas for the latest window, including windows with NaNs.
+    """
+    rng = np.random.default_rng(1)
+    values = 100 + rng.random(200)
+    values[[20, 21, 22, 23, 24, 25, 26, 90]] = np.nan
+    window_size = 6
+
+    window = rolling.RollingStatistics(values[:window_size])
+    for i in range(window_size, len(values)):
+        window.push(values[i])
+        expected = pd.Series(values[i + 1 - window_size:i + 1])
+        assert np.array_equal(window.values(), expected.to_numpy(), equal_nan=True)
+        assert np.isclose(window.mean(), expected.mean(), equal_nan=True)
+        assert np.isclose(window.std(), expected.std(), equal_nan=True)
+
+def test_rolling_statistics_constant_window():
+    """
+    Test that a window of identical values has a standard deviation of exactly zero.
+    """
+    window = rolling.RollingStatistics(np.full(10, 0.5))
+    for _ in range(25):
+        window.push(0.5)
+    assert window.mean() == 0.5
+    assert window.std() == 0.0
+
+def test_rolling_statistics_drift():
+    """
+    Test that rounding errors do not build up over many updates of a tight window of values
+    far from zero: the statistics are exact after every window_size updates, when they are
+    recalculated, and stay within a fixed bound in between.
+    """
+    rng = np.random.default_rng(2)
+    values = 1e4 + rng.normal(0, 1, 20000)
+    values[rng.integers(0, len(values), 200)] = np.nan
+    window_size = 5
+
+    window = rolling.RollingStatistics(values[:window_size])
+    for i in range(window_size, len(values)):
+        window.push(values[i])
+        valid_values = values[i + 1 - window_size:i + 1]
+        valid_values = valid_values[~np.isnan(valid_values)]
+        if len(valid_values) < 2:
+            continue
+        mean = math.fsum(valid_values) / len(valid_values)
+        std = math.sqrt(math.fsum((valid_values - mean) ** 2) / (len(valid_values) - 1))
+        if (i + 1 - window_size) % window_size == 0:
+            assert (window.mean(), window.std()) == (mean, std)
+        assert window.mean() == pytest.approx(mean, rel=1e-14)
+        assert window.std() == pytest.approx(std, rel=1e-8)
@@ -0,0 +1,212 @@
+"""
+Test routines for the pairs_trading_oaf.runner module.
+"""
+import json
+import numpy as np
+import pandas as pd
+import pytest
+from pairs_trading_oaf import main, portfolio, results_store, runner, strategies, trading
+
+STOCK_PAIR_LABELS_LIST = [('StockA', 'StockB'), ('StockC', 'StockA')]
+
+@pytest.fixture
+def mock_csv_files(tmp_path):
+    """
+    Mock training data and two testing datasets of three stocks, written to CSV files.
+    """
+    rng = np.random.default_rng(0)
+    num_days = 300
+    df = pd.DataFrame({
+        'StockA': 100 * np.exp(np.cumsum(rng.normal(0, 0.02, num_days))),
+        'StockB': 100 * np.exp(np.cumsum(rng.normal(0, 0.02, num_days))),
+        'StockC': 100 * np.exp(np.cumsum(rng.normal(0, 0.02, num_days)))
+    }, index=pd.date_range(start='2021-01-01', periods=num_days, freq='D',
+                           name='Closing Date'))
+    csv_files = [str(tmp_path / f"{name}.csv") for name in ["training", "testing", "testing_2"]]
+    df.iloc[:150].to_csv(csv_files[0])
+    df.iloc[150:250].to_csv(csv_files[1])
+    df.iloc[150:].to_csv(csv_files[2])
+    return csv_files
+
+# pylint: disable=redefined-outer-name
+@pytest.fixture
+def manifest(mock_csv_files, tmp_path):
+    """
+    A manifest of two experiments which share their training data.
+    """
+    training_csv, testing_csv, testing_csv_2 = mock_csv_files
+    return {'defaults': {'training_data': training_csv,
+                         'pairs': [list(pair) for pair in STOCK_PAIR_LABELS_LIST],
+                         'strategies': ['StrategyA',
+                                        {'class': 'StrategyB', 'params': {'fast_period': 6}}],
+                         'trading_fee': 0.001,
+                         'results_file': str(tmp_path / 'results.store')},
+            'experiments': [{'name': str(tmp_path / 'first'), 'testing_data': testing_csv,
+                             'outputs': ['metrics', 'results']},
+                            {'name': str(tmp_path / 'second'), 'testing_data': testing_csv_2,
+                             'engine': 'vectorized', 'outputs': ['results']}]}
+
+def test_parse_manifest(manifest):
+    """
+    Test that the defaults are filled in and that invalid manifests are rejected.
+    """
+    experiments = runner.parse_manifest(manifest)
+    assert [experiment['engine'] for experiment in experiments] == ['trading', 'vectorized']
+    assert experiments[0]['pairs'] == STOCK_PAIR_LABELS_LIST
+    assert experiments[1]['strategies'] == [(strategies.StrategyA, {}),
+                                            (strategies.StrategyB, {'fast_period': 6})]
+    assert experiments[1]['cash'] == runner.EXPERIMENT_DEFAULTS['cash']
+
+    for key, value in [('strategies', ['StrategyZ']), ('outputs', ['plot_everything']),
+                       ('engine', 'fast'), ('pairs', [['StockA']]), ('window', 5),
+                       ('name', experiments[1]['name']), ('overwrite', 'yes'),
+                       ('pairs', [{'stocks': ['StockA', 'StockB'], 'weights': [1]}]),
+                       ('pairs', [{'stocks': ['StockA', 'StockB', 'StockC']}]),
+                       ('strategies', ['StrategyF']),
+                       ('pairs', [{'stocks': ['StockA', 'StockB'], 'weights': [1, -1]}])]:
+        invalid_manifest = json.loads(json.dumps(manifest))
+        invalid_manifest['experiments'][0][key] = value
+        with pytest.raises(ValueError):
+            runner.parse_manifest(invalid_manifest)
+    del manifest['defaults']['training_data']
+    with pytest.raises(ValueError):
+        runner.parse_manifest(manifest)
+
+def test_run_manifest(manifest, mock_csv_files, tmp_path):
+    """
+    Test that the experiments give the same results as building and simulating their
+    portfolios directly, and that the strategies are only warmed up once.
+    """
+    experiments = runner.parse_manifest(manifest)
+    with runner.BatchRunner() as batch_runner:
+        master_portfolios = [batch_runner.run_experiment(experiment)
+                             for experiment in experiments]
+        assert len(batch_runner.warm_strategies) == 4
+        for warm_strategy in batch_runner.warm_strategies.values():
+            assert warm_strategy.pair_portfolio is None
+
+    training_csv = mock_csv_files[0]
+    for testing_csv, master_portfolio in zip(mock_csv_files[1:], master_portfolios):
+        expected_portfolio = portfolio.MasterPortfolio(1.0, training_csv, testing_csv,
+                                                       trading_fee=0.001)
+        for strategy_class, strategy_kwargs in [(strategies.StrategyA, {}),
+                                                (strategies.StrategyB, {'fast_period': 6})]:
+            for stock_pair_labels in STOCK_PAIR_LABELS_LIST:
+                expected_pair_portfolio = portfolio.PairPortfolio(
+                    stock_pair_labels, strategy_class, expected_portfolio, cash=10,
+                    strategy_kwargs=strategy_kwargs)
+                expected_pair_portfolio.trading_fee = 0.001
+                expected_portfolio.add_pair_portfolio(expected_pair_portfolio)
+        trading.simulate_trading(expected_portfolio)
+        for pair_portfolio, expected_pair_portfolio in zip(master_portfolio.pair_portfolios,
+                                                           expected_portfolio.pair_portfolios):
+            assert pair_portfolio.strategy is not expected_pair_portfolio.strategy
+            assert pair_portfolio.strategy.pair_portfolio is pair_portfolio
+            assert list(pair_portfolio.portfolio_value_over_time) == pytest.approx(
+                list(expected_pair_portfolio.portfolio_value_over_time))
+
+    metrics_df = pd.read_csv(tmp_path / 'first' / runner.METRICS_FILENAME)
+    assert len(metrics_df) == 4
+    assert not (tmp_path / 'second' / runner.METRICS_FILENAME).exists()
+    segments = results_store.list_segments(str(tmp_path / 'results.store'))
+    assert segments['run_id'].tolist() == [experiments[0]['name']] * 4 \
+                                         + [experiments[1]['name']] * 4
+    assert segments['num_rows'].tolist() == [100] * 4 + [150] * 4
+
+    # Running the experiments again appends to the results file, unless it is overwritten
+    runner.run_manifest(experiments)
+    assert len(results_store.list_segments(str(tmp_path / 'results.store'))) == 16
+    results = runner.run_manifest(experiments, num_workers=2, overwrite=True)
+    assert len(results_store.list_segments(str(tmp_path / 'results.store'))) == 8
+    experiments[0]['overwrite'] = True
+    runner.run_manifest(experiments[:1])
+    assert len(results_store.list_segments(str(tmp_path / 'results.store'))) == 4
+    assert results['experiment'].tolist() == [experiments[0]['name']] * 4 \
+                                            + [experiments[1]['name']] * 4
+    assert results['final_value'].tolist() == pytest.approx(
+        [pair_portfolio.portfolio_value for master_portfolio in master_portfolios
+         for pair_portfolio in master_portfolio.pair_portfolios])
+
+def test_trading_fee(manifest):
+    """
+    Test that the trading fee of an experiment is paid by every pair portfolio.
+    """
+    experiment = runner.parse_manifest(manifest)[0]
+    experiment['outputs'] = []
+    with runner.BatchRunner() as batch_runner:
+        master_portfolio = batch_runner.run_experiment(experiment)
+        free_master_portfolio = batch_runner.run_experiment({**experiment, 'trading_fee': 0.0})
+    for pair_portfolio, free_pair_portfolio in zip(master_portfolio.pair_portfolios,
+                                                   free_master_portfolio.pair_portfolios):
+        assert pair_portfolio.trading_fee == 0.001
+        assert free_pair_portfolio.trading_fee == 0.0
+        assert pair_portfolio.cash < free_pair_portfolio.cash
+
+def test_run_experiment_events(manifest):
+    """
+    Test that the event-driven engine reconstructs the daily values which the outputs are
+    calculated from.
+    """
+    experiment = runner.parse_manifest(manifest)[0]
+    experiment['outputs'] = []
+    with runner.BatchRunner() as batch_runner:
+        expected = batch_runner.run_experiment(experiment)
+        master_portfolio = batch_runner.run_experiment({**experiment, 'engine': 'events'})
+    for pair_portfolio, expected_pair_portfolio in zip(master_portfolio.pair_portfolios,
+                                                       expected.pair_portfolios):
+        assert len(pair_portfolio.trade_logs) == 1
+        assert list(pair_portfolio.portfolio_value_over_time) == pytest.approx(
+            list(expected_pair_portfolio.portfolio_value_over_time), rel=1e-12)
+
+def test_run_manifest_baskets(manifest, mock_csv_files, tmp_path):
+    """
+    Test that an experiment of baskets trades them with StrategyF, as basket portfolios.
+    """
+    basket = {'stocks': ['StockA', 'StockB', 'StockC'], 'weights': [0.5, -1, 0.5]}
+    manifest['experiments'] = [{'name': str(tmp_path / 'baskets'),
+                                'testing_data': mock_csv_files[1],
+                                'pairs': [basket, {**basket, 'weights': [1, -0.5, -0.5]}],
+                                'strategies': [{'class': 'StrategyF',
+                                                'params': {'window_size': 20}}],
+                                'outputs': ['metrics']}]
+    experiments = runner.parse_manifest(manifest)
+    assert experiments[0]['pairs'][0] == runner.Basket(('StockA', 'StockB', 'StockC'),
+                                                       (0.5, -1.0, 0.5))
+    with runner.BatchRunner() as batch_runner:
+        master_portfolio = batch_runner.run_experiment(experiments[0])
+    assert master_portfolio.pair_portfolios == []
+    assert len(master_portfolio.basket_portfolios) == 2
+
+    expected_portfolio = portfolio.MasterPortfolio(1.0, mock_csv_files[0], mock_csv_files[1])
+    basket_portfolio = portfolio.BasketPortfolio(basket['stocks'], basket['weights'],
+                                                 strategies.StrategyF, expected_portfolio,
+                                                 cash=10, strategy_kwargs={'window_size': 20})
+    basket_portfolio.trading_fee = 0.001
+    expected_portfolio.add_basket_portfolio(basket_portfolio)
+    trading.simulate_trading(expected_portfolio)
+    assert np.any(basket_portfolio.position_over_time)
+    assert list(master_portfolio.basket_portfolios[0].portfolio_value_over_time) \
+        == list(basket_portfolio.portfolio_value_over_time)
+
+    metrics_df = pd.read_csv(tmp_path / 'baskets' / runner.METRICS_FILENAME)
+    assert metrics_df['stock_c'].tolist() == ['StockC'] * 2
+    assert metrics_df['strategy'].tolist() == ['StrategyF'] * 2
+
+    manifest['experiments'][0]['outputs'] = ['metrics', 'plot_values_over_time']
+    with pytest.raises(ValueError):
+        runner.parse_manifest(manifest)
+
+def test_main(manifest, tmp_path):
+    """
+    Test that the command line interface runs a manifest file and writes the metrics, and
+    that --overwrite starts the results file afresh.
+    """
+    manifest_file = tmp_path / "manifest.json"
+    manifest_file.write_text(json.dumps(manifest), encoding='utf-8')
+    output = tmp_path / "results.csv"
+    assert main.main([str(manifest_file), '--output', str(output)]) == 0
+    assert len(pd.read_csv(output)) == 8
+    assert main.main([str(manifest_file)]) == 0
+    assert len(results_store.list_segments(str(tmp_path / 'results.store'))) == 16
+    assert main.main([str(manifest_file), '--overwrite']) == 0
+    assert len(results_store.list_segments(str(tmp_path / 'results.store'))) == 8
@@ -5,11 +5,12 @@ Tests for the strategies module.
 from unittest.mock import Mock, patch
 import numpy as np
 import pandas as pd
-from pairs_trading_oaf import strategies
+import pytest
+from pairs_trading_oaf import strategies, vectorized
 
 # To initialise a Strategy object, we need to pass in a pair portfolio object.
 # That pair portfolio object needs to have the following attributes:
-# - training_data_str: the path to the training data but we will use a mock object
+# - training_data_source: the path to the training data but we will use a mock object
 #   so we don't need to specify this.
 # - stock_pair_labels: the labels of the stock pair so we know which columns to read
 
@@ -19,7 +20,7 @@ def test_strategy_a_initialization(mock_read_csv):
     This test checks that the StrategyA class is initialized correctly.
     To initialise a Strategy object, we need to pass in a pair portfolio object.
     That pair portfolio object needs to have the following attributes:
-    - training_data_str: the path to the training data but we will use a mock object
+    - training_data_source: the path to the training data but we will use a mock object
                          so we don't need to specify this.
     - stock_pair_labels: the labels of the stock pair so we know which columns to read
     """
@@ -48,7 +49,8 @@ def test_strategy_a_initialization(mock_read_csv):
     # Assert
     assert strategy.pair_portfolio == mock_pair_portfolio
     assert strategy.window_size == 60
-    assert strategy.window_prices.equals(mock_data[['StockA', 'StockB']].tail(60))
+    assert np.array_equal(strategy.window_ratios.values(),
+                          (mock_data['StockA'] / mock_data['StockB']).tail(60).to_numpy())
     assert strategy.z_threshold == 1.0
 
 @patch('pairs_trading_oaf.data.read_csv')
@@ -78,17 +80,17 @@ def test_strategy_a_calculate_new_position(mock_read_csv):
     # Test 1: z-score is 0
     mock_pair_portfolio.stock_pair_prices = (100, 200)
     new_position = strategy.calculate_new_position()
-    assert new_position == 'no position'
+    assert str(new_position) == 'no position'
 
     # Test 2: z-score is below the lower threshold
     mock_pair_portfolio.stock_pair_prices = (1, 1000)
     new_position = strategy.calculate_new_position()
-    assert new_position == 'long A short B'
+    assert str(new_position) == 'long A short B'
 
     # Test 3: z-score is above the upper threshold
     mock_pair_portfolio.stock_pair_prices = (1000, 1)
     new_position = strategy.calculate_new_position()
-    assert new_position == 'long B short A'
+    assert str(new_position) == 'long B short A'
 
 @patch('pairs_trading_oaf.strategies.StrategyB.calc_initial_macd_signal')
 def test_strategy_b_initialization_no_initital_macd(mock_calc_initial_macd_signal):
@@ -215,7 +217,7 @@ def test_strategy_b_calculate_new_position(mock_read_csv):
     assert np.isclose(strategy.macd.slow_ewma, 66/25)
     assert np.isclose(strategy.macd.macd, 11/100)
     assert np.isclose(strategy.macd.signal, 43/450)
-    assert new_position == 'no position'
+    assert str(new_position) == 'no position'
 
     # Test 2: Check if the macd crosses below the signal
     #         then the position should change to long B short A.
@@ -229,7 +231,7 @@ def test_strategy_b_calculate_new_position(mock_read_csv):
     assert np.isclose(strategy.macd.slow_ewma, 644/375)
     assert np.isclose(strategy.macd.macd, -527/3000)
     assert np.isclose(strategy.macd.signal, -1151/13500)
-    assert new_position == 'long B short A'
+    assert str(new_position) == 'long B short A'
 
     # Test 3: Check if the macd crosses above the signal
     #         then the position should change to long A short B.
@@ -244,7 +246,7 @@ def test_strategy_b_calculate_new_position(mock_read_csv):
     assert np.isclose(strategy.macd.slow_ewma, 3144/625)
     assert np.isclose(strategy.macd.macd, 22213/30000)
     assert np.isclose(strategy.macd.signal, 188407/405000)
-    assert new_position == 'long A short B'
+    assert str(new_position) == 'long A short B'
 
 @patch('pairs_trading_oaf.data.read_csv')
 def test_strategy_c_initialization(mock_read_csv):
@@ -252,7 +254,7 @@ def test_strategy_c_initialization(mock_read_csv):
     This test checks that the StrategyC class is initialized correctly.
     To initialise a Strategy object, we need to pass in a pair portfolio object.
     That pair portfolio object needs to have the following attributes:
-    - training_data_str: the path to the training data but we will use a mock object
+    - training_data_source: the path to the training data but we will use a mock object
                          so we don't need to specify this.
     - stock_pair_labels: the labels of the stock pair so we know which columns to read
     """
@@ -280,7 +282,8 @@ def test_strategy_c_initialization(mock_read_csv):
     # Assert
     assert strategy.pair_portfolio == mock_pair_portfolio
     assert strategy.window_size == 20
-    assert strategy.window_prices.equals(mock_data[['StockA', 'StockB']].tail(20))
+    assert np.array_equal(strategy.window_ratios.values(),
+                          (mock_data['StockA'] / mock_data['StockB']).tail(20).to_numpy())
     assert strategy.num_std == 2
 
 @patch('pairs_trading_oaf.data.read_csv')
@@ -310,14 +313,179 @@ def test_strategy_c_calculate_new_position(mock_read_csv):
     # Test 1: z-score is 0
     mock_pair_portfolio.stock_pair_prices = (100, 200)
     new_position = strategy.calculate_new_position()
-    assert new_position == 'no position'
+    assert str(new_position) == 'no position'
 
     # Test 2: z-score is below the lower threshold
     mock_pair_portfolio.stock_pair_prices = (1, 1000)
     new_position = strategy.calculate_new_position()
-    assert new_position == 'long A short B'
+    assert str(new_position) == 'long A short B'
 
     # Test 3: z-score is above the upper threshold
     mock_pair_portfolio.stock_pair_prices = (1000, 1)
     new_position = strategy.calculate_new_position()
-    assert new_position == 'long B short A'
+    assert str(new_position) == 'long B short A'
+
+def make_mock_strategy_e(mock_read_csv, seed, stock_pair_labels=('StockA', 'StockB')):
+    """
+    Make a StrategyE object whose training data has stock A = 2 * stock B + 5 plus noise.
+    """
+    rng = np.random.default_rng(seed)
+    stock_b = 50 + np.cumsum(rng.normal(0, 1, 100))
+    mock_data = pd.DataFrame({'StockA': 2 * stock_b + 5 + rng.normal(0, 0.5, 100),
+                              'StockB': stock_b},
+                             index=pd.date_range(start='2021-01-01', periods=100, freq='D'))
+    mock_read_csv.return_value = mock_data
+    mock_pair_portfolio = Mock()
+    mock_pair_portfolio.stock_pair_labels = stock_pair_labels
+    mock_pair_portfolio.position = strategies.NO_POSITION
+    return strategies.StrategyE(mock_pair_portfolio, training_period=80)
+
+def make_mock_trading_prices(seed, num_days=50):
+    """
+    Make stock A and stock B prices of shape (num_days, 2) which follow the relation of the
+    training data of make_mock_strategy_e, with a missing stock B price.
+    """
+    rng = np.random.default_rng(seed)
+    stock_b = 50 + np.cumsum(rng.normal(0, 1, num_days))
+    stock_pair_prices = np.column_stack([2.1 * stock_b + 4 + rng.normal(0, 1, num_days),
+                                         stock_b])
+    stock_pair_prices[10, 1] = np.nan
+    return stock_pair_prices
+
+@patch('pairs_trading_oaf.data.read_csv')
+def test_strategy_e_initialization(mock_read_csv):
+    """
+    This test checks that StrategyE estimates its initial hedge ratio and intercept from
+    the training data.
+    """
+    strategy = make_mock_strategy_e(mock_read_csv, 0)
+    assert strategy.state[0] == pytest.approx(2, abs=0.05)
+    assert strategy.state[1] == pytest.approx(5, abs=2)
+    assert strategy.observation_variance == pytest.approx(0.25, rel=0.3)
+
+    mock_read_csv.return_value = mock_read_csv.return_value.iloc[:2]
+    strategy = strategies.StrategyE(strategy.pair_portfolio)
+    assert np.isnan(strategy.state).all()
+
+@patch('pairs_trading_oaf.data.read_csv')
+def test_strategy_e_calculate_new_position(mock_read_csv):
+    """
+    This test checks that StrategyE calculates the new position from the z-score of the
+    spread and that a missing price leaves the state and position unchanged.
+    """
+    strategy = make_mock_strategy_e(mock_read_csv, 0)
+    hedge_ratio, intercept = strategy.state
+
+    strategy.pair_portfolio.stock_pair_prices = (hedge_ratio * 50 + intercept, 50)
+    assert strategy.calculate_new_position() == strategies.NO_POSITION
+    strategy.pair_portfolio.stock_pair_prices = (strategy.state[0] * 50 + strategy.state[1] - 10,
+                                                 50)
+    assert strategy.calculate_new_position() == strategies.LONG_A_SHORT_B
+    strategy.pair_portfolio.stock_pair_prices = (strategy.state[0] * 50 + strategy.state[1] + 10,
+                                                 50)
+    assert strategy.calculate_new_position() == strategies.LONG_B_SHORT_A
+
+    state = list(strategy.state)
+    strategy.pair_portfolio.position = strategies.LONG_B_SHORT_A
+    strategy.pair_portfolio.stock_pair_prices = (np.nan, 50)
+    assert strategy.calculate_new_position() == strategies.LONG_B_SHORT_A
+    assert strategy.state == state
+    assert len(strategy.z_score_over_time) == 4
+
+@patch('pairs_trading_oaf.data.read_csv')
+def test_strategy_e_calculate_new_positions(mock_read_csv):
+    """
+    This test checks that the batched forms of StrategyE give exactly the same z-scores,
+    states and positions as the daily calls.
+    """
+    stock_pair_prices = [make_mock_trading_prices(seed) for seed in range(3)]
+    daily_strategies = [make_mock_strategy_e(mock_read_csv, seed) for seed in range(3)]
+    expected_positions = []
+    for strategy, prices in zip(daily_strategies, stock_pair_prices):
+        positions = []
+        for day_prices in prices:
+            strategy.pair_portfolio.stock_pair_prices = day_prices
+            positions.append(strategy.calculate_new_position())
+            strategy.pair_portfolio.position = positions[-1]
+        expected_positions.append(positions)
+
+    # One pair at a time, holding the position where HOLD_POSITION is returned
+    strategy = make_mock_strategy_e(mock_read_csv, 0)
+    new_positions = strategy.calculate_new_positions(stock_pair_prices[0])
+    np.testing.assert_array_equal(strategy.z_score_over_time,
+                                  daily_strategies[0].z_score_over_time)
+    assert strategy.state == daily_strategies[0].state
+    assert vectorized.resolve_positions(new_positions, 0).tolist() == expected_positions[0]
+
+    # All the pairs filtered together
+    batch_strategies = [make_mock_strategy_e(mock_read_csv, seed) for seed in range(3)]
+    new_positions = strategies.StrategyE.calculate_batch_new_positions(
+        batch_strategies, np.stack(stock_pair_prices))
+    assert vectorized.resolve_positions(new_positions, 0).tolist() == expected_positions
+    for batch_strategy, daily_strategy in zip(batch_strategies, daily_strategies):
+        assert batch_strategy.hedge_ratio_over_time == daily_strategy.hedge_ratio_over_time
+        assert batch_strategy.state_covariance == daily_strategy.state_covariance
+
+    # A batch of price paths leaves the stored state unchanged
+    strategy = make_mock_strategy_e(mock_read_csv, 0)
+    state = list(strategy.state)
+    new_positions = strategy.calculate_new_positions(np.stack(stock_pair_prices))
+    assert new_positions.shape == (3, 50)
+    assert strategy.state == state
+    assert not strategy.z_score_over_time
+
+@patch('pairs_trading_oaf.data.read_csv')
+def test_strategy_f_calculate_new_position(mock_read_csv):
+    """
+    This test checks that StrategyF trades the z-score of the log spread of a basket.
+    """
+    mock_read_csv.return_value = pd.DataFrame(
+        {'StockA': np.ones(100) * 100, 'StockB': np.ones(100) * 200,
+         'StockC': np.ones(100) * 400},
+        index=pd.date_range(start='2021-01-01', periods=100, freq='D'))
+    mock_basket_portfolio = Mock()
+    mock_basket_portfolio.stock_labels = ('StockA', 'StockB', 'StockC')
+    mock_basket_portfolio.weights = np.array([0.5, -1, 0.5])
+    mock_basket_portfolio.position = strategies.NO_POSITION
+
+    strategy = strategies.StrategyF(mock_basket_portfolio, window_size=20, z_threshold=1.0)
+    assert strategy.window_spreads.values() == pytest.approx(np.zeros(20), abs=1e-12)
+
+    mock_basket_portfolio.stock_prices = np.array([100.0, 200.0, 400.0])
+    assert strategy.calculate_new_position() == strategies.NO_POSITION
+    # The middle leg is cheap, so the basket, which is short it, is rich
+    mock_basket_portfolio.stock_prices = np.array([100.0, 100.0, 400.0])
+    assert strategy.calculate_new_position() == strategies.LONG_B_SHORT_A
+    mock_basket_portfolio.stock_prices = np.array([100.0, 400.0, 400.0])
+    assert strategy.calculate_new_position() == strategies.LONG_A_SHORT_B
+
+@patch('pairs_trading_oaf.data.read_csv')
+def test_strategies_warm_up_late_listing(mock_read_csv):
+    """
+    This test checks that the initial windows of a stock which was listed late only hold the
+    days after its listing, and that the strategies warm up for the days they are short.
+    """
+    mock_data = pd.DataFrame({'StockA': np.arange(1.0, 101.0),
+                              'StockB': np.ones(100)},
+                             index=pd.date_range(start='2021-01-01', periods=100, freq='D'))
+    mock_data.iloc[:70, 1] = np.nan
+    mock_read_csv.return_value = mock_data
+    mock_pair_portfolio = Mock()
+    mock_pair_portfolio.stock_pair_labels = ('StockA', 'StockB')
+    mock_pair_portfolio.position = strategies.NO_POSITION
+
+    strategy = strategies.StrategyA(mock_pair_portfolio, window_size=60, z_threshold=1.0)
+    assert strategy.warm_up_days == 30
+    window_ratios = strategy.window_ratios.values()
+    assert np.isnan(window_ratios[:30]).all()
+    assert window_ratios[30:].tolist() == np.arange(71.0, 101.0).tolist()
+
+    # StrategyB starts its averages from the first trading day if no day had both prices
+    mock_data.iloc[:, 1] = np.nan
+    strategy = strategies.StrategyB(mock_pair_portfolio, fast_period=3, slow_period=4,
+                                    signal_period=2, training_period=50)
+    assert strategy.warm_up_days == 50
+    assert strategy.macd.fast_ewma is None
+    mock_pair_portfolio.stock_pair_prices = (4.0, 2.0)
+    assert strategy.calculate_new_position() == strategies.NO_POSITION
+    assert (strategy.macd.fast_ewma, strategy.macd.macd) == (2.0, 0)
@@ -0,0 +1,106 @@
+"""
+Test routines for the pairs_trading_oaf.sweep module.
+"""
+import numpy as np
+import pandas as pd
+import pytest
+from pairs_trading_oaf import portfolio, strategies, sweep, vectorized
+
+STOCK_PAIR_LABELS_LIST = [('StockA', 'StockB'), ('StockC', 'StockA')]
+
+@pytest.fixture
+def mock_csv_files(tmp_path):
+    """
+    Write mock training and testing data for three stocks to CSV files and return their paths.
+    """
+    rng = np.random.default_rng(0)
+    num_days = 240
+    mock_data = pd.DataFrame({
+        'Closing Date': pd.date_range(start='2021-01-01', periods=num_days, freq='D'),
+        'StockA': 100 * np.exp(np.cumsum(rng.normal(0, 0.02, num_days))),
+        'StockB': 100 * np.exp(np.cumsum(rng.normal(0, 0.02, num_days))),
+        'StockC': 100 * np.exp(np.cumsum(rng.normal(0, 0.02, num_days)))
+    }).set_index('Closing Date')
+    training_csv = str(tmp_path / "training.csv")
+    testing_csv = str(tmp_path / "testing.csv")
+    mock_data.iloc[:120].to_csv(training_csv)
+    mock_data.iloc[120:].to_csv(testing_csv)
+    return training_csv, testing_csv
+
+def test_expand_grid():
+    """
+    Test that a parameter grid is expanded into every combination of parameters.
+    """
+    grid = sweep.expand_grid({'window_size': [30, 60], 'z_threshold': [1.0, 1.5]})
+    assert grid == [{'window_size': 30, 'z_threshold': 1.0},
+                    {'window_size': 30, 'z_threshold': 1.5},
+                    {'window_size': 60, 'z_threshold': 1.0},
+                    {'window_size': 60, 'z_threshold': 1.5}]
+    assert sweep.expand_grid({}) == [{}]
+
+def test_calc_max_drawdown():
+    """
+    Test the maximum drawdown of a series of portfolio values.
+    """
+    assert sweep.calc_max_drawdown([10, 12, 9, 11, 6, 13]) == pytest.approx(0.5)
+    assert sweep.calc_max_drawdown([1, 2, 3]) == 0.0
+    assert sweep.calc_max_drawdown([]) == 0.0
+
+def test_calc_num_trades():
+    """
+    Test that the number of trades counts every change of position.
+    """
+    positions = ["no position", "long A short B", "long A short B", "long B short A",
+                 "no position"]
+    assert sweep.calc_num_trades(positions) == 3
+
+# pylint: disable=redefined-outer-name
+@pytest.mark.parametrize("num_workers", [1, 2])
+def test_run_sweep(mock_csv_files, num_workers):
+    """
+    Test that the sweep gives one row per combination and the same results as simulating
+    each combination directly.
+    """
+    training_csv, testing_csv = mock_csv_files
+    strategy_grids = {strategies.StrategyA: {'window_size': [20, 40], 'z_threshold': [1, 2]},
+                      strategies.StrategyC: {'num_std': [1.5, 2]}}
+
+    results = sweep.run_sweep(strategy_grids, STOCK_PAIR_LABELS_LIST, training_csv,
+                              testing_csv, 1, num_workers=num_workers)
+
+    assert len(results) == (4 + 2) * len(STOCK_PAIR_LABELS_LIST)
+    assert list(results.columns) == ['strategy', 'stock_a', 'stock_b', 'window_size',
+                                     'z_threshold', 'num_std', 'final_value',
+                                     'max_drawdown', 'num_trades']
+    for row in results.itertuples():
+        strategy_class = getattr(strategies, row.strategy)
+        strategy_kwargs = {name: getattr(row, name)
+                           for name in strategy_grids[strategy_class]}
+        master_portfolio = portfolio.MasterPortfolio(1, training_csv, testing_csv)
+        pair_portfolio = portfolio.PairPortfolio((row.stock_a, row.stock_b), strategy_class,
+                                                 master_portfolio, cash=10,
+                                                 strategy_kwargs=strategy_kwargs)
+        master_portfolio.add_pair_portfolio(pair_portfolio)
+        vectorized.simulate_trading(master_portfolio)
+        assert row.final_value == pair_portfolio.portfolio_value
+        assert row.num_trades == sweep.calc_num_trades(pair_portfolio.position_over_time)
+    assert results.loc[results["strategy"] == "StrategyC", "window_size"].isna().all()
+
+def test_run_sweep_trading_fee(mock_csv_files):
+    """
+    Test that the trading fee lowers the final value of every combination which trades, the
+    most for the one which trades the most.
+    """
+    training_csv, testing_csv = mock_csv_files
+    strategy_grids = {strategies.StrategyC: {'num_std': [0.5, 2]}}
+    free_results = sweep.run_sweep(strategy_grids, STOCK_PAIR_LABELS_LIST, training_csv,
+                                   testing_csv, 1, num_workers=1)
+    results = sweep.run_sweep(strategy_grids, STOCK_PAIR_LABELS_LIST, training_csv,
+                              testing_csv, 1, trading_fee=0.01, num_workers=1)
+
+    traded = free_results['num_trades'] > 0
+    assert traded.any()
+    assert (results['num_trades'] == free_results['num_trades']).all()
+    assert (results['final_value'][traded] < free_results['final_value'][traded]).all()
+    fee_costs = free_results['final_value'] - results['final_value']
+    assert fee_costs.idxmax() == results['num_trades'].idxmax()
@@ -1,11 +1,11 @@
 """
 Test routines for the pairs_trading_oaf.trading module.
 """
-from unittest.mock import patch
+from unittest.mock import Mock, patch
 import numpy as np
 import pandas as pd
 import pytest
-from pairs_trading_oaf import portfolio, trading
+from pairs_trading_oaf import portfolio, strategies, trading
 
 class MockStrategy:
     """
@@ -51,9 +51,9 @@ def master_portfolio():
     data.read_csv function.
     """
     position_limit = 1
-    training_data_str = None
-    testing_data_str = None
-    mp = portfolio.MasterPortfolio(position_limit, training_data_str, testing_data_str)
+    training_data_source = None
+    testing_data_source = None
+    mp = portfolio.MasterPortfolio(position_limit, training_data_source, testing_data_source)
     return mp
 
 # pylint: disable=redefined-outer-name
@@ -89,9 +89,11 @@ def test_simulate_trading(mock_read_csv, master_portfolio):
     assert len(master_portfolio.pair_portfolios) == 2
     assert master_portfolio.pair_portfolios[0].stock_pair_labels == ('StockA', 'StockB')
     assert master_portfolio.pair_portfolios[1].stock_pair_labels == ('StockD', 'StockC')
-    assert master_portfolio.pair_portfolios[0].position_over_time == \
+    assert [str(position) for position in
+            master_portfolio.pair_portfolios[0].position_over_time] == \
         ['long A short B', 'long B short A', 'no position', 'long A short B', 'long A short B']
-    assert master_portfolio.pair_portfolios[1].position_over_time == \
+    assert [str(position) for position in
+            master_portfolio.pair_portfolios[1].position_over_time] == \
         ['long A short B', 'long B short A', 'no position', 'long A short B', 'long A short B']
     expected_shares_over_time = [(+1 / 100, -1 / 200),
                                  (-1 / 101, +1 / 201),
@@ -198,3 +200,134 @@ def test_close_position_with_transaction_fee(master_portfolio):
     expected_cash = 1000 + total_trade_value - transaction_fee
     assert pair_portfolio.cash == pytest.approx(expected_cash)
     assert pair_portfolio.shares == (0, 0)
+
+def make_mock_master_portfolio(training_csv, testing_csv):
+    """
+    Make a master portfolio with a pair portfolio for every pair of mock stocks and
+    every strategy.
+    """
+    master_portfolio = portfolio.MasterPortfolio(1, str(training_csv), str(testing_csv))
+    for strategy_class in [strategies.StrategyA, strategies.StrategyB,
+                           strategies.StrategyC, strategies.StrategyD]:
+        for stock_pair_labels in [('StockA', 'StockB'), ('StockC', 'StockA'),
+                                  ('StockB', 'StockC')]:
+            pair_portfolio = portfolio.PairPortfolio(stock_pair_labels, strategy_class,
+                                                     master_portfolio, cash=10)
+            master_portfolio.add_pair_portfolio(pair_portfolio)
+    return master_portfolio
+
+def test_simulate_trading_parallel(tmp_path):
+    """
+    Test whether the parallel simulation gives identical results to the serial simulation.
+    """
+    # Arrange
+    rng = np.random.default_rng(0)
+    num_days = 200
+    mock_data = pd.DataFrame({
+        'Closing Date': pd.date_range(start='2021-01-01', periods=num_days, freq='D'),
+        'StockA': 100 * np.exp(np.cumsum(rng.normal(0, 0.02, num_days))),
+        'StockB': 100 * np.exp(np.cumsum(rng.normal(0, 0.02, num_days))),
+        'StockC': 100 * np.exp(np.cumsum(rng.normal(0, 0.02, num_days)))
+    }).set_index('Closing Date')
+    training_csv = tmp_path / "training.csv"
+    testing_csv = tmp_path / "testing.csv"
+    mock_data.iloc[:100].to_csv(training_csv)
+    mock_data.iloc[100:].to_csv(testing_csv)
+    serial_master_portfolio = make_mock_master_portfolio(training_csv, testing_csv)
+    parallel_master_portfolio = make_mock_master_portfolio(training_csv, testing_csv)
+    original_pair_portfolios = list(parallel_master_portfolio.pair_portfolios)
+
+    # Act
+    trading.simulate_trading(serial_master_portfolio)
+    trading.simulate_trading_parallel(parallel_master_portfolio, num_workers=3)
+
+    # Assert
+    assert parallel_master_portfolio.pair_portfolios == original_pair_portfolios
+    for serial, parallel in zip(serial_master_portfolio.pair_portfolios,
+                                parallel_master_portfolio.pair_portfolios):
+        assert parallel.strategy.pair_portfolio is parallel
+        assert len(parallel.dates_over_time) == num_days - 100
+        for value_string in ["cash", "dates", "position", "shares", "stock_pair_prices",
+                             "portfolio_value", "ratio"]:
+            assert getattr(parallel, value_string + "_over_time") == \
+                getattr(serial, value_string + "_over_time")
+
+def test_get_price_rows():
+    """
+    Test that the price columns of each pair portfolio are looked up once and that the rows
+    hold plain floats, including NaN for a stock which is not listed yet.
+    """
+    df_test = pd.DataFrame({'StockA': [1.0, 2.0], 'StockB': [np.nan, 4.0],
+                            'StockC': [5.0, 6.0]},
+                           index=pd.date_range(start='2021-01-01', periods=2, freq='D'))
+    pair_portfolios = []
+    for stock_pair_labels in [('StockC', 'StockA'), ('StockA', 'StockB')]:
+        mock_pair_portfolio = Mock()
+        mock_pair_portfolio.stock_labels = stock_pair_labels
+        pair_portfolios.append(mock_pair_portfolio)
+
+    price_rows, column_indices = trading.get_price_rows(df_test, pair_portfolios)
+
+    assert column_indices == [(0, 1), (1, 2)]
+    assert price_rows[1] == [6.0, 2.0, 4.0]
+    assert {type(price) for row in price_rows for price in row} == {float}
+    index_a, index_b = column_indices[1]
+    assert price_rows[0][index_a] == 1.0
+    assert np.isnan(price_rows[0][index_b])
+
+def test_get_day_states():
+    """
+    Test that the first warm_up_days of the days on which both stocks are listed are warm-up
+    days, and that the warm_up_days of the strategy are left for the trading loop to use up.
+    """
+    available = pd.DataFrame({'StockA': [True] * 5, 'StockB': [False, True, False, True, True]})
+    mock_pair_portfolio = Mock()
+    mock_pair_portfolio.stock_labels = ('StockA', 'StockB')
+    mock_pair_portfolio.strategy.warm_up_days = 2
+
+    for _ in range(2):
+        day_states = trading.get_day_states(available, [mock_pair_portfolio])
+        assert [states[0] for states in day_states] \
+            == [trading.NOT_LISTED, trading.WARMING_UP, trading.NOT_LISTED, trading.WARMING_UP,
+                trading.TRADING]
+        assert mock_pair_portfolio.strategy.warm_up_days == 2
+
+@patch('pairs_trading_oaf.data.read_csv')
+def test_simulate_trading_baskets(mock_read_csv, master_portfolio):
+    """
+    Test that basket portfolios are traded in the same loop as the pair portfolios, that a
+    basket with the weights (1, -1) trades like a pair and that the shares of each leg of a
+    larger basket follow its weights.
+    """
+    mock_data = pd.DataFrame({'StockA': [100, 101, 102, 103, 104],
+                              'StockB': [200, 201, 202, 203, 204],
+                              'StockC': [300, 301, 302, 303, 304]},
+                             index=pd.date_range(start='2021-01-01', periods=5, freq='D'))
+    mock_read_csv.return_value = mock_data
+    pair_portfolio = portfolio.PairPortfolio(('StockA', 'StockB'), MockStrategy, master_portfolio)
+    pair_basket_portfolio = portfolio.BasketPortfolio(('StockA', 'StockB'), [1, -1],
+                                                      MockStrategy, master_portfolio)
+    basket_portfolio = portfolio.BasketPortfolio(('StockA', 'StockB', 'StockC'),
+                                                 [0.5, -1, 0.5], MockStrategy, master_portfolio)
+    for traded_portfolio in [pair_portfolio, pair_basket_portfolio, basket_portfolio]:
+        traded_portfolio.trading_fee = 0.001
+    master_portfolio.add_pair_portfolio(pair_portfolio)
+    master_portfolio.add_basket_portfolio(pair_basket_portfolio)
+    master_portfolio.add_basket_portfolio(basket_portfolio)
+
+    trading.simulate_trading(master_portfolio)
+
+    assert pair_basket_portfolio.position_over_time == pair_portfolio.position_over_time
+    for value_string in ["cash", "portfolio_value", "shares"]:
+        np.testing.assert_allclose(
+            np.array(getattr(pair_basket_portfolio, value_string + "_over_time")),
+            np.array(getattr(pair_portfolio, value_string + "_over_time")), rtol=1e-12)
+    assert basket_portfolio.shares_over_time[1] == pytest.approx((-0.5 / 101, 1 / 201,
+                                                                  -0.5 / 301))
+    assert basket_portfolio.shares_over_time[2] == (0, 0, 0)
+    # Opening is cash neutral apart from the fee, and closing adds the value of the shares
+    opening_fee = 2 * 0.001
+    expected_cash = 1e6 - opening_fee \
+                  + (0.5 / 100 * 101 - 1 / 200 * 201 + 0.5 / 300 * 301) - 0.001 * (
+                      0.5 / 100 * 101 + 1 / 200 * 201 + 0.5 / 300 * 301) - opening_fee
+    assert basket_portfolio.cash_over_time[1] == pytest.approx(expected_cash)
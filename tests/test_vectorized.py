@@ -0,0 +1,43 @@
+"""
+Test routines for the pairs_trading_oaf.vectorized module.
+
+The tests which compare the results of the vectorized engine with trading.simulate_trading
+are run for every engine in test_equivalence.py.
+"""
+import numpy as np
+from pairs_trading_oaf import strategies, trading, vectorized
+from tests.conftest import assert_same_over_time_values, make_mock_data, run_engine
+
+def test_resolve_positions():
+    """
+    Test that held positions are replaced by the previous position.
+    """
+    hold = strategies.HOLD_POSITION
+    new_positions = np.array([hold, 1, hold, hold, -1, 0, hold], dtype=np.int8)
+    positions = vectorized.resolve_positions(new_positions, 0)
+    assert positions.tolist() == [0, 1, 1, 1, -1, 0, 0]
+
+class MockStrategy:
+    """
+    Mock strategy without a calculate_new_positions method, which is simulated with
+    the daily loop.
+    """
+    def __init__(self, pair_portfolio):
+        self.pair_portfolio = pair_portfolio
+
+    def calculate_new_position(self):
+        """
+        Go long stock A and short stock B on odd days, otherwise do the opposite.
+        """
+        if self.pair_portfolio.date.day % 2 == 1:
+            return "long A short B"
+        return "long B short A"
+
+def test_simulate_trading_without_vectorized_strategy():
+    """
+    Test that strategies without calculate_new_positions fall back to the daily loop.
+    """
+    df_train, df_test = make_mock_data(5)
+    expected = run_engine(trading.simulate_trading, MockStrategy, df_train, df_test)
+    actual = run_engine(vectorized.simulate_trading, MockStrategy, df_train, df_test)
+    assert_same_over_time_values(expected, actual)
@@ -0,0 +1,126 @@
+"""
+Test routines for the pairs_trading_oaf.walk_forward module.
+"""
+from concurrent.futures import ProcessPoolExecutor
+import numpy as np
+import pandas as pd
+import pytest
+from pairs_trading_oaf import portfolio, strategies, trading, walk_forward
+
+STOCK_PAIR_LABELS_LIST = [('StockA', 'StockB'), ('StockC', 'StockA')]
+STRATEGY_CLASSES = [strategies.StrategyA, strategies.StrategyB, strategies.StrategyD,
+                    strategies.StrategyE]
+
+@pytest.fixture
+def mock_data():
+    """
+    Mock prices of three stocks over 400 days.
+    """
+    rng = np.random.default_rng(0)
+    num_days = 400
+    return pd.DataFrame({
+        'StockA': 100 * np.exp(np.cumsum(rng.normal(0, 0.02, num_days))),
+        'StockB': 100 * np.exp(np.cumsum(rng.normal(0, 0.02, num_days))),
+        'StockC': 100 * np.exp(np.cumsum(rng.normal(0, 0.02, num_days)))
+    }, index=pd.date_range(start='2021-01-01', periods=num_days, freq='D',
+                           name='Closing Date'))
+
+def test_make_windows():
+    """
+    Test that the windows roll forward by step_days and stay inside the dataset.
+    """
+    assert walk_forward.make_windows(10, 4, 2) == [(0, 4, 6), (2, 6, 8), (4, 8, 10)]
+    assert walk_forward.make_windows(10, 4, 2, step_days=3) == [(0, 4, 6), (3, 7, 9)]
+    assert walk_forward.make_windows(5, 4, 2) == []
+    with pytest.raises(ValueError):
+        walk_forward.make_windows(10, 4, 0)
+
+# pylint: disable=redefined-outer-name
+def test_run_walk_forward_matches_csv_files(mock_data, tmp_path):
+    """
+    Test that each window gives the same results as writing its formation and trading
+    periods to CSV files and simulating them with the daily loop, with the same trading fee.
+    """
+    full_csv = str(tmp_path / "full.csv")
+    mock_data.to_csv(full_csv)
+    results = walk_forward.run_walk_forward(STRATEGY_CLASSES, STOCK_PAIR_LABELS_LIST, 1,
+                                            data_source=full_csv, formation_days=100,
+                                            trading_days=50, trading_fee=0.001,
+                                            num_workers=1)
+
+    windows = walk_forward.make_windows(len(mock_data), 100, 50)
+    assert len(results) == len(windows) * len(STRATEGY_CLASSES) * len(STOCK_PAIR_LABELS_LIST)
+    for window_index in [0, len(windows) - 1]:
+        formation_start, trading_start, trading_end = windows[window_index]
+        training_csv = str(tmp_path / f"training_{window_index}.csv")
+        testing_csv = str(tmp_path / f"testing_{window_index}.csv")
+        mock_data.iloc[formation_start:trading_start].to_csv(training_csv)
+        mock_data.iloc[trading_start:trading_end].to_csv(testing_csv)
+        master_portfolio = portfolio.MasterPortfolio(1, training_csv, testing_csv)
+        for strategy_class in STRATEGY_CLASSES:
+            for stock_pair_labels in STOCK_PAIR_LABELS_LIST:
+                pair_portfolio = portfolio.PairPortfolio(stock_pair_labels, strategy_class,
+                                                         master_portfolio, cash=10)
+                pair_portfolio.trading_fee = 0.001
+                master_portfolio.add_pair_portfolio(pair_portfolio)
+        trading.simulate_trading(master_portfolio)
+
+        window_results = results[results['window'] == window_index]
+        assert (window_results['trading_start'] == mock_data.index[trading_start]).all()
+        assert (window_results['trading_end'] == mock_data.index[trading_end - 1]).all()
+        assert window_results['final_value'].tolist() == pytest.approx(
+            [pair_portfolio.portfolio_value
+             for pair_portfolio in master_portfolio.pair_portfolios])
+
+def test_run_walk_forward_trading_fee(mock_data):
+    """
+    Test that the trading fee lowers the final value of every pair portfolio which trades.
+    """
+    kwargs = {'data_source': mock_data, 'formation_days': 100, 'trading_days': 75,
+              'num_workers': 1}
+    free_results = walk_forward.run_walk_forward(STRATEGY_CLASSES, STOCK_PAIR_LABELS_LIST, 1,
+                                                 **kwargs)
+    results = walk_forward.run_walk_forward(STRATEGY_CLASSES, STOCK_PAIR_LABELS_LIST, 1,
+                                            trading_fee=0.01, **kwargs)
+    traded = free_results['num_trades'] > 0
+    assert traded.any()
+    assert (results['final_value'][traded] < free_results['final_value'][traded]).all()
+    assert (results['final_value'][~traded] == free_results['final_value'][~traded]).all()
+
+def test_run_walk_forward_in_parallel(mock_data):
+    """
+    Test that running the windows in worker processes gives the same results.
+    """
+    kwargs = {'data_source': mock_data, 'formation_days': 100, 'trading_days': 75}
+    expected = walk_forward.run_walk_forward(STRATEGY_CLASSES, STOCK_PAIR_LABELS_LIST, 1,
+                                             num_workers=1, **kwargs)
+    with ProcessPoolExecutor(max_workers=2) as executor:
+        results = walk_forward.run_walk_forward(STRATEGY_CLASSES, STOCK_PAIR_LABELS_LIST, 1,
+                                                executor=executor, **kwargs)
+    pd.testing.assert_frame_equal(results, expected)
+
+def test_carry_state(mock_data):
+    """
+    Test that carrying the state of StrategyB on from window to window gives the same MACD
+    values as trading all the windows in one run.
+    """
+    windows = walk_forward.make_windows(len(mock_data), 100, 50)
+    master_portfolio = None
+    macd = []
+    for window in windows:
+        master_portfolio = walk_forward.simulate_window(
+            mock_data, window, [strategies.StrategyB], STOCK_PAIR_LABELS_LIST[:1], 1,
+            previous_master_portfolio=master_portfolio)
+        macd.extend(master_portfolio.pair_portfolios[0].strategy.over_time_vals.macd)
+
+    one_run = walk_forward.simulate_window(mock_data, (0, 100, windows[-1][2]),
+                                           [strategies.StrategyB],
+                                           STOCK_PAIR_LABELS_LIST[:1], 1)
+    assert macd == pytest.approx(one_run.pair_portfolios[0].strategy.over_time_vals.macd)
+
+    results = walk_forward.run_walk_forward([strategies.StrategyA, strategies.StrategyB],
+                                            STOCK_PAIR_LABELS_LIST, 1, data_source=mock_data,
+                                            formation_days=100, trading_days=50,
+                                            carry_state=True, num_workers=1)
+    assert results['window'].is_monotonic_increasing
+    assert results['strategy'].tolist()[:4] == ['StrategyA'] * 2 + ['StrategyB'] * 2